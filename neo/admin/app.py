@@ -43,6 +43,8 @@ class Application(BaseApplication):
         # partitions.
         self.pt = None
         self.uuid = config.getUUID()
+        self.metrics_address = config.getMetrics()
+        self.metrics_server = None
         self.request_handler = MasterRequestEventHandler(self)
         self.master_event_handler = MasterEventHandler(self)
         self.cluster_state = None
@@ -51,6 +53,9 @@ class Application(BaseApplication):
 
     def close(self):
         self.listening_conn = None
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_server = None
         super(Application, self).close()
 
     def reset(self):
@@ -81,6 +86,9 @@ class Application(BaseApplication):
         # Make a listening port.
         handler = AdminEventHandler(self)
         self.listening_conn = ListeningConnection(self, handler, self.server)
+        if self.metrics_address:
+            from .metrics import MetricsServer
+            self.metrics_server = MetricsServer(self, self.metrics_address)
 
         while self.cluster_state != ClusterStates.STOPPING:
             self.connectToPrimary()
@@ -108,11 +116,11 @@ class Application(BaseApplication):
         self.master_node, self.master_conn, num_partitions, num_replicas = \
             bootstrap.getPrimaryConnection()
 
-        if self.pt is None:
+        if self.pt is None or self.pt.getPartitions() != num_partitions:
+            # The number of partitions changes when they're split
+            # (see 'neoctl split'), and the master may recover a split
+            # partition table after it was restarted with the former number.
             self.pt = PartitionTable(num_partitions, num_replicas)
-        elif self.pt.getPartitions() != num_partitions:
-            # XXX: shouldn't we recover instead of raising ?
-            raise RuntimeError('the number of partitions is inconsistent')
         elif self.pt.getReplicas() != num_replicas:
             # XXX: shouldn't we recover instead of raising ?
             raise RuntimeError('the number of replicas is inconsistent')
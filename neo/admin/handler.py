@@ -72,6 +72,11 @@ class AdminEventHandler(EventHandler):
     checkReplicas = forward_ask(Packets.CheckReplicas)
     truncate = forward_ask(Packets.Truncate)
     repair = forward_ask(Packets.Repair)
+    askImportProgress = forward_ask(Packets.AskImportProgress)
+    askBackupLag = forward_ask(Packets.AskBackupLag)
+    askTweakPlan = forward_ask(Packets.AskTweakPlan)
+    splitPartitions = forward_ask(Packets.SplitPartitions)
+    askStats = forward_ask(Packets.AskStats)
 
 
 class MasterEventHandler(EventHandler):
@@ -110,6 +115,12 @@ class MasterEventHandler(EventHandler):
     def notifyPartitionChanges(self, conn, ptid, cell_list):
         self.app.pt.update(ptid, cell_list, self.app.nm)
 
+    def notifyPartitionSplit(self, conn, ptid, num_partitions):
+        self.app.pt.split(ptid, num_partitions)
+
+    def answerStats(self, conn, node_list, callback):
+        callback(node_list)
+
     def answerPartitionTable(self, conn, ptid, row_list):
         self.app.pt.load(ptid, row_list, self.app.nm)
         self.app.bootstrapped = True
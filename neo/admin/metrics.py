@@ -0,0 +1,82 @@
+#
+# Copyright (C) 2017  Nexedi SA
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import socket, threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from neo.lib import logging
+from neo.lib.protocol import Packets
+from neo.lib.stats import formatNodeStats
+
+# How long an HTTP request waits for the metrics of the cluster.
+TIMEOUT = 10
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            return self.send_error(404)
+        node_list = self.server.getStats()
+        if node_list is None:
+            return self.send_error(503, 'Metrics of the cluster unavailable')
+        text = formatNodeStats(node_list)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def log_message(self, format, *args):
+        logging.debug('%s - ' + format, self.address_string(), *args)
+
+
+class MetricsServer(HTTPServer):
+    """HTTP server exporting the metrics of the cluster at /metrics
+
+    Requests are served from a separate thread, and metrics are asked to the
+    primary master from the thread of the event loop.
+    """
+
+    def __init__(self, app, address):
+        self.address_family = socket.AF_INET6 if ':' in address[0] \
+            else socket.AF_INET
+        HTTPServer.__init__(self, address, MetricsRequestHandler)
+        self.app = app
+        thread = threading.Thread(target=self.serve_forever,
+                                  name='metrics server')
+        thread.daemon = True
+        thread.start()
+
+    def getStats(self):
+        result = []
+        ready = threading.Event()
+        def callback(node_list):
+            result.append(node_list)
+            ready.set()
+        def ask():
+            app = self.app
+            if app.bootstrapped:
+                app.master_conn.ask(Packets.AskStats(), callback=callback)
+            else:
+                ready.set()
+        self.app.em.wakeup(ask)
+        ready.wait(TIMEOUT)
+        if result:
+            return result[0]
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
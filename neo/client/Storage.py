@@ -27,7 +27,7 @@ def raiseReadOnlyError(*args, **kw):
 
 @implementer(
         ZODB.interfaces.IStorage,
-        # ZODB.interfaces.IStorageRestoreable,
+        ZODB.interfaces.IStorageRestoreable,
         ZODB.interfaces.IStorageIteration,
         ZODB.interfaces.IStorageUndoable,
         ZODB.interfaces.IExternalGC,
@@ -57,6 +57,7 @@ class Storage(BaseStorage.BaseStorage,
                         'tpc_vote',
                         'tpc_abort',
                         'store',
+                        'restore',
                         'deleteObject',
                         'undo',
                         'undoLog',
@@ -104,6 +105,11 @@ class Storage(BaseStorage.BaseStorage,
         assert version == '', 'Versions are not supported'
         return self.app.store(oid, serial, data, version, transaction)
 
+    def restore(self, oid, serial, data, version, prev_txn, transaction):
+        assert version == '', 'Versions are not supported'
+        return self.app.restore(oid, serial, data, version, prev_txn,
+                                transaction)
+
     def deleteObject(self, oid, serial, transaction):
         self.app.store(oid, serial, None, None, transaction)
 
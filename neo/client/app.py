@@ -15,7 +15,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from cPickle import dumps, loads
-from zlib import compress, decompress
+from collections import deque
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 import heapq
 import time
 
@@ -26,22 +28,37 @@ if OLD_ZODB:
 from persistent.TimeStamp import TimeStamp
 
 from neo.lib import logging
+from neo.lib.compress import Compressor, decompress
 from neo.lib.protocol import NodeTypes, Packets, \
     INVALID_PARTITION, MAX_TID, ZERO_HASH, ZERO_TID
 from neo.lib.util import makeChecksum, dump
-from neo.lib.locking import Empty, Lock
+from neo.lib.locking import Empty, Lock, SimpleQueue
 from neo.lib.connection import MTClientConnection, ConnectionClosed
 from .exception import (NEOStorageError, NEOStorageCreationUndoneError,
-    NEOStorageReadRetry, NEOStorageNotFoundError, NEOPrimaryMasterLost)
+    NEOStorageReadRetry, NEOStorageNotFoundError, NEOPrimaryMasterLost,
+    NEOPartitionSplit)
 from .handlers import storage, master
 from neo.lib.threaded_app import ThreadedApplication
 from .cache import ClientCache
+from .hostcache import HostCache, HOST_CACHE_SIZE
 from .pool import ConnectionPool
 from .transactions import TransactionContainer
 from neo.lib.util import p64, u64, parseMasterList
 
 CHECKED_SERIAL = object()
 
+# Maximum number of transactions being committed at the same time by
+# Application.importFrom
+IMPORT_WINDOW = 16
+
+# Bounds of the number of OIDs to ask at once to the master: the more new
+# objects are created, the more OIDs are preallocated, so that new_oid rarely
+# waits for the master.
+MIN_NEW_OIDS = 100
+MAX_NEW_OIDS = 10000
+# Targeted time between 2 requests of new OIDs, in seconds.
+NEW_OIDS_PERIOD = 1
+
 try:
     from Signals.Signals import SignalHandler
 except ImportError:
@@ -59,7 +76,10 @@ class Application(ThreadedApplication):
     # is unreachable.
     max_reconnection_to_master = float('inf')
 
-    def __init__(self, master_nodes, name, compress=True, **kw):
+    def __init__(self, master_nodes, name, compress=True, compress_workers=0,
+                 compress_min_size=0, compress_min_gain=0, cache_compress=False,
+                 cache_policy=None, cache_trace=None, host_cache=None,
+                 host_cache_size=None, max_new_oids=None, **kw):
         super(Application, self).__init__(parseMasterList(master_nodes),
                                           name, **kw)
         # Internal Attributes common to all thread
@@ -69,9 +89,18 @@ class Application(ThreadedApplication):
         self.trying_master_node = None
 
         # no self-assigned UUID, primary master will supply us one
-        self._cache = ClientCache()
+        self._cache = ClientCache(compress=cache_compress,
+            policy=cache_policy or 'mq', trace=cache_trace)
+        self._host_cache = host_cache and HostCache(host_cache,
+            host_cache_size or HOST_CACHE_SIZE)
         self._loading_oid = None
         self.new_oid_list = ()
+        self._new_oid_count = MIN_NEW_OIDS
+        self._max_new_oids = max(MIN_NEW_OIDS, max_new_oids or MAX_NEW_OIDS)
+        self._new_oid_queue = SimpleQueue()
+        self._new_oid_request = self._new_oid_time = None
+        # Number of times new_oid had to wait for the master, and for how long.
+        self.new_oid_stall_count = self.new_oid_stall_time = 0
         self.last_oid = '\0' * 8
         self.storage_event_handler = storage.StorageEventHandler(self)
         self.storage_bootstrap_handler = storage.StorageBootstrapHandler(self)
@@ -97,7 +126,22 @@ class Application(ThreadedApplication):
         # _connecting_to_master_node is used to prevent simultaneous master
         # node connection attempts
         self._connecting_to_master_node = Lock()
-        self.compress = compress
+        self.compress = Compressor(compress,
+            compress_min_size or 0, compress_min_gain or 0)
+        # Until notified by the master, only use codecs known by all versions.
+        self.compression_set = frozenset((0, 1))
+        # zlib & hashlib release the GIL, so data to store can be prepared
+        # by other threads while previous stores are being sent.
+        self._compress_pool = (ThreadPool(compress_workers)
+                               if compress_workers else None)
+
+    def close(self):
+        if self._compress_pool is not None:
+            self._compress_pool.terminate()
+        self._cache.close()
+        if self._host_cache:
+            self._host_cache.close()
+        super(Application, self).close()
 
     def __getattr__(self, attr):
         if attr in ('last_tid', 'pt'):
@@ -111,6 +155,9 @@ class Application(ThreadedApplication):
     def log(self):
         super(Application, self).log()
         logging.info("%r", self._cache)
+        logging.info("new_oid: %s stall(s) for %.3fs, %s OIDs per request",
+            self.new_oid_stall_count, self.new_oid_stall_time,
+            self._new_oid_count)
 
     @property
     def txn_contexts(self):
@@ -173,7 +220,10 @@ class Application(ThreadedApplication):
             with self._connecting_to_master_node:
                 result = self.master_conn
                 if result is None:
+                    # OIDs (and any pending request for more) come from the
+                    # previous primary master.
                     self.new_oid_list = ()
+                    self._new_oid_request = None
                     result = self.master_conn = self._connectToPrimaryNode()
         return result
 
@@ -245,19 +295,81 @@ class Application(ThreadedApplication):
         """Get a new OID."""
         self._oid_lock_acquire()
         try:
-            if not self.new_oid_list:
-                # Get new oid list from master node
-                # we manage a list of oid here to prevent
-                # from asking too many time new oid one by one
-                # from master node
-                self._askPrimary(Packets.AskNewOIDs(100))
+            # Get new oid list from master node. We manage a list of oid here
+            # to prevent from asking too many time new oid one by one from
+            # master node, and the next list is requested in the background
+            # when the current one is about to be exhausted.
+            if self._new_oid_request:
+                try:
+                    self._waitNewOIDs(not self.new_oid_list)
+                except ConnectionClosed:
+                    # The request was sent to a previous primary master:
+                    # ask again below.
+                    pass
+            if (not self._new_oid_request and
+                len(self.new_oid_list) <= self._new_oid_count >> 2):
+                self._askNewOIDs()
                 if not self.new_oid_list:
-                    raise NEOStorageError('new_oid failed')
+                    self._waitNewOIDs(True)
+            if not self.new_oid_list:
+                raise NEOStorageError('new_oid failed')
             self.last_oid = oid = self.new_oid_list.pop()
             return oid
         finally:
             self._oid_lock_release()
 
+    def _askNewOIDs(self):
+        now = time.time()
+        if self._new_oid_time is not None:
+            # Adapt the number of OIDs to the allocation rate.
+            elapsed = now - self._new_oid_time
+            if elapsed < NEW_OIDS_PERIOD:
+                self._new_oid_count = min(self._max_new_oids,
+                                          self._new_oid_count * 2)
+            elif elapsed > 10 * NEW_OIDS_PERIOD:
+                self._new_oid_count = max(MIN_NEW_OIDS,
+                                          self._new_oid_count // 2)
+        self._new_oid_time = now
+        conn = self._getMasterConnection()
+        self._new_oid_request = conn, conn.ask(
+            Packets.AskNewOIDs(self._new_oid_count),
+            queue=self._new_oid_queue)
+
+    def _waitNewOIDs(self, block):
+        """Process the answer to the pending request of new OIDs"""
+        try:
+            conn, msg_id = self._new_oid_request
+        except TypeError: # reset by a reconnection to the primary master
+            if block:
+                raise ConnectionClosed
+            return
+        get = self._new_oid_queue.get
+        if block:
+            start = time.time()
+        try:
+            while 1:
+                try:
+                    qconn, qpacket, kw = get(block)
+                except Empty:
+                    return
+                # Skip what may remain from previous connections.
+                if qconn is conn and msg_id == qpacket.getId():
+                    break
+        finally:
+            if block:
+                self.new_oid_stall_count += 1
+                self.new_oid_stall_time += time.time() - start
+        self._new_oid_request = None
+        if conn is self.master_conn:
+            try:
+                self._handlePacket(qconn, qpacket, kw, self.primary_handler)
+            except ConnectionClosed:
+                if block:
+                    raise
+        elif block:
+            # OIDs from a previous primary master must not be used.
+            raise ConnectionClosed
+
     def getObjectCount(self):
         # return the last OID used, this is inaccurate
         return int(u64(self.last_oid))
@@ -296,6 +408,43 @@ class Application(ThreadedApplication):
             # when there's an incoming PT update.
             self.sync()
 
+    def _askStorageListForRead(self, request_list, askStorage=None):
+        """Send several requests to storage nodes at the same time
+
+        request_list is a list of (object_id, packet), as for
+        _askStorageForRead, and answers are returned in the same order.
+        Requests that fail are retried one by one, with the given askStorage.
+        """
+        queue = SimpleQueue()
+        pending = {}
+        for i, (object_id, packet) in enumerate(request_list):
+            def ask(conn, packet):
+                pending[conn, conn.ask(packet, queue=queue)] = i
+            self._askStorageForRead(object_id, packet, ask)
+        result_list = [None] * len(request_list)
+        handler = self.storage_handler
+        try:
+            while pending:
+                conn, packet, kw = queue.get(True)
+                try:
+                    self._handlePacket(conn, packet, kw, handler)
+                except ConnectionClosed:
+                    retry_list = [pending.pop(x) for x in pending.keys()
+                                                 if x[0] is conn]
+                except NEOStorageReadRetry:
+                    retry_list = [pending.pop((conn, packet.getId()))]
+                else:
+                    result_list[pending.pop((conn, packet.getId()))] = \
+                        self.getHandlerData()
+                    continue
+                for i in retry_list:
+                    object_id, packet = request_list[i]
+                    result_list[i] = self._askStorageForRead(
+                        object_id, packet, askStorage)
+        finally:
+            self.dispatcher.forget_queue(queue, flush_queue=False)
+        return result_list
+
     def load(self, oid, tid=None, before_tid=None):
         """
         Internal method which manage load, loadSerial and loadBefore.
@@ -339,9 +488,27 @@ class Application(ThreadedApplication):
         try:
             acquire()
             try:
+                inc = self.em.stats.inc
                 result = self._loadFromCache(oid, tid, before_tid)
                 if result:
+                    inc(('neo_cache_hits_total', 'cache', 'local'))
                     return result
+                inc(('neo_cache_misses_total', 'cache', 'local'))
+                if self._host_cache:
+                    # Lower bound of the validity of current data we'll get.
+                    valid_tid = self.__dict__.get('last_tid')
+                    if tid or before_tid or not valid_tid:
+                        result = self._loadFromHostCache(oid, tid, before_tid)
+                    else:
+                        # Like storage nodes below, the shared cache may
+                        # have data that other processes committed after the
+                        # last invalidation we got from master.
+                        result = self._loadFromHostCache(oid, None,
+                            p64(u64(valid_tid) + 1))
+                    if result:
+                        inc(('neo_cache_hits_total', 'cache', 'host'))
+                        return result
+                    inc(('neo_cache_misses_total', 'cache', 'host'))
                 self._loading_oid = oid
             finally:
                 release()
@@ -352,18 +519,24 @@ class Application(ThreadedApplication):
                 # Do not get something more recent than the last invalidation
                 # we got from master.
                 before_tid = p64(u64(self.last_tid) + 1)
-            data, tid, next_tid, _ = self._loadFromStorage(oid, tid, before_tid)
+            data, tid, next_tid, compressed = self._loadFromStorage(
+                oid, tid, before_tid)
             acquire()
             try:
                 if self._loading_oid:
                     # Common case (no race condition).
-                    self._cache.store(oid, data, tid, next_tid)
+                    self._cache.store(oid, data, tid, next_tid, compressed)
                 elif self._loading_invalidated:
                     # oid has just been invalidated.
                     if not next_tid:
                         next_tid = self._loading_invalidated
-                    self._cache.store(oid, data, tid, next_tid)
-                # Else, we just reconnected to the master.
+                    self._cache.store(oid, data, tid, next_tid, compressed)
+                else:
+                    # We just reconnected to the master.
+                    compressed = None
+                if compressed and self._host_cache:
+                    self._host_cache.store(oid, compressed[0], compressed[1],
+                                           tid, next_tid, valid_tid)
             finally:
                 release()
         finally:
@@ -379,8 +552,8 @@ class Application(ThreadedApplication):
                     logging.error('wrong checksum from %s for oid %s',
                               conn, dump(oid))
                     raise NEOStorageReadRetry(False)
-                return (decompress(data) if compression else data,
-                        tid, next_tid, data_tid)
+                return (decompress(compression, data),
+                        tid, next_tid, (compression, data))
             raise NEOStorageCreationUndoneError(dump(oid))
         return self._askStorageForRead(oid,
             Packets.AskObject(oid, at_tid, before_tid),
@@ -396,6 +569,16 @@ class Application(ThreadedApplication):
             return result
         return self._cache.load(oid, before_tid)
 
+    def _loadFromHostCache(self, oid, at_tid, before_tid):
+        result = self._host_cache.load(oid,
+            at_tid + '*' if at_tid else before_tid)
+        if result:
+            tid, next_tid, compression, compressed = result
+            data = decompress(compression, compressed)
+            self._cache.store(oid, data, tid, next_tid,
+                              (compression, compressed))
+            return data, tid, next_tid
+
     def tpc_begin(self, storage, transaction, tid=None, status=' '):
         """Begin a new transaction."""
         # First get a transaction, only one is allowed at a time
@@ -416,39 +599,90 @@ class Application(ThreadedApplication):
         self._store(self._txn_container.get(transaction), oid, serial, data)
 
     def _store(self, txn_context, oid, serial, data, data_serial=None):
-        ttid = txn_context.ttid
+        pool = self._compress_pool
         if data is None:
             # This is some undo: either a no-data object (undoing object
             # creation) or a back-pointer to an earlier revision (going back to
             # an older object revision).
-            compressed_data = ''
-            compression = 0
-            checksum = ZERO_HASH
+            compressed = None
         else:
             assert data_serial is None
-            size = len(data)
-            if self.compress:
-                compressed_data = compress(data)
-                if size < len(compressed_data):
-                    compressed_data = data
-                    compression = 0
-                else:
-                    compression = 1
-            else:
-                compression = 0
-                compressed_data = data
-            checksum = makeChecksum(compressed_data)
-            txn_context.data_size += size
+            txn_context.data_size += len(data)
+            compressed = (self._compress(data) if pool is None else
+                pool.apply_async(self._compress, (data,)))
+        if pool is None:
+            self._sendStore(txn_context, oid, serial, data, data_serial,
+                            compressed)
+        else:
+            # Stores are sent in the order they are requested.
+            txn_context.compress_queue.append(
+                (oid, serial, data, data_serial, compressed))
+            self._flushStores(txn_context, False)
+
+        while txn_context.data_size >= self._cache._max_size:
+            self._flushStores(txn_context)
+            self._waitAnyTransactionMessage(txn_context)
+        self._waitAnyTransactionMessage(txn_context, False)
+
+    def _sendStore(self, txn_context, oid, serial, data, data_serial,
+                   compressed):
+        compression, compressed_data, checksum = \
+            compressed or (0, '', ZERO_HASH)
         # Store object in tmp cache
         packet = Packets.AskStoreObject(oid, serial, compression,
-            checksum, compressed_data, data_serial, ttid)
+            checksum, compressed_data, data_serial, txn_context.ttid)
         txn_context.data_dict[oid] = data, serial, txn_context.write(
             self, packet, oid, oid=oid)
 
+    def _flushStores(self, txn_context, block=True):
+        """Send stores whose data is compressed by the worker pool
+
+        If block is false, stop at the first store that is not ready.
+        """
+        compress_queue = txn_context.compress_queue
+        while compress_queue:
+            oid, serial, data, data_serial, compressed = compress_queue[0]
+            if compressed is not None:
+                if not (block or compressed.ready()):
+                    break
+                compressed = compressed.get()
+            del compress_queue[0]
+            self._sendStore(txn_context, oid, serial, data, data_serial,
+                            compressed)
+
+    def _compress(self, data):
+        compress = self.compress
+        if compress.codec in self.compression_set:
+            compression, data = compress(data)
+        else:
+            compression = 0
+        return compression, data, makeChecksum(data)
+
+    def restore(self, oid, serial, data, version, prev_txn, transaction):
+        """Store object as it was committed in another storage"""
+        txn_context = self._txn_container.get(transaction)
+        assert serial == txn_context.ttid, (serial, txn_context.ttid)
+        self._restore(txn_context, oid, data, prev_txn)
         while txn_context.data_size >= self._cache._max_size:
             self._waitAnyTransactionMessage(txn_context)
         self._waitAnyTransactionMessage(txn_context, False)
 
+    def _restore(self, txn_context, oid, data, data_serial):
+        # Unlike _store, there's nothing to resolve so 'serial' is not sent.
+        # 'data_serial' is only a hint: the storage may not have the revision
+        # it points to (e.g. partial copy), so the data is also sent if known.
+        if data is None:
+            compressed_data = ''
+            compression = 0
+            checksum = ZERO_HASH
+        else:
+            compression, compressed_data, checksum = self._compress(data)
+            txn_context.data_size += len(data)
+        packet = Packets.AskRestoreObject(oid, compression, checksum,
+            compressed_data, data_serial, txn_context.ttid)
+        txn_context.data_dict[oid] = data, None, txn_context.write(
+            self, packet, oid, oid=oid)
+
     def _handleConflicts(self, txn_context):
         data_dict = txn_context.data_dict
         pop_conflict = txn_context.conflict_dict.popitem
@@ -534,8 +768,14 @@ class Application(ThreadedApplication):
     def waitStoreResponses(self, txn_context):
         queue = txn_context.queue
         pending = self.dispatcher.pending
+        _flushStores = self._flushStores
         _waitAnyTransactionMessage = self._waitAnyTransactionMessage
-        while pending(queue):
+        while 1:
+            # Objects that are stored again after conflict resolution may
+            # still be compressed by the worker pool.
+            _flushStores(txn_context)
+            if not pending(queue):
+                break
             _waitAnyTransactionMessage(txn_context)
         if txn_context.data_dict:
             raise NEOStorageError('could not store/check all oids')
@@ -544,29 +784,38 @@ class Application(ThreadedApplication):
         """Store current transaction."""
         txn_context = self._txn_container.get(transaction)
         self.waitStoreResponses(txn_context)
+        self._askVote(txn_context, transaction)
+        self.waitResponses(txn_context.queue)
+        self._voted(txn_context)
+        if OLD_ZODB:
+            return [(oid, ResolvedSerial)
+                for oid in txn_context.resolved_dict]
+        return txn_context.resolved_dict
+
+    def _askVote(self, txn_context, transaction):
         ttid = txn_context.ttid
         packet = Packets.AskStoreTransaction(ttid, str(transaction.user),
             str(transaction.description), dumps(transaction._extension),
             txn_context.cache_dict)
-        queue = txn_context.queue
-        involved_nodes = txn_context.involved_nodes
         # Ask in parallel all involved storage nodes to commit object metadata.
         # Nodes that store the transaction metadata get a special packet.
         trans_nodes = txn_context.write(self, packet, ttid)
         packet = Packets.AskVoteTransaction(ttid)
-        for uuid, status in involved_nodes.iteritems():
+        for uuid, status in txn_context.involved_nodes.iteritems():
             if status == 1 and uuid not in trans_nodes:
                 self._askStorageForWrite(txn_context, uuid, packet)
-        self.waitResponses(txn_context.queue)
+
+    def _voted(self, txn_context):
         # If there are failed nodes, ask the master whether they can be
         # disconnected while keeping the cluster operational. If possible,
         # this will happen during tpc_finish.
+        involved_nodes = txn_context.involved_nodes
         failed = [node.getUUID()
             for node in self.nm.getStorageList()
             if node.isRunning() and involved_nodes.get(node.getUUID()) == 2]
         if failed:
             try:
-                self._askPrimary(Packets.FailedVote(ttid, failed))
+                self._askPrimary(Packets.FailedVote(txn_context.ttid, failed))
             except ConnectionClosed:
                 pass
         txn_context.voted = True
@@ -578,10 +827,6 @@ class Application(ThreadedApplication):
         #       - If possible, recover from master failure.
         if txn_context.error:
             raise NEOStorageError(txn_context.error)
-        if OLD_ZODB:
-            return [(oid, ResolvedSerial)
-                for oid in txn_context.resolved_dict]
-        return txn_context.resolved_dict
 
     def tpc_abort(self, transaction):
         """Abort current transaction."""
@@ -782,10 +1027,14 @@ class Application(ThreadedApplication):
             txn_info[k] = v
 
     def _getTransactionInformation(self, tid):
-        packet = Packets.AskTransactionInformation(tid)
         return self._askStorageForRead(tid,
             Packets.AskTransactionInformation(tid))
 
+    def _getTransactionInformationList(self, tid_list):
+        return self._askStorageListForRead([
+            (tid, Packets.AskTransactionInformation(tid))
+            for tid in tid_list])
+
     def undoLog(self, first, last, filter=None, block=0):
         # XXX: undoLog is broken
         if last < 0:
@@ -813,18 +1062,23 @@ class Application(ThreadedApplication):
         # Reorder tids
         ordered_tids = sorted(tid_set, reverse=True)
         logging.debug("UndoLog tids %s", map(dump, ordered_tids))
-        # For each transaction, get info
+        # For each transaction, get info, only for as many transactions as
+        # there are missing results
         undo_info = []
         append = undo_info.append
-        for tid in ordered_tids:
-            (txn_info, txn_ext) = self._getTransactionInformation(tid)
-            if filter is None or filter(txn_info):
-                txn_info.pop('packed')
-                txn_info.pop("oids")
-                self._insertMetadata(txn_info, txn_ext)
-                append(txn_info)
-                if len(undo_info) >= last - first:
-                    break
+        while ordered_tids:
+            count = last - first - len(undo_info)
+            if count <= 0:
+                break
+            tid_list = ordered_tids[:count]
+            del ordered_tids[:count]
+            for txn_info, txn_ext in self._getTransactionInformationList(
+                    tid_list):
+                if filter is None or filter(txn_info):
+                    txn_info.pop('packed')
+                    txn_info.pop("oids")
+                    self._insertMetadata(txn_info, txn_ext)
+                    append(txn_info)
         # Check we return at least one element, otherwise call
         # again but extend offset
         if len(undo_info) == 0 and not block:
@@ -833,32 +1087,41 @@ class Application(ThreadedApplication):
         return undo_info
 
     def transactionLog(self, start, stop, limit):
-        tid_list = []
         # request a tid list for each partition
-        for offset in xrange(self.pt.getPartitions()):
-            r = self._askStorageForRead(offset,
-                Packets.AskTIDsFrom(start, stop, limit, offset))
-            if r:
-                tid_list = list(heapq.merge(tid_list, r))
-                if len(tid_list) >= limit:
-                    del tid_list[limit:]
-                    stop = tid_list[-1]
+        while 1:
+            np = self.pt.getPartitions()
+            def askStorage(conn, packet):
+                # Storage nodes reject requests that were built for another
+                # number of partitions: restart if there was a split.
+                if np != self.pt.getPartitions():
+                    raise NEOPartitionSplit
+                return self._askStorage(conn, packet)
+            try:
+                tid_list = list(islice(heapq.merge(
+                    *self._askStorageListForRead([
+                        (offset, Packets.AskTIDsFrom(
+                            start, stop, limit, offset, np))
+                        for offset in xrange(np)], askStorage)), limit))
+                break
+            except NEOPartitionSplit:
+                logging.info('partition table split during transactionLog')
         # request transactions informations
         txn_list = []
         append = txn_list.append
-        tid = None
-        for tid in tid_list:
-            (txn_info, txn_ext) = self._getTransactionInformation(tid)
+        for txn_info, txn_ext in self._getTransactionInformationList(
+                tid_list):
             txn_info['ext'] = loads(txn_ext)
             append(txn_info)
-        return (tid, txn_list)
+        return (tid_list[-1] if tid_list else None), txn_list
 
     def history(self, oid, size=1, filter=None):
         packet = Packets.AskObjectHistory(oid, 0, size)
         result = []
         # history_list is already sorted descending (by the storage)
-        for serial, size in self._askStorageForRead(oid, packet):
-                txn_info, txn_ext = self._getTransactionInformation(serial)
+        history_list = self._askStorageForRead(oid, packet)
+        for (serial, size), (txn_info, txn_ext) in zip(history_list,
+                self._getTransactionInformationList(
+                    [serial for serial, _ in history_list])):
                 # create history dict
                 txn_info.pop('id')
                 txn_info.pop('oids')
@@ -872,25 +1135,122 @@ class Application(ThreadedApplication):
         return result
 
     def importFrom(self, storage, source, start, stop, preindex=None):
-        # TODO: The main difference with BaseStorage implementation is that
-        #       preindex can't be filled with the result 'store' (tid only
-        #       known after 'tpc_finish'. This method could be dropped if we
-        #       implemented IStorageRestoreable (a wrapper around source would
-        #       still be required for partial import).
+        """Import transactions from another storage, preserving tids
+
+        Transactions are restored, i.e. objects are stored without conflict
+        detection and with back-pointers to data imported by the same call,
+        and up to IMPORT_WINDOW of them are being committed at the same time.
+        """
+        # The main difference with BaseStorage implementation is that
+        # transactions are pipelined: we only wait when the oldest one is not
+        # finished yet, whereas tpc_begin/tpc_vote/tpc_finish would wait
+        # answers from the master and storages for each transaction.
         if preindex is None:
             preindex = {}
-        for transaction in source.iterator(start, stop):
-            tid = transaction.tid
-            self.tpc_begin(storage, transaction, tid, transaction.status)
-            for r in transaction:
-                oid = r.oid
-                pre = preindex.get(oid)
-                self.store(oid, pre, r.data, r.version, transaction)
-                preindex[oid] = tid
-            conflicted = self.tpc_vote(transaction)
-            assert not conflicted, conflicted
-            real_tid = self.tpc_finish(transaction)
-            assert real_tid == tid, (real_tid, tid)
+        txn_container = self._txn_container
+        pending_ = self.dispatcher.pending
+        master_queue = SimpleQueue()
+        # [txn_context, step, begun] in tid order, with step:
+        # -1 -> storing, 0 -> stored, 1 -> voting, 2 -> finishing
+        pending = deque()
+        begin_list = deque()
+
+        def masterAnswer(block):
+            conn, packet, kw = master_queue.get(block)
+            if type(packet) is Packets.AnswerBeginTransaction:
+                self._handlePacket(conn, packet, kw)
+                item = begin_list.popleft()
+                item[2] = True
+            else:
+                # Unlike tpc_finish, the lock is not held while waiting
+                # the answer, so that the import does not block load().
+                self._load_lock_acquire()
+                try:
+                    self._handlePacket(conn, packet, kw)
+                finally:
+                    self._load_lock_release()
+                item = pending.popleft()
+                txn_container.pop(item[0].txn)
+            tid = self.getHandlerData()
+            assert tid == item[0].ttid, (dump(tid), dump(item[0].ttid))
+
+        def process(item):
+            txn_context, step, begun = item
+            self._waitAnyTransactionMessage(txn_context, False)
+            if 0 <= step < 2 and not pending_(txn_context.queue):
+                if not step:
+                    if txn_context.data_dict:
+                        raise NEOStorageError('could not store all oids')
+                    self._askVote(txn_context, txn_context.txn)
+                    item[1] = 1
+                elif begun:
+                    self._voted(txn_context)
+                    cache_dict = txn_context.cache_dict
+                    self._load_lock_acquire()
+                    try:
+                        master_conn.ask(Packets.AskFinishTransaction(
+                                txn_context.ttid, cache_dict, ()),
+                            queue=master_queue, cache_dict=cache_dict,
+                            callback=None)
+                    finally:
+                        self._load_lock_release()
+                    item[1] = 2
+
+        def wait(n):
+            # Wait until at most n transactions are being imported.
+            while n < len(pending):
+                for item in pending:
+                    process(item)
+                try:
+                    while 1:
+                        masterAnswer(False)
+                except Empty:
+                    pass
+                if n < len(pending):
+                    txn_context = pending[0][0]
+                    if pending_(txn_context.queue):
+                        self._waitAnyTransactionMessage(txn_context)
+                    else:
+                        masterAnswer(True)
+
+        max_size = self._cache._max_size
+        first_tid = None
+        try:
+            master_conn = self._getMasterConnection()
+            for transaction in source.iterator(start, stop):
+                tid = transaction.tid
+                if first_tid is None:
+                    first_tid = tid
+                txn_context = txn_container.new(transaction)
+                txn_context.Storage = storage
+                txn_context.ttid = tid
+                item = [txn_context, -1, False]
+                pending.append(item)
+                begin_list.append(item)
+                master_conn.ask(Packets.AskBeginTransaction(tid),
+                                queue=master_queue)
+                for r in transaction:
+                    data_serial = r.data_txn
+                    if data_serial and data_serial < first_tid:
+                        data_serial = None # maybe not in this storage
+                    self._restore(txn_context, r.oid, r.data, data_serial)
+                    preindex[r.oid] = tid
+                    if txn_context.data_size >= max_size:
+                        # Previous transactions may lock objects
+                        # of this one: finish them first.
+                        wait(1)
+                        while txn_context.data_size >= max_size:
+                            self._waitAnyTransactionMessage(txn_context)
+                item[1] = 0
+                wait(IMPORT_WINDOW - 1)
+            wait(0)
+        except:
+            for txn_context, step, _ in pending:
+                if step < 2:
+                    self.tpc_abort(txn_context.txn)
+                else:
+                    txn_container.pop(txn_context.txn)
+            raise
 
     from .iterator import iterator
 
@@ -14,12 +14,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import math
+import math, os, struct
 from bisect import insort
+from neo.lib.compress import Compressor, decompress
+from neo.lib.protocol import ZERO_TID
 
 class CacheItem(object):
 
-    __slots__ = ('oid', 'tid', 'next_tid', 'data',
+    __slots__ = ('oid', 'tid', 'next_tid', 'data', 'compression',
                  'counter', 'level', 'expire',
                  'prev', 'next')
 
@@ -42,6 +44,147 @@ class CacheItem(object):
     def __lt__(self, other):
         return self.tid < other.tid
 
+class MultiQueuePolicy(object):
+    """Original Multi-Queue policy: the level only depends on access frequency
+
+    A policy decides of the level of an object in the cache, and whether a
+    new object may evict other ones.
+    """
+
+    name = 'mq'
+
+    def __init__(self, max_size):
+        pass
+
+    def level(self, counter, size, _log=math.log):
+        return 1 + int(_log(counter, 2))
+
+    def access(self, oid):
+        """Notify a cache lookup, whether it is a hit or a miss"""
+
+    def getCounter(self, oid):
+        """Return the initial access counter of an object entering the cache"""
+        return 0
+
+    def admit(self, oid, victim):
+        """Tell whether a new object may evict another one"""
+        return True
+
+class SizeAwarePolicy(MultiQueuePolicy):
+    """GDSF-like policy: the frequency is weighted by the size
+
+    Objects bigger than 'reference_size' lose a level each time their size
+    doubles, so that big objects that are rarely reused don't evict many
+    small hot ones.
+    """
+
+    name = 'size'
+    reference_size = 4096
+
+    def level(self, counter, size, _log=math.log):
+        level = _log(counter, 2)
+        if self.reference_size < size:
+            level -= _log(float(size) / self.reference_size, 2)
+        return 1 + max(0, int(level))
+
+class TinyLFUPolicy(MultiQueuePolicy):
+    """Multi-Queue policy with TinyLFU admission
+
+    Access frequencies are estimated with a count-min sketch of 4-bit
+    counters, which are halved regularly to forget old accesses. When the
+    cache is full, a new object is only admitted if it is more frequently
+    accessed than the object that would be evicted first.
+    """
+
+    name = 'tinylfu'
+    _depth = 4
+    _halve = ''.join(chr(i >> 1) for i in xrange(256))
+
+    def __init__(self, max_size):
+        # About 1 counter per KiB of cache.
+        width = 1024
+        while width < max_size >> 10:
+            width <<= 1
+        self._mask = width - 1
+        self._sample_size = 10 * width
+        self._sketch = [bytearray(width) for _ in xrange(self._depth)]
+        self._count = 0
+
+    def _iterCounters(self, oid):
+        h = hash(oid)
+        h2 = h >> 16 | 1
+        mask = self._mask
+        for i, row in enumerate(self._sketch):
+            yield row, h + i * h2 & mask
+
+    def estimate(self, oid):
+        return min(row[i] for row, i in self._iterCounters(oid))
+
+    def access(self, oid):
+        for row, i in self._iterCounters(oid):
+            if row[i] < 15:
+                row[i] += 1
+        self._count += 1
+        if self._sample_size <= self._count:
+            self._count //= 2
+            halve = self._halve
+            for row in self._sketch:
+                row[:] = row.translate(halve)
+
+    def getCounter(self, oid):
+        # The lookup that preceded the store is already counted.
+        return max(0, self.estimate(oid) - 1)
+
+    def admit(self, oid, victim):
+        return self.estimate(victim) < self.estimate(oid)
+
+POLICY_DICT = {x.name: x
+    for x in (MultiQueuePolicy, SizeAwarePolicy, TinyLFUPolicy)}
+
+
+class CacheTrace(object):
+    """Record cache events to a file, to be replayed offline (see 'replay')
+
+    Several processes may be configured with the same path, so the pid is
+    appended to it, in order not to mix their records.
+
+    Each event is a fixed-size record made of a code, an oid, 3 tids
+    (ZERO_TID for None) and a size of uncompressed data:
+    - 'L': load(oid, before_tid) returned (tid, next_tid), size is 0 on miss
+    - 'l': same as 'L' for a load at an exact tid, i.e. before_tid is tid+'*'
+    - 'S': store(oid, tid, next_tid) of data of given size
+    - 'I': invalidate(oid, tid)
+    - 'C': clear_current()
+    - 'X': clear()
+    """
+
+    _record = struct.Struct('>c8s8s8s8sL')
+
+    def __init__(self, path):
+        self.path = path = '%s.%u' % (path, os.getpid())
+        self._file = open(path, 'ab')
+        self._write = self._file.write
+        self._pack = self._record.pack
+
+    def __call__(self, code, oid=ZERO_TID, tid1=None, tid2=None, tid3=None,
+                 size=0):
+        self._write(self._pack(code, oid, tid1 or ZERO_TID, tid2 or ZERO_TID,
+                               tid3 or ZERO_TID, size))
+
+    def load(self, oid, before_tid, result):
+        code = 'L'
+        if before_tid and len(before_tid) > 8:
+            before_tid = before_tid[:8]
+            code = 'l'
+        if result:
+            self(code, oid, before_tid, result[1], result[2], len(result[0]))
+        else:
+            self(code, oid, before_tid)
+
+    def close(self):
+        self._file.close()
+
+
 class ClientCache(object):
     """In-memory pickle cache based on Multi-Queue cache algorithm
 
@@ -61,20 +204,50 @@ class ClientCache(object):
         shorter-lived queue as it ages without being accessed, or in the
         history queue if it's really too old.
       - The history queue only contains items with counter > 0
+
+    The computation of levels, and the admission of new objects when the cache
+    is full, depend on a pluggable policy (see POLICY_DICT).
+
+    In compressed mode, data is kept compressed in memory (as sent by storage
+    nodes if possible, so that it's not compressed again), and decompressed on
+    every hit, except for small objects that become very hot.
     """
 
-    __slots__ = ('_life_time', '_max_history_size', '_max_size',
+    __slots__ = ('_life_time', '_max_history_size', '_max_size', '_compress',
+                 '_policy', '_trace',
                  '_queue_list', '_oid_dict', '_time', '_size', '_history_size')
 
+    # In compressed mode, objects that reach this level
+    # and are not bigger than this size are kept uncompressed.
+    _hot_level = 4
+    _hot_size = 4096
+
     def __init__(self, life_time=10000, max_history_size=100000,
-                                        max_size=20*1024*1024):
+                                        max_size=20*1024*1024,
+                                        compress=False, policy='mq',
+                                        trace=None):
         self._life_time = life_time
         self._max_history_size = max_history_size
         self._max_size = max_size
+        self._compress = Compressor() if compress else None
+        try:
+            policy = POLICY_DICT[policy]
+        except KeyError:
+            raise ValueError('unknown cache policy %r (choose among: %s)'
+                             % (policy, ', '.join(sorted(POLICY_DICT))))
+        self._policy = policy(max_size)
+        self._trace = None if trace is None else CacheTrace(trace)
         self.clear()
 
+    def close(self):
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
     def clear(self):
         """Reset cache"""
+        if self._trace is not None:
+            self._trace('X')
         self._queue_list = [None] # first is history
         self._oid_dict = {}
         self._time = 0
@@ -84,12 +257,13 @@ class ClientCache(object):
     def __repr__(self):
         return ("<%s history_size=%s oid_count=%s size=%s time=%s"
                 " queue_length=%r (life_time=%s max_history_size=%s"
-                " max_size=%s)>") % (
+                " max_size=%s compress=%s policy=%s)>") % (
             self.__class__.__name__, self._history_size,
             len(self._oid_dict), self._size, self._time,
             [sum(1 for _ in self._iterQueue(x))
              for x in xrange(len(self._queue_list))],
-            self._life_time, self._max_history_size, self._max_size)
+            self._life_time, self._max_history_size, self._max_size,
+            self._compress is not None, self._policy.name)
 
     def _iterQueue(self, level):
         """for debugging purpose"""
@@ -151,14 +325,10 @@ class ClientCache(object):
                     self._queue_list[level] = next
             return next
 
-    def _fetched(self, item, _log=math.log):
+    def _fetched(self, item):
         self._remove(item)
         item.counter = counter = item.counter + 1
-        # XXX It might be better to adjust the level according to the object
-        # size. See commented factor for example.
-        item.level = 1 + int(_log(counter, 2)
-                             # * (1.01 - float(len(item.data)) / self._max_size)
-                            )
+        item.level = self._policy.level(counter, len(item.data))
         self._add(item)
 
         self._time = time = self._time + 1
@@ -188,15 +358,39 @@ class ClientCache(object):
 
     def load(self, oid, before_tid=None):
         """Return a revision of oid that was current before given tid"""
+        result = None
         item = self._load(oid, before_tid)
+        self._policy.access(oid)
         if item:
             data = item.data
             if data is not None:
                 self._fetched(item)
-                return data, item.tid, item.next_tid
+                compression = item.compression
+                if compression:
+                    data = decompress(compression, data)
+                    if (self._hot_level <= item.level and
+                        len(data) <= self._hot_size):
+                        self._size += len(data) - len(item.data)
+                        item.data = data
+                        item.compression = 0
+                        self._evict()
+                result = data, item.tid, item.next_tid
+        if self._trace is not None:
+            self._trace.load(oid, before_tid, result)
+        return result
+
+    def store(self, oid, data, tid, next_tid, compressed=None):
+        """Store a new data record in the cache
 
-    def store(self, oid, data, tid, next_tid):
-        """Store a new data record in the cache"""
+        In compressed mode, the caller can pass data as it is compressed
+        by storage nodes, with 'compressed' being (compression, data).
+        """
+        if self._trace is not None:
+            self._trace('S', oid, tid, next_tid, size=len(data))
+        if self._compress is None:
+            compression = 0
+        else:
+            compression, data = compressed or self._compress(data)
         size = len(data)
         max_size = self._max_size
         if size < max_size:
@@ -208,17 +402,21 @@ class ClientCache(object):
                 # is still None).
                 assert item.tid == tid, (item, tid)
                 if item.level: # already stored
-                    assert item.next_tid == next_tid and item.data == data
+                    assert item.next_tid == next_tid and (
+                        decompress(item.compression, item.data) ==
+                        decompress(compression, data))
                     return
                 assert not item.data
                 # Possible case of late invalidation.
                 item.next_tid = next_tid
             else:
+                if max_size < self._size + size and not self._admit(oid):
+                    return
                 item = CacheItem()
                 item.oid = oid
                 item.tid = tid
                 item.next_tid = next_tid
-                item.counter = 0
+                item.counter = self._policy.getCounter(oid)
                 item.level = None
                 try:
                     item_list = self._oid_dict[oid]
@@ -240,23 +438,36 @@ class ClientCache(object):
                             self._remove(prev)
                             item_list[-1] = item
             item.data = data
+            item.compression = compression
             self._fetched(item)
             self._size += size
-            if max_size < self._size:
-                for head in self._queue_list[1:]:
-                    while head:
-                        next = self._remove(head)
-                        if head.counter:
-                            head.level = 0
-                            self._add(head)
-                        else:
-                            self._remove_from_oid_dict(head)
-                        if self._size <= max_size:
-                            return
-                        head = next
+            self._evict()
+
+    def _admit(self, oid):
+        for head in self._queue_list[1:]:
+            if head:
+                return self._policy.admit(oid, head.oid)
+        return True
+
+    def _evict(self):
+        max_size = self._max_size
+        if max_size < self._size:
+            for head in self._queue_list[1:]:
+                while head:
+                    next = self._remove(head)
+                    if head.counter:
+                        head.level = 0
+                        self._add(head)
+                    else:
+                        self._remove_from_oid_dict(head)
+                    if self._size <= max_size:
+                        return
+                    head = next
 
     def invalidate(self, oid, tid):
         """Mark data record as being valid only up to given tid"""
+        if self._trace is not None:
+            self._trace('I', oid, tid)
         try:
             item = self._oid_dict[oid][-1]
         except KeyError:
@@ -268,6 +479,8 @@ class ClientCache(object):
                 assert item.next_tid <= tid, (item, oid, tid)
 
     def clear_current(self):
+        if self._trace is not None:
+            self._trace('C')
         for oid, item_list in self._oid_dict.items():
             item = item_list[-1]
             if item.next_tid is None:
@@ -281,6 +494,48 @@ class ClientCache(object):
                     del self._oid_dict[oid]
 
 
+def replay(trace_file, cache):
+    """Replay a trace recorded by CacheTrace, return (hits, misses)
+
+    Objects that were found in the traced cache but not in the given one
+    are stored as if they were loaded from storage nodes.
+    """
+    record = CacheTrace._record
+    unpack = record.unpack
+    read = trace_file.read
+    size = record.size
+    hits = misses = 0
+    data = ''
+    while 1:
+        r = read(size)
+        if len(r) < size:
+            return hits, misses
+        code, oid, tid1, tid2, tid3, length = unpack(r)
+        if length != len(data):
+            data = '\0' * length
+        if code in 'Ll':
+            if tid1 == ZERO_TID:
+                tid1 = None
+            elif code == 'l':
+                tid1 += '*'
+            if cache.load(oid, tid1):
+                hits += 1
+            else:
+                misses += 1
+                if length:
+                    cache.store(oid, data, tid2, tid3 if tid3 != ZERO_TID
+                                                   else None)
+        elif code == 'S':
+            cache.store(oid, data, tid1, tid2 if tid2 != ZERO_TID else None)
+        elif code == 'I':
+            cache.invalidate(oid, tid1)
+        elif code == 'C':
+            cache.clear_current()
+        else:
+            assert code == 'X', code
+            cache.clear()
+
+
 def test(self):
     cache = ClientCache()
     repr(cache)
@@ -320,6 +575,50 @@ def test(self):
     self.assertEqual(1, cache._history_size)
     cache.clear_current()
     self.assertEqual(0, cache._history_size)
+    # Test compressed mode.
+    cache = ClientCache(compress=True)
+    data = 'x' * 1000, 10, None
+    cache.store(1, *data)
+    size = cache._size
+    self.assertLess(size, 100)
+    self.assertEqual(cache.load(1), data)
+    compressed = Compressor('bz2')(data[0])
+    cache.store(2, data[0], 10, None, compressed)
+    self.assertEqual(cache._size, size + len(compressed[1]))
+    self.assertEqual(cache.load(2), data)
+    # Very hot small objects are decompressed.
+    item = cache._oid_dict[1][-1]
+    while item.compression:
+        self.assertEqual(cache.load(1), data)
+    self.assertEqual(item.level, cache._hot_level)
+    self.assertEqual(cache._size, len(data[0]) + len(compressed[1]))
+    self.assertEqual(cache.load(1), data)
+    # Incompressible data.
+    data = '0123456789', 10, None
+    cache.store(3, *data)
+    self.assertEqual(cache._oid_dict[3][-1].compression, 0)
+    self.assertEqual(cache.load(3), data)
+    # Test policies.
+    policy = SizeAwarePolicy(0)
+    size = policy.reference_size
+    self.assertEqual(policy.level(4, size), MultiQueuePolicy(0).level(4, size))
+    self.assertEqual(policy.level(4, size * 2), 2)
+    self.assertEqual(policy.level(1, size * 10), 1)
+    cache = ClientCache(max_size=100, policy='tinylfu')
+    for oid in 1, 2:
+        cache.load(oid)
+        cache.store(oid, 'x' * 40, 10, None)
+        cache.load(oid)
+    # Not admitted, because less frequently accessed than 1.
+    self.assertEqual(cache.load(3), None)
+    cache.store(3, 'y' * 40, 10, None)
+    self.assertEqual(cache.load(3), None)
+    self.assertEqual(cache._size, 80)
+    for i in xrange(2):
+        cache.load(3)
+    cache.store(3, 'y' * 40, 10, None)
+    self.assertEqual(cache.load(3), ('y' * 40, 10, None))
+    self.assertEqual(cache.load(1), None)
 
 if __name__ == '__main__':
     import unittest
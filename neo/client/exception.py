@@ -22,6 +22,12 @@ class NEOStorageError(POSException.StorageError):
 class NEOStorageReadRetry(NEOStorageError):
     pass
 
+class NEOPartitionSplit(NEOStorageError):
+    """
+    The number of partitions changed during a read made of requests per
+    partition, which must then be restarted with the new partitions.
+    """
+
 class NEOStorageNotFoundError(NEOStorageError):
     pass
 
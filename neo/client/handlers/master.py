@@ -15,10 +15,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from neo.lib import logging
+from neo.lib.compress import CODEC_NAME_DICT
 from neo.lib.exception import PrimaryElected
 from neo.lib.handler import MTEventHandler
 from neo.lib.pt import MTPartitionTable as PartitionTable
-from neo.lib.protocol import NodeStates
+from neo.lib.protocol import NodeStates, Packets
 from . import AnswerBaseHandler
 from ..exception import NEOStorageError
 
@@ -68,6 +69,8 @@ class PrimaryNotificationsHandler(MTEventHandler):
                 # Make sure a parallel load won't refill the cache
                 # with garbage.
                 app._loading_oid = app._loading_invalidated = None
+                if app._host_cache:
+                    app._host_cache.connected(ltid)
             finally:
                 app._cache_lock_release()
             db = app.getDB()
@@ -88,6 +91,10 @@ class PrimaryNotificationsHandler(MTEventHandler):
                 if data is not None:
                     # Store in cache with no next_tid
                     cache.store(oid, data, tid, None)
+            if app._host_cache:
+                # Other processes will get invalidations from the master
+                # but maybe after they loaded previous data.
+                app._host_cache.invalidateObjects(tid, cache_dict)
             if callback is not None:
                 callback(tid)
         finally:
@@ -116,22 +123,29 @@ class PrimaryNotificationsHandler(MTEventHandler):
         logging.info("cluster switching to %s state", state)
 
     def invalidateObjects(self, conn, tid, oid_list):
+        self.invalidateObjectsList(conn, ((tid, oid_list),))
+
+    def invalidateObjectsList(self, conn, invalidation_list):
         app = self.app
         if app.ignore_invalidations:
             return
-        app.last_tid = tid
+        app.last_tid = invalidation_list[-1][0]
         app._cache_lock_acquire()
         try:
             invalidate = app._cache.invalidate
-            loading = app._loading_oid
-            for oid in oid_list:
-                invalidate(oid, tid)
-                if oid == loading:
-                    app._loading_oid = None
-                    app._loading_invalidated = tid
+            host_cache = app._host_cache
             db = app.getDB()
-            if db is not None:
-                db.invalidate(tid, oid_list)
+            for tid, oid_list in invalidation_list:
+                loading = app._loading_oid
+                for oid in oid_list:
+                    invalidate(oid, tid)
+                    if oid == loading:
+                        app._loading_oid = None
+                        app._loading_invalidated = tid
+                if host_cache:
+                    host_cache.invalidateObjects(tid, oid_list)
+                if db is not None:
+                    db.invalidate(tid, oid_list)
         finally:
             app._cache_lock_release()
 
@@ -139,6 +153,15 @@ class PrimaryNotificationsHandler(MTEventHandler):
         if self.app.pt.filled():
             self.app.pt.update(ptid, cell_list, self.app.nm)
 
+    def notifyPartitionSplit(self, conn, ptid, num_partitions):
+        if self.app.pt.filled():
+            self.app.pt.split(ptid, num_partitions)
+
+    def askStats(self, conn):
+        app = self.app
+        conn.answer(Packets.AnswerStats(
+            [(app.uuid, app.em.stats.getSampleList())]))
+
     def notifyNodeInformation(self, conn, timestamp, node_list):
         super(PrimaryNotificationsHandler, self).notifyNodeInformation(
             conn, timestamp, node_list)
@@ -151,6 +174,15 @@ class PrimaryNotificationsHandler(MTEventHandler):
                 if node and node.isConnected():
                     node.getConnection().close()
 
+    def notifyCompression(self, conn, codec_list):
+        app = self.app
+        codec = app.compress.codec
+        if codec not in codec_list:
+            logging.warning('compression codec %s is not allowed by the'
+                ' cluster: data will be stored uncompressed',
+                CODEC_NAME_DICT[codec])
+        app.compression_set = frozenset(codec_list)
+
     def notifyDeadlock(self, conn, ttid, locking_tid):
         for txn_context in self.app.txn_contexts():
             if txn_context.ttid == ttid:
@@ -165,8 +197,10 @@ class PrimaryAnswersHandler(AnswerBaseHandler):
         self.app.setHandlerData(ttid)
 
     def answerNewOIDs(self, conn, oid_list):
+        # OIDs are popped from the end, and the list may not be empty
+        # if it was requested in advance.
         oid_list.reverse()
-        self.app.new_oid_list = oid_list
+        self.app.new_oid_list = oid_list + list(self.app.new_oid_list)
 
     def incompleteTransaction(self, conn, message):
         raise NEOStorageError("storage nodes for which vote failed can not be"
@@ -14,10 +14,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from zlib import decompress
 from ZODB.TimeStamp import TimeStamp
 
 from neo.lib import logging
+from neo.lib.compress import decompress
 from neo.lib.protocol import Packets, uuid_str
 from neo.lib.util import dump, makeChecksum
 from neo.lib.exception import NodeNotReady
@@ -81,6 +81,9 @@ class StorageAnswersHandler(AnswerBaseHandler):
 
     answerCheckCurrentSerial = answerStoreObject
 
+    def answerRestoreObject(self, conn, oid):
+        self.app.getHandlerData().written(self.app, conn.getUUID(), oid)
+
     def answerRebaseTransaction(self, conn, oid_list):
         txn_context = self.app.getHandlerData()
         ttid = txn_context.ttid
@@ -129,8 +132,7 @@ class StorageAnswersHandler(AnswerBaseHandler):
                             'wrong checksum while getting back data for'
                             ' object %s during rebase of transaction %s'
                             % (dump(oid), dump(txn_context.ttid)))
-                    if compression:
-                        data = decompress(data)
+                    data = decompress(compression, data)
                     size = len(data)
                     txn_context.data_size += size
                     if cached:
@@ -154,6 +156,9 @@ class StorageAnswersHandler(AnswerBaseHandler):
         logging.debug('Get %u TIDs from %r', len(tid_list), conn)
         self.app.setHandlerData(tid_list)
 
+    def answerTransactionRecords(self, conn, *args):
+        self.app.setHandlerData(args)
+
     def answerTransactionInformation(self, conn, tid,
                                            user, desc, ext, packed, oid_list):
         self.app.setHandlerData(({
@@ -0,0 +1,308 @@
+#
+# Copyright (C) 2017  Nexedi SA
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Cache of object records shared by all client processes of a host
+
+The cache is a file mapped in memory by all processes (it should be on a
+tmpfs like /dev/shm), which is split into stripes. A stripe is selected by
+oid and protected by a POSIX record lock, which the kernel releases if the
+process dies. Each stripe has a fixed number of index entries, reused in a
+circular way, and a ring buffer for data: an entry is valid as long as its
+data has not been overwritten, and checked with a CRC, so that a write
+interrupted by a dead process is ignored.
+
+As for ClientCache, a record without next_tid is the current one, and
+invalidations from the master set next_tid. Because processes don't receive
+invalidations at the same time, a current record can only be added if it is
+known to be current at least up to the last invalidation applied to its
+stripe (see 'valid_tid' in store()).
+"""
+
+import errno, fcntl, mmap, os, struct, threading
+from zlib import crc32
+from neo.lib.protocol import ZERO_TID
+from neo.lib.util import u64
+
+MAGIC = 'NEOHC001'
+# magic, stripe count, entries per stripe, data size per stripe,
+# min valid tid, last tid
+HEADER = struct.Struct('>8sLLQ8s8s')
+MIN_VALID_TID = slice(HEADER.size - 16, HEADER.size - 8)
+LAST_TID = slice(HEADER.size - 8, HEADER.size)
+# write position, last invalidation tid, next entry
+STRIPE_HEADER = struct.Struct('>Q8sL')
+# used, oid, tid, next_tid, valid_tid, compression, position, size, crc
+ENTRY = struct.Struct('>B8s8s8s8sBQLl')
+PAGE_SIZE = mmap.PAGESIZE
+HOST_CACHE_SIZE = 256 << 20
+
+# lockf() locks are per process so we also need a lock for threads.
+# There's normally a single host cache per process so a global lock is fine.
+_thread_lock = threading.Lock()
+
+class HostCache(object):
+    """Host-local cache of object records, shared between processes
+
+    Methods must be called with the client cache lock held, like those of
+    ClientCache. Object data is kept as sent by storage nodes, i.e. possibly
+    compressed.
+    """
+
+    def __init__(self, path, max_size=HOST_CACHE_SIZE, stripes=64):
+        self._path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            _thread_lock.acquire()
+            fcntl.lockf(fd, fcntl.LOCK_EX, 1, 0)
+            try:
+                size = os.fstat(fd).st_size
+                if size:
+                    header = os.read(fd, HEADER.size)
+                else:
+                    stripe_size = max_size // stripes
+                    entries = max(64, stripe_size >> 10)
+                    header = HEADER.pack(MAGIC, stripes, entries,
+                                         stripe_size, ZERO_TID, ZERO_TID)
+                    size = PAGE_SIZE + stripes * (STRIPE_HEADER.size
+                        + entries * ENTRY.size + stripe_size)
+                    os.ftruncate(fd, size)
+                    os.write(fd, header)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, 1, 0)
+                _thread_lock.release()
+            magic, self._stripes, self._entries, self._data_size, _, _ = \
+                HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError("%r is not a NEO host cache" % path)
+            self._map = mmap.mmap(fd, size)
+        except:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._stripe_size = (STRIPE_HEADER.size
+            + self._entries * ENTRY.size + self._data_size)
+        # Bigger objects would evict too many other ones.
+        self._max_object_size = self._data_size >> 2
+
+    def close(self):
+        # Closing any file descriptor releases all locks of the process.
+        with _thread_lock:
+            if self._fd is not None:
+                self._map.close()
+                os.close(self._fd)
+                self._fd = None
+
+    def __repr__(self):
+        return '<%s %r stripes=%s entries=%s size=%s>' % (
+            self.__class__.__name__, self._path, self._stripes,
+            self._entries, self._stripes * self._data_size)
+
+    def _lock(self, stripe):
+        # The header is protected by the lock at offset 0 (stripe = -1).
+        _thread_lock.acquire()
+        try:
+            while 1:
+                try:
+                    fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 1 + stripe)
+                    break
+                except IOError, e:
+                    if e.errno != errno.EINTR:
+                        raise
+        except:
+            _thread_lock.release()
+            raise
+
+    def _unlock(self, stripe):
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 1 + stripe)
+        finally:
+            _thread_lock.release()
+
+    def _getStripe(self, oid):
+        stripe = u64(oid) % self._stripes
+        return stripe, PAGE_SIZE + stripe * self._stripe_size
+
+    def _iterEntries(self, offset, oid):
+        """Return offsets of entries of the given oid in a stripe"""
+        find = self._map.find
+        start = offset + STRIPE_HEADER.size
+        end = start + self._entries * ENTRY.size
+        # Search oids with mmap.find (fast) and skip matches of other fields.
+        i = find(oid, start + 1, end)
+        while i >= 0:
+            i -= 1
+            if not (i - start) % ENTRY.size and self._map[i] == '\1':
+                yield i
+                i += ENTRY.size - 1
+            i = find(oid, i + 2, end)
+
+    def load(self, oid, before_tid=None):
+        """Return (tid, next_tid, compression, data) or None
+
+        See ClientCache.load for the meaning of 'before_tid'.
+        """
+        at_tid = before_tid and before_tid[-1:] == '*' and before_tid[:-1]
+        unpack_from = ENTRY.unpack_from
+        stripe, offset = self._getStripe(oid)
+        self._lock(stripe)
+        try:
+            write_pos = STRIPE_HEADER.unpack_from(self._map, offset)[0]
+            data_offset = (offset + STRIPE_HEADER.size
+                           + self._entries * ENTRY.size)
+            min_valid_tid = self._map[MIN_VALID_TID]
+            for i in self._iterEntries(offset, oid):
+                (_, _, tid, next_tid, valid_tid, compression, pos, size,
+                 crc) = unpack_from(self._map, i)
+                if next_tid == ZERO_TID:
+                    if valid_tid < min_valid_tid:
+                        continue
+                    next_tid = None
+                if at_tid:
+                    if tid != at_tid:
+                        continue
+                elif before_tid:
+                    if not (tid < before_tid and
+                            (next_tid is None or before_tid <= next_tid)):
+                        continue
+                elif next_tid:
+                    continue
+                if not 0 <= write_pos - pos - size <= self._data_size - size:
+                    continue # overwritten, or corrupted entry
+                data = self._read(data_offset, pos, size)
+                if crc32(data) != crc:
+                    continue
+                return tid, next_tid, compression, data
+        finally:
+            self._unlock(stripe)
+
+    def _read(self, data_offset, pos, size):
+        pos %= self._data_size
+        end = pos + size
+        if end <= self._data_size:
+            return self._map[data_offset+pos:data_offset+end]
+        end -= self._data_size
+        return (self._map[data_offset+pos:data_offset+self._data_size]
+              + self._map[data_offset:data_offset+end])
+
+    def _write(self, data_offset, pos, data):
+        pos %= self._data_size
+        end = pos + len(data)
+        if end <= self._data_size:
+            self._map[data_offset+pos:data_offset+end] = data
+        else:
+            n = self._data_size - pos
+            self._map[data_offset+pos:data_offset+self._data_size] = data[:n]
+            self._map[data_offset:data_offset+end-self._data_size] = data[n:]
+
+    def store(self, oid, compression, data, tid, next_tid, valid_tid):
+        """Add a record to the cache
+
+        'valid_tid' is a tid up to which a current record (i.e. next_tid is
+        None) is known to be current. For such record, nothing is done if
+        this tid is older than any invalidation that was already applied
+        to the stripe by any process, or if it's None.
+        """
+        size = len(data)
+        if size > self._max_object_size:
+            return
+        pack_into = ENTRY.pack_into
+        stripe, offset = self._getStripe(oid)
+        self._lock(stripe)
+        try:
+            write_pos, inv_tid, entry = STRIPE_HEADER.unpack_from(
+                self._map, offset)
+            if next_tid is None:
+                if (valid_tid is None or
+                    valid_tid < max(inv_tid, self._map[MIN_VALID_TID])):
+                    return
+                next_tid = ZERO_TID
+            for i in self._iterEntries(offset, oid):
+                if ENTRY.unpack_from(self._map, i)[2] == tid:
+                    # Someone else was faster, or the entry is being replaced
+                    # because its data was overwritten.
+                    self._map[i] = '\0'
+            index_offset = offset + STRIPE_HEADER.size
+            i = index_offset + entry * ENTRY.size
+            # First reserve space, so that nothing refers to data that a
+            # dying process may have partially written.
+            self._map[i] = '\0'
+            STRIPE_HEADER.pack_into(self._map, offset, write_pos + size,
+                inv_tid, (entry + 1) % self._entries)
+            self._write(index_offset + self._entries * ENTRY.size,
+                        write_pos, data)
+            pack_into(self._map, i, 1, oid, tid, next_tid, valid_tid,
+                      compression, write_pos, size, crc32(data))
+        finally:
+            self._unlock(stripe)
+
+    def invalidate(self, oid, tid):
+        """Mark data record as being valid only up to given tid"""
+        stripe, offset = self._getStripe(oid)
+        self._lock(stripe)
+        try:
+            if self._map[offset+8:offset+16] < tid:
+                self._map[offset+8:offset+16] = tid
+            for i in self._iterEntries(offset, oid):
+                if (self._map[i+17:i+25] == ZERO_TID and
+                    self._map[i+9:i+17] < tid):
+                    self._map[i+17:i+25] = tid
+        finally:
+            self._unlock(stripe)
+
+    def invalidateObjects(self, tid, oid_list):
+        for oid in oid_list:
+            self.invalidate(oid, tid)
+        self._lock(-1)
+        try:
+            if self._map[LAST_TID] < tid:
+                self._map[LAST_TID] = tid
+        finally:
+            self._unlock(-1)
+
+    def connected(self, ltid):
+        """Called when a client is (re)connected to the master
+
+        If no process was connected to the master when the last transactions
+        were committed, invalidations were lost and all current records that
+        are not known to be valid up to 'ltid' must be ignored.
+        """
+        self._lock(-1)
+        try:
+            last_tid = self._map[LAST_TID]
+            if last_tid < ltid:
+                self._map[LAST_TID] = self._map[MIN_VALID_TID] = ltid
+        finally:
+            self._unlock(-1)
+        if ltid < last_tid:
+            # The DB was truncated.
+            self.clear()
+            self._lock(-1)
+            try:
+                self._map[LAST_TID] = self._map[MIN_VALID_TID] = ltid
+            finally:
+                self._unlock(-1)
+
+    def clear(self):
+        """Forget everything"""
+        index_size = self._entries * ENTRY.size
+        for stripe in xrange(self._stripes):
+            offset = PAGE_SIZE + stripe * self._stripe_size
+            self._lock(stripe)
+            try:
+                offset += STRIPE_HEADER.size
+                self._map[offset:offset+index_size] = '\0' * index_size
+            finally:
+                self._unlock(stripe)
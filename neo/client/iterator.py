@@ -14,12 +14,21 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import defaultdict, deque
+from cPickle import loads
+from operator import attrgetter
 from ZODB import BaseStorage
-from neo.lib.protocol import ZERO_TID, MAX_TID
-from neo.lib.util import u64, add64
-from .exception import NEOStorageCreationUndoneError, NEOStorageNotFoundError
+from neo.lib import logging
+from neo.lib.compress import decompress
+from neo.lib.connection import ConnectionClosed
+from neo.lib.locking import SimpleQueue
+from neo.lib.protocol import Packets, MAX_TID, ZERO_HASH, ZERO_OID, ZERO_TID
+from neo.lib.util import add64, dump, makeChecksum, u64
+from .exception import NEOPartitionSplit, NEOStorageReadRetry
 
 CHUNK_LENGTH = 100
+# Number of chunks that are read in advance for each partition.
+READAHEAD = 2
 
 class Record(BaseStorage.DataRecord):
     """ BaseStorage Transaction record yielded by the Transaction object """
@@ -34,40 +43,162 @@ class Record(BaseStorage.DataRecord):
 class Transaction(BaseStorage.TransactionRecord):
     """ Transaction object yielded by the NEO iterator """
 
-    def __init__(self, app, txn):
-        super(Transaction, self).__init__(txn['id'], ' ',
-            txn['user_name'], txn['description'], txn['ext'])
-        self.app = app
-        self.oid_list = txn['oids']
+    def __init__(self, txn, record_dict):
+        tid, user, desc, ext, packed, oid_list = txn
+        super(Transaction, self).__init__(tid, ' ', user, desc, loads(ext))
+        self.oid_list = oid_list
+        self.record_dict = record_dict
 
     def __iter__(self):
         """ Iterate over the transaction records """
-        load = self.app._loadFromStorage
+        record_dict = self.record_dict
         for oid in self.oid_list:
-            try:
-                data, _, _, data_tid = load(oid, self.tid, None)
-            except NEOStorageCreationUndoneError:
-                data = data_tid = None
-            except NEOStorageNotFoundError:
-                # Transactions are not updated after a pack, so their object
-                # will not be found in the database. Skip them.
-                continue
-            yield Record(oid, self.tid, data, data_tid)
+            # Transactions are not updated after a pack, so their object
+            # will not be found in the database. Skip them.
+            if oid in record_dict:
+                yield record_dict[oid]
 
     def __str__(self):
         return 'Transaction #%s: %s %s' \
             % (u64(self.tid), self.user, self.status)
 
 
+class PartitionReader(object):
+    """Read transactions and object records of a partition by chunks
+
+    The next chunk is requested as soon as an answer is received, unless
+    READAHEAD chunks are already buffered. Partitions are those of a table
+    with np partitions: NEOPartitionSplit is raised if it is split.
+    """
+
+    asking = False
+
+    def __init__(self, app, partition, np, start, stop):
+        self.app = app
+        self.partition = partition
+        self.np = np
+        self.stop = stop
+        self.next = start, ZERO_OID
+        # All records and transactions below this tid are received.
+        self.upto = start
+        # Upper bounds of chunks that are not entirely consumed.
+        self.bound_list = deque()
+        self.queue = SimpleQueue()
+
+    def _packet(self):
+        min_tid, min_oid = self.next
+        return Packets.AskTransactionRecords(self.partition, self.np,
+            CHUNK_LENGTH, min_tid, self.stop, min_oid)
+
+    def _decode(self, conn, answer):
+        txn_list, object_list, next_tid, next_oid = answer
+        record_list = []
+        for oid, serial, compression, checksum, data, data_serial \
+                in object_list:
+            if data or checksum != ZERO_HASH:
+                if checksum != makeChecksum(data):
+                    logging.error('wrong checksum from %s for oid %s',
+                              conn, dump(oid))
+                    raise NEOStorageReadRetry(False)
+                data = decompress(compression, data)
+            else:
+                data = data_serial = None
+            record_list.append(Record(oid, serial, data, data_serial))
+        return txn_list, record_list, next_tid, next_oid
+
+    def ask(self, upto):
+        """Request the next chunk if possible
+
+        upto: tid below which all received data is consumed
+        """
+        bound_list = self.bound_list
+        while bound_list and bound_list[0] <= upto:
+            bound_list.popleft()
+        if not self.asking and self.next and len(bound_list) < READAHEAD:
+            queue = self.queue
+            self.app._askStorageForRead(self.partition, self._packet(),
+                lambda conn, packet: conn.ask(packet, queue=queue))
+            self.asking = True
+
+    def receive(self):
+        """Wait for the requested chunk and return its contents"""
+        app = self.app
+        conn, packet, kw = self.queue.get(True)
+        self.asking = False
+        try:
+            app._handlePacket(conn, packet, kw, app.storage_handler)
+            result = self._decode(conn, app.getHandlerData())
+        except (ConnectionClosed, NEOStorageReadRetry):
+            # Retry synchronously, possibly with another storage node.
+            # Storage nodes reject requests with a wrong number of partitions.
+            def askStorage(conn, packet):
+                if self.np != app.pt.getPartitions():
+                    raise NEOPartitionSplit
+                return self._decode(conn, app._askStorage(conn, packet))
+            result = app._askStorageForRead(self.partition, self._packet(),
+                                            askStorage)
+        txn_list, record_list, next_tid, next_oid = result
+        if next_tid is None:
+            self.next = None
+            self.upto = add64(self.stop, 1)
+        else:
+            self.next = next_tid, next_oid
+            self.upto = next_tid
+        self.bound_list.append(self.upto)
+        return txn_list, record_list
+
+
 def iterator(app, start=None, stop=None):
-    """NEO transaction iterator"""
+    """NEO transaction iterator
+
+    Storage nodes return transactions and object records of each partition
+    by chunks, which are merged by tid. If partitions are split meanwhile,
+    reading restarts with the new partitions from the first tid that is not
+    returned yet.
+    """
     if start is None:
         start = ZERO_TID
     stop = min(stop or MAX_TID, app.last_tid)
-    while 1:
-        max_tid, chunk = app.transactionLog(start, stop, CHUNK_LENGTH)
-        if not chunk:
-            break # nothing more
-        for txn in chunk:
-            yield Transaction(app, txn)
-        start = add64(max_tid, 1)
+    if stop < start:
+        return
+    forget_queue = app.dispatcher.forget_queue
+    def forget():
+        for reader in reader_list:
+            forget_queue(reader.queue, flush_queue=False)
+    reader_list = []
+    end = add64(stop, 1)
+    upto = start
+    try:
+        while 1:
+            if not reader_list:
+                np = app.pt.getPartitions()
+                reader_list = [PartitionReader(app, partition, np, upto, stop)
+                               for partition in xrange(np)]
+                txn_dict = {}
+                record_dict = defaultdict(dict)
+            for reader in reader_list:
+                reader.ask(upto)
+            # Wait for the partition that is the most behind.
+            reader = min(reader_list, key=attrgetter('upto'))
+            if reader.upto == end:
+                break
+            try:
+                txn_list, record_list = reader.receive()
+            except NEOPartitionSplit:
+                logging.info('partition table split during iteration,'
+                             ' restarting from %s', dump(upto))
+                forget()
+                reader_list = []
+                continue
+            for txn in txn_list:
+                txn_dict[txn[0]] = txn
+            for record in record_list:
+                record_dict[record.tid][record.oid] = record
+            x = min(reader_list, key=attrgetter('upto')).upto
+            if upto < x:
+                upto = x
+                for tid in sorted(tid for tid in txn_dict if tid < upto):
+                    yield Transaction(txn_dict.pop(tid),
+                                      record_dict.pop(tid, {}))
+    finally:
+        forget()
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import deque
 from ZODB.POSException import StorageTransactionError
 from neo.lib.connection import ConnectionClosed
 from neo.lib.locking import SimpleQueue
@@ -39,6 +40,8 @@ class Transaction(object):
     def __init__(self, txn):
         self.queue = SimpleQueue()
         self.txn = txn
+        # data being compressed by the worker pool, before being stored
+        self.compress_queue = deque()
         # data being stored
         self.data_dict = {}                 # {oid: (value, serial, [node_id])}
         # data stored: this will go to the cache on tpc_finish
@@ -0,0 +1,120 @@
+#
+# Copyright (C) 2017  Nexedi SA
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bz2, zlib
+
+# The id of a codec is what the 'compression' field of packets and of the
+# 'data' table contains, so it must never change: 0 means uncompressed data
+# and 1 is what older versions used for zlib at default level.
+#  (id, name, compress, decompress, min level, max level, default level)
+_codec_list = (
+    (1, 'zlib', zlib.compress, zlib.decompress, 0, 9, 6),
+    (2, 'bz2', bz2.compress, bz2.decompress, 1, 9, 9),
+)
+
+CODEC_DICT = {x[1]: x[0] for x in _codec_list}
+CODEC_NAME_DICT = {x[0]: x[1] for x in _codec_list}
+DEFAULT_CODEC = 'zlib'
+_compress_dict = {x[0]: x[2] for x in _codec_list}
+_decompress_dict = {x[0]: x[3] for x in _codec_list}
+_level_dict = {x[0]: x[4:] for x in _codec_list}
+_boolean_dict = dict.fromkeys(('true', 'yes', 'on', '1'), True)
+_boolean_dict.update(dict.fromkeys(('false', 'no', 'off', '0', ''), False))
+
+def parseCodec(spec):
+    """Return (codec id, level) from a specification like 'zlib=9'
+
+    A boolean (or its usual string representations) selects the default codec
+    at default level, or disables compression, in which case (0, None) is
+    returned.
+    """
+    if isinstance(spec, basestring):
+        name, sep, level = spec.strip().lower().partition('=')
+        if not sep and name in _boolean_dict:
+            spec = _boolean_dict[name]
+        else:
+            try:
+                codec = CODEC_DICT[name]
+            except KeyError:
+                raise ValueError('unknown compression codec %r' % name)
+            min_level, max_level, default = _level_dict[codec]
+            if not sep:
+                return codec, default
+            try:
+                level = int(level)
+            except ValueError:
+                level = None
+            if level is None or not min_level <= level <= max_level:
+                raise ValueError('%s level must be between %s and %s'
+                                 % (name, min_level, max_level))
+            return codec, level
+    if spec:
+        codec = CODEC_DICT[DEFAULT_CODEC]
+        return codec, _level_dict[codec][2]
+    return 0, None
+
+def parseCodecList(value):
+    """Return the set of codec ids from a comma-separated list of names
+
+    Uncompressed data is always allowed.
+    """
+    codec_set = {0}
+    for name in value.split(','):
+        name = name.strip().lower()
+        if name:
+            try:
+                codec_set.add(CODEC_DICT[name])
+            except KeyError:
+                raise ValueError('unknown compression codec %r' % name)
+    return codec_set
+
+def decompress(compression, data):
+    if compression:
+        try:
+            decompress = _decompress_dict[compression]
+        except KeyError:
+            raise ValueError('unknown compression codec %r' % compression)
+        return decompress(data)
+    return data
+
+
+class Compressor(object):
+    """Compress object records according to a codec specification
+
+    Data smaller than 'min_size' bytes is left uncompressed, as well as data
+    whose compression does not save at least the 'min_gain' ratio of its size.
+    """
+
+    def __init__(self, spec=True, min_size=0, min_gain=0):
+        self.codec, self.level = parseCodec(spec)
+        if self.codec:
+            self._compress = _compress_dict[self.codec]
+        if not 0 <= min_gain < 1:
+            raise ValueError('minimum compression gain must be in [0, 1)')
+        self.min_size = min_size
+        self.max_ratio = 1 - min_gain
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, '%s=%s' % (
+            CODEC_NAME_DICT[self.codec], self.level) if self.codec else 'off')
+
+    def __call__(self, data):
+        """Return (compression, data)"""
+        if self.codec and self.min_size <= len(data):
+            compressed_data = self._compress(data, self.level)
+            if len(compressed_data) <= len(data) * self.max_ratio:
+                return self.codec, compressed_data
+        return 0, data
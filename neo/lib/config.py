@@ -18,6 +18,7 @@ import os
 from optparse import OptionParser
 from ConfigParser import SafeConfigParser, NoOptionError
 from . import util
+from .compress import parseCodecList
 from .util import parseNodeAddress
 
 
@@ -97,9 +98,28 @@ class ConfigurationManager(object):
         bind = self.__get('bind')
         return parseNodeAddress(bind, 0)
 
+    def getMetrics(self):
+        """ Get the address of the HTTP server exporting metrics """
+        bind = self.__get('metrics', True)
+        if bind:
+            return parseNodeAddress(bind, 0)
+
     def getDisableDropPartitions(self):
         return self.__get('disable_drop_partitions', True)
 
+    def getBackupReplications(self):
+        n = self.__get('backup_replications', True)
+        if n:
+            return int(n)
+
+    def getDevid(self):
+        return self.__get('devid', True)
+
+    def getCapacity(self):
+        n = self.__get('capacity', True)
+        if n:
+            return int(n)
+
     def getDatabase(self):
         return self.__get('database')
 
@@ -143,6 +163,16 @@ class ConfigurationManager(object):
     def getUpstreamMasters(self):
         return util.parseMasterList(self.__get('upstream_masters'))
 
+    def getCompression(self):
+        codecs = self.__get('compression', True)
+        if codecs is not None:
+            return parseCodecList(codecs)
+
+    def getInvalidationDelay(self):
+        delay = self.__get('invalidation_delay', True)
+        if delay:
+            return float(delay)
+
     def getAutostart(self):
         n = self.__get('autostart', True)
         if n:
@@ -76,7 +76,7 @@ class HandlerSwitcher(object):
         answer_class = request.getAnswerClass()
         assert answer_class is not None, "Not a request"
         assert msg_id not in request_dict, "Packet id already expected"
-        request_dict[msg_id] = answer_class, kw
+        request_dict[msg_id] = answer_class, kw, type(request).__name__, time()
 
     def handle(self, connection, packet):
         assert not self._is_handling
@@ -90,6 +90,9 @@ class HandlerSwitcher(object):
         pending = self._pending
         assert len(pending) == 1 or pending[0][0], pending
         logging.packet(connection, packet, False)
+        stats = connection.em.stats
+        stats.inc(('neo_packets_received_total', 'type',
+                   type(packet).__name__))
         if connection.isClosed() and (connection.isAborted() or
                                       packet.ignoreOnClosedConnection()):
             logging.debug('Ignoring packet %r on closed connection %r',
@@ -103,10 +106,13 @@ class HandlerSwitcher(object):
         request_dict, handler = pending[0]
         # checkout the expected answer class
         try:
-            klass, kw = request_dict.pop(msg_id)
+            klass, kw, request, start = request_dict.pop(msg_id)
         except KeyError:
             klass = None
             kw = {}
+        else:
+            stats.observe(('neo_request_latency_seconds', 'type', request),
+                          time() - start)
         try:
             if klass and isinstance(packet, klass) or packet.isError():
                 handler.packetReceived(connection, packet, kw)
@@ -544,6 +550,8 @@ class Connection(BaseConnection):
             # enable polling for writing.
             self.em.addWriter(self)
         logging.packet(self, packet, True)
+        self.em.stats.inc(('neo_packets_sent_total', 'type',
+                           type(packet).__name__))
 
     def send(self, packet, msg_id=None):
         """ Then a packet with a new ID """
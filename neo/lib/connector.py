@@ -25,6 +25,8 @@ from .protocol import ENCODED_VERSION
 # Fill by calling registerConnectorHandler.
 # Read by calling SocketConnector.__new__
 connector_registry = {}
+# Data that is sent without being concatenated with other chunks.
+BIG_CHUNK = 1 << 16
 def registerConnectorHandler(connector_handler):
     connector_registry[connector_handler.af_type] = connector_handler
 
@@ -170,9 +172,24 @@ class SocketConnector(object):
         self._error('recv')
 
     def send(self):
-        # XXX: unefficient for big packets
-        msg = ''.join(self.queued)
-        if msg:
+        # Small chunks (like packet headers) are concatenated, but big ones
+        # are sent without being copied: they're usually bodies of packets
+        # that are broadcasted, i.e. shared by many connections.
+        queued = self.queued
+        while queued:
+            i = 0
+            for msg in queued:
+                if len(msg) >= BIG_CHUNK:
+                    break
+                i += 1
+            if i > 1:
+                msg = ''.join(queued[:i])
+                queued[:i] = msg,
+            else:
+                msg = queued[0]
+            if not msg:
+                del queued[0]
+                continue
             try:
                 n = self.socket.send(msg)
             except socket.error, e:
@@ -182,11 +199,10 @@ class SocketConnector(object):
             # - for SSL sockets, this is always the case unless everything
             #   could be sent.
             if n != len(msg):
-                self.queued[:] = msg[n:],
+                queued[0] = (buffer(msg, n) if len(msg) - n >= BIG_CHUNK
+                             else msg[n:])
                 return False
-            del self.queued[:]
-        else:
-            assert not self.queued
+            del queued[0]
         return True
 
 
@@ -19,6 +19,7 @@ from time import time
 from select import epoll, EPOLLIN, EPOLLOUT, EPOLLERR, EPOLLHUP
 from errno import EAGAIN, EEXIST, EINTR, ENOENT
 from . import logging
+from .stats import Stats
 from .locking import Lock
 
 @apply
@@ -37,6 +38,7 @@ class EpollEventManager(object):
     _timeout = None
 
     def __init__(self):
+        self.stats = Stats()
         self.connection_dict = {}
         self.reader_set = set()
         self.writer_set = set()
@@ -156,9 +158,12 @@ class EpollEventManager(object):
             if not self._pending_processing:
                 return
         to_process = self._pending_processing.pop(0)
+        start = time()
         try:
             to_process.process()
         finally:
+            # How long other connections waited because of this one.
+            self.stats.observe('neo_event_loop_lag_seconds', time() - start)
             # ...and requeue if there are pending messages
             if to_process.hasPendingMessages():
                 self._addPendingConnection(to_process)
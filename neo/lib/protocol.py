@@ -22,7 +22,7 @@ from struct import Struct
 # The protocol version must be increased whenever upgrading a node may require
 # to upgrade other nodes. It is encoded as a 4-bytes big-endian integer and
 # the high order byte 0 is different from TLS Handshake (0x16).
-PROTOCOL_VERSION = 1
+PROTOCOL_VERSION = 2
 ENCODED_VERSION = Struct('!L').pack(PROTOCOL_VERSION)
 
 # Avoid memory errors on corrupted data.
@@ -525,6 +525,16 @@ class PBoolean(PStructItem):
     """
     _fmt = '!?'
 
+class PCompression(PStructItem):
+    """
+        A compression codec (see neo.lib.compress), encoded as a single byte
+        (0 for uncompressed data, and also when there is no data at all)
+    """
+    _fmt = '!B'
+
+    def _encode(self, writer, value):
+        writer(self.pack(value or 0))
+
 class PNumber(PStructItem):
     """
         A integer number (4-bytes length)
@@ -726,6 +736,16 @@ class LastIDs(Packet):
         PTID('last_tid'),
     )
 
+class NotifyLastIDs(Packet):
+    """
+    Notify the last OID/TID allocated by the primary master, so that a
+    secondary master does not reuse them if it takes over. PM -> M.
+    """
+    _fmt = PStruct('notify_last_ids',
+        POID('last_oid'),
+        PTID('last_tid'),
+    )
+
 class PartitionTable(Packet):
     """
     Ask the full partition table. PM -> S.
@@ -738,7 +758,7 @@ class PartitionTable(Packet):
 
 class NotifyPartitionTable(Packet):
     """
-    Send rows in a partition table to update other nodes. PM -> S, C.
+    Send rows in a partition table to update other nodes. PM -> S, C, M.
     """
     _fmt = PStruct('send_partition_table',
         PPTID('ptid'),
@@ -748,7 +768,7 @@ class NotifyPartitionTable(Packet):
 class PartitionChanges(Packet):
     """
     Notify a subset of a partition table. This is used to notify changes.
-    PM -> S, C.
+    PM -> S, C, M.
     """
     _fmt = PStruct('notify_partition_changes',
         PPTID('ptid'),
@@ -907,6 +927,19 @@ class InvalidateObjects(Packet):
         PFOidList,
     )
 
+class InvalidateObjectsList(Packet):
+    """
+    Invalidate objects of several transactions, in commit order. PM -> C.
+    """
+    _fmt = PStruct('invalidate_objects_list',
+        PList('invalidation_list',
+            PStruct('invalidation',
+                PTID('tid'),
+                PFOidList,
+            ),
+        ),
+    )
+
 class UnlockInformation(Packet):
     """
     Unlock information on a transaction. PM -> S.
@@ -970,7 +1003,7 @@ class RebaseObject(Packet):
             PTID('serial'),
             PTID('conflict_serial'),
             POption('data',
-                PBoolean('compression'),
+                PCompression('compression'),
                 PChecksum('checksum'),
                 PString('data'),
             ),
@@ -986,7 +1019,7 @@ class StoreObject(Packet):
     _fmt = PStruct('ask_store_object',
         POID('oid'),
         PTID('serial'),
-        PBoolean('compression'),
+        PCompression('compression'),
         PChecksum('checksum'),
         PString('data'),
         PTID('data_serial'),
@@ -997,6 +1030,23 @@ class StoreObject(Packet):
         PTID('conflict'),
     )
 
+class RestoreObject(Packet):
+    """
+    Ask to store an object as it was committed in another storage, i.e.
+    with its original transaction ID and with 'data_serial' as back-pointer.
+    Unlike StoreObject, there is no conflict detection. C -> S.
+    """
+    _fmt = PStruct('ask_restore_object',
+        POID('oid'),
+        PCompression('compression'),
+        PChecksum('checksum'),
+        PString('data'),
+        PTID('data_serial'),
+        PTID('tid'),
+    )
+
+    _answer = PFEmpty
+
 class AbortTransaction(Packet):
     """
     Abort a transaction. C -> S and C -> PM -> S.
@@ -1047,7 +1097,7 @@ class GetObject(Packet):
         POID('oid'),
         PTID('serial_start'),
         PTID('serial_end'),
-        PBoolean('compression'),
+        PCompression('compression'),
         PChecksum('checksum'),
         PString('data'),
         PTID('data_serial'),
@@ -1072,7 +1122,8 @@ class TIDList(Packet):
 class TIDListFrom(Packet):
     """
     Ask for length TIDs starting at min_tid. The order of TIDs is ascending.
-    C -> S.
+    The request is rejected if num_partitions is not the number of partitions
+    of the storage node, as after a split. C -> S.
     Answer the requested TIDs. S -> C
     """
     _fmt = PStruct('tid_list_from',
@@ -1080,6 +1131,7 @@ class TIDListFrom(Packet):
         PTID('max_tid'),
         PNumber('length'),
         PNumber('partition'),
+        PNumber('num_partitions'),
     )
 
     _answer = PStruct('answer_tids',
@@ -1104,6 +1156,50 @@ class TransactionInformation(Packet):
         PFOidList,
     )
 
+class TransactionRecords(Packet):
+    """
+    Ask transactions and object records of a partition, from
+    (min_tid, min_oid) to max_tid, at most length of each kind. As for
+    AskTIDsFrom, num_partitions must be the number of partitions of the
+    storage node. C -> S.
+    Answer them, sorted by tid, with the position from which the next chunk
+    starts, or None if max_tid is reached. Transactions are only returned
+    once all their records of this partition are. S -> C.
+    """
+    _fmt = PStruct('ask_transaction_records',
+        PNumber('partition'),
+        PNumber('num_partitions'),
+        PNumber('length'),
+        PTID('min_tid'),
+        PTID('max_tid'),
+        POID('min_oid'),
+    )
+
+    _answer = PStruct('answer_transaction_records',
+        PList('txn_list',
+            PStruct('txn',
+                PTID('tid'),
+                PString('user'),
+                PString('description'),
+                PString('extension'),
+                PBoolean('packed'),
+                PFOidList,
+            ),
+        ),
+        PList('object_list',
+            PStruct('object',
+                POID('oid'),
+                PTID('serial'),
+                PCompression('compression'),
+                PChecksum('checksum'),
+                PString('data'),
+                PTID('data_serial'),
+            ),
+        ),
+        PTID('next_tid'),
+        POID('next_oid'),
+    )
+
 class ObjectHistory(Packet):
     """
     Ask history information for a given object. The order of serials is
@@ -1483,7 +1579,7 @@ class AddObject(Packet):
     _fmt = PStruct('add_object',
         POID('oid'),
         PTID('serial'),
-        PBoolean('compression'),
+        PCompression('compression'),
         PChecksum('checksum'),
         PString('data'),
         PTID('data_serial'),
@@ -1529,6 +1625,152 @@ class Truncate(Packet):
 
     _answer = Error
 
+PFImportProgress = (
+    PTID('tid'),
+    PTID('max_tid'),
+    PFloat('transaction_rate'),
+    PFloat('byte_rate'),
+    PFloat('eta'),
+)
+
+class ImportProgress(Packet):
+    """
+    Notify the master node about the progress of the import done by the
+    Importer backend.
+    S -> M
+    """
+    _fmt = PStruct('notify_import_progress', *PFImportProgress)
+
+class ImportProgressList(Packet):
+    """
+    Ask the progress of imports done by storage nodes.
+    ctl -> A -> M
+    """
+    _answer = PStruct('answer_import_progress',
+        PList('progress_list',
+            PStruct('progress',
+                PUUID('node'),
+                *PFImportProgress
+            ),
+        ),
+    )
+
+class BackupLag(Packet):
+    """
+    Ask how far a backup cluster is behind its upstream cluster, globally and
+    for each partition: the 'backup_tid' and the number of transactions that
+    remain to be replicated.
+    ctl -> A -> M
+    """
+    _answer = PStruct('answer_backup_lag',
+        PTID('backup_tid'),
+        PTID('upstream_tid'),
+        PList('partition_list',
+            PStruct('partition',
+                PNumber('offset'),
+                PTID('backup_tid'),
+                PNumber('pending'),
+            ),
+        ),
+    )
+
+class PartitionSizes(Packet):
+    """
+    Notify the master node about the amount of data stored for some readable
+    partitions, and about the device this storage node is on ('devid') and
+    how many bytes it can store ('capacity', 0 if unlimited). This is used
+    when tweaking the partition table.
+    S -> M
+    """
+    _fmt = PStruct('notify_partition_sizes',
+        PString('devid'),
+        PIndex('capacity'),
+        PList('partition_list',
+            PStruct('partition',
+                PNumber('offset'),
+                PIndex('object_count'),
+                PIndex('byte_count'),
+            ),
+        ),
+    )
+
+class TweakPlan(Packet):
+    """
+    Ask the primary master how it would tweak the partition table, without
+    doing it: the changes to cells and the number of bytes that would have
+    to be replicated.
+    ctl -> A -> M
+    """
+    _fmt = PStruct('ask_tweak_plan',
+        PFUUIDList,
+    )
+
+    _answer = PStruct('answer_tweak_plan',
+        PIndex('byte_count'),
+        PList('cell_list',
+            PStruct('cell',
+                PNumber('offset'),
+                PUUID('uuid'),
+                PFCellState,
+            ),
+        ),
+    )
+
+class SplitPartitions(Packet):
+    """
+    Ask the primary master to multiply the number of partitions.
+    ctl -> A -> M
+    """
+    _fmt = PStruct('split_partitions',
+        PNumber('num_partitions'),
+    )
+
+    _answer = Error
+
+class PartitionSplit(Packet):
+    """
+    Notify that the number of partitions is multiplied: each partition is
+    split into all partitions that are congruent to it modulo the former
+    number of partitions, and these new partitions get the same cells.
+    PM -> S, C, A, M
+    """
+    _fmt = PStruct('notify_partition_split',
+        PPTID('ptid'),
+        PNumber('num_partitions'),
+    )
+
+class Stats(Packet):
+    """
+    Ask the metrics of nodes, as samples in the Prometheus text format. The
+    primary master answers with its own ones and those of the storage and
+    client nodes, which it asks in turn.
+    ctl -> A -> M -> S, C
+    """
+    _answer = PStruct('answer_stats',
+        PList('node_list',
+            PStruct('node',
+                PUUID('uuid'),
+                PList('sample_list',
+                    PStruct('sample',
+                        PString('name'),
+                        PFloat('value'),
+                    ),
+                ),
+            ),
+        ),
+    )
+
+class Compression(Packet):
+    """
+    Notify the compression codecs that clients are allowed to use.
+    M -> S, C
+    """
+    _fmt = PStruct('notify_compression',
+        PList('codec_list',
+            PCompression('codec'),
+        ),
+    )
+
 
 StaticRegistry = {}
 def register(request, ignore_when_closed=None):
@@ -1708,6 +1950,32 @@ class Packets(dict):
                     AddObject)
     Truncate = register(
                     Truncate)
+    NotifyImportProgress = register(
+                    ImportProgress)
+    AskImportProgress, AnswerImportProgress = register(
+                    ImportProgressList)
+    AskRestoreObject, AnswerRestoreObject = register(
+                    RestoreObject)
+    AskTransactionRecords, AnswerTransactionRecords = register(
+                    TransactionRecords)
+    NotifyCompression = register(
+                    Compression)
+    InvalidateObjectsList = register(
+                    InvalidateObjectsList)
+    NotifyLastIDs = register(
+                    NotifyLastIDs)
+    AskBackupLag, AnswerBackupLag = register(
+                    BackupLag)
+    NotifyPartitionSizes = register(
+                    PartitionSizes)
+    AskTweakPlan, AnswerTweakPlan = register(
+                    TweakPlan)
+    SplitPartitions = register(
+                    SplitPartitions)
+    NotifyPartitionSplit = register(
+                    PartitionSplit)
+    AskStats, AnswerStats = register(
+                    Stats)
 
 def Errors():
     registry_dict = {}
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import math
+from collections import Counter
 from . import logging, protocol
 from .locking import Lock
 from .protocol import uuid_str, CellStates
@@ -93,6 +94,7 @@ class PartitionTable(object):
         # inner list instance.
         self.partition_list = [[] for _ in xrange(num_partitions)]
         self.count_dict = {}
+        self._resetReadable()
 
     def getID(self):
         return self._id
@@ -112,12 +114,43 @@ class PartitionTable(object):
         # inner list instance.
         self.partition_list = [[] for _ in xrange(self.np)]
         self.count_dict.clear()
+        self._resetReadable()
+
+    def _resetReadable(self):
+        # For each partition, the tuple of readable cells. It is what
+        # clients need for every read, and it makes operational() fast.
+        self._readable_list = [()] * self.np
+        self._unreadable_rows = self.np
+        # Number of readable cells per node.
+        self._readable_count = Counter()
+
+    def _updateReadable(self, *offset_list):
+        """Update the readable cells of the given partitions
+
+        This must be called whenever the state of a cell changes, or cells
+        are added or removed, other than via _setCell and removeCell.
+        All partitions are updated if none is given.
+        """
+        readable_list = self._readable_list
+        readable_count = self._readable_count
+        for offset in offset_list or xrange(self.np):
+            old = readable_list[offset]
+            new = tuple(filter(Cell.isReadable, self.partition_list[offset]))
+            if old != new:
+                self._unreadable_rows += (not new) - (not old)
+                readable_count.subtract(cell.getNode() for cell in old)
+                readable_count.update(cell.getNode() for cell in new)
+                for cell in old:
+                    node = cell.getNode()
+                    if not readable_count[node]:
+                        del readable_count[node]
+                readable_list[offset] = new
 
     def getAssignedPartitionList(self, uuid):
         """ Return the partition assigned to the specified UUID """
         assigned_partitions = []
-        for offset in xrange(self.np):
-            for cell in self.getCellList(offset, readable=True):
+        for offset, row in enumerate(self._readable_list):
+            for cell in row:
                 if cell.getUUID() == uuid:
                     assigned_partitions.append(offset)
                     break
@@ -131,8 +164,7 @@ class PartitionTable(object):
 
     def getNodeSet(self, readable=False):
         if readable:
-            return {x.getNode() for row in self.partition_list for x in row
-                                   if x.isReadable()}
+            return set(self._readable_count)
         return {x.getNode() for row in self.partition_list for x in row}
 
     def getConnectedNodeList(self):
@@ -140,7 +172,7 @@ class PartitionTable(object):
 
     def getCellList(self, offset, readable=False):
         if readable:
-            return filter(Cell.isReadable, self.partition_list[offset])
+            return list(self._readable_list[offset])
         return list(self.partition_list[offset])
 
     def getPartition(self, oid_or_tid):
@@ -184,6 +216,7 @@ class PartitionTable(object):
             row.append(Cell(node, state))
         if state != CellStates.FEEDING:
             self.count_dict[node] += 1
+        self._updateReadable(offset)
 
     def removeCell(self, offset, node):
         row = self.partition_list[offset]
@@ -193,6 +226,7 @@ class PartitionTable(object):
                 self.num_filled_rows -= not row
                 if not cell.isFeeding():
                     self.count_dict[node] -= 1
+                self._updateReadable(offset)
                 break
 
     def dropNode(self, node):
@@ -240,6 +274,37 @@ class PartitionTable(object):
         if not all(cell.isReadable() for cell in readable_list):
             logging.warning(self._first_outdated_message)
 
+    def split(self, ptid, num_partitions):
+        """
+        Multiply the number of partitions. Each new partition gets the cells
+        of the partition it comes from, i.e. the one congruent to it modulo
+        the former number of partitions.
+        """
+        np = self.np
+        assert np < num_partitions and not num_partitions % np, (
+            np, num_partitions)
+        assert self._id < ptid, (self._id, ptid)
+        k = num_partitions // np
+        partition_list = self.partition_list + [
+            [Cell(cell.getNode(), cell.getState()) for cell in row]
+            for _ in xrange(1, k) for row in self.partition_list]
+        readable_list = self._readable_list + [
+            tuple(filter(Cell.isReadable, row))
+            for row in partition_list[np:]]
+        for node in self.count_dict:
+            self.count_dict[node] *= k
+        for node in self._readable_count:
+            self._readable_count[node] *= k
+        self._unreadable_rows *= k
+        self.num_filled_rows *= k
+        # Offsets computed with the former number of partitions remain valid
+        # until it is updated.
+        self.partition_list = partition_list
+        self._readable_list = readable_list
+        self.np = num_partitions
+        self._id = ptid
+        self.logUpdated()
+
     def filled(self):
         return self.num_filled_rows == self.np
 
@@ -302,16 +367,20 @@ class PartitionTable(object):
                 yield ''.join(cell_dict.get(x, '.') for x in node_list)
 
     def operational(self, exclude_list=()):
-        if not self.filled():
+        if not self.filled() or self._unreadable_rows:
             return False
-        for row in self.partition_list:
-            for cell in row:
-                if cell.isReadable():
-                    node = cell.getNode()
-                    if node.isRunning() and node.getUUID() not in exclude_list:
+        # Only look at partitions if some nodes with readable cells
+        # are unavailable.
+        down_set = {node for node in self._readable_count
+                         if not node.isRunning()
+                         or node.getUUID() in exclude_list}
+        if down_set:
+            for row in self._readable_list:
+                for cell in row:
+                    if cell.getNode() not in down_set:
                         break
-            else:
-                return False
+                else:
+                    return False
         return True
 
     def getRow(self, offset):
@@ -340,6 +409,10 @@ class MTPartitionTable(PartitionTable):
         with self._lock:
             return PartitionTable.clear(self, *args, **kw)
 
+    def split(self, *args, **kw):
+        with self._lock:
+            return PartitionTable.split(self, *args, **kw)
+
     def operational(self, *args, **kw):
         with self._lock:
             return PartitionTable.operational(self, *args, **kw)
@@ -0,0 +1,115 @@
+#
+# Copyright (C) 2017  Nexedi SA
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_left
+from collections import defaultdict
+from .protocol import uuid_str
+
+# Upper bounds (in seconds) of the buckets of all histograms.
+BUCKET_LIST = .0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 10
+
+def _splitKey(key):
+    """Return the metric name and labels of a key
+
+    A key is either a metric name, or a (name, label name, label value) tuple
+    for metrics that are split by some property (e.g. a packet type).
+    """
+    if type(key) is tuple:
+        name, label, value = key
+        return name, ['%s="%s"' % (label, value)]
+    return key, []
+
+def _sampleName(name, label_list):
+    if label_list:
+        return '%s{%s}' % (name, ','.join(label_list))
+    return name
+
+
+class Histogram(object):
+
+    __slots__ = 'count_list', 'sum'
+
+    def __init__(self):
+        self.count_list = [0] * (len(BUCKET_LIST) + 1)
+        self.sum = 0.
+
+    def observe(self, value):
+        self.count_list[bisect_left(BUCKET_LIST, value)] += 1
+        self.sum += value
+
+    def iterSamples(self, key):
+        name, label_list = _splitKey(key)
+        bucket = name + '_bucket'
+        count = 0
+        for le, n in zip(BUCKET_LIST + ('+Inf',), self.count_list):
+            count += n
+            yield _sampleName(bucket, label_list + ['le="%s"' % le]), count
+        yield _sampleName(name + '_sum', label_list), self.sum
+        yield _sampleName(name + '_count', label_list), count
+
+
+class Stats(object):
+    """Counters and histograms of a node
+
+    Updating them must remain cheap because it is done on hot paths, like
+    for every packet: formatting is only done when samples are requested.
+    Names of counters end with '_total'.
+    """
+
+    def __init__(self):
+        self.counter_dict = defaultdict(int)
+        self.histogram_dict = {}
+
+    def inc(self, key, value=1):
+        self.counter_dict[key] += value
+
+    def observe(self, key, value):
+        try:
+            histogram = self.histogram_dict[key]
+        except KeyError:
+            histogram = self.histogram_dict[key] = Histogram()
+        histogram.observe(value)
+
+    def getSampleList(self):
+        """Return (name, value) pairs, in the Prometheus text format"""
+        # Copy dicts with items() because a client node may update them from
+        # other threads.
+        sample_list = [(_sampleName(*_splitKey(key)), value)
+            for key, value in self.counter_dict.items()]
+        for key, histogram in self.histogram_dict.items():
+            sample_list += histogram.iterSamples(key)
+        return sample_list
+
+
+def formatNodeStats(node_list):
+    """Format the samples of several nodes in the Prometheus text format
+
+    A 'node' label is added to distinguish nodes, and samples of a same metric
+    are grouped (the suffix of a name is ignored so that all samples of a
+    histogram remain together).
+    """
+    line_list = []
+    for uuid, sample_list in node_list:
+        node = 'node="%s"' % uuid_str(uuid)
+        for name, value in sample_list:
+            i = name.find('{')
+            if i < 0:
+                line_list.append((name, '{%s}' % node, value))
+            else:
+                line_list.append((name[:i], '{%s,%s' % (node, name[i+1:]),
+                                  value))
+    line_list.sort(key=lambda x: x[0].rsplit('_', 1)[0])
+    return ''.join('%s%s %s\n' % x for x in line_list)
@@ -17,6 +17,9 @@
 
 import socket
 from binascii import a2b_hex, b2a_hex
+from calendar import timegm
+from cPickle import Unpickler
+from cStringIO import StringIO
 from datetime import timedelta, datetime
 from hashlib import sha1
 from Queue import deque
@@ -91,6 +94,13 @@ def timeStringFromTID(ptid):
     return '%04d-%02d-%02d %02d:%02d:%09.6f' % (higher[0], higher[1], higher[2],
                                                 higher[3], higher[4], seconds)
 
+def timeFromTID(ptid):
+    """
+    Return the time (as returned by time.time) at which given TID was generated
+    """
+    higher, lower = unpackTID(ptid)
+    return timegm(higher + (0,)) + lower * SECOND_PER_TID_LOW
+
 def addTID(ptid, offset):
     """
     Offset given packed TID.
@@ -130,6 +140,22 @@ def makeChecksum(s):
     return sha1(s).digest()
 
 
+def getPersistentReferences(data):
+    """Return the list of persistent ids found in given pickles
+
+    'data' can be several pickles sharing the same memo, like ZODB object
+    records. The opcode stream is walked by cPickle without building any
+    instance (globals are None), which is much faster than unpickling.
+    """
+    f = StringIO(data)
+    u = Unpickler(f)
+    u.persistent_load = ref_list = []
+    end = len(data)
+    while f.tell() < end:
+        u.noload()
+    return ref_list
+
+
 def parseNodeAddress(address, port_opt=None):
     if address[:1] == '[':
         (host, port) = address[1:].split(']')
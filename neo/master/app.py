@@ -20,6 +20,7 @@ from time import time
 
 from neo.lib import logging
 from neo.lib.app import BaseApplication
+from neo.lib.compress import CODEC_NAME_DICT
 from neo.lib.debug import register as registerLiveDebugger
 from neo.lib.protocol import uuid_str, UUID_NAMESPACES, ZERO_TID
 from neo.lib.protocol import ClusterStates, NodeStates, NodeTypes, Packets
@@ -29,6 +30,10 @@ from neo.lib.exception import PrimaryElected, PrimaryFailure, StoppedOperation
 
 class StateChangedException(Exception): pass
 
+# Maximum number of buffered invalidated oids per client, when invalidations
+# are delayed.
+INVALIDATION_BATCH_SIZE = 10000
+
 _previous_time = 0
 def monotonic_time():
     global _previous_time
@@ -56,6 +61,8 @@ class Application(BaseApplication):
     backup_tid = None
     backup_app = None
     truncate_tid = None
+    # Last OID/TID allocated by the primary, when we're secondary.
+    mirrored_ids = None
 
     def uuid(self, uuid):
         node = self.nm.getByUUID(uuid)
@@ -80,9 +87,26 @@ class Application(BaseApplication):
         self.name = config.getCluster()
         self.server = config.getBind()
         self.autostart = config.getAutostart()
+        # Compression codecs that clients are allowed to use.
+        compression = config.getCompression()
+        self.compression_list = sorted(compression or
+            [0] + CODEC_NAME_DICT.keys())
 
         self.storage_ready_dict = {}
         self.storage_starting_set = set()
+        # Last progress reported by storage nodes using the Importer backend.
+        self.import_progress_dict = {}
+        # Amount of data per partition reported by storage nodes, with the
+        # constraints they have (see getPartitionSizes).
+        self.partition_size_dict = {}
+        # Requests of metrics from admin nodes, waiting for answers from
+        # storage and client nodes (see askStats).
+        self.stats_request_list = []
+        # Invalidations buffered per client connection, when they are not
+        # sent immediately (see onTransactionCommitted).
+        self.invalidation_delay = config.getInvalidationDelay() or 0
+        self._invalidation_dict = {}
+        self._invalidation_deadline = None
         for master_address in config.getMasters():
             self.nm.createMaster(address=master_address)
         self._node = self.nm.createMaster(address=self.server,
@@ -101,6 +125,8 @@ class Application(BaseApplication):
         logging.info('Partitions: %d', partitions)
         logging.info('Replicas  : %d', replicas)
         logging.info('Name      : %s', self.name)
+        logging.info('Compression: %s', ', '.join(
+            CODEC_NAME_DICT[x] for x in self.compression_list if x) or 'none')
 
         self.listening_conn = None
         self.cluster_state = None
@@ -179,14 +205,18 @@ class Application(BaseApplication):
         """
         node_dict = self.getNodeInformationDict(node_list)
         now = monotonic_time()
+        # Encode once per node type: only headers differ between connections.
+        packet_dict = {node_type: Packets.NotifyNodeInformation(now, node_list)
+                       for node_type, node_list in node_dict.iteritems()
+                       if node_list}
         # send at most one non-empty notification packet per node
         for node in self.nm.getIdentifiedList():
-            node_list = node_dict.get(node.getType())
+            packet = packet_dict.get(node.getType())
             # We don't skip pending storage nodes because we don't send them
             # the full list of nodes when they're added, and it's also quite
             # useful to notify them about new masters.
-            if node_list and node is not exclude:
-                node.send(Packets.NotifyNodeInformation(now, node_list))
+            if packet is not None and node is not exclude:
+                node.send(packet)
 
     def broadcastPartitionChanges(self, cell_list):
         """Broadcast a Notify Partition Changes packet."""
@@ -197,9 +227,19 @@ class Application(BaseApplication):
             for node in self.nm.getIdentifiedList():
                 # As for broadcastNodesInformation, we don't send the full PT
                 # when pending storage nodes are added, so keep them notified.
-                if not node.isMaster():
+                # Secondary masters mirror the partition table.
+                if not (node.isMaster() and self.election):
                     node.send(packet)
 
+    def notifyLastIDs(self):
+        """Notify secondary masters about the last allocated OID/TID"""
+        master_list = self.nm.getMasterList(only_identified=True)
+        if master_list and not self.election:
+            tm = self.tm
+            packet = Packets.NotifyLastIDs(tm.getLastOID(), tm.getLastTID())
+            for node in master_list:
+                node.send(packet)
+
     def provideService(self):
         """
         This is the normal mode for a primary master node. Handle transactions
@@ -212,8 +252,11 @@ class Application(BaseApplication):
 
         # Now everything is passive.
         try:
-            while True:
-                poll(1)
+            try:
+                while True:
+                    poll(1)
+            finally:
+                self.flushInvalidations()
         except StateChangedException, e:
             if e.args[0] != ClusterStates.STARTING_BACKUP:
                 raise
@@ -393,6 +436,12 @@ class Application(BaseApplication):
         if self.cluster_state == state:
             return
 
+        # Answer pending stats requests with the metrics received so far,
+        # because handlers of other states do not report lost nodes.
+        for request in self.stats_request_list[:]:
+            request[3].clear()
+            self.statsReceived(request)
+
         # select the storage handler
         if state in (ClusterStates.RUNNING, ClusterStates.STARTING_BACKUP,
                      ClusterStates.BACKINGUP, ClusterStates.STOPPING_BACKUP):
@@ -515,13 +564,54 @@ class Application(BaseApplication):
         ttid = txn.getTTID()
         tid = txn.getTID()
         transaction_node = txn.getNode()
-        invalidate_objects = Packets.InvalidateObjects(tid, txn.getOIDList())
-        for client_node in self.nm.getClientList(only_identified=True):
-            if client_node is transaction_node:
-                client_node.send(Packets.AnswerTransactionFinished(ttid, tid),
-                                 msg_id=txn.getMessageId())
-            else:
-                client_node.send(invalidate_objects)
+        oid_list = txn.getOIDList()
+        birth, prepared = txn.getCommitTimes()
+        observe = self.em.stats.observe
+        observe(('neo_commit_phase_seconds', 'phase', 'store'),
+                prepared - birth)
+        observe(('neo_commit_phase_seconds', 'phase', 'lock'),
+                time() - prepared)
+        if self.invalidation_delay:
+            # Invalidations are coalesced per client, and sent when the delay
+            # expires, or when too many are buffered, or before anything else
+            # that is sent to the client (e.g. an answer to a ping/sync),
+            # so that the client never sees transactions out of order.
+            now = time()
+            deadline = self._invalidation_deadline
+            if deadline is not None and deadline <= now:
+                # The timeout only triggers when the master is idle.
+                self.flushInvalidations()
+                deadline = None
+            if deadline is None:
+                self._invalidation_deadline = deadline = \
+                    now + self.invalidation_delay
+                self.em.setTimeout(deadline, self.flushInvalidations)
+            invalidation_dict = self._invalidation_dict
+            for client_node in self.nm.getClientList(only_identified=True):
+                conn = client_node.getConnection()
+                if client_node is transaction_node:
+                    self.flushInvalidations(conn)
+                    conn.send(Packets.AnswerTransactionFinished(ttid, tid),
+                              msg_id=txn.getMessageId())
+                    continue
+                try:
+                    x = invalidation_dict[conn]
+                except KeyError:
+                    x = invalidation_dict[conn] = [[], 0]
+                x[0].append((tid, oid_list))
+                x[1] += len(oid_list)
+                if x[1] >= INVALIDATION_BATCH_SIZE:
+                    self.flushInvalidations(conn)
+        else:
+            invalidate_objects = Packets.InvalidateObjects(tid, oid_list)
+            for client_node in self.nm.getClientList(only_identified=True):
+                if client_node is transaction_node:
+                    client_node.send(
+                        Packets.AnswerTransactionFinished(ttid, tid),
+                        msg_id=txn.getMessageId())
+                else:
+                    client_node.send(invalidate_objects)
+        self.notifyLastIDs()
 
         # Unlock Information to relevant storage nodes.
         notify_unlock = Packets.NotifyUnlockInformation(ttid)
@@ -536,6 +626,7 @@ class Application(BaseApplication):
             node = getByUUID(uuid)
             if node.isClient():
                 # There should be only 1 client interested.
+                self.flushInvalidations(node.getConnection())
                 node.answer(Packets.AnswerFinalTID(tid))
             else:
                 node.send(notify_finished)
@@ -543,6 +634,28 @@ class Application(BaseApplication):
         assert self.last_transaction < tid, (self.last_transaction, tid)
         self.setLastTransaction(tid)
 
+    def flushInvalidations(self, conn=None):
+        """Send buffered invalidations to the given client, or to all"""
+        invalidation_dict = self._invalidation_dict
+        if conn is None:
+            self._invalidation_deadline = None
+            if not invalidation_dict:
+                return
+            self._invalidation_dict = {}
+            item_list = invalidation_dict.iteritems()
+        else:
+            try:
+                item_list = (conn, invalidation_dict.pop(conn)),
+            except KeyError:
+                return
+            if not invalidation_dict:
+                self._invalidation_deadline = None
+        for conn, (invalidation_list, _) in item_list:
+            if not conn.isClosed():
+                conn.send(Packets.InvalidateObjects(*invalidation_list[0])
+                    if len(invalidation_list) == 1 else
+                    Packets.InvalidateObjectsList(invalidation_list))
+
     def getLastTransaction(self):
         return self.last_transaction
 
@@ -574,3 +687,72 @@ class Application(BaseApplication):
     def getStorageReadySet(self, readiness=float('inf')):
         return {k for k, v in self.storage_ready_dict.iteritems()
                   if v <= readiness}
+
+    def getPartitionSizes(self):
+        """Return what storage nodes reported about their data and devices,
+        in the form expected by PartitionTable.tweak
+
+        The size of a partition is only taken from nodes having a readable
+        cell for it, because other reports may be outdated. Partitions for
+        which nothing is known are assumed to have the average size of the
+        others. If no size is known at all, None is returned instead of the
+        list of sizes.
+        """
+        pt = self.pt
+        getByUUID = self.nm.getByUUID
+        size_dict = {}
+        device_dict = {}
+        for uuid, (devid, capacity, partition_dict) in \
+                self.partition_size_dict.iteritems():
+            node = getByUUID(uuid)
+            if node is None:
+                continue
+            if devid or capacity:
+                device_dict[node] = devid, capacity
+            for offset, (_, size) in partition_dict.iteritems():
+                cell = pt.getCell(offset, uuid)
+                if cell is not None and cell.isReadable() and \
+                   size_dict.get(offset, -1) < size:
+                    size_dict[offset] = size
+        if not size_dict:
+            return None, device_dict
+        default = sum(size_dict.itervalues()) // len(size_dict)
+        return [size_dict.get(offset, default)
+                for offset in xrange(pt.getPartitions())], device_dict
+
+    def askStats(self, conn):
+        """Collect the metrics of this node and of all storage and client
+        nodes, and answer them to the given admin connection
+
+        Storage nodes are only asked while the cluster is in service.
+        """
+        request = conn, conn.getPeerId(), \
+            [(self.uuid, self.em.stats.getSampleList())], set()
+        self.stats_request_list.append(request)
+        service = self.cluster_state in (ClusterStates.RUNNING,
+            ClusterStates.STARTING_BACKUP, ClusterStates.BACKINGUP,
+            ClusterStates.STOPPING_BACKUP)
+        p = Packets.AskStats()
+        for node in self.nm.getIdentifiedList():
+            if node.isClient() or service and node.isStorage():
+                node.ask(p, stats_request=request)
+                request[3].add(node.getUUID())
+        self.statsReceived(request)
+
+    def statsReceived(self, request, uuid=None, node_list=()):
+        conn, msg_id, stats_list, uuid_set = request
+        if uuid is not None:
+            if uuid not in uuid_set:
+                return
+            uuid_set.remove(uuid)
+            stats_list += node_list
+        if not uuid_set:
+            self.stats_request_list.remove(request)
+            if not conn.isClosed():
+                conn.send(Packets.AnswerStats(stats_list), msg_id)
+
+    def statsLost(self, uuid):
+        """Stop waiting for the metrics of a node that is lost"""
+        for request in self.stats_request_list[:]:
+            if uuid in request[3]:
+                self.statsReceived(request, uuid)
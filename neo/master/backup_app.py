@@ -54,7 +54,18 @@ is the last TID for which we have all data. This TID can't be guessed from
 Out of backup storage nodes assigned to a partition, one is chosen as primary
 for that partition. It means only this node will fetch data from the upstream
 cluster, to minimize bandwidth between clusters. Other replicas will
-synchronize from the primary node.
+synchronize from the primary node. A storage node can replicate several
+partitions at the same time from the upstream cluster.
+
+How far the backup is behind the upstream cluster can be monitored with
+'neoctl print backup', globally and for each partition.
+
+Invalidations from the upstream cluster are forwarded to the clients of the
+backup cluster (which only have read-only access) as soon as the backup_tid
+of the cluster reaches them, so that these clients see new data without
+having to reconnect. Clients are disconnected when the backup master misses
+invalidations, which happens when it is disconnected from the upstream master,
+or when too many invalidations are waiting for the backup_tid.
 
 There is no conflict of node id between the 2 clusters:
 - Storage nodes connect anonymously to upstream.
@@ -66,6 +77,10 @@ class BackupApplication(object):
 
     pt = None
     uuid = None
+    # Maximum number of OIDs in invalidations that are not yet forwarded to
+    # clients. Beyond that, they're dropped and clients are disconnected
+    # instead, as if invalidations were missed.
+    max_invalidations = 100000
 
     def __init__(self, app, name, master_addresses):
         self.app = weakref.proxy(app)
@@ -91,6 +106,12 @@ class BackupApplication(object):
         poll = self.em.poll
         app = self.app
         pt = app.pt
+        # [(tid, oid_list)] not yet forwarded to clients,
+        # with None as oid_list for missed invalidations
+        self.invalidation_list = []
+        self.invalidation_size = 0
+        # last tid for which invalidations were forwarded to clients
+        self.client_tid = ZERO_TID
         while True:
             app.changeClusterState(ClusterStates.STARTING_BACKUP)
             bootstrap = BootstrapManager(self, NodeTypes.CLIENT)
@@ -255,6 +276,7 @@ class BackupApplication(object):
                 node.send(Packets.Replicate(tid, '', untouched_dict))
         for node in trigger_set:
             self.triggerBackup(node)
+        self.invalidateClients()
         count = sum(map(len, self.tid_list))
         if self.debug_tid_count < count:
             logging.debug("Maximum number of tracked tids: %u", count)
@@ -309,9 +331,6 @@ class BackupApplication(object):
         logging.debug("partition %u: updating backup_tid of %r to %s",
                       offset, cell, dump(tid))
         cell.backup_tid = tid
-        # TODO: Provide invalidation feedback about new txns to read-only
-        #       clients connected to backup cluster. Not only here but also
-        #       hooked to in-progress feedback from fetchObjects (storage).
         # Forget tids we won't need anymore.
         cell_list = app.pt.getCellList(offset, readable=True)
         del tid_list[:bisect(tid_list, min(x.backup_tid for x in cell_list))]
@@ -346,4 +365,49 @@ class BackupApplication(object):
                             uuid_str(cell.getUUID()), offset,
                             dump(tid), uuid_str(node.getUUID()))
                         cell.getNode().send(p)
+        self.invalidateClients()
         return result
+
+    def queueInvalidations(self, tid, oid_list):
+        """Queue invalidations for clients, None if they are unknown"""
+        if oid_list is not None:
+            size = self.invalidation_size + len(oid_list)
+            if size <= self.max_invalidations:
+                self.invalidation_size = size
+            else:
+                logging.info("too many pending invalidations for clients,"
+                             " they will be disconnected")
+                del self.invalidation_list[:]
+                self.invalidation_size = 0
+                oid_list = None
+        self.invalidation_list.append((tid, oid_list))
+
+    def invalidateClients(self):
+        """Forward invalidations to clients, up to the backup_tid"""
+        invalidation_list = self.invalidation_list
+        backup_tid = self.app.pt.getBackupTid()
+        i = 0
+        for tid, oid_list in invalidation_list:
+            if backup_tid < tid:
+                break
+            i += 1
+        if not i:
+            return
+        invalidation_list = invalidation_list[:i]
+        del self.invalidation_list[:i]
+        self.invalidation_size -= sum(len(oid_list)
+            for tid, oid_list in invalidation_list if oid_list is not None)
+        self.client_tid = invalidation_list[-1][0]
+        client_list = self.app.nm.getClientList(only_identified=True)
+        if None in (oid_list for tid, oid_list in invalidation_list):
+            # We don't know what was modified upstream (we were disconnected
+            # or invalidations were dropped), so clients must reconnect to
+            # clear their cache.
+            for node in client_list:
+                node.getConnection().close()
+        elif client_list:
+            p = (Packets.InvalidateObjects(*invalidation_list[0])
+                if len(invalidation_list) == 1 else
+                Packets.InvalidateObjectsList(invalidation_list))
+            for node in client_list:
+                node.send(p)
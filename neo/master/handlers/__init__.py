@@ -63,6 +63,9 @@ class MasterHandler(EventHandler):
         pt = self.app.pt
         conn.answer(Packets.AnswerPartitionTable(pt.getID(), pt.getRowList()))
 
+    def answerStats(self, conn, node_list, stats_request):
+        self.app.statsReceived(stats_request, conn.getUUID(), node_list)
+
 
 class BaseServiceHandler(MasterHandler):
     """This class deals with events for a service phase."""
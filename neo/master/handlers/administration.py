@@ -15,14 +15,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import random
+from bisect import bisect
 
 from . import MasterHandler
 from ..app import monotonic_time, StateChangedException
 from neo.lib import logging
 from neo.lib.exception import StoppedOperation
 from neo.lib.pt import PartitionTableException
-from neo.lib.protocol import ClusterStates, Errors, \
-    NodeStates, NodeTypes, Packets, ProtocolError, uuid_str
+from neo.lib.protocol import CellStates, ClusterStates, Errors, \
+    NodeStates, NodeTypes, Packets, ProtocolError, uuid_str, ZERO_TID
 from neo.lib.util import dump
 
 CLUSTER_STATE_WORKFLOW = {
@@ -165,7 +166,7 @@ class AdministrationHandler(MasterHandler):
             node.send(repair)
         conn.answer(Errors.Ack(''))
 
-    def tweakPartitionTable(self, conn, uuid_list):
+    def _tweak(self, uuid_list, simulate=False):
         app = self.app
         state = app.getClusterState()
         # XXX: Would it be safe to allow more states ?
@@ -174,9 +175,48 @@ class AdministrationHandler(MasterHandler):
                          ClusterStates.BACKINGUP):
             raise ProtocolError('Can not tweak partition table in %s state'
                                 % state)
-        app.broadcastPartitionChanges(app.pt.tweak([node
+        size_list, device_dict = app.getPartitionSizes()
+        return size_list, app.pt.tweak([node
             for node in app.nm.getStorageList()
-            if node.getUUID() in uuid_list or not node.isRunning()]))
+            if node.getUUID() in uuid_list or not node.isRunning()],
+            size_list, device_dict, simulate)
+
+    def tweakPartitionTable(self, conn, uuid_list):
+        self.app.broadcastPartitionChanges(self._tweak(uuid_list)[1])
+        conn.answer(Errors.Ack(''))
+
+    def askTweakPlan(self, conn, uuid_list):
+        size_list, change_list = self._tweak(uuid_list, True)
+        conn.answer(Packets.AnswerTweakPlan(sum(
+            size_list[offset] for offset, _, state in change_list
+                              if state == CellStates.OUT_OF_DATE
+            ) if size_list else 0, change_list))
+
+    def splitPartitions(self, conn, num_partitions):
+        app = self.app
+        if app.cluster_state != ClusterStates.RUNNING:
+            raise ProtocolError('Can not split partitions in this state')
+        pt = app.pt
+        np = pt.getPartitions()
+        if num_partitions <= np or num_partitions % np:
+            raise ProtocolError('The number of partitions must be a multiple'
+                                ' of the current one (%s)' % np)
+        for offset in xrange(np):
+            for cell in pt.getCellList(offset):
+                if not (cell.isUpToDate() and cell.getNode().isRunning()):
+                    raise ProtocolError('All cells must be up-to-date'
+                                        ' and their nodes running')
+        ptid = pt.getID() + 1
+        pt.split(ptid, num_partitions)
+        # Sizes are reported again by storage nodes for the new partitions.
+        app.partition_size_dict.clear()
+        packet = Packets.NotifyPartitionSplit(ptid, num_partitions)
+        for node in app.nm.getIdentifiedList():
+            if not (node.isMaster() and app.election):
+                node.send(packet)
+        logging.warning('partition table split to %s partitions: the'
+            ' --partitions option of master nodes should be updated',
+            num_partitions)
         conn.answer(Errors.Ack(''))
 
     def truncate(self, conn, tid):
@@ -186,6 +226,40 @@ class AdministrationHandler(MasterHandler):
         conn.answer(Errors.Ack(''))
         raise StoppedOperation(tid)
 
+    def askImportProgress(self, conn):
+        getByUUID = self.app.nm.getByUUID
+        conn.answer(Packets.AnswerImportProgress([(uuid,) + x
+            for uuid, x in sorted(self.app.import_progress_dict.iteritems())
+            if getByUUID(uuid) is not None]))
+
+    def askBackupLag(self, conn):
+        app = self.app
+        if app.cluster_state not in (ClusterStates.STARTING_BACKUP,
+                                     ClusterStates.BACKINGUP,
+                                     ClusterStates.STOPPING_BACKUP):
+            raise ProtocolError('Not in backup mode')
+        pt = app.pt
+        # Transactions that are known to be committed upstream but not yet
+        # replicated are only remembered while the cluster is backing up.
+        tid_list = getattr(app.backup_app, 'tid_list', None)
+        partition_list = []
+        for offset in xrange(pt.getPartitions()):
+            try:
+                tid = max(cell.backup_tid
+                          for cell in pt.getCellList(offset, readable=True))
+            except ValueError:
+                tid = ZERO_TID
+            pending = 0
+            if tid_list:
+                x = tid_list[offset]
+                pending = len(x) - bisect(x, tid)
+            partition_list.append((offset, tid, pending))
+        conn.answer(Packets.AnswerBackupLag(pt.getBackupTid(),
+            app.getLastTransaction(), partition_list))
+
+    def askStats(self, conn):
+        self.app.askStats(conn)
+
     def checkReplicas(self, conn, partition_dict, min_tid, max_tid):
         app = self.app
         pt = app.pt
@@ -32,6 +32,13 @@ class BackupHandler(EventHandler):
         if self.app.pt.filled():
             self.app.pt.update(ptid, cell_list, self.app.nm)
 
+    def notifyPartitionSplit(self, conn, ptid, num_partitions):
+        raise PrimaryFailure('upstream partition table split')
+
+    def notifyCompression(self, conn, codec_list):
+        # Storage nodes replicate data as is, whatever the codec.
+        pass
+
     def answerLastTransaction(self, conn, tid):
         app = self.app
         prev_tid = app.app.getLastTransaction()
@@ -43,6 +50,7 @@ class BackupHandler(EventHandler):
             #   >= app.app.getLastTransaction()
             #   < tid
             # but passing 'tid' is good enough.
+            app.queueInvalidations(tid, None)
             app.invalidatePartitions(tid, tid, xrange(app.pt.getPartitions()))
         elif prev_tid != tid:
             raise RuntimeError("upstream DB truncated")
@@ -56,4 +64,9 @@ class BackupHandler(EventHandler):
         partition_set = set(map(getPartition, oid_list))
         partition_set.add(getPartition(tid))
         prev_tid = app.app.getLastTransaction()
+        app.queueInvalidations(tid, oid_list)
         app.invalidatePartitions(tid, prev_tid, partition_set)
+
+    def invalidateObjectsList(self, conn, invalidation_list):
+        for tid, oid_list in invalidation_list:
+            self.invalidateObjects(conn, tid, oid_list)
@@ -28,9 +28,15 @@ class ClientServiceHandler(MasterHandler):
         node = app.nm.getByUUID(conn.getUUID())
         assert node is not None, conn
         app.tm.clientLost(node)
+        app.statsLost(node.getUUID())
         node.setUnknown()
         app.broadcastNodesInformation([node])
 
+    def packetReceived(self, conn, *args):
+        # Answers must not overtake buffered invalidations.
+        self.app.flushInvalidations(conn)
+        super(ClientServiceHandler, self).packetReceived(conn, *args)
+
     def askBeginTransaction(self, conn, tid):
         """
             A client request a TID, nothing is kept about it until the finish.
@@ -46,7 +52,10 @@ class ClientServiceHandler(MasterHandler):
         conn.answer(Packets.AnswerBeginTransaction(tid))
 
     def askNewOIDs(self, conn, num_oids):
-        conn.answer(Packets.AnswerNewOIDs(self.app.tm.getNextOIDList(num_oids)))
+        app = self.app
+        oid_list = app.tm.getNextOIDList(num_oids)
+        app.notifyLastIDs()
+        conn.answer(Packets.AnswerNewOIDs(oid_list))
 
     def getEventQueue(self):
         # for askBeginTransaction & failedVote
@@ -146,6 +155,10 @@ class ClientReadOnlyServiceHandler(ClientServiceHandler):
 
     # like in MasterHandler but returns backup_tid instead of last_tid
     def askLastTransaction(self, conn):
-        assert self.app.backup_tid is not None   # we are in BACKUPING mode
-        backup_tid = self.app.pt.getBackupTid()
+        app = self.app
+        assert app.backup_tid is not None   # we are in BACKUPING mode
+        # backup_tid may decrease when a storage node is lost,
+        # whereas invalidations may have already been forwarded
+        # to clients up to a greater tid.
+        backup_tid = max(app.pt.getBackupTid(), app.backup_app.client_tid)
         conn.answer(Packets.AnswerLastTransaction(backup_tid))
@@ -114,6 +114,8 @@ class IdentificationHandler(EventHandler):
             app.pt.getReplicas(),
             uuid))
         handler._notifyNodeInformation(conn)
+        if node_type in (NodeTypes.CLIENT, NodeTypes.STORAGE):
+            conn.send(Packets.NotifyCompression(app.compression_list))
         handler.connectionCompleted(conn, True)
 
 
@@ -23,6 +23,18 @@ from neo.lib.protocol import ClusterStates, NodeStates, NodeTypes, Packets
 class SecondaryHandler(MasterHandler):
     """Handler used by primary to handle secondary masters"""
 
+    def connectionCompleted(self, conn, new=None):
+        if new is None:
+            super(SecondaryHandler, self).connectionCompleted(conn)
+        else:
+            # Secondary masters mirror our state, so that a new primary
+            # does not have to recover everything from storage nodes.
+            app = self.app
+            pt = app.pt
+            conn.send(Packets.SendPartitionTable(pt.getID(), pt.getRowList()))
+            tm = app.tm
+            conn.send(Packets.NotifyLastIDs(tm.getLastOID(), tm.getLastTID()))
+
     def _connectionLost(self, conn):
         app = self.app
         node = app.nm.getByUUID(conn.getUUID())
@@ -62,6 +74,19 @@ class ElectionHandler(MasterHandler):
         # There may be new master nodes. Connect to them.
         self.app._current_manager.try_secondary = True
 
+    # The primary master may send us its state before we switch handler.
+    def sendPartitionTable(self, conn, ptid, row_list):
+        pass
+
+    def notifyPartitionChanges(self, conn, ptid, cell_list):
+        pass
+
+    def notifyPartitionSplit(self, conn, ptid, num_partitions):
+        pass
+
+    def notifyLastIDs(self, conn, loid, ltid):
+        pass
+
 
 class PrimaryHandler(ElectionHandler):
     """Handler used by secondaries to handle primary master"""
@@ -93,3 +118,31 @@ class PrimaryHandler(ElectionHandler):
             assert node_type == NodeTypes.MASTER, node_type
             if uuid == self.app.uuid and state == NodeStates.DOWN:
                 sys.exit()
+
+    def sendPartitionTable(self, conn, ptid, row_list):
+        app = self.app
+        app.pt.load(ptid, row_list, app.nm)
+
+    def notifyPartitionChanges(self, conn, ptid, cell_list):
+        app = self.app
+        pt = app.pt
+        if pt.filled() and pt.getID() + 1 == ptid:
+            nm = app.nm
+            for _, uuid, _ in cell_list:
+                if nm.getByUUID(uuid) is None:
+                    nm.createStorage(uuid=uuid)
+            pt.update(ptid, cell_list, nm)
+        else:
+            # Some changes were missed: the partition table will be
+            # recovered from storage nodes if we become primary.
+            pt.clear()
+
+    def notifyPartitionSplit(self, conn, ptid, num_partitions):
+        pt = self.app.pt
+        if pt.filled() and pt.getID() + 1 == ptid:
+            pt.split(ptid, num_partitions)
+        else:
+            pt.clear()
+
+    def notifyLastIDs(self, conn, loid, ltid):
+        self.app.mirrored_ids = loid, ltid
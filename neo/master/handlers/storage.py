@@ -15,8 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from neo.lib import logging
-from neo.lib.protocol import (CellStates, ClusterStates, Packets, ProtocolError,
-    uuid_str)
+from neo.lib.protocol import ClusterStates, Packets, ProtocolError, uuid_str
 from neo.lib.exception import StoppedOperation
 from neo.lib.pt import PartitionTableException
 from neo.lib.util import dump
@@ -37,10 +36,25 @@ class StorageServiceHandler(BaseServiceHandler):
     def notifyReady(self, conn):
         self.app.setStorageReady(conn.getUUID())
 
+    def notifyImportProgress(self, conn, *args):
+        self.app.import_progress_dict[conn.getUUID()] = args
+
+    def notifyPartitionSizes(self, conn, devid, capacity, partition_list):
+        app = self.app
+        uuid = conn.getUUID()
+        try:
+            partition_dict = app.partition_size_dict[uuid][2]
+        except KeyError:
+            partition_dict = {}
+        for offset, object_count, byte_count in partition_list:
+            partition_dict[offset] = object_count, byte_count
+        app.partition_size_dict[uuid] = devid, capacity, partition_dict
+
     def connectionLost(self, conn, new_state):
         app = self.app
         uuid = conn.getUUID()
         node = app.nm.getByUUID(uuid)
+        app.statsLost(uuid)
         super(StorageServiceHandler, self).connectionLost(conn, new_state)
         app.setStorageNotReady(uuid)
         app.tm.storageLost(uuid)
@@ -75,12 +89,7 @@ class StorageServiceHandler(BaseServiceHandler):
         self.app.tm.lock(ttid, conn.getUUID())
 
     def notifyPartitionCorrupted(self, conn, partition, cell_list):
-        change_list = []
-        for cell in self.app.pt.getCellList(partition):
-            if cell.getUUID() in cell_list:
-                cell.setState(CellStates.CORRUPTED)
-                change_list.append((partition, cell.getUUID(),
-                                    CellStates.CORRUPTED))
+        change_list = self.app.pt.setCorrupted(partition, cell_list)
         self.app.broadcastPartitionChanges(change_list)
         if not self.app.pt.operational():
             raise StoppedOperation
@@ -106,6 +106,7 @@ class PartitionTable(neo.lib.pt.PartitionTable):
             for node in node_list:
                 self.count_dict.pop(node, None)
             self.num_filled_rows = len(filter(None, self.partition_list))
+            self._updateReadable()
         return change_list
 
     def load(self, ptid, row_list, nm):
@@ -114,9 +115,18 @@ class PartitionTable(neo.lib.pt.PartitionTable):
         Return the new storage nodes registered
         """
         # check offsets
+        np = self.np
         for offset, _row in row_list:
-            if offset >= self.getPartitions():
-                raise IndexError, offset
+            if offset >= np:
+                # The partitions were split (see 'neoctl split') after this
+                # node was started with the former number of partitions.
+                np = len(row_list)
+                if offset >= np or np % self.np:
+                    raise IndexError, offset
+        if np != self.np:
+            logging.warning('the number of partitions is now %s: the'
+                ' --partitions option of master nodes should be updated', np)
+            self.np = np
         # store the partition table
         self.clear()
         self._id = ptid
@@ -148,7 +158,7 @@ class PartitionTable(neo.lib.pt.PartitionTable):
         cell_list = [(offset, uuid, CellStates.UP_TO_DATE)]
 
         # Do no keep too many feeding cells.
-        readable_list = filter(Cell.isReadable, row)
+        readable_list = self.getCellList(offset, True)
         iter_feeding = (cell.getNode() for cell in readable_list
                                        if cell.isFeeding())
         # If all cells are readable, we can now drop all feeding cells.
@@ -175,7 +185,8 @@ class PartitionTable(neo.lib.pt.PartitionTable):
                 added_list.append(node)
         return added_list
 
-    def tweak(self, drop_list=()):
+    def tweak(self, drop_list=(), size_list=None, device_dict=None,
+              simulate=False):
         """Optimize partition table
 
         This reassigns cells in 3 ways:
@@ -215,7 +226,30 @@ class PartitionTable(neo.lib.pt.PartitionTable):
           U.  .U  U.
           .U  U.  U.
           U.  U.  .U
+
+        If the size of each partition is known ('size_list', in bytes), the
+        permutation is chosen to minimize the amount of data to replicate,
+        rather than the number of cells. 'device_dict' maps nodes to
+        (devid, capacity) constraints: nodes with the same non-empty devid
+        must not have cells for the same partition, and the data assigned to
+        a node must not exceed its capacity (if not 0, and if sizes are known).
+        If constraints can't be satisfied, they're ignored with a warning.
+
+        With 'simulate', the partition table is left unchanged and the
+        returned changes are those that would be done.
         """
+        if simulate:
+            pt = self.__class__(self.np, self.nr)
+            pt._id = self._id
+            pt.num_filled_rows = self.num_filled_rows
+            pt.count_dict = self.count_dict.copy()
+            pt.partition_list = [[Cell(cell.getNode(), cell.getState())
+                                  for cell in row]
+                                 for row in self.partition_list]
+            pt._updateReadable()
+            return pt.tweak(drop_list, size_list, device_dict)
+        if device_dict is None:
+            device_dict = {}
         # Collect some data in a usable form for the rest of the method.
         node_list = {node: {} for node in self.count_dict
                               if node not in drop_list}
@@ -242,6 +276,22 @@ class PartitionTable(neo.lib.pt.PartitionTable):
                 i += 1
         option_dict = Counter(map(tuple, x))
 
+        def acceptable(option):
+            # Check constraints for the node of the option being evaluated.
+            node = node_list[node_options[len(new)][-2]][0]
+            devid, capacity = device_dict.get(node, ('', 0))
+            if capacity and size_list and \
+               sum(size_list[offset] for offset in option) > capacity:
+                return False
+            if devid:
+                option = set(option)
+                for i, x in enumerate(new):
+                    if device_dict.get(node_list[node_options[i][-2]][0],
+                                       ('',))[0] == devid and \
+                       not option.isdisjoint(x):
+                        return False
+            return True
+
         # Strategies to find the "best" permutation of nodes.
         def node_options():
             # The second part of the key goes with the above cosmetic sort.
@@ -258,7 +308,7 @@ class PartitionTable(neo.lib.pt.PartitionTable):
                     break
                 result.append((i, x))
             else:
-                yield result
+                yield result, float('inf'), True
             # 2. We have to move cells. Evaluating all options would have
             #    a complexity of O(node_count!), which is clearly too slow,
             #    so we use a heuristic.
@@ -266,9 +316,16 @@ class PartitionTable(neo.lib.pt.PartitionTable):
             #    in the best (min_cost) and worst (max_cost) case, and we first
             #    iterate over nodes with the biggest difference. This minimizes
             #    the impact of bad allocation patterns for the last nodes.
+            #    If partition sizes are known, the cost is first the number
+            #    of bytes to replicate. Options exceeding the capacity of the
+            #    node come last, and nodes with fewer options are processed
+            #    first. Backtracking is limited, so this may still fail if
+            #    there are constraints, in which case we try again without
+            #    them.
             result = []
             np_complement = frozenset(xrange(self.np)).difference
-            for i, (_, cell_dict) in enumerate(node_list):
+            for i, (node, cell_dict) in enumerate(node_list):
+                capacity = size_list and device_dict.get(node, ('', 0))[1]
                 cost_list = []
                 for x, option in enumerate(option_list):
                     discard = [0, 0]
@@ -276,34 +333,50 @@ class PartitionTable(neo.lib.pt.PartitionTable):
                         cell = cell_dict.get(offset)
                         if cell:
                             discard[cell.isReadable()] += 1
-                    cost_list.append(((discard[1], discard[0]), x))
+                    cost = discard[1], discard[0]
+                    if size_list:
+                        cost = (sum(size_list[offset] for offset in option
+                            if not (offset in cell_dict
+                                    and cell_dict[offset].isReadable())),
+                            ) + cost
+                    cost_list.append((capacity and capacity < sum(
+                        size_list[offset] for offset in option), cost, x))
                 cost_list.sort()
-                min_cost = cost_list[0][0]
-                max_cost = cost_list[-1][0]
-                result.append((
-                    min_cost[0] - max_cost[0],
-                    min_cost[1] - max_cost[1],
-                    i, [option_list[x[1]] for x in cost_list]))
+                min_cost = cost_list[0][1]
+                max_cost = cost_list[-1][1]
+                result.append((sum(not x[0] for x in cost_list),)
+                    + tuple(x - y for x, y in zip(min_cost, max_cost))
+                    + (i, [option_list[x[2]] for x in cost_list]))
             result.sort()
-            yield result
+            yield result, 1000, True
+            if device_dict:
+                logging.warning("tweak: constraints of storage nodes"
+                                " can't be satisfied, ignoring them")
+                yield result, 0, False
 
         # The main loop, which is where we evaluate options.
         new = []   # the solution
         stack = [] # data recursion
         def options():
             return iter(node_options[len(new)][-1])
-        for node_options in node_options(): # for each strategy
+        # For each strategy (with the maximum number of backtracks)
+        for node_options, backtrack, constrained in node_options():
             iter_option = options()
             while 1:
                 try:
                     option = next(iter_option)
-                except StopIteration: # 1st strategy only
+                except StopIteration: # 1st strategy or constraints only
                     if new:
-                        iter_option = stack.pop()
-                        option_dict[new.pop()] += 1
-                        continue
+                        if backtrack:
+                            backtrack -= 1
+                            iter_option = stack.pop()
+                            option_dict[new.pop()] += 1
+                            continue
+                        option_dict.update(new)
+                        del new[:], stack[:]
                     break
-                if option_dict[option]:
+                if option_dict[option] and (
+                        not constrained or acceptable(option)):
                     new.append(option)
                     if len(new) == len(node_list):
                         break
@@ -364,6 +437,7 @@ class PartitionTable(neo.lib.pt.PartitionTable):
                     row.remove(cell)
                 changed_list.append((offset, cell.getUUID(), state))
 
+        self._updateReadable()
         assert self.operational(), changed_list
         return changed_list
 
@@ -391,10 +465,22 @@ class PartitionTable(neo.lib.pt.PartitionTable):
                     cell.setState(CellStates.OUT_OF_DATE)
                     change_list.append((offset, cell.getUUID(),
                         CellStates.OUT_OF_DATE))
+        if change_list:
+            self._updateReadable(*{offset for offset, _, _ in change_list})
         if fully_readable and change_list:
             logging.warning(self._first_outdated_message)
         return change_list
 
+    def setCorrupted(self, offset, uuid_list):
+        change_list = []
+        for cell in self.partition_list[offset]:
+            uuid = cell.getUUID()
+            if uuid in uuid_list:
+                cell.setState(CellStates.CORRUPTED)
+                change_list.append((offset, uuid, CellStates.CORRUPTED))
+        self._updateReadable(offset)
+        return change_list
+
     def updatable(self, uuid, offset_list):
         for offset in offset_list:
             for cell in self.partition_list[offset]:
@@ -30,6 +30,7 @@ class RecoveryManager(MasterHandler):
         # The target node's uuid to request next.
         self.target_ptid = None
         self.ask_pt = []
+        self.known_pt = None
         self.backup_tid_dict = {}
         self.truncate_dict = {}
 
@@ -54,6 +55,11 @@ class RecoveryManager(MasterHandler):
         app = self.app
         pt = app.pt
         app.changeClusterState(ClusterStates.RECOVERING)
+        if pt.filled():
+            # Our partition table, or the one mirrored from the previous
+            # primary (see PrimaryHandler): no need to ask it again to
+            # storage nodes if they have the same version.
+            self.known_pt = pt.getID(), pt.getRowList()
         pt.clear()
 
         self.try_secondary = True
@@ -184,6 +190,8 @@ class RecoveryManager(MasterHandler):
 
     def answerRecovery(self, conn, ptid, backup_tid, truncate_tid):
         uuid = conn.getUUID()
+        self.backup_tid_dict[uuid] = backup_tid
+        self.truncate_dict[uuid] = truncate_tid
         if self.target_ptid <= ptid:
             # Maybe a newer partition table.
             if self.target_ptid == ptid and self.ask_pt:
@@ -192,26 +200,37 @@ class RecoveryManager(MasterHandler):
             elif self.target_ptid < ptid or self.ask_pt is not ():
                 # No node asked yet for the newest partition table.
                 self.target_ptid = ptid
-                self.ask_pt = [uuid]
-                conn.ask(Packets.AskPartitionTable())
-        self.backup_tid_dict[uuid] = backup_tid
-        self.truncate_dict[uuid] = truncate_tid
+                if self.known_pt and self.known_pt[0] == ptid:
+                    self._loadPartitionTable(uuid, *self.known_pt)
+                else:
+                    self.ask_pt = [uuid]
+                    conn.ask(Packets.AskPartitionTable())
 
     def answerPartitionTable(self, conn, ptid, row_list):
         # If this is not from a target node, ignore it.
         if ptid == self.target_ptid:
-            app = self.app
-            try:
-                new_nodes = app.pt.load(ptid, row_list, app.nm)
-            except IndexError:
-                raise ProtocolError('Invalid offset')
-            self._notifyAdmins(
-                Packets.NotifyNodeInformation(monotonic_time(), new_nodes),
-                Packets.SendPartitionTable(ptid, row_list))
-            self.ask_pt = ()
-            uuid = conn.getUUID()
-            app.backup_tid = self.backup_tid_dict[uuid]
-            app.truncate_tid = self.truncate_dict[uuid]
+            self._loadPartitionTable(conn.getUUID(), ptid, row_list)
+
+    def _loadPartitionTable(self, uuid, ptid, row_list):
+        app = self.app
+        np = app.pt.getPartitions()
+        try:
+            new_nodes = app.pt.load(ptid, row_list, app.nm)
+        except IndexError:
+            raise ProtocolError('Invalid offset')
+        if np != app.pt.getPartitions():
+            # Other nodes were told the former number of partitions when
+            # they were identified, so they must reconnect.
+            for node in app.nm.getIdentifiedList():
+                if node.isAdmin() or (node.isStorage()
+                                      and node.getUUID() != uuid):
+                    node.getConnection().close()
+        self._notifyAdmins(
+            Packets.NotifyNodeInformation(monotonic_time(), new_nodes),
+            Packets.SendPartitionTable(ptid, row_list))
+        self.ask_pt = ()
+        app.backup_tid = self.backup_tid_dict[uuid]
+        app.truncate_tid = self.truncate_dict[uuid]
 
     def _notifyAdmins(self, *packets):
         for node in self.app.nm.getAdminList(only_identified=True):
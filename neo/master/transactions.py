@@ -33,6 +33,8 @@ class Transaction(object):
     _oid_list = None
     _failed = frozenset()
     _prepared = False
+    # True while in the commit queue of the transaction manager
+    _queued = False
     # uuid dict hold flag to known who has locked the transaction
     _uuid_set = None
     _lock_wait_uuid_set = None
@@ -115,8 +117,16 @@ class Transaction(object):
         """
         return list(self._notification_set)
 
+    def getCommitTimes(self):
+        """
+            Returns when the transaction began and when its commit was
+            requested by the client
+        """
+        return self._birth, self._prepare_time
+
     def prepare(self, tid, oid_list, uuid_set, msg_id):
 
+        self._prepare_time = time()
         self._tid = tid
         self._oid_list = oid_list
         self._msg_id = msg_id
@@ -162,7 +172,9 @@ class Transaction(object):
         """
             Returns true if all nodes are locked
         """
-        return not self._lock_wait_uuid_set
+        # With tpc_begin(tid), several transactions may be queued before
+        # they are prepared (e.g. pipelined imports).
+        return self._prepared and not self._lock_wait_uuid_set
 
 
 class TransactionManager(EventQueue):
@@ -180,8 +192,12 @@ class TransactionManager(EventQueue):
         self._ttid_dict = {}
         self._last_oid = ZERO_OID
         self._last_tid = ZERO_TID
-        # queue filled with ttids pointing to transactions with increasing tids
+        # queue filled with transactions with increasing tids
+        # (removed transactions are skipped when they reach the head)
         self._queue = deque()
+        # storage uuid -> transactions that involve this storage, either
+        # because it must lock them or because it must be notified at commit
+        self._storage_dict = {}
 
     def __getitem__(self, ttid):
         """
@@ -193,13 +209,34 @@ class TransactionManager(EventQueue):
             raise ProtocolError("unknown ttid %s" % dump(ttid))
 
     def __delitem__(self, ttid):
-        try:
-            self._queue.remove(ttid)
-        except ValueError:
-            pass
-        del self._ttid_dict[ttid]
+        self._forget(self._ttid_dict[ttid])
+        self._skipForgotten()
         self.executeQueuedEvents()
 
+    def _forget(self, txn):
+        del self._ttid_dict[txn.getTTID()]
+        txn._queued = False
+        storage_dict = self._storage_dict
+        for uuid in txn._notification_set.union(txn._uuid_set or ()):
+            try:
+                txn_set = storage_dict[uuid]
+            except KeyError:
+                continue
+            txn_set.discard(txn)
+            if not txn_set:
+                del storage_dict[uuid]
+
+    def _skipForgotten(self):
+        queue = self._queue
+        while queue and not queue[0]._queued:
+            queue.popleft()
+
+    def _index(self, uuid, txn_list):
+        try:
+            self._storage_dict[uuid].update(txn_list)
+        except KeyError:
+            self._storage_dict[uuid] = set(txn_list)
+
     def __contains__(self, ttid):
         """
             Returns True if this is a pending transaction
@@ -285,8 +322,10 @@ class TransactionManager(EventQueue):
         """
         # remember that this node must be notified when pending transactions
         # will be finished
-        for txn in self._ttid_dict.itervalues():
+        txn_list = self._ttid_dict.values()
+        for txn in txn_list:
             txn.registerForNotification(uuid)
+        self._index(uuid, txn_list)
         return self._ttid_dict.keys()
 
     def begin(self, node, storage_readiness, tid=None):
@@ -296,12 +335,15 @@ class TransactionManager(EventQueue):
         if tid is None:
             # No TID requested, generate a temporary one
             tid = self._nextTID()
+            txn = Transaction(node, storage_readiness, tid)
         else:
             # Use of specific TID requested, queue it immediately and update
             # last TID.
-            self._queue.append(tid)
+            txn = Transaction(node, storage_readiness, tid)
+            txn._queued = True
+            self._queue.append(txn)
             self.setLastTID(tid)
-        txn = self._ttid_dict[tid] = Transaction(node, storage_readiness, tid)
+        self._ttid_dict[tid] = txn
         logging.debug('Begin %s', txn)
         return tid
 
@@ -386,15 +428,17 @@ class TransactionManager(EventQueue):
         # that is UP.
         assert node_list, (ready, failed)
 
-        # maybe not the fastest but _queue should be often small
-        if ttid in self._queue:
+        if txn._queued:
             tid = ttid
         else:
             tid = self._nextTID(ttid, pt.getPartitions())
-            self._queue.append(ttid)
+            txn._queued = True
+            self._queue.append(txn)
         logging.debug('Finish TXN %s for %s (was %s)',
                       dump(tid), txn.getNode(), dump(ttid))
         txn.prepare(tid, oid_list, uuid_set, msg_id)
+        for uuid in uuid_set:
+            self._index(uuid, (txn,))
         # check if greater and foreign OID was stored
         if oid_list:
             self.setLastOID(max(oid_list))
@@ -419,7 +463,8 @@ class TransactionManager(EventQueue):
             instantiation time.
         """
         logging.debug('Lock TXN %s for %s', dump(ttid), uuid_str(uuid))
-        if self[ttid].lock(uuid) and self._queue[0] == ttid:
+        txn = self[ttid]
+        if txn.lock(uuid) and self._queue[0] is txn:
             # all storage are locked and we unlock the commit queue
             self._unlockPending()
 
@@ -429,8 +474,8 @@ class TransactionManager(EventQueue):
             current transactions
         """
         unlock = False
-        for ttid, txn in self._ttid_dict.iteritems():
-            if txn.storageLost(uuid) and self._queue[0] == ttid:
+        for txn in self._storage_dict.pop(uuid, ()):
+            if txn.storageLost(uuid) and self._queue[0] is txn:
                 unlock = True
                 # do not break: we must call storageLost() on all transactions
         if unlock:
@@ -444,14 +489,13 @@ class TransactionManager(EventQueue):
         is required is when some storages are already busy by other tasks.
         """
         queue = self._queue
-        self._on_commit(self._ttid_dict.pop(queue.popleft()))
-        while queue:
-            ttid = queue[0]
-            txn = self._ttid_dict[ttid]
-            if not txn.locked():
-                break
-            del queue[0], self._ttid_dict[ttid]
+        while 1:
+            txn = queue.popleft()
+            self._forget(txn)
             self._on_commit(txn)
+            self._skipForgotten()
+            if not (queue and queue[0].locked()):
+                break
         self.executeQueuedEvents()
 
     def clientLost(self, node):
@@ -67,7 +67,17 @@ class VerificationManager(BaseServiceHandler):
         # - just before they return the last tid/oid
         self._askStorageNodesAndWait(Packets.AskLastIDs(),
             [x for x in app.nm.getIdentifiedList() if x.isStorage()])
-        app.setLastTransaction(app.tm.getLastTID())
+        tm = app.tm
+        app.setLastTransaction(tm.getLastTID())
+        last_ids = app.mirrored_ids
+        if last_ids:
+            app.mirrored_ids = None
+            if not (app.backup_tid or app.truncate_tid):
+                # Clients may already know IDs allocated by the previous
+                # primary, which may not be committed yet.
+                tm.setLastOID(last_ids[0])
+                tm.setLastTID(last_ids[1])
+        app.notifyLastIDs()
         # Just to not return meaningless information in AnswerRecovery.
         app.truncate_tid = None
 
@@ -15,7 +15,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from .neoctl import NeoCTL, NotReadyException
-from neo.lib.util import p64, u64, tidFromTime, timeStringFromTID
+from neo.lib.stats import formatNodeStats
+from neo.lib.util import p64, u64, tidFromTime, timeFromTID, \
+    timeStringFromTID
 from neo.lib.protocol import uuid_str, formatNodeList, \
     ClusterStates, NodeTypes, UUID_NAMESPACES, ZERO_TID
 
@@ -26,6 +28,9 @@ action_dict = {
         'node': 'getNodeList',
         'cluster': 'getClusterState',
         'primary': 'getPrimary',
+        'import': 'getImportProgress',
+        'backup': 'getBackupLag',
+        'tweak': 'getTweakPlan',
     },
     'set': {
         'cluster': 'setClusterState',
@@ -38,6 +43,8 @@ action_dict = {
     'kill': 'killNode',
     'prune_orphan': 'pruneOrphan',
     'truncate': 'truncate',
+    'split': 'splitPartitions',
+    'stats': 'getStats',
 }
 
 uuid_int = (lambda ns: lambda uuid:
@@ -170,6 +177,21 @@ class TerminalNeoCTL(object):
         """
         return self.neoctl.tweakPartitionTable(map(self.asNode, params))
 
+    def getTweakPlan(self, params):
+        """
+          Show how the partition table would be optimized by 'tweak' with
+          the same parameters, and the estimated amount of data to replicate.
+          Parameters: [node [...]]
+        """
+        byte_count, cell_list = self.neoctl.getTweakPlan(
+            map(self.asNode, params))
+        r = ['%03d | %s | %s' % (offset, uuid_str(uuid), state)
+             for offset, uuid, state in cell_list]
+        r.append('estimated transfer = %u bytes (%.2f MB)'
+                 % (byte_count, byte_count / 1e6) if cell_list else
+                 'No change.')
+        return '\n'.join(r)
+
     def killNode(self, params):
         """
           Kill redundant nodes (either a storage or a secondary master).
@@ -190,6 +212,48 @@ class TerminalNeoCTL(object):
         """
         return uuid_str(self.neoctl.getPrimary())
 
+    def getImportProgress(self, params):
+        """
+          Get progress of storage nodes that import data with the Importer
+          backend.
+        """
+        assert not params
+        r = []
+        for uuid, tid, max_tid, transaction_rate, byte_rate, eta in \
+                self.neoctl.getImportProgress():
+            x = '%s | ' % uuid_str(uuid)
+            if tid == max_tid:
+                x += 'done'
+            else:
+                x += '%s / %s' % (timeStringFromTID(tid),
+                                  timeStringFromTID(max_tid))
+                if transaction_rate is not None:
+                    x += ' | %.1f txn/s | %.2f MB/s' % (
+                        transaction_rate, byte_rate / 1e6)
+                if eta is not None:
+                    x += ' | ETA %uh%02um' % divmod(int(eta) // 60, 60)
+            r.append(x)
+        return '\n'.join(r) or 'No import in progress.'
+
+    def getBackupLag(self, params):
+        """
+          Get how far a backup cluster is behind its upstream cluster,
+          globally and for each partition.
+        """
+        assert not params
+        backup_tid, upstream_tid, partition_list = self.neoctl.getBackupLag()
+        upstream_time = timeFromTID(upstream_tid)
+        lag = lambda tid: max(0, upstream_time - timeFromTID(tid))
+        r = ["backup_tid = 0x%x (%s)" % (u64(backup_tid),
+                                         timeStringFromTID(backup_tid)),
+             "upstream_tid = 0x%x (%s)" % (u64(upstream_tid),
+                                           timeStringFromTID(upstream_tid)),
+             "lag = %.3f s" % lag(backup_tid)]
+        for offset, tid, pending in partition_list:
+            r.append('%03d | 0x%x | %u transaction(s) | %.3f s' % (
+                offset, u64(tid), pending, lag(tid)))
+        return '\n'.join(r)
+
     def pruneOrphan(self, params):
         """
           Fix database by deleting unreferenced raw data
@@ -217,6 +281,38 @@ class TerminalNeoCTL(object):
         """
         self.neoctl.truncate(self.asTID(*params))
 
+    def splitPartitions(self, params):
+        """
+          Multiply the number of partitions, without moving any data:
+          each partition is split into all partitions that are congruent
+          to it, with the same cells, and the new partitions can then be
+          spread over more storage nodes with 'tweak'.
+
+          The cluster must be in RUNNING state, with all cells up-to-date.
+          The --partitions option of master nodes should be changed
+          accordingly: a master that is started with the former value
+          gets the new one from storage nodes during the recovery.
+
+          Parameters: num_partitions
+            num_partitions: a multiple of the current number of partitions
+        """
+        return self.neoctl.splitPartitions(int(*params))
+
+    def getStats(self, params):
+        """
+          Get the metrics of the primary master, storage and client nodes,
+          in the Prometheus text format. Storage nodes only answer while the
+          cluster is in service.
+          Parameters: [prefix]
+            prefix: only show metrics whose name starts with it
+        """
+        assert len(params) < 2
+        text = formatNodeStats(self.neoctl.getStats())
+        if params:
+            text = ''.join(line for line in text.splitlines(True)
+                                if line.startswith(params[0]))
+        return text.rstrip('\n')
+
     def checkReplicas(self, params):
         """
           Test whether partitions have corrupted metadata
@@ -62,3 +62,7 @@ class CommandEventHandler(EventHandler):
     answerLastIDs = __answer(Packets.AnswerLastIDs)
     answerLastTransaction = __answer(Packets.AnswerLastTransaction)
     answerRecovery = __answer(Packets.AnswerRecovery)
+    answerImportProgress = __answer(Packets.AnswerImportProgress)
+    answerBackupLag = __answer(Packets.AnswerBackupLag)
+    answerTweakPlan = __answer(Packets.AnswerTweakPlan)
+    answerStats = __answer(Packets.AnswerStats)
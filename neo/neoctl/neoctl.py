@@ -82,6 +82,12 @@ class NeoCTL(BaseApplication):
             raise RuntimeError(response)
         return response[2]
 
+    def getTweakPlan(self, uuid_list=()):
+        response = self.__ask(Packets.AskTweakPlan(uuid_list))
+        if response[0] != Packets.AnswerTweakPlan:
+            raise RuntimeError(response)
+        return response[1:]
+
     def setClusterState(self, state):
         """
           Set cluster state.
@@ -184,6 +190,30 @@ class NeoCTL(BaseApplication):
             raise RuntimeError(response)
         return response[2]
 
+    def splitPartitions(self, num_partitions):
+        response = self.__ask(Packets.SplitPartitions(num_partitions))
+        if response[0] != Packets.Error or response[1] != ErrorCodes.ACK:
+            raise RuntimeError(response)
+        return response[2]
+
+    def getStats(self):
+        response = self.__ask(Packets.AskStats())
+        if response[0] != Packets.AnswerStats:
+            raise RuntimeError(response)
+        return response[1]
+
+    def getImportProgress(self):
+        response = self.__ask(Packets.AskImportProgress())
+        if response[0] != Packets.AnswerImportProgress:
+            raise RuntimeError(response)
+        return response[1]
+
+    def getBackupLag(self):
+        response = self.__ask(Packets.AskBackupLag())
+        if response[0] != Packets.AnswerBackupLag:
+            raise RuntimeError(response)
+        return response[1:]
+
     def checkReplicas(self, *args):
         response = self.__ask(Packets.CheckReplicas(*args))
         if response[0] != Packets.Error or response[1] != ErrorCodes.ACK:
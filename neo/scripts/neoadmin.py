@@ -23,6 +23,9 @@ from neo.lib.config import getServerOptionParser, ConfigurationManager
 parser = getServerOptionParser()
 parser.add_option('-u', '--uuid', help='specify an UUID to use for this ' \
                   'process')
+parser.add_option('--metrics', help='the local address of an HTTP server'
+                  ' exporting metrics of the cluster (at /metrics) in the'
+                  ' Prometheus text format')
 
 defaults = dict(
     bind = '127.0.0.1:9999',
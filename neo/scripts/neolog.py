@@ -20,7 +20,7 @@
 import bz2, gzip, errno, optparse, os, signal, sqlite3, sys, time
 from bisect import insort
 from logging import getLevelName
-from zlib import decompress
+from neo.lib.compress import decompress
 
 comp_dict = dict(bz2=bz2.BZ2File, gz=gzip.GzipFile)
 
@@ -98,7 +98,8 @@ class Log(object):
         x = {}
         if self._decode > 1:
             PStruct = g['PStruct']
-            PBoolean = g['PBoolean']
+            # Older protocols encoded compression as a boolean.
+            PCompression = g.get('PCompression', g['PBoolean'])
             def hasData(item):
                 items = item._items
                 for i, item in enumerate(items):
@@ -106,7 +107,7 @@ class Log(object):
                         j = hasData(item)
                         if j:
                             return (i,) + j
-                    elif (isinstance(item, PBoolean)
+                    elif (isinstance(item, PCompression)
                           and item._name == 'compression'
                           and i + 2 < len(items)
                           and items[i+2]._name == 'data'):
@@ -181,9 +182,7 @@ class Log(object):
             if path:
                 args[i] = self._decompress(args[i], path)
             else:
-                data = args[i+2]
-                if args[i]:
-                    data = decompress(data)
+                data = decompress(args[i], args[i+2])
                 args[i:i+3] = (len(data), data),
             return tuple(args)
 
@@ -18,6 +18,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from neo.lib import logging
+from neo.lib.compress import CODEC_DICT
 from neo.lib.config import getServerOptionParser, ConfigurationManager
 
 parser = getServerOptionParser()
@@ -32,6 +33,15 @@ parser.add_option('-C', '--upstream-cluster',
     help='the name of cluster to backup')
 parser.add_option('-M', '--upstream-masters',
     help='list of master nodes in cluster to backup')
+parser.add_option('--compression',
+    help='comma-separated list of compression codecs that clients are'
+         ' allowed to use for the data they store (default: all codecs,'
+         ' i.e. %s)' % ','.join(sorted(CODEC_DICT)))
+parser.add_option('--invalidation-delay',
+    help='delay (in seconds) during which invalidations are buffered per'
+         ' client before being sent in a single packet; this reduces the'
+         ' number of packets processed by clients when transactions are'
+         ' committed at a high rate (default: 0, i.e. no buffering)')
 
 defaults = dict(
     bind = '127.0.0.1:10000',
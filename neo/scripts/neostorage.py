@@ -35,6 +35,17 @@ parser.add_option('--disable-drop-partitions', action='store_true',
                          ' useful for big databases because the current'
                          ' implementation is inefficient (this option should'
                          ' disappear in the future)')
+parser.add_option('--backup-replications', type='int',
+                  help = 'maximum number of partitions that are replicated'
+                         ' at the same time from the upstream cluster, in'
+                         ' backup mode (default: 1)')
+parser.add_option('--devid',
+                  help = 'identifier of the device the database is on:'
+                         ' the master does not assign the same partition to'
+                         ' several storage nodes with the same devid')
+parser.add_option('--capacity', type='int',
+                  help = 'maximum number of bytes of object data the master'
+                         ' should assign to this node (default: unlimited)')
 parser.add_option('--reset', action='store_true',
                   help='remove an existing database if any, and exit')
 
@@ -42,6 +42,7 @@ from neo.tests.benchmark import BenchmarkRunner
 # each of them have to import its TestCase classes
 UNIT_TEST_MODULES = [
     # generic parts
+    'neo.tests.testConnector',
     'neo.tests.testHandler',
     'neo.tests.testNodes',
     'neo.tests.testUtil',
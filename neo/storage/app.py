@@ -26,6 +26,7 @@ from neo.lib.exception import StoppedOperation, PrimaryFailure
 from neo.lib.pt import PartitionTable
 from neo.lib.util import dump
 from neo.lib.bootstrap import BootstrapManager
+from neo.lib.compress import CODEC_NAME_DICT
 from .checker import Checker
 from .database import buildDatabaseManager
 from .handlers import identification, initialization, master
@@ -49,6 +50,15 @@ class Application(BaseApplication):
             (config.getDatabase(), config.getEngine(), config.getWait()),
         )
         self.disable_drop_partitions = config.getDisableDropPartitions()
+        # Maximum number of partitions that are replicated at the same time
+        # from an upstream cluster, in backup mode.
+        self.backup_replications = config.getBackupReplications() or 1
+        # Constraints for the master when it tweaks the partition table.
+        self.devid = config.getDevid() or ''
+        self.capacity = config.getCapacity() or 0
+        # Compression codecs that clients are allowed to use,
+        # as notified by the master.
+        self.compression_set = frozenset(CODEC_NAME_DICT).union((0,))
 
         # load master nodes
         for master_address in config.getMasters():
@@ -215,8 +225,24 @@ class Application(BaseApplication):
         # table, because the table might be incomplete.
         if pt is not None:
             self.loadPartitionTable()
-            if num_partitions != pt.getPartitions():
-                raise RuntimeError('the number of partitions is inconsistent')
+            np = pt.getPartitions()
+            if num_partitions != np:
+                if pt.getID() is None:
+                    # No partition table yet, and we may have been told the
+                    # former number of partitions by a master that then
+                    # recovered a split partition table.
+                    pt = None
+                elif np % num_partitions:
+                    raise RuntimeError(
+                        'the number of partitions is inconsistent')
+                else:
+                    # Our partitions were split after the master was started
+                    # with the former number. It is told the new one by the
+                    # partition table we send during the recovery.
+                    logging.warning('the master was started with an outdated'
+                        ' number of partitions (%s instead of %s)',
+                        num_partitions, np)
+                    num_partitions = np
 
         if pt is None or pt.getReplicas() != num_replicas:
             # changing number of replicas is not an issue
@@ -248,8 +274,12 @@ class Application(BaseApplication):
         self.dm.dropUnfinishedData()
 
         self.task_queue = task_queue = deque()
+        # For each partition whose size was reported to the master, the
+        # number of object records to commit before reporting it again.
+        self.size_countdown_dict = {}
         try:
             self.dm.doOperation(self)
+            self.newTask(self.reportPartitionSizes())
             while True:
                 while task_queue:
                     try:
@@ -276,8 +306,42 @@ class Application(BaseApplication):
             return
         self.task_queue.appendleft(iterator)
 
+    def reportPartitionSizes(self, offset_list=None):
+        """Task notifying the master about the amount of data stored for the
+        given partitions, all readable ones by default"""
+        if offset_list is None:
+            offset_list = self.pt.getAssignedPartitionList(self.uuid)
+        iterPartitionSize = self.dm.iterPartitionSize
+        countdown = self.size_countdown_dict
+        partition_list = []
+        for offset in offset_list:
+            # Partitions are scanned by steps, in order not to block the
+            # processing of other events for too long.
+            for count, size in iterPartitionSize(offset, 1000):
+                yield 1
+            partition_list.append((offset, count, size))
+            # Report again when the partition has grown by 10%.
+            countdown[offset] = max(100, count // 10)
+        self.master_conn.send(Packets.NotifyPartitionSizes(
+            self.devid, self.capacity, partition_list))
+
+    def countObjects(self, oid_list):
+        """Count object records that have just been committed, so that the
+        size of partitions that grew significantly is reported again"""
+        countdown = self.size_countdown_dict
+        getPartition = self.pt.getPartition
+        for oid in oid_list:
+            offset = getPartition(oid)
+            n = countdown.get(offset)
+            if n:
+                if n > 1:
+                    countdown[offset] = n - 1
+                else:
+                    del countdown[offset]
+                    self.newTask(self.reportPartitionSizes((offset,)))
+
     def closeClient(self, connection):
-        if connection is not self.replicator.getCurrentConnection() and \
+        if not self.replicator.isUsingConnection(connection) and \
            connection not in self.checker.conn_dict:
             connection.closeClient()
 
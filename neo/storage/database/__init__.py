@@ -20,6 +20,8 @@ from neo.lib.exception import DatabaseFailure
 
 DATABASE_MANAGER_DICT = {
     'Importer': 'importer.ImporterDatabaseManager',
+    'Log': 'log.LogDatabaseManager',
+    'Memory': 'memory.MemoryDatabaseManager',
     'MySQL': 'mysqldb.MySQLDatabaseManager',
     'SQLite': 'sqlite.SQLiteDatabaseManager',
 }
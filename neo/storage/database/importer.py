@@ -15,23 +15,44 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import cPickle, pickle, time
+import cPickle, multiprocessing, pickle, time, weakref
 from bisect import bisect, insort
 from collections import deque
 from cStringIO import StringIO
 from ConfigParser import SafeConfigParser
+from persistent.TimeStamp import TimeStamp
 from ZODB.config import storageFromString
 from ZODB.POSException import POSKeyError
 
 from . import buildDatabaseManager
 from .manager import DatabaseManager
 from neo.lib import logging, patch, util
+from neo.lib.compress import Compressor
 from neo.lib.exception import DatabaseFailure
 from neo.lib.interfaces import implements
-from neo.lib.protocol import BackendNotImplemented, MAX_TID
+from neo.lib.protocol import BackendNotImplemented, MAX_TID, Packets
 
 patch.speedupFileStorageTxnLookup()
 
+def prepareData(repickle, compress, data):
+    """Return (checksum, data, compression) to store given object record"""
+    compression, data = compress(repickle(data))
+    return util.makeChecksum(data), data, compression
+
+# Repickling in worker processes: each worker gets the oid mapping of all
+# imported ZODBs at startup, and then, batches of (zodb index, data).
+
+_worker_args = None
+
+def _initWorker(mapping_list, compress):
+    global _worker_args
+    _worker_args = [getRepickler(*x) for x in mapping_list], compress
+
+def _prepareDataList(job_list):
+    repickle_list, compress = _worker_args
+    return [prepareData(repickle_list[i], compress, data)
+            for i, data in job_list]
+
 class Reference(object):
 
     __slots__ = "value",
@@ -174,6 +195,52 @@ class Repickler(pickle.Unpickler):
     dispatch[pickle.BUILD] = load_build
 
 
+def getRepickler(shift_oid, mapping):
+    """Return a function that maps oids in an object record
+
+    'mapping' maps oids of mount points to oids in the NEO DB and other oids
+    are shifted by 'shift_oid'. Records are returned unchanged (same object)
+    if they don't contain any reference to remap.
+    """
+    if not (shift_oid or mapping):
+        return lambda x: x
+    u64 = util.u64
+    p64 = util.p64
+    def map_oid(obj):
+        if isinstance(obj, tuple) and len(obj) == 2:
+            oid = u64(obj[0])
+            # If this oid pointed to a mount point, drop 2nd item because
+            # it's probably different than the real class of the new oid.
+        elif isinstance(obj, str):
+            oid = u64(obj)
+        else:
+            raise NotImplementedError(
+                "Unsupported external reference: %r" % obj)
+        try:
+            return p64(mapping[oid])
+        except KeyError:
+            if not shift_oid:
+                return obj # common case for root db
+        oid = p64(oid + shift_oid)
+        return oid if isinstance(obj, str) else (oid, obj[1])
+    repickle = Repickler(map_oid)
+    getPersistentReferences = util.getPersistentReferences
+    def fast_repickle(data):
+        # Most records of the root db don't reference mount points:
+        # return them as is if scanning them shows that nothing would change.
+        try:
+            ref_list = getPersistentReferences(data)
+        except Exception:
+            return repickle(data) # let Repickler report the error
+        for oid in ref_list:
+            if isinstance(oid, tuple) and len(oid) == 2:
+                oid = oid[0]
+            if not isinstance(oid, str) or map_oid(oid) is not oid:
+                return repickle(data)
+        return data
+    return fast_repickle
+
+
 class ZODB(object):
 
     def __init__(self, storage, oid=0, **kw):
@@ -211,29 +278,7 @@ class ZODB(object):
         return shift_oid
 
     def repickle(self, data):
-        if not (self.shift_oid or self.mapping):
-            self.repickle = lambda x: x
-            return data
-        u64 = util.u64
-        p64 = util.p64
-        def map_oid(obj):
-            if isinstance(obj, tuple) and len(obj) == 2:
-                oid = u64(obj[0])
-                # If this oid pointed to a mount point, drop 2nd item because
-                # it's probably different than the real class of the new oid.
-            elif isinstance(obj, str):
-                oid = u64(obj)
-            else:
-                raise NotImplementedError(
-                    "Unsupported external reference: %r" % obj)
-            try:
-                return p64(self.mapping[oid])
-            except KeyError:
-                if not self.shift_oid:
-                    return obj # common case for root db
-            oid = p64(oid + self.shift_oid)
-            return oid if isinstance(obj, str) else (oid, obj[1])
-        self.repickle = Repickler(map_oid)
+        self.repickle = getRepickler(self.shift_oid, self.mapping)
         return self.repickle(data)
 
     def __getattr__(self, attr):
@@ -274,11 +319,82 @@ class ZODBIterator(object):
             and self.zodb.shift_oid < other.zodb.shift_oid
 
 
+class ImportProgress(object):
+    """Throughput and ETA of an import
+
+    The ETA assumes that the amount of data committed per unit of time in
+    source databases was constant, since the number of remaining
+    transactions is unknown.
+    """
+
+    # Minimum interval between 2 reports, in seconds.
+    INTERVAL = 10
+
+    def __init__(self, tid, max_tid):
+        self.start = self._last = time.time()
+        self.tid = tid
+        self.max_tid = max_tid
+        self._start_time = self._time(tid)
+        self._end_time = self._time(max_tid)
+        self.transactions = self.bytes = 0
+
+    @staticmethod
+    def _time(tid):
+        return TimeStamp(util.p64(tid)).timeTime() if tid else 0
+
+    def update(self, tid, transactions, bytes):
+        if not self._start_time: # nothing was imported before
+            self._start_time = self._time(tid)
+        self.tid = tid
+        self.transactions += transactions
+        self.bytes += bytes
+
+    def asTuple(self):
+        """Return (tid, max_tid, transactions/s, bytes/s, ETA in seconds)"""
+        elapsed = time.time() - self.start
+        p64 = util.p64
+        if not elapsed:
+            return p64(self.tid), p64(self.max_tid), None, None, None
+        eta = None
+        if self.tid < self.max_tid:
+            done = self._time(self.tid) - self._start_time
+            if done > 0:
+                eta = elapsed * (self._end_time - self._time(self.tid)) / done
+        else:
+            eta = 0
+        return (p64(self.tid), p64(self.max_tid), self.transactions / elapsed,
+                self.bytes / elapsed, eta)
+
+    def report(self, force=False):
+        now = time.time()
+        if force or self._last + self.INTERVAL <= now:
+            self._last = now
+            logging.info("import: %s", formatImportProgress(*self.asTuple()))
+            return True
+
+
+def formatImportProgress(tid, max_tid, transaction_rate, byte_rate, eta):
+    if tid == max_tid:
+        return "done (%s)" % util.dump(tid)
+    r = "%s/%s" % (util.dump(tid), util.dump(max_tid))
+    if transaction_rate is not None:
+        r += ", %.1f txn/s, %.2f MB/s" % (transaction_rate, byte_rate / 1e6)
+    if eta is not None:
+        r += ", ETA %uh%02um" % divmod(int(eta) // 60, 60)
+    return r
+
+
 class ImporterDatabaseManager(DatabaseManager):
     """Proxy that transparently imports data from a ZODB storage
     """
+    _app = _pool = None
     _last_commit = 0
 
+    # Limits to the size of a batch of transactions to import, both in bytes
+    # and in number of object records to repickle.
+    BATCH_SIZE = 1 << 22
+    BATCH_RECORDS = 1000
+
     def __init__(self, *args, **kw):
         super(ImporterDatabaseManager, self).__init__(*args, **kw)
         implements(self, """_getNextTID checkSerialRange checkTIDRange
@@ -287,6 +403,7 @@ class ImporterDatabaseManager(DatabaseManager):
 
     _getPartition = property(lambda self: self.db._getPartition)
     _getReadablePartition = property(lambda self: self.db._getReadablePartition)
+    _split = property(lambda self: self.db._split)
     _uncommitted_data = property(lambda self: self.db._uncommitted_data)
 
     def _parse(self, database):
@@ -297,17 +414,23 @@ class ImporterDatabaseManager(DatabaseManager):
         main = {'adapter': 'MySQL', 'wait': 0}
         main.update(config.items(sections.pop(0)))
         self.zodb = ((x, dict(config.items(x))) for x in sections)
-        self.compress = main.get('compress', 1)
+        self.compress = Compressor(main.get('compress', True),
+            int(main.get('compress-min-size', 0)),
+            float(main.get('compress-min-gain', 0)))
+        self.workers = int(main.get('workers', 0))
         self.db = buildDatabaseManager(main['adapter'],
             (main['database'], main.get('engine'), main['wait']))
         for x in """getConfiguration _setConfiguration setNumPartitions
-                    query erase getPartitionTable changePartitionTable
+                    splitPartitions query erase getPartitionTable changePartitionTable
                     getUnfinishedTIDDict dropUnfinishedData abortTransaction
                     storeTransaction lockTransaction unlockTransaction
                     loadData storeData getOrphanList _pruneData deferCommit
-                    dropPartitionsTemporary
+                    dropPartitionsTemporary _getPartitionSize
                  """.split():
-            setattr(self, x, getattr(self.db, x))
+            try:
+                setattr(self, x, getattr(self.db, x))
+            except AttributeError: # 'query' only exists for SQL backends
+                pass
 
     def _connect(self):
         pass
@@ -317,6 +440,9 @@ class ImporterDatabaseManager(DatabaseManager):
         self._last_commit = time.time()
 
     def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            del self._pool
         self.db.close()
         if isinstance(self.zodb, list): # _setup called
             for zodb in self.zodb:
@@ -346,65 +472,133 @@ class ImporterDatabaseManager(DatabaseManager):
 
     def doOperation(self, app):
         if self._import:
+            self._app = weakref.ref(app)
             app.newTask(self._import)
 
-    def _import(self):
+    def _iterTransactions(self):
+        """Iterate over transactions to import, merging those with same tid
+
+        Only user/desc/ext from first ZODB are kept. Object records are
+        returned as (oid, data_tid, data, index of source ZODB).
+        """
         p64 = util.p64
         u64 = util.u64
         tid = p64(self.zodb_tid + 1)
         zodb_list = []
-        for zodb in self.zodb:
+        for i, zodb in enumerate(self.zodb):
             try:
-                zodb_list.append(ZODBIterator(zodb, tid, p64(self.zodb_ltid)))
+                z = ZODBIterator(zodb, tid, p64(self.zodb_ltid))
             except StopIteration:
-                pass
+                continue
+            z.index = i
+            zodb_list.append(z)
         tid = None
-        def finish():
-            if tid:
-                self.storeTransaction(tid, object_list, (
-                    (x[0] for x in object_list),
-                    str(txn.user), str(txn.description),
-                    cPickle.dumps(txn.extension), False, tid), False)
-                self.releaseData(data_id_list)
-                logging.debug("TXN %s imported (user=%r, desc=%r, len(oid)=%s)",
-                    util.dump(tid), txn.user, txn.description, len(object_list))
-                del object_list[:], data_id_list[:]
-                if self._last_commit + 1 < time.time():
-                    self.commit()
-                self.zodb_tid = u64(tid)
-        if self.compress:
-            from zlib import compress
-        else:
-            compress = None
-            compression = 0
-        object_list = []
-        data_id_list = []
         while zodb_list:
             zodb_list.sort()
             z = zodb_list[0]
-            # Merge transactions with same tid. Only
-            # user/desc/ext from first ZODB are kept.
             if tid != z.tid:
-                finish()
+                if tid:
+                    yield txn, record_list
                 txn = z.transaction
                 tid = txn.tid
-                yield 1
-            zodb = z.zodb
+                record_list = []
+            shift_oid = z.zodb.shift_oid
             for r in z.transaction:
-                oid = p64(u64(r.oid) + zodb.shift_oid)
-                data_tid = r.data_txn
-                if data_tid or r.data is None:
+                record_list.append((p64(u64(r.oid) + shift_oid),
+                                    r.data_txn, r.data, z.index))
+            try:
+                z.next()
+            except StopIteration:
+                del zodb_list[0]
+        if tid:
+            yield txn, record_list
+
+    def _import(self):
+        """Import transactions in tid order
+
+        Object records are read by batches (see BATCH_* attributes), which
+        are repickled & compressed by a pool of worker processes if
+        configured, else in the main thread. Batches are written in order,
+        as soon as they are processed, transaction per transaction.
+        """
+        u64 = util.u64
+        pool = None
+        if self.workers:
+            pool = self._pool = multiprocessing.Pool(self.workers,
+                _initWorker, ([(x.shift_oid, x.mapping) for x in self.zodb],
+                              self.compress))
+        progress = ImportProgress(self.zodb_tid, self.zodb_ltid)
+        transactions = self._iterTransactions()
+        pending = deque()
+        while 1:
+            # Read & submit batches, while there are not too many of them
+            # waiting to be written.
+            if len(pending) <= self.workers:
+                batch = []
+                job_list = []
+                size = 0
+                for txn, record_list in transactions:
+                    batch.append((txn, record_list))
+                    for _, data_tid, data, i in record_list:
+                        if not (data_tid or data is None):
+                            job_list.append((i, data))
+                            size += len(data)
+                    if (self.BATCH_SIZE <= size or
+                        self.BATCH_RECORDS <= len(job_list)):
+                        break
+                if batch:
+                    if pool is None:
+                        # Lazily, to not block the main loop for too long.
+                        zodb = self.zodb
+                        result = (prepareData(zodb[i].repickle,
+                                              self.compress, data)
+                                  for i, data in job_list)
+                    else:
+                        result = pool.apply_async(_prepareDataList,
+                                                  (job_list,))
+                    pending.append((batch, result, size))
+                    if pool is not None:
+                        continue
+            if not pending:
+                break
+            batch, result, size = pending[0]
+            if pool is not None:
+                # Do not block the main loop while workers are busy.
+                if not result.ready():
+                    yield 1
+                    continue
+                result = result.get()
+            pending.popleft()
+            for x in self._writeBatch(batch, result):
+                yield x
+            progress.update(self.zodb_tid, len(batch), size)
+            if progress.report():
+                self._notifyProgress(progress)
+        if pool is not None:
+            pool.close()
+            pool.join()
+            del self._pool
+        self.commit()
+        progress.report(True)
+        self._notifyProgress(progress)
+        logging.warning("All data are imported. You should change"
+            " your configuration to use the native backend and restart.")
+        self._import = None
+        for x in """getObject getReplicationTIDList
+                 """.split():
+            setattr(self, x, getattr(self.db, x))
+
+    def _writeBatch(self, batch, result):
+        u64 = util.u64
+        result = iter(result)
+        for txn, record_list in batch:
+            object_list = []
+            data_id_list = []
+            for oid, data_tid, data, _ in record_list:
+                if data_tid or data is None:
                     data_id = None
                 else:
-                    data = zodb.repickle(r.data)
-                    if compress:
-                        compressed_data = compress(data)
-                        compression = len(compressed_data) < len(data)
-                        if compression:
-                            data = compressed_data
-                    checksum = util.makeChecksum(data)
-                    data_id = self.holdData(util.makeChecksum(data), data,
-                                            compression)
+                    data_id = self.holdData(*next(result))
                     data_id_list.append(data_id)
                 object_list.append((oid, data_id, data_tid))
                 # Give the main loop the opportunity to process requests
@@ -414,18 +608,23 @@ class ImporterDatabaseManager(DatabaseManager):
                 # unreferenced. This is not a problem because the leak is
                 # solved when resuming the migration.
                 yield 1
-            try:
-                z.next()
-            except StopIteration:
-                del zodb_list[0]
-        self._last_commit = 0
-        finish()
-        logging.warning("All data are imported. You should change"
-            " your configuration to use the native backend and restart.")
-        self._import = None
-        for x in """getObject getReplicationTIDList
-                 """.split():
-            setattr(self, x, getattr(self.db, x))
+            tid = txn.tid
+            self.storeTransaction(tid, object_list, (
+                (x[0] for x in object_list),
+                str(txn.user), str(txn.description),
+                cPickle.dumps(txn.extension), False, tid), False)
+            self.releaseData(data_id_list)
+            logging.debug("TXN %s imported (user=%r, desc=%r, len(oid)=%s)",
+                util.dump(tid), txn.user, txn.description, len(object_list))
+            self.zodb_tid = u64(tid)
+        if self._last_commit + 1 < time.time():
+            self.commit()
+
+    def _notifyProgress(self, progress):
+        app = self._app and self._app()
+        if app is not None and app.master_conn is not None:
+            app.master_conn.send(Packets.NotifyImportProgress(
+                *progress.asTuple()))
 
     def inZodb(self, oid, tid=None, before_tid=None):
         return oid <= self.zodb_loid and (
@@ -529,10 +728,11 @@ class ImporterDatabaseManager(DatabaseManager):
             tid = p64(self.zodb_ltid)
             if min_tid <= tid:
                 u64 = util.u64
+                np = self.getNumPartitions()
                 def next_tid(i):
                     for txn in i:
                         tid = u64(txn.tid)
-                        if self._getPartition(tid) == partition:
+                        if tid % np == partition:
                             insort(z, (-tid, i))
                             break
                 z = []
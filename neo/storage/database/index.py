@@ -0,0 +1,607 @@
+#
+# Copyright (C) 2017  Nexedi SA
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+from bisect import bisect, bisect_left
+from contextlib import contextmanager
+from hashlib import sha1
+from heapq import merge
+from itertools import islice
+
+from .manager import DatabaseManager, splitOIDField
+from neo.lib import util
+from neo.lib.interfaces import abstract
+from neo.lib.protocol import MAX_TID, ZERO_HASH, ZERO_OID, ZERO_TID
+
+# OIDs & TIDs are kept in arrays of 64-bit unsigned integers.
+if array('L').itemsize != 8:
+    raise ImportError("in-memory index requires a 64-bit platform")
+
+def find(a, tid):
+    """Return the position in the array of revisions 'a' of the first
+    revision whose serial is not lower than 'tid'
+
+    Each revision takes 3 items: serial, data_id, value_tid
+    """
+    lo = 0
+    hi = len(a) // 3
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if a[mid*3] < tid:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo * 3
+
+def insort(a, x):
+    if not a or a[-1] < x:
+        a.append(x)
+    else:
+        i = bisect_left(a, x)
+        if i == len(a) or a[i] != x:
+            a.insert(i, x)
+
+def remove(a, x):
+    i = bisect_left(a, x)
+    if i < len(a) and a[i] == x:
+        del a[i]
+
+
+class Partition(object):
+
+    __slots__ = 'trans', 'trans_dict', 'obj', 'obj_tid', 'obj_oid', 'count'
+
+    def __init__(self):
+        self.trans = array('L')   # sorted tids of transactions
+        self.trans_dict = {}      # tid -> metadata (see _getTransactionRecord)
+        self.obj = {}             # oid -> revisions (see find)
+        self.obj_tid = array('L') # sorted tids of object records
+        self.obj_oid = {}         # tid -> sorted array of oids
+        self.count = 0            # number of object records
+
+
+class IndexDatabaseManager(DatabaseManager):
+    """Base class for backends whose whole index is in memory
+
+    Each partition has a set of arrays (see Partition), and object data are
+    deduplicated by checksum: '_data_hash' maps checksum + chr(compression)
+    to data ids and '_data_ref' counts the object records using each data id.
+    Temporary metadata are in '_ttrans' and '_tobj' dicts.
+
+    Subclasses decide where transaction metadata and data are stored, and
+    may override the methods that update the index, in order to log changes.
+    """
+
+    # Index
+
+    @abstract
+    def _newPartition(self, offset):
+        """Return a new Partition object for given offset"""
+
+    @abstract
+    def _getTransactionRecord(self, p, tid):
+        """Return (ttid, packed, oids, user, description, ext)
+        of a committed transaction"""
+
+    @abstract
+    def _getDataLength(self, data_id):
+        """Return the length of data, as stored"""
+
+    def _getPartitionData(self, offset, create=False):
+        try:
+            return self._partitions[offset]
+        except KeyError:
+            if create:
+                p = self._partitions[offset] = self._newPartition(offset)
+                return p
+
+    def _addObject(self, p, oid, tid, data_id, value_tid):
+        """Add an object record to the index
+
+        Return False if it replaces an existing record.
+        """
+        revision = array('L', (tid, data_id, value_tid))
+        try:
+            a = p.obj[oid]
+        except KeyError:
+            p.obj[oid] = revision
+        else:
+            i = find(a, tid)
+            if i < len(a) and a[i] == tid:
+                self._unref(a[i+1])
+                a[i+1] = data_id
+                a[i+2] = value_tid
+                self._ref(data_id)
+                return False
+            a[i:i] = revision
+        p.count += 1
+        self._ref(data_id)
+        try:
+            insort(p.obj_oid[tid], oid)
+        except KeyError:
+            p.obj_oid[tid] = array('L', (oid,))
+            insort(p.obj_tid, tid)
+        return True
+
+    def _addTransaction(self, p, tid, x):
+        """Add a transaction to the index
+
+        Return False if it replaces an existing one.
+        """
+        new = tid not in p.trans_dict
+        if new:
+            insort(p.trans, tid)
+        p.trans_dict[tid] = x
+        return new
+
+    def _deleteTransactionFromIndex(self, p, tid):
+        """Remove a transaction from the index and return whether it existed"""
+        if p.trans_dict.pop(tid, None) is not None:
+            remove(p.trans, tid)
+            return True
+        return False
+
+    def _deleteObject(self, p, oid, tid=None):
+        """Remove object records from index and return list of data ids"""
+        try:
+            a = p.obj[oid]
+        except KeyError:
+            return ()
+        if tid is None:
+            del p.obj[oid]
+            i = 0
+            j = len(a)
+        else:
+            i = find(a, tid)
+            if i == len(a) or a[i] != tid:
+                return ()
+            j = i + 3
+        data_id_list = []
+        for k in xrange(i, j, 3):
+            serial = a[k]
+            oids = p.obj_oid[serial]
+            remove(oids, oid)
+            if not oids:
+                del p.obj_oid[serial]
+                remove(p.obj_tid, serial)
+            data_id = a[k+1]
+            if data_id:
+                self._unref(data_id)
+                data_id_list.append(data_id)
+            p.count -= 1
+        if tid is not None:
+            del a[i:j]
+            if not a:
+                del p.obj[oid]
+        return data_id_list
+
+    def _deleteRangeFromIndex(self, p, min_tid, max_tid, split=0,
+                              partition=None):
+        """Remove records in ]min_tid, max_tid] and return list of data ids"""
+        data_id_list = []
+        def bounds(tids):
+            return (0 if min_tid is None else bisect(tids, min_tid),
+                    len(tids) if max_tid is None else bisect(tids, max_tid))
+        tids = p.trans
+        i, j = bounds(tids)
+        kept = array('L')
+        for tid in tids[i:j]:
+            if split and tid % split != partition:
+                kept.append(tid)
+            else:
+                del p.trans_dict[tid]
+        tids[i:j] = kept
+        tids = p.obj_tid
+        i, j = bounds(tids)
+        for tid in tids[i:j]:
+            for oid in p.obj_oid[tid].tolist():
+                if not split or oid % split == partition:
+                    data_id_list += self._deleteObject(p, oid, tid)
+        return data_id_list
+
+    def _ref(self, data_id):
+        if data_id:
+            data_ref = self._data_ref
+            data_ref[data_id] = data_ref.get(data_id, 0) + 1
+
+    def _unref(self, data_id):
+        if data_id:
+            data_ref = self._data_ref
+            count = data_ref[data_id] - 1
+            if count:
+                data_ref[data_id] = count
+            else:
+                del data_ref[data_id]
+
+    @contextmanager
+    def _duplicate(self):
+        # Everything is already in memory and nothing is written
+        # from another thread.
+        yield self
+
+    def nonempty(self, table):
+        if table in ('trans', 'obj'):
+            return any(p.trans if table == 'trans' else p.obj
+                       for p in self._partitions.itervalues())
+        try:
+            return bool(getattr(self, '_' + {'config': 'config', 'pt': 'pt',
+                'data': 'data_hash', 'ttrans': 'ttrans', 'tobj': 'tobj',
+                }[table]))
+        except KeyError:
+            pass
+
+    def _setup(self):
+        if self._config:
+            # Automatic migration.
+            if self._getVersion() < 1:
+                self._checkNoUnfinishedTransactions()
+        self._setConfiguration("version", self.VERSION)
+        uncommitted_data = self._uncommitted_data
+        for x in self._tobj.itervalues():
+            for data_id, _ in x.itervalues():
+                if data_id:
+                    uncommitted_data[data_id] += 1
+
+    # Configuration & partition table
+
+    def getConfiguration(self, key):
+        return self._config.get(key)
+
+    def getPartitionTable(self, *nid):
+        if nid:
+            nid, = nid
+            return [(offset, state)
+                for (offset, x), state in self._pt.iteritems()
+                if x == nid]
+        return [(offset, nid, state)
+            for (offset, nid), state in self._pt.iteritems()]
+
+    def _getAssignedPartitionList(self):
+        """Return (tag, data, partitions) of assigned partitions, grouped by
+        the tag of their rows"""
+        nid = self.getUUID()
+        np = self._getDataPartitions()
+        partitions = self._partitions
+        partition_dict = {}
+        for offset, x in self._pt:
+            if x == nid:
+                partition_dict.setdefault(offset % np, set()).add(offset)
+        return [(offset, partitions[offset], partition_set)
+            for offset, partition_set in partition_dict.iteritems()
+            if offset in partitions]
+
+    # Reading
+
+    def getLastTID(self, max_tid):
+        split = self._split
+        r = None
+        for _, p, partition_set in self._getAssignedPartitionList():
+            tids = p.trans
+            for i in xrange(bisect(tids, max_tid) - 1, -1, -1):
+                tid = tids[i]
+                if not split or tid % split in partition_set:
+                    r = max(r, tid)
+                    break
+        return r
+
+    def _getLastIDs(self):
+        p64 = util.p64
+        split = self._split
+        trans = {}
+        obj = {}
+        oid = None
+        for offset, p, partition_set in self._getAssignedPartitionList():
+            for tid in reversed(p.trans):
+                if not split or tid % split in partition_set:
+                    trans[offset] = p64(tid)
+                    break
+            obj_oid = p.obj_oid
+            for tid in reversed(p.obj_tid):
+                if not split or any(x % split in partition_set
+                                    for x in obj_oid[tid]):
+                    obj[offset] = p64(tid)
+                    oid = max(oid, max(x for x in p.obj
+                        if not split or x % split in partition_set))
+                    break
+        return trans, obj, None if oid is None else p64(oid)
+
+    def _getUnfinishedTIDDict(self):
+        return ((ttid, x[0]) for ttid, x in self._ttrans.iteritems()), \
+            self._tobj.iterkeys()
+
+    def getFinalTID(self, ttid):
+        ttid = util.u64(ttid)
+        p = self._getPartitionData(self._getReadablePartition(ttid))
+        if p is not None:
+            tids = p.trans
+            for i in xrange(bisect_left(tids, ttid), len(tids)):
+                tid = tids[i]
+                if self._getTransactionRecord(p, tid)[0] == ttid:
+                    return util.p64(tid)
+
+    def _getRevisions(self, oid, partition=None):
+        p = self._getPartitionData(self._getReadablePartition(oid)
+            if partition is None else partition)
+        if p is not None:
+            return p.obj.get(oid)
+
+    def getLastObjectTID(self, oid):
+        oid = util.u64(oid)
+        a = self._getRevisions(oid)
+        return a and util.p64(a[-3])
+
+    def _getNextTID(self, partition, oid, tid):
+        a = self._getRevisions(oid, partition)
+        if a:
+            i = find(a, tid + 1)
+            if i < len(a):
+                return a[i]
+
+    def _getRevision(self, oid, tid, before_tid):
+        a = self._getRevisions(oid)
+        if a:
+            if tid is not None:
+                i = find(a, tid)
+                if i == len(a) or a[i] != tid:
+                    return
+            elif before_tid is not None:
+                i = find(a, before_tid) - 3
+                if i < 0:
+                    return
+            else:
+                i = len(a) - 3
+            return a, i
+
+    def _getObject(self, oid, tid=None, before_tid=None):
+        r = self._getRevision(oid, tid, before_tid)
+        if r:
+            a, i = r
+            serial, data_id, value_tid = a[i:i+3]
+            if data_id:
+                compression, checksum, data = self.loadData(data_id)
+            else:
+                compression = checksum = data = None
+            return (serial, a[i+3] if i + 3 < len(a) else None,
+                compression, checksum, data, value_tid or None)
+
+    def _getDataTID(self, oid, tid=None, before_tid=None):
+        r = self._getRevision(oid, tid, before_tid)
+        if r:
+            a, i = r
+            return a[i], a[i+2] or None
+        return None, None
+
+    def getTransaction(self, tid, all=False):
+        tid = util.u64(tid)
+        p = self._getPartitionData(self._getReadablePartition(tid))
+        if p is not None and tid in p.trans_dict:
+            ttid, packed, oids, user, desc, ext = \
+                self._getTransactionRecord(p, tid)
+        else:
+            if not all:
+                return
+            for ttid, x in self._ttrans.iteritems():
+                if x[0] == tid:
+                    _, _, packed, oids, user, desc, ext = x
+                    break
+            else:
+                return
+        return (splitOIDField(tid, oids), user, desc, ext, packed,
+                util.p64(ttid))
+
+    def getObjectHistory(self, oid, offset, length):
+        # FIXME: This method doesn't take client's current transaction id as
+        # parameter, which means it can return transactions in the future of
+        # client's transaction.
+        a = self._getRevisions(util.u64(oid))
+        if a:
+            i = find(a, max(0, self._getPackTID()))
+            r = []
+            for i in xrange(len(a) - 3 - 3 * offset, i - 1, -3):
+                if len(r) == length:
+                    break
+                data_id = a[i+1]
+                r.append((util.p64(a[i]),
+                    self._getDataLength(data_id) if data_id else 0))
+            return r or None
+
+    def _iterObjects(self, partition, min_tid, max_tid, min_oid):
+        """Iterate over (tid, oid) of given partition, sorted by tid & oid,
+        starting from min_tid & min_oid"""
+        p = self._getPartitionData(self._getPartition(partition))
+        if p is not None:
+            split = self._split
+            tids = p.obj_tid
+            obj_oid = p.obj_oid
+            for i in xrange(bisect_left(tids, min_tid), len(tids)):
+                tid = tids[i]
+                if max_tid < tid:
+                    break
+                oids = obj_oid[tid]
+                for i in xrange(bisect_left(oids, min_oid)
+                                if tid == min_tid else 0, len(oids)):
+                    oid = oids[i]
+                    if not split or oid % split == partition:
+                        yield tid, oid
+
+    def getReplicationObjectList(self, min_tid, max_tid, length, partition,
+            min_oid):
+        u64 = util.u64
+        p64 = util.p64
+        return [(p64(tid), p64(oid)) for tid, oid in islice(
+            self._iterObjects(partition, u64(min_tid), u64(max_tid),
+                              u64(min_oid)), length)]
+
+    def _getTIDList(self, offset, length, partition_list):
+        split = self._split
+        partition_set = set(partition_list)
+        return (-tid for tid in islice(merge(*(
+            (-tid for tid in reversed(p.trans)
+                  if not split or tid % split in partition_set)
+            for p in map(self._getPartitionData,
+                         set(map(self._getPartition, partition_list)))
+            if p is not None)), offset, offset + length))
+
+    def _getReplicationTIDList(self, min_tid, max_tid, length, partition):
+        p = self._getPartitionData(self._getPartition(partition))
+        if p is None:
+            return ()
+        tids = p.trans
+        i = bisect_left(tids, min_tid)
+        j = bisect(tids, max_tid)
+        split = self._split
+        if split:
+            return list(islice((tid for tid in islice(tids, i, j)
+                                    if tid % split == partition), length))
+        if length is not None:
+            j = min(j, i + length)
+        return tids[i:j]
+
+    def getReplicationTIDList(self, min_tid, max_tid, length, partition):
+        u64 = util.u64
+        return map(util.p64, self._getReplicationTIDList(
+            u64(min_tid), u64(max_tid), length, partition))
+
+    def _getPartitionSize(self, partition, length, min_tid, min_oid):
+        u64 = util.u64
+        p = self._getPartitionData(self._getPartition(partition))
+        count = size = 0
+        for tid, oid in islice(self._iterObjects(partition, u64(min_tid),
+                u64(MAX_TID), u64(min_oid)), length):
+            a = p.obj[oid]
+            data_id = a[find(a, tid) + 1]
+            if data_id:
+                size += self._getDataLength(data_id)
+            count += 1
+        return count, size, (util.p64(tid), util.p64(oid)) if count else None
+
+    def checkTIDRange(self, partition, length, min_tid, max_tid):
+        tids = self._getReplicationTIDList(
+            util.u64(min_tid), util.u64(max_tid), length, partition)
+        if tids:
+            return (len(tids), sha1(','.join(map(str, tids))).digest(),
+                    util.p64(tids[-1]))
+        return 0, ZERO_HASH, ZERO_TID
+
+    def checkSerialRange(self, partition, length, min_tid, max_tid, min_oid):
+        u64 = util.u64
+        r = list(islice(self._iterObjects(partition, u64(min_tid),
+            u64(max_tid), u64(min_oid)), length))
+        if r:
+            p64 = util.p64
+            return (len(r),
+                    sha1(','.join(str(x[0]) for x in r)).digest(),
+                    p64(r[-1][0]),
+                    sha1(','.join(str(x[1]) for x in r)).digest(),
+                    p64(r[-1][1]))
+        return 0, ZERO_HASH, ZERO_TID, ZERO_HASH, ZERO_OID
+
+    # Writing
+
+    def _getUnfinishedDataIdList(self):
+        return [data_id for x in self._tobj.itervalues()
+                        for data_id, _ in x.itervalues() if data_id]
+
+    def _removePartition(self, p):
+        """Called when a partition is dropped, after it is out of the index"""
+
+    def dropPartitions(self, offset_list):
+        if self._split:
+            for offset in offset_list:
+                self._deleteRange(offset)
+            return
+        for offset in offset_list:
+            p = self._partitions.pop(offset, None)
+            if p is not None:
+                data_id_set = set()
+                for a in p.obj.itervalues():
+                    for i in xrange(1, len(a), 3):
+                        data_id = a[i]
+                        if data_id:
+                            self._unref(data_id)
+                            data_id_set.add(data_id)
+                self._removePartition(p)
+                self._pruneData(data_id_set)
+
+    def _setValueTID(self, p, oid, a, i, value_tid):
+        """Change the value_tid of the revision at position i of array a"""
+        a[i+2] = value_tid
+
+    def _setTemporaryObject(self, ttid, oid, data_id, value_tid):
+        self._tobj[ttid][oid] = data_id, value_tid
+
+    def _deleteRevision(self, partition, p, oid, tid):
+        """Delete an object record that is obsolete after a pack"""
+        self._deleteObject(p, oid, tid)
+
+    def _updatePackFuture(self, p, oid, orig_serial, max_serial):
+        # Before deleting this objects revision, see if there is any
+        # transaction referencing its value at max_serial or above.
+        # If there is, copy value to the first future transaction. Any further
+        # reference is just updated to point to the new data location.
+        value_serial = None
+        a = p.obj[oid]
+        for i in xrange(find(a, max_serial), len(a), 3):
+            if a[i+2] == orig_serial:
+                self._setValueTID(p, oid, a, i, value_serial or 0)
+                if value_serial is None:
+                    # First found, mark its serial for future reference.
+                    value_serial = a[i]
+        for ttid in sorted(self._tobj):
+            if max_serial <= ttid:
+                try:
+                    data_id, value_tid = self._tobj[ttid][oid]
+                except KeyError:
+                    continue
+                if value_tid == orig_serial:
+                    self._setTemporaryObject(ttid, oid, data_id, value_serial)
+                    if value_serial is None:
+                        value_serial = ttid
+        return value_serial
+
+    def pack(self, tid, updateObjectDataForPack):
+        p64 = util.p64
+        tid = util.u64(tid)
+        self._setPackTID(tid)
+        for partition, p in self._partitions.items():
+            for oid in p.obj.keys():
+                a = p.obj[oid]
+                i = find(a, tid + 1)
+                if not i:
+                    continue
+                max_serial = a[i-3]
+                if a[i-2]: # not deleted
+                    if i == 3:
+                        continue
+                    # keep current revision
+                    i -= 3
+                else:
+                    max_serial += 1
+                # There are things to delete for this object
+                data_id_set = set()
+                for serial, data_id in zip(a[:i:3], a[1:i:3]):
+                    data_id_set.add(data_id)
+                    new_serial = self._updatePackFuture(
+                        p, oid, serial, max_serial)
+                    if new_serial:
+                        new_serial = p64(new_serial)
+                    updateObjectDataForPack(p64(oid), p64(serial),
+                        new_serial, data_id or None)
+                for serial in a[:i:3]:
+                    self._deleteRevision(partition, p, oid, serial)
+                data_id_set.discard(0)
+                self._pruneData(data_id_set)
+        self.commit()
@@ -0,0 +1,822 @@
+#
+# Copyright (C) 2017  Nexedi SA
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import errno, marshal, mmap, os, struct, weakref
+from array import array
+
+from .index import IndexDatabaseManager, Partition, find
+from neo.lib import logging, util
+from neo.lib.exception import DatabaseFailure
+from neo.lib.interfaces import implements
+from neo.lib.protocol import CellStates, ZERO_HASH
+
+MAGIC = 'NEOLOG1\n'
+_header = struct.Struct('>8sQ') # magic, generation
+_record = struct.Struct('>I') # length of marshalled record
+_data = struct.Struct('>QIB20s') # data_id, length, compression, checksum
+FREED = 0xff # compression value of a record that frees data
+
+class _Log(object):
+    """Append-only file read through mmap
+
+    Appended records are buffered until the next flush and they are served
+    from memory in the meantime.
+    """
+
+    def __init__(self, path, generation=None):
+        self.path = path
+        try:
+            f = open(path, 'r+b')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            f = open(path, 'w+b')
+            if generation is None:
+                generation = util.u64(os.urandom(8))
+            f.write(_header.pack(MAGIC, generation))
+            f.flush()
+            self.generation = generation
+        else:
+            try:
+                magic, self.generation = _header.unpack(
+                    f.read(_header.size))
+            except struct.error:
+                magic = None
+            if magic != MAGIC:
+                f.close()
+                raise DatabaseFailure('%r is not a NEO log' % path)
+            f.seek(0, 2)
+        self._f = f
+        self.size = f.tell()
+        self._pending = []
+        self._pending_size = 0
+        self._map = None
+        self._mapped = 0
+
+    end = property(lambda self: self.size + self._pending_size)
+    pending = property(lambda self: self._pending_size)
+
+    def append(self, *chunks):
+        offset = self.size + self._pending_size
+        for x in chunks:
+            self._pending.append(x)
+            self._pending_size += len(x)
+        return offset
+
+    def flush(self):
+        if self._pending:
+            self._f.write(''.join(self._pending))
+            self._f.flush()
+            self.size += self._pending_size
+            del self._pending[:]
+            self._pending_size = 0
+
+    def sync(self, fsync=True):
+        self.flush()
+        if fsync:
+            os.fsync(self._f.fileno())
+
+    def discard(self):
+        del self._pending[:]
+        self._pending_size = 0
+
+    def truncate(self, size):
+        logging.warning("truncating incomplete log %r at %s", self.path, size)
+        self.discard()
+        self._unmap()
+        self._f.truncate(size)
+        self._f.seek(0, 2)
+        self.size = size
+
+    def read(self, offset, length):
+        end = offset + length
+        if end > self._mapped:
+            size = self.size
+            if offset >= size:
+                pending = self._pending
+                if len(pending) > 1:
+                    pending[:] = ''.join(pending),
+                offset -= size
+                return pending[0][offset:offset+length]
+            self._unmap()
+            self._map = mmap.mmap(self._f.fileno(), size,
+                                  access=mmap.ACCESS_READ)
+            self._mapped = size
+        return self._map[offset:end]
+
+    def iterRecords(self, offset=_header.size):
+        """Iterate over marshalled records, from given offset"""
+        size = self.size
+        read = self.read
+        loads = marshal.loads
+        while offset + _record.size <= size:
+            n, = _record.unpack(read(offset, _record.size))
+            end = offset + _record.size + n
+            if size < end:
+                break
+            yield offset, loads(read(offset + _record.size, n))
+            offset = end
+        if offset != size:
+            self.truncate(offset)
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._mapped = 0
+
+    def close(self):
+        self._unmap()
+        self._f.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class _Partition(Partition):
+    """Index of a partition, with 'trans_dict' mapping tids to offsets
+    of 'T' records in the log"""
+
+    __slots__ = 'log', 'dead'
+
+    def __init__(self, log):
+        Partition.__init__(self)
+        self.log = log
+        self.dead = 0             # number of obsolete records in the log
+
+    def getState(self):
+        return (self.log.generation, self.log.size, self.trans.tostring(),
+            self.trans_dict,
+            {oid: a.tostring() for oid, a in self.obj.iteritems()},
+            self.obj_tid.tostring(),
+            {tid: a.tostring() for tid, a in self.obj_oid.iteritems()},
+            self.count, self.dead)
+
+    def setState(self, state):
+        def load(s):
+            a = array('L')
+            a.fromstring(s)
+            return a
+        (_, _, trans, self.trans_dict, obj, obj_tid, obj_oid,
+            self.count, self.dead) = state
+        self.trans = load(trans)
+        self.obj = {oid: load(a) for oid, a in obj.iteritems()}
+        self.obj_tid = load(obj_tid)
+        self.obj_oid = {tid: load(a) for tid, a in obj_oid.iteritems()}
+
+
+@implements
+class LogDatabaseManager(IndexDatabaseManager):
+    """This class manages a database made of append-only logs
+
+    Committed transactions and object records are appended to 1 log per
+    partition, whereas object data go to a single log because they are stored
+    before the partition is known. The whole index (oid -> revisions,
+    tid -> position of transaction metadata, data id -> position of data) is
+    in memory, with revisions in arrays. Another log contains the
+    configuration, the partition table and uncommitted transactions.
+
+    Records are buffered until commit, and reading is done through mmap.
+    The index is saved as a checkpoint from time to time, so that it is not
+    required to replay all logs at startup. Logs are compacted in background
+    when they contain too many obsolete records (e.g. after a pack).
+    """
+
+    VERSION = 1
+
+    # A checkpoint is written at commit, after this amount of appended bytes.
+    CHECKPOINT_SIZE = 1 << 26
+    # Above these ratios of obsolete records, logs are compacted.
+    COMPACT_DATA = 16 << 20, .5
+    COMPACT_RECORDS = 4096, .5
+    # Buffered data are written once this size is reached.
+    FLUSH_SIZE = 1 << 24
+
+    _app = None
+    _compacting = False
+
+    def _parse(self, database):
+        self.db = os.path.expanduser(database)
+
+    def _connect(self):
+        logging.info('opening log database %r', self.db)
+        try:
+            os.makedirs(self.db)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.lock(self.db)
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.db, name)
+
+    def _init(self):
+        self._config = {}
+        self._pt = {}
+        self._ttrans = {}   # ttid -> [tid, partition, packed, oids,
+                            #          user, description, ext]
+        self._tobj = {}     # ttid -> {oid: (data_id, value_tid)}
+        self._data_pos = {} # data_id -> offset
+        self._data_hash = {}# checksum + chr(compression) -> data_id
+        self._data_ref = {} # data_id -> number of object records
+        self._data_live = 0
+        self._data_next = 1
+        self._partitions = {}
+        self._appended = 0
+        self._checkpoint_pending = False
+
+    def _load(self):
+        self._init()
+        meta = self._meta_log = _Log(self._path('meta'))
+        for offset, r in meta.iterRecords():
+            self._applyMeta(r)
+        data = self._data_log = _Log(self._path('data'))
+        partition_list = []
+        for name in os.listdir(self.db):
+            if name[0] == 'p' and name[1:].isdigit():
+                partition_list.append(int(name[1:]))
+        state = self._loadCheckpoint(partition_list)
+        offset = _header.size
+        partition_dict = {}
+        if state:
+            (_, offset, self._data_next, self._data_pos, self._data_hash,
+                self._data_ref, self._data_live), partition_dict = state
+        self._replayData(offset)
+        for offset in partition_list:
+            p = self._partitions[offset] = _Partition(
+                _Log(self._path('p%u' % offset)))
+            x = partition_dict.get(offset)
+            if x is None:
+                start = _header.size
+            else:
+                p.setState(x)
+                start = x[1]
+            for offset, r in p.log.iterRecords(start):
+                self._applyPartition(p, r, offset)
+
+    def _loadCheckpoint(self, partition_list):
+        try:
+            with open(self._path('checkpoint'), 'rb') as f:
+                version, data, partition_dict = marshal.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        except (EOFError, ValueError, TypeError):
+            logging.warning("ignoring corrupted checkpoint")
+            return
+        if version == self.VERSION:
+            def check(log, state):
+                return log.generation == state[0] and state[1] <= log.size
+            if check(self._data_log, data) and \
+               set(partition_dict).issubset(partition_list):
+                for offset, x in partition_dict.iteritems():
+                    log = _Log(self._path('p%u' % offset))
+                    try:
+                        if not check(log, x):
+                            break
+                    finally:
+                        log.close()
+                else:
+                    return data, partition_dict
+        logging.warning("checkpoint does not match logs: replaying them all")
+
+    def _replayData(self, offset):
+        log = self._data_log
+        size = log.size
+        read = log.read
+        data_pos = self._data_pos
+        data_hash = self._data_hash
+        data_next = self._data_next
+        while offset + _data.size <= size:
+            data_id, length, compression, checksum = _data.unpack(
+                read(offset, _data.size))
+            end = offset + _data.size + length
+            if size < end:
+                break
+            if compression == FREED:
+                offset = data_pos.pop(data_id)
+                data_id, length, compression, checksum = _data.unpack(
+                    read(offset, _data.size))
+                del data_hash[checksum + chr(compression)]
+                self._data_live -= _data.size + length
+            else:
+                data_pos[data_id] = offset
+                data_hash[checksum + chr(compression)] = data_id
+                self._data_live += _data.size + length
+                if data_next <= data_id:
+                    data_next = data_id + 1
+            offset = end
+        self._data_next = data_next
+        if offset != size:
+            log.truncate(offset)
+
+    def _close(self):
+        try:
+            if not self._pending() and self._appended:
+                self._checkpoint()
+        finally:
+            self._closeLogs()
+
+    def _closeLogs(self):
+        self._meta_log.close()
+        self._data_log.close()
+        for p in self._partitions.itervalues():
+            p.log.close()
+
+    def _pending(self):
+        return (self._meta_log.pending or self._data_log.pending or
+            any(p.log.pending for p in self._partitions.itervalues()))
+
+    def _commit(self):
+        fsync = not self.UNSAFE
+        self._data_log.sync(fsync)
+        for p in self._partitions.itervalues():
+            if p.log.pending:
+                p.log.sync(fsync)
+        self._meta_log.sync(fsync)
+        if self._checkpoint_pending or self.CHECKPOINT_SIZE < self._appended:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        logging.debug('writing checkpoint of %r', self.db)
+        fsync = not self.UNSAFE
+        # First, replace the log of metadata by a snapshot.
+        log = _Log(self._path('meta.tmp'))
+        append = self._writeRecord(log)
+        for x in self._config.iteritems():
+            append(('C',) + x)
+        for x, state in self._pt.iteritems():
+            append(('P',) + x + (state,))
+        for ttid, x in self._ttrans.iteritems():
+            append(('t', ttid) + tuple(x[1:]))
+            if x[0] is not None:
+                append(('l', ttid, x[0]))
+        for ttid, x in self._tobj.iteritems():
+            for oid, x in x.iteritems():
+                append(('o', ttid, oid) + x)
+        log.sync(fsync)
+        self._meta_log.close()
+        os.rename(log.path, self._meta_log.path)
+        log.path = self._meta_log.path
+        self._meta_log = log
+        # Then save the index.
+        log = self._data_log
+        data = (log.generation, log.size, self._data_next, self._data_pos,
+                self._data_hash, self._data_ref, self._data_live)
+        path = self._path('checkpoint')
+        with open(path + '.tmp', 'wb') as f:
+            marshal.dump((self.VERSION, data, {offset: p.getState()
+                for offset, p in self._partitions.iteritems()}), f)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+        self._appended = 0
+        self._checkpoint_pending = False
+
+    def erase(self):
+        self._closeLogs()
+        for name in os.listdir(self.db):
+            if name in ('meta', 'data', 'checkpoint') or \
+               name[0] == 'p' and name[1:].isdigit():
+                os.remove(self._path(name))
+        self._load()
+
+    def doOperation(self, app):
+        self._app = weakref.ref(app)
+        self._maybeCompact()
+
+    # Writing & replaying records
+
+    def _writeRecord(self, log):
+        def append(r):
+            s = marshal.dumps(r)
+            self._appended += _record.size + len(s)
+            return log.append(_record.pack(len(s)), s)
+        return append
+
+    def _meta(self, *r):
+        self._writeRecord(self._meta_log)(r)
+        self._applyMeta(r)
+
+    def _applyMeta(self, r):
+        x = r[0]
+        if x == 'o':
+            _, ttid, oid, data_id, value_tid = r
+            try:
+                self._tobj[ttid][oid] = data_id, value_tid
+            except KeyError:
+                self._tobj[ttid] = {oid: (data_id, value_tid)}
+        elif x == 't':
+            self._ttrans[r[1]] = [None] + list(r[2:])
+        elif x == 'l':
+            try:
+                self._ttrans[r[1]][0] = r[2]
+            except KeyError: # metadata stored by another node
+                pass
+        elif x == 'x':
+            _, tid, ttid = r
+            self._tobj.pop(ttid, None)
+            for ttid, t in self._ttrans.items():
+                if t[0] == tid:
+                    del self._ttrans[ttid]
+        elif x == 'a':
+            self._tobj.pop(r[1], None)
+            self._ttrans.pop(r[1], None)
+        elif x == 'C':
+            _, key, value = r
+            if value is None:
+                self._config.pop(key, None)
+            else:
+                self._config[key] = value
+        elif x == 'P':
+            _, offset, nid, state = r
+            if state is None:
+                self._pt.pop((offset, nid), None)
+            else:
+                self._pt[offset, nid] = state
+        elif x == 'R':
+            self._pt.clear()
+        elif x == 'd':
+            offset_list = r[1]
+            if offset_list is None:
+                self._tobj.clear()
+                self._ttrans.clear()
+            else:
+                # Records may be replayed before the partition table is loaded.
+                np = int(self._config['partitions'])
+                offset_list = set(offset_list)
+                for ttid, x in self._tobj.items():
+                    for oid in x.keys():
+                        if oid % np in offset_list:
+                            del x[oid]
+                    if not x:
+                        del self._tobj[ttid]
+                for ttid in self._ttrans.keys():
+                    if ttid % np in offset_list:
+                        del self._ttrans[ttid]
+        else:
+            raise DatabaseFailure('invalid metadata record: %r' % (r,))
+
+    def _newPartition(self, offset):
+        return _Partition(_Log(self._path('p%u' % offset)))
+
+    def _write(self, offset, *r):
+        p = self._getPartitionData(offset, True)
+        self._applyPartition(p, r, self._writeRecord(p.log)(r))
+
+    def _applyPartition(self, p, r, offset):
+        x = r[0]
+        if x == 'O':
+            self._addObject(p, *r[1:])
+        elif x == 'T':
+            if not self._addTransaction(p, r[1], offset):
+                p.dead += 1
+        elif x == 'u':
+            _, oid, tid, value_tid = r
+            a = p.obj[oid]
+            a[find(a, tid) + 2] = value_tid
+            p.dead += 1
+        elif x == 'o':
+            _, oid, tid = r
+            self._deleteObject(p, oid, tid)
+            p.dead += 1
+        elif x == 't':
+            if self._deleteTransactionFromIndex(p, r[1]):
+                p.dead += 1
+            p.dead += 1
+        elif x == 'r':
+            self._deleteRangeFromIndex(p, *r[1:])
+            p.dead += 1
+        else:
+            raise DatabaseFailure('invalid partition record: %r' % (r,))
+
+    def _addObject(self, p, *args):
+        if not IndexDatabaseManager._addObject(self, p, *args):
+            p.dead += 1
+
+    def _deleteRangeFromIndex(self, p, *args):
+        n = len(p.trans) + p.count
+        data_id_list = IndexDatabaseManager._deleteRangeFromIndex(
+            self, p, *args)
+        p.dead += n - len(p.trans) - p.count
+        return data_id_list
+
+    def _getTransactionRecord(self, p, tid):
+        return self._readTransaction(p, tid)[2:]
+
+    def _readTransaction(self, p, tid):
+        log = p.log
+        offset = p.trans_dict[tid]
+        n, = _record.unpack(log.read(offset, _record.size))
+        return marshal.loads(log.read(offset + _record.size, n))
+
+    def _getDataLength(self, data_id):
+        return _data.unpack(self._data_log.read(
+            self._data_pos[data_id], _data.size))[1]
+
+    # Configuration & partition table
+
+    def _setConfiguration(self, key, value):
+        self._meta('C', key, None if value is None else str(value))
+
+    def _changePartitionTable(self, cell_list, reset=False):
+        if reset:
+            self._meta('R')
+        for offset, nid, state in cell_list:
+            self._meta('P', offset, nid,
+                None if state == CellStates.DISCARDED else int(state))
+
+    # Data
+
+    def storeData(self, checksum, data, compression):
+        key = checksum + chr(compression)
+        try:
+            data_id = self._data_hash[key]
+        except KeyError:
+            pass
+        else:
+            if self.loadData(data_id)[2] == data:
+                return data_id
+            raise DatabaseFailure("hash collision for %s"
+                                  % util.dump(checksum))
+        data_id = self._data_next
+        self._data_next = data_id + 1
+        log = self._data_log
+        self._data_pos[data_id] = log.append(
+            _data.pack(data_id, len(data), compression, checksum), data)
+        self._data_hash[key] = data_id
+        self._data_live += _data.size + len(data)
+        if self.FLUSH_SIZE < log.pending:
+            log.flush()
+        return data_id
+
+    def loadData(self, data_id):
+        read = self._data_log.read
+        offset = self._data_pos[data_id]
+        _, length, compression, checksum = _data.unpack(
+            read(offset, _data.size))
+        return compression, checksum, read(offset + _data.size, length)
+
+    def getOrphanList(self):
+        data_ref = self._data_ref
+        return [x for x in self._data_pos.keys() if x not in data_ref]
+
+    def _pruneData(self, data_id_list):
+        data_id_list = set(data_id_list).difference(self._uncommitted_data)
+        data_id_list.difference_update(self._data_ref)
+        data_pos = self._data_pos
+        log = self._data_log
+        read = log.read
+        count = 0
+        for data_id in data_id_list:
+            try:
+                offset = data_pos.pop(data_id)
+            except KeyError:
+                continue
+            _, length, compression, checksum = _data.unpack(
+                read(offset, _data.size))
+            del self._data_hash[checksum + chr(compression)]
+            self._data_live -= _data.size + length
+            log.append(_data.pack(data_id, 0, FREED, ZERO_HASH))
+            count += 1
+        return count
+
+    # Writing
+
+    def _removePartition(self, p):
+        p.log.remove()
+        self._checkpoint_pending = True
+
+    def dropPartitionsTemporary(self, offset_list=None):
+        self._meta('d', offset_list if offset_list is None else
+                        list(offset_list))
+
+    def storeTransaction(self, tid, object_list, transaction, temporary=True):
+        u64 = util.u64
+        tid = u64(tid)
+        for oid, data_id, value_serial in object_list:
+            oid = u64(oid)
+            partition = self._getPartition(oid)
+            if value_serial:
+                value_serial = u64(value_serial)
+                a = self._getRevisions(oid, partition)
+                data_id = a[find(a, value_serial) + 1]
+                if temporary:
+                    self.holdData(data_id)
+            if temporary:
+                self._meta('o', tid, oid, data_id, value_serial or None)
+            else:
+                self._write(partition, 'O', oid, tid, data_id or 0,
+                            value_serial or 0)
+        if transaction:
+            oid_list, user, desc, ext, packed, ttid = transaction
+            partition = self._getPartition(tid)
+            assert packed in (0, 1)
+            args = int(packed), ''.join(oid_list), str(user), str(desc), \
+                str(ext)
+            if temporary:
+                self._meta('t', u64(ttid), partition, *args)
+            else:
+                self._write(partition, 'T', tid, u64(ttid), *args)
+
+    def lockTransaction(self, tid, ttid):
+        self._meta('l', util.u64(ttid), util.u64(tid))
+        self.commit()
+
+    def unlockTransaction(self, tid, ttid):
+        u64 = util.u64
+        tid = u64(tid)
+        ttid = u64(ttid)
+        data_id_list = []
+        getPartition = self._getPartition
+        for oid, (data_id, value_tid) in sorted(
+                self._tobj.get(ttid, {}).iteritems()):
+            if data_id:
+                data_id_list.append(data_id)
+            self._write(getPartition(oid), 'O', oid, tid, data_id or 0,
+                        value_tid or 0)
+        for x in self._ttrans.itervalues():
+            if x[0] == tid:
+                self._write(x[1], 'T', tid, ttid, *x[2:])
+        self._meta('x', tid, ttid)
+        self.releaseData(data_id_list)
+
+    def abortTransaction(self, ttid):
+        self._meta('a', util.u64(ttid))
+
+    def deleteTransaction(self, tid):
+        tid = util.u64(tid)
+        partition = self._getPartition(tid)
+        p = self._getPartitionData(partition)
+        if p is not None and tid in p.trans_dict:
+            self._write(partition, 't', tid)
+
+    def deleteObject(self, oid, serial=None):
+        oid = util.u64(oid)
+        partition = self._getPartition(oid)
+        p = self._getPartitionData(partition)
+        if p is not None and oid in p.obj:
+            if serial:
+                serial = util.u64(serial)
+                a = p.obj[oid]
+                i = find(a, serial)
+                if i == len(a) or a[i] != serial:
+                    return
+            data_id_list = p.obj[oid][1::3] if serial is None else \
+                (a[i+1],)
+            self._write(partition, 'o', oid, serial)
+            self._pruneData(x for x in data_id_list if x)
+
+    def _deleteRange(self, partition, min_tid=None, max_tid=None):
+        p = self._getPartitionData(self._getPartition(partition))
+        if p is not None:
+            r = 'r', min_tid and util.u64(min_tid), \
+                     max_tid and util.u64(max_tid)
+            if self._split:
+                r += self._split, partition
+            self._writeRecord(p.log)(r)
+            self._pruneData(self._deleteRangeFromIndex(p, *r[1:]))
+            p.dead += 1
+
+    def _setValueTID(self, p, oid, a, i, value_tid):
+        self._writeRecord(p.log)(('u', oid, a[i], value_tid))
+        a[i+2] = value_tid
+        p.dead += 1
+
+    def _setTemporaryObject(self, *args):
+        self._meta('o', *args)
+
+    def _deleteRevision(self, partition, p, oid, tid):
+        self._write(partition, 'o', oid, tid)
+
+    def pack(self, tid, updateObjectDataForPack):
+        IndexDatabaseManager.pack(self, tid, updateObjectDataForPack)
+        self._maybeCompact()
+
+    # Compaction
+
+    def _maybeCompact(self):
+        if not self._compacting and self._needCompaction():
+            app = self._app and self._app()
+            if app is not None:
+                self._compacting = True
+                app.newTask(self._compact())
+
+    def _needCompaction(self):
+        return self._needDataCompaction() or any(
+            self._needPartitionCompaction(p)
+            for p in self._partitions.itervalues())
+
+    def _needDataCompaction(self):
+        minimum, ratio = self.COMPACT_DATA
+        dead = self._data_log.end - _header.size - self._data_live
+        return minimum < dead and ratio * self._data_log.end < dead
+
+    def _needPartitionCompaction(self, p):
+        minimum, ratio = self.COMPACT_RECORDS
+        return minimum < p.dead and ratio * (p.dead + p.count
+                                             + len(p.trans)) < p.dead
+
+    def _compact(self):
+        try:
+            for offset, p in sorted(self._partitions.items()):
+                if p is self._partitions.get(offset) and \
+                   self._needPartitionCompaction(p):
+                    self._compactPartition(p)
+                    yield 1
+            if self._needDataCompaction():
+                for x in self._compactData():
+                    yield x
+        finally:
+            self._compacting = False
+
+    def _replaceLog(self, old, new):
+        new.sync(not self.UNSAFE)
+        old.close()
+        os.rename(new.path, old.path)
+        new.path = old.path
+        self._checkpoint_pending = True
+
+    def _compactPartition(self, p):
+        """Rewrite the log of a partition with only live records"""
+        self.commit()
+        old = p.log
+        logging.info("compacting %r", old.path)
+        new = _Log(old.path + '.tmp')
+        append = self._writeRecord(new)
+        trans_dict = {}
+        for tid in p.trans:
+            offset = p.trans_dict[tid]
+            n, = _record.unpack(old.read(offset, _record.size))
+            trans_dict[tid] = new.append(
+                old.read(offset, _record.size + n))
+        for tid in p.obj_tid:
+            for oid in p.obj_oid[tid]:
+                a = p.obj[oid]
+                i = find(a, tid)
+                append(('O', oid, tid, a[i+1], a[i+2]))
+        self._replaceLog(old, new)
+        p.log = new
+        p.trans_dict = trans_dict
+        p.dead = 0
+        self.commit()
+
+    def _compactData(self):
+        """Rewrite data log with only live records
+
+        Data are copied in background. Records that are appended to the old
+        log in the meantime are copied at the end.
+        """
+        self.commit()
+        old = self._data_log
+        logging.info("compacting %r", old.path)
+        new = _Log(old.path + '.tmp')
+        end = old.size
+        moved = {}
+        n = 0
+        for offset, data_id in sorted((offset, data_id)
+                for data_id, offset in self._data_pos.iteritems()):
+            length = _data.unpack(old.read(offset, _data.size))[1]
+            record = old.read(offset, _data.size + length)
+            moved[data_id] = offset, new.append(record)
+            n += len(record)
+            if self.FLUSH_SIZE < n:
+                new.flush()
+                n = 0
+                yield 1
+        self.commit()
+        shift = new.end - end
+        offset = end
+        while offset < old.size:
+            x = old.read(offset, min(self.FLUSH_SIZE, old.size - offset))
+            new.append(x)
+            new.flush()
+            offset += len(x)
+        self._replaceLog(old, new)
+        self._data_log = new
+        data_pos = self._data_pos
+        for data_id, offset in data_pos.iteritems():
+            if end <= offset:
+                data_pos[data_id] = offset + shift
+            else:
+                x = moved.get(data_id)
+                if x and x[0] == offset:
+                    data_pos[data_id] = x[1]
+        self.commit()
@@ -21,7 +21,7 @@ from functools import wraps
 from neo.lib import logging, util
 from neo.lib.exception import DatabaseFailure
 from neo.lib.interfaces import abstract, requires
-from neo.lib.protocol import CellStates, NonReadableCell, ZERO_TID
+from neo.lib.protocol import CellStates, NonReadableCell, ZERO_OID, ZERO_TID
 
 def lazymethod(func):
     def getter(self):
@@ -59,7 +59,7 @@ class DatabaseManager(object):
     LOCK = "neostorage"
     LOCKED = "error: database is locked"
 
-    _deferred = 0
+    _deferred = _split = 0
     _duplicating = _repairing = None
 
     def __init__(self, database, engine=None, wait=None):
@@ -252,6 +252,36 @@ class DatabaseManager(object):
         except AttributeError:
             pass
 
+    def _getDataPartitions(self):
+        """Return the number of partitions that rows are tagged with"""
+        n = self.getConfiguration('data_partitions')
+        return self.getNumPartitions() if n is None else int(n)
+
+    def splitPartitions(self, ptid, num_partitions):
+        """Multiply the number of partitions
+
+        Each partition is split into all partitions that are congruent to it
+        modulo the former number of partitions, and these new partitions get
+        the same cells.
+
+        Existing rows are not moved: they keep the partition they were stored
+        with, i.e. modulo the number of partitions before the first split,
+        and so do new rows, so that a split is immediate whatever the amount
+        of data. Backends filter rows by oid/tid wherever a partition is
+        queried, using the '_split' attribute.
+        """
+        np = self.getNumPartitions()
+        assert np < num_partitions and not num_partitions % np, (
+            np, num_partitions)
+        if self.getConfiguration('data_partitions') is None:
+            self._setConfiguration('data_partitions', np)
+        cell_list = [(offset + i, nid, CellStates[state])
+            for i in xrange(0, num_partitions, np)
+            for offset, nid, state in self.getPartitionTable()]
+        self._setConfiguration('partitions', num_partitions)
+        self.changePartitionTable(ptid, cell_list, reset=True)
+        self.commit()
+
     def getNumReplicas(self):
         """
             Load the number of replicas from a database.
@@ -458,12 +488,19 @@ class DatabaseManager(object):
         if reset:
             readable_set.clear()
             np = self.getNumPartitions()
-            def _getPartition(x, np=np):
+            tag = self._getDataPartitions()
+            # Rows are tagged modulo the number of partitions before any
+            # split (see splitPartitions), and the same goes for the
+            # partition arguments of methods once converted with
+            # _getPartition. '_split' is then the number of partitions that
+            # the backend must use to filter rows by oid/tid, or 0 if there
+            # was no split.
+            self._split = 0 if tag == np else np
+            def _getPartition(x, np=tag):
                 return x % np
-            def _getReadablePartition(x, np=np, r=readable_set):
-                x %= np
-                if x in r:
-                    return x
+            def _getReadablePartition(x, np=np, tag=tag, r=readable_set):
+                if x % np in r:
+                    return x % tag
                 raise NonReadableCell
             self._getPartition = _getPartition
             self._getReadablePartition = _getReadablePartition
@@ -478,6 +515,16 @@ class DatabaseManager(object):
         assert isinstance(ptid, (int, long)), ptid
         self._setConfiguration('ptid', str(ptid))
 
+    def _splitCondition(self, column, *partition_list):
+        """Return a SQL condition to select rows of the given partitions
+
+        Only needed after a split, since the 'partition' column then
+        selects a superset of the wanted rows.
+        """
+        split = self._split
+        return " AND %s %% %u IN (%s)" % (column, split,
+            ",".join(map(str, partition_list))) if split else ""
+
     @abstract
     def dropPartitions(self, offset_list):
         """Delete all data for specified partitions"""
@@ -626,44 +673,106 @@ class DatabaseManager(object):
             False if object was modified by later transaction (ie, data_tid is
             not current), True otherwise.
         """
+        return self.findUndoTIDDict(tid, ltid, undone_tid,
+            {oid: transaction_object})[oid]
+
+    def findUndoTIDDict(self, tid, ltid, undone_tid, object_dict):
+        """Batched version of findUndoTID
+
+        'object_dict' maps oids to the 'transaction_object' parameter of
+        findUndoTID, and a dict of 3-tuples as returned by findUndoTID is
+        returned. The number of queries does not depend on the number of
+        oids, only on the length of the longest chain of data tids.
+        """
         u64 = util.u64
         p64 = util.p64
-        oid = u64(oid)
         tid = u64(tid)
         if ltid:
             ltid = u64(ltid)
         undone_tid = u64(undone_tid)
-        def getDataTID(tid=None, before_tid=None):
-            tid, data_tid = self._getDataTID(oid, tid, before_tid)
-            current_tid = tid
-            while data_tid:
-                if data_tid < tid:
-                    tid, data_tid = self._getDataTID(oid, data_tid)
-                    if tid is not None:
-                        continue
-                logging.error("Incorrect data serial for oid %s at tid %s",
-                              oid, current_tid)
-                return current_tid, current_tid
-            return current_tid, tid
-        if transaction_object:
-            try:
-                current_tid = current_data_tid = u64(transaction_object[2])
-            except struct.error:
-                current_tid = current_data_tid = tid
-        else:
-            current_tid, current_data_tid = getDataTID(before_tid=ltid)
+        object_list = object_dict.items()
+        request_list = []
+        for oid, transaction_object in object_list:
+            oid = u64(oid)
+            if not transaction_object:
+                request_list.append((oid, None, ltid))
+            request_list += (oid, undone_tid, None), (oid, None, undone_tid)
+        result_iter = iter(self._getDataTIDChainList(request_list))
+        result = {}
+        for oid, transaction_object in object_list:
+            if transaction_object:
+                try:
+                    current_tid = current_data_tid = u64(transaction_object[2])
+                except struct.error:
+                    current_tid = current_data_tid = tid
+            else:
+                current_tid, current_data_tid = next(result_iter)
+            found_undone_tid, undone_data_tid = next(result_iter)
+            # Load object data as it was before given transaction.
+            # It can be None, in which case it means we are undoing object
+            # creation.
+            _, data_tid = next(result_iter)
             if current_tid is None:
-                return None, None, False
-        found_undone_tid, undone_data_tid = getDataTID(tid=undone_tid)
-        assert found_undone_tid is not None, (oid, undone_tid)
-        is_current = undone_data_tid in (current_data_tid, tid)
-        # Load object data as it was before given transaction.
-        # It can be None, in which case it means we are undoing object
-        # creation.
-        _, data_tid = getDataTID(before_tid=undone_tid)
-        if data_tid is not None:
-            data_tid = p64(data_tid)
-        return p64(current_tid), data_tid, is_current
+                result[oid] = None, None, False
+                continue
+            assert found_undone_tid is not None, (oid, undone_tid)
+            is_current = undone_data_tid in (current_data_tid, tid)
+            if data_tid is not None:
+                data_tid = p64(data_tid)
+            result[oid] = p64(current_tid), data_tid, is_current
+        return result
+
+    def _getDataTIDChainList(self, request_list):
+        """Follow data tids for a list of (oid, tid, before_tid)
+
+        Return a list of (current_tid, data_tid) where 'current_tid' is the
+        tid of the record found by _getDataTID and 'data_tid' the tid of the
+        record that actually contains the data. Each step of all chains is
+        resolved by a single call to _getDataTIDList.
+        """
+        result = []
+        pending = []
+        for i, (tid, data_tid) in enumerate(
+                self._getDataTIDList(request_list)):
+            result.append((tid, tid))
+            if data_tid:
+                pending.append((i, request_list[i][0], tid, data_tid))
+        while pending:
+            follow_list = []
+            for x in pending:
+                i, oid, tid, data_tid = x
+                if data_tid < tid:
+                    follow_list.append(x)
+                else:
+                    self._incorrectDataTID(result, i, oid)
+            pending = []
+            for (i, oid, _, _), (tid, data_tid) in zip(follow_list,
+                    self._getDataTIDList([(oid, data_tid, None)
+                        for _, oid, _, data_tid in follow_list])):
+                if tid is None:
+                    self._incorrectDataTID(result, i, oid)
+                else:
+                    result[i] = result[i][0], tid
+                    if data_tid:
+                        pending.append((i, oid, tid, data_tid))
+        return result
+
+    @staticmethod
+    def _incorrectDataTID(result, i, oid):
+        current_tid = result[i][0]
+        logging.error("Incorrect data serial for oid %s at tid %s",
+                      oid, current_tid)
+        result[i] = current_tid, current_tid
+
+    @fallback
+    def _getDataTIDList(self, request_list):
+        """Batched version of _getDataTID
+
+        'request_list' is a list of (oid, tid, before_tid) and a list of
+        results of _getDataTID is returned, in the same order.
+        """
+        getDataTID = self._getDataTID
+        return [getDataTID(*x) for x in request_list]
 
     @abstract
     def lockTransaction(self, tid, ttid):
@@ -793,6 +902,51 @@ class DatabaseManager(object):
             value
         """
 
+    @abstract
+    def _getPartitionSize(self, partition, length, min_tid, min_oid):
+        """Return the amount of data stored for at most 'length' object
+        records of the given partition, sorted by tid & oid, starting from
+        min_tid & min_oid
+
+        Returns a 3-tuple:
+            - number of object records
+            - sum of the sizes of their data, as stored (i.e. possibly
+              compressed), in bytes
+            - (tid, oid) of the last record, None if there is none
+        """
+
+    @requires(_getPartitionSize)
+    def iterPartitionSize(self, partition, length):
+        """Compute the amount of data stored for the given partition, by
+        steps of 'length' object records
+
+        (count, size) is generated after each step, so that the caller can
+        process other events between them, and the last value is the total
+        for the partition.
+        """
+        count = size = 0
+        min_tid = ZERO_TID
+        min_oid = ZERO_OID
+        while 1:
+            n, s, last = self._getPartitionSize(
+                partition, length, min_tid, min_oid)
+            count += n
+            size += s
+            yield count, size
+            if n < length:
+                break
+            min_tid, min_oid = last
+            min_oid = util.add64(min_oid, 1)
+
+    def getPartitionSize(self, partition):
+        """Return the amount of data stored for the given partition
+
+        Returns (count, size): see _getPartitionSize.
+        """
+        for result in self.iterPartitionSize(partition, 10000):
+            pass
+        return result
+
     @abstract
     def checkTIDRange(self, partition, length, min_tid, max_tid):
         """
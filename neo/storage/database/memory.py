@@ -0,0 +1,257 @@
+#
+# Copyright (C) 2017  Nexedi SA
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+
+from .index import IndexDatabaseManager, Partition, find
+from neo.lib import logging, util
+from neo.lib.exception import DatabaseFailure
+from neo.lib.interfaces import implements
+from neo.lib.protocol import CellStates
+
+
+# Databases that are not open, by name.
+# A value of None means that the database is currently open.
+_database_dict = {}
+
+@implements
+class MemoryDatabaseManager(IndexDatabaseManager):
+    """This class manages a database that is only kept in memory
+
+    Nothing is written to disk: this is meant for ephemeral clusters (e.g.
+    caches) and for profiling everything except the backend. The index is
+    the same as the Log backend (see IndexDatabaseManager), and object data
+    are in a single dict.
+
+    The database parameter is a name: a named database survives the
+    storage node within the same process (e.g. restart of a node in threaded
+    tests), whereas an empty name gives a private database.
+    """
+
+    VERSION = 1
+
+    # Attributes that are preserved when a named database is closed.
+    _STATE = ('_config', '_pt', '_ttrans', '_tobj', '_data', '_data_hash',
+              '_data_ref', '_data_next', '_partitions')
+
+    def _parse(self, database):
+        self.db = database
+
+    def _connect(self):
+        logging.info('opening memory database %r', self.db)
+        state = None
+        if self.db:
+            state = _database_dict.get(self.db, False)
+            if state is None:
+                sys.exit(self.LOCKED)
+            _database_dict[self.db] = None
+        self._init()
+        if state:
+            self.__dict__.update(state)
+
+    def _init(self):
+        self._config = {}
+        self._pt = {}
+        self._ttrans = {}   # ttid -> [tid, partition, packed, oids,
+                            #          user, description, ext]
+        self._tobj = {}     # ttid -> {oid: (data_id, value_tid)}
+        self._data = {}     # data_id -> (compression, checksum, data)
+        self._data_hash = {}# checksum + chr(compression) -> data_id
+        self._data_ref = {} # data_id -> number of object records
+        self._data_next = 1
+        self._partitions = {}
+
+    def _close(self):
+        if self.db:
+            _database_dict[self.db] = {x: getattr(self, x)
+                                       for x in self._STATE}
+
+    def _commit(self):
+        pass
+
+    def erase(self):
+        self._init()
+
+    # Index
+
+    def _newPartition(self, offset):
+        return Partition()
+
+    def _getTransactionRecord(self, p, tid):
+        return p.trans_dict[tid]
+
+    def _getDataLength(self, data_id):
+        return len(self._data[data_id][2])
+
+    # Configuration & partition table
+
+    def _setConfiguration(self, key, value):
+        if value is None:
+            self._config.pop(key, None)
+        else:
+            self._config[key] = str(value)
+
+    def _changePartitionTable(self, cell_list, reset=False):
+        pt = self._pt
+        if reset:
+            pt.clear()
+        for offset, nid, state in cell_list:
+            if state == CellStates.DISCARDED:
+                pt.pop((offset, nid), None)
+            else:
+                pt[offset, nid] = int(state)
+
+    # Data
+
+    def storeData(self, checksum, data, compression):
+        key = checksum + chr(compression)
+        try:
+            data_id = self._data_hash[key]
+        except KeyError:
+            pass
+        else:
+            if self._data[data_id][2] == data:
+                return data_id
+            raise DatabaseFailure("hash collision for %s"
+                                  % util.dump(checksum))
+        data_id = self._data_next
+        self._data_next = data_id + 1
+        self._data[data_id] = compression, checksum, data
+        self._data_hash[key] = data_id
+        return data_id
+
+    def loadData(self, data_id):
+        return self._data[data_id]
+
+    def getOrphanList(self):
+        data_ref = self._data_ref
+        return [x for x in self._data if x not in data_ref]
+
+    def _pruneData(self, data_id_list):
+        data_id_list = set(data_id_list).difference(self._uncommitted_data)
+        data_id_list.difference_update(self._data_ref)
+        data = self._data
+        count = 0
+        for data_id in data_id_list:
+            try:
+                compression, checksum, _ = data.pop(data_id)
+            except KeyError:
+                continue
+            del self._data_hash[checksum + chr(compression)]
+            count += 1
+        return count
+
+    # Writing
+
+    def dropPartitionsTemporary(self, offset_list=None):
+        if offset_list is None:
+            self._tobj.clear()
+            self._ttrans.clear()
+        else:
+            np = self.getNumPartitions()
+            offset_list = set(offset_list)
+            for ttid, x in self._tobj.items():
+                for oid in x.keys():
+                    if oid % np in offset_list:
+                        del x[oid]
+                if not x:
+                    del self._tobj[ttid]
+            for ttid in self._ttrans.keys():
+                if ttid % np in offset_list:
+                    del self._ttrans[ttid]
+
+    def storeTransaction(self, tid, object_list, transaction, temporary=True):
+        u64 = util.u64
+        tid = u64(tid)
+        for oid, data_id, value_serial in object_list:
+            oid = u64(oid)
+            partition = self._getPartition(oid)
+            if value_serial:
+                value_serial = u64(value_serial)
+                a = self._getRevisions(oid, partition)
+                data_id = a[find(a, value_serial) + 1]
+                if temporary:
+                    self.holdData(data_id)
+            if temporary:
+                try:
+                    self._tobj[tid][oid] = data_id, value_serial or None
+                except KeyError:
+                    self._tobj[tid] = {oid: (data_id, value_serial or None)}
+            else:
+                self._addObject(self._getPartitionData(partition, True),
+                    oid, tid, data_id or 0, value_serial or 0)
+        if transaction:
+            oid_list, user, desc, ext, packed, ttid = transaction
+            partition = self._getPartition(tid)
+            assert packed in (0, 1)
+            args = int(packed), ''.join(oid_list), str(user), str(desc), \
+                str(ext)
+            if temporary:
+                self._ttrans[u64(ttid)] = [None, partition] + list(args)
+            else:
+                self._addTransaction(self._getPartitionData(partition, True),
+                                     tid, (u64(ttid),) + args)
+
+    def lockTransaction(self, tid, ttid):
+        try:
+            self._ttrans[util.u64(ttid)][0] = util.u64(tid)
+        except KeyError: # metadata stored by another node
+            pass
+        self.commit()
+
+    def unlockTransaction(self, tid, ttid):
+        u64 = util.u64
+        tid = u64(tid)
+        ttid = u64(ttid)
+        data_id_list = []
+        getPartition = self._getPartition
+        getPartitionData = self._getPartitionData
+        for oid, (data_id, value_tid) in self._tobj.pop(ttid, {}).iteritems():
+            if data_id:
+                data_id_list.append(data_id)
+            self._addObject(getPartitionData(getPartition(oid), True),
+                            oid, tid, data_id or 0, value_tid or 0)
+        for x, t in self._ttrans.items():
+            if t[0] == tid:
+                del self._ttrans[x]
+                self._addTransaction(getPartitionData(t[1], True),
+                                     tid, (ttid,) + tuple(t[2:]))
+        self.releaseData(data_id_list)
+
+    def abortTransaction(self, ttid):
+        ttid = util.u64(ttid)
+        self._tobj.pop(ttid, None)
+        self._ttrans.pop(ttid, None)
+
+    def deleteTransaction(self, tid):
+        tid = util.u64(tid)
+        p = self._getPartitionData(self._getPartition(tid))
+        if p is not None:
+            self._deleteTransactionFromIndex(p, tid)
+
+    def deleteObject(self, oid, serial=None):
+        oid = util.u64(oid)
+        p = self._getPartitionData(self._getPartition(oid))
+        if p is not None:
+            self._pruneData(self._deleteObject(p, oid,
+                serial and util.u64(serial)))
+
+    def _deleteRange(self, partition, min_tid=None, max_tid=None):
+        p = self._getPartitionData(self._getPartition(partition))
+        if p is not None:
+            self._pruneData(self._deleteRangeFromIndex(p,
+                min_tid and util.u64(min_tid), max_tid and util.u64(max_tid),
+                self._split, partition))
@@ -311,10 +311,17 @@ class MySQLDatabaseManager(DatabaseManager):
         return self.query("SELECT * FROM pt")
 
     def _getAssignedPartitionList(self):
+        """Return (tag, partitions) of assigned partitions, grouped by the
+        tag of their rows"""
         nid = self.getUUID()
         if nid is None:
             return ()
-        return [p for p, in self.query("SELECT rid FROM pt WHERE nid=%s" % nid)]
+        np = self._getDataPartitions()
+        partition_dict = {}
+        for p, in self.query("SELECT rid FROM pt WHERE nid=%s" % nid):
+            partition_dict.setdefault(p % np, []).append(p)
+        return [(offset, partition_list)
+            for offset, partition_list in partition_dict.iteritems()]
 
     def _sqlmax(self, sql, arg_list):
         q = self.query
@@ -324,23 +331,27 @@ class MySQLDatabaseManager(DatabaseManager):
     def getLastTID(self, max_tid):
         return self._sqlmax(
             "SELECT MAX(tid) as t FROM trans FORCE INDEX (PRIMARY)"
-            " WHERE tid<=%s and `partition`=%%s" % max_tid,
-            self._getAssignedPartitionList())
+            " WHERE tid<=%s and `partition`=%%s%%s" % max_tid,
+            [(offset, self._splitCondition('tid', *partition_list))
+             for offset, partition_list in self._getAssignedPartitionList()])
 
     def _getLastIDs(self):
         offset_list = self._getAssignedPartitionList()
         p64 = util.p64
         q = self.query
         sql = ("SELECT MAX(tid) FROM %s FORCE INDEX (PRIMARY)"
-               " WHERE `partition`=%s")
+               " WHERE `partition`=%s%s")
         trans, obj = ({partition: p64(tid)
-            for partition in offset_list
-            for tid, in q(sql % (t, partition))
+            for partition, partition_list in offset_list
+            for tid, in q(sql % (t, partition,
+                self._splitCondition(column, *partition_list)))
             if tid is not None}
-            for t in ('trans', 'obj'))
+            for t, column in (('trans', 'tid'), ('obj', 'oid')))
         oid = self._sqlmax(
             "SELECT MAX(oid) FROM obj FORCE INDEX (`partition`)"
-            " WHERE `partition`=%s", offset_list)
+            " WHERE `partition`=%s%s",
+            [(offset, self._splitCondition('oid', *partition_list))
+             for offset, partition_list in offset_list])
         return trans, obj, None if oid is None else p64(oid)
 
     def _getUnfinishedTIDDict(self):
@@ -427,20 +438,23 @@ class MySQLDatabaseManager(DatabaseManager):
 
     def dropPartitions(self, offset_list):
         q = self.query
+        split = self._split
         # XXX: these queries are inefficient (execution time increase with
         # row count, although we use indexes) when there are rows to
         # delete. It should be done as an idle task, by chunks.
         for partition in offset_list:
-            where = " WHERE `partition`=%d" % partition
+            where = " WHERE `partition`=%d" % self._getPartition(partition)
+            sql = where + self._splitCondition('oid', partition)
             data_id_list = [x for x, in
                 q("SELECT DISTINCT data_id FROM obj FORCE INDEX(PRIMARY)"
-                  + where)
+                  + sql)
                 if x]
-            if not self._use_partition:
-                q("DELETE FROM obj" + where)
-                q("DELETE FROM trans" + where)
+            if split or not self._use_partition:
+                q("DELETE FROM obj" + sql)
+                q("DELETE FROM trans" + where
+                  + self._splitCondition('tid', partition))
             self._pruneData(data_id_list)
-        if self._use_partition:
+        if self._use_partition and not split:
             drop = "ALTER TABLE %s DROP PARTITION" + \
                 ','.join(' p%u' % i for i in offset_list)
             for table in 'trans', 'obj':
@@ -454,11 +468,20 @@ class MySQLDatabaseManager(DatabaseManager):
         return [x for x, in self.query("SELECT data_id FROM tobj") if x]
 
     def dropPartitionsTemporary(self, offset_list=None):
-        where = "" if offset_list is None else \
-            " WHERE `partition` IN (%s)" % ','.join(map(str, offset_list))
         q = self.query
-        q("DELETE FROM tobj" + where)
-        q("DELETE FROM ttrans" + where)
+        if offset_list is None:
+            q("DELETE FROM tobj")
+            q("DELETE FROM ttrans")
+        elif self._split:
+            q("DELETE FROM tobj WHERE 1" + self._splitCondition(
+                'oid', *offset_list))
+            q("DELETE FROM ttrans WHERE 1" + self._splitCondition(
+                'ttid', *offset_list))
+        else:
+            where = " WHERE `partition` IN (%s)" % ','.join(
+                map(str, offset_list))
+            q("DELETE FROM tobj" + where)
+            q("DELETE FROM ttrans" + where)
 
     def storeTransaction(self, tid, object_list, transaction, temporary = True):
         e = self.escape
@@ -612,6 +635,25 @@ class MySQLDatabaseManager(DatabaseManager):
         r = self.query(sql)
         return r[0] if r else (None, None)
 
+    def _getDataTIDList(self, request_list):
+        result = [(None, None)] * len(request_list)
+        sql_list = []
+        for i, (oid, tid, before_tid) in enumerate(request_list):
+            sql = ('(SELECT %d, tid, value_tid FROM obj'
+                   ' FORCE INDEX(`partition`)'
+                   ' WHERE `partition` = %d AND oid = %d'
+                  ) % (i, self._getReadablePartition(oid), oid)
+            if tid is not None:
+                sql += ' AND tid = %d' % tid
+            elif before_tid is not None:
+                sql += ' AND tid < %d' % before_tid
+            sql_list.append(sql + ' ORDER BY tid DESC LIMIT 1)')
+        for j in xrange(0, len(sql_list), 1000):
+            for i, tid, value_tid in self.query(
+                    ' UNION ALL '.join(sql_list[j:j+1000])):
+                result[i] = tid, value_tid
+        return result
+
     def lockTransaction(self, tid, ttid):
         u64 = util.u64
         self.query("UPDATE ttrans SET tid=%d WHERE ttid=%d LIMIT 1"
@@ -655,14 +697,14 @@ class MySQLDatabaseManager(DatabaseManager):
         self._pruneData(data_id_list)
 
     def _deleteRange(self, partition, min_tid=None, max_tid=None):
-        sql = " WHERE `partition`=%d" % partition
+        sql = " WHERE `partition`=%d" % self._getPartition(partition)
         if min_tid:
             sql += " AND %d < tid" % util.u64(min_tid)
         if max_tid:
             sql += " AND tid <= %d" % util.u64(max_tid)
         q = self.query
-        q("DELETE FROM trans" + sql)
-        sql = " FROM obj" + sql
+        q("DELETE FROM trans" + sql + self._splitCondition('tid', partition))
+        sql = " FROM obj" + sql + self._splitCondition('oid', partition)
         data_id_list = [x for x, in q("SELECT DISTINCT data_id" + sql) if x]
         q("DELETE" + sql)
         self._pruneData(data_id_list)
@@ -705,16 +747,18 @@ class MySQLDatabaseManager(DatabaseManager):
         min_tid = u64(min_tid)
         r = self.query('SELECT tid, oid FROM obj FORCE INDEX(PRIMARY)'
                        ' WHERE `partition` = %d AND tid <= %d'
-                       ' AND (tid = %d AND %d <= oid OR %d < tid)'
+                       ' AND (tid = %d AND %d <= oid OR %d < tid)%s'
                        ' ORDER BY tid ASC, oid ASC LIMIT %d' % (
-            partition, u64(max_tid), min_tid, u64(min_oid), min_tid, length))
+            self._getPartition(partition), u64(max_tid), min_tid, u64(min_oid),
+            min_tid, self._splitCondition('oid', partition), length))
         return [(p64(serial), p64(oid)) for serial, oid in r]
 
     def _getTIDList(self, offset, length, partition_list):
         return (t[0] for t in self.query(
-            "SELECT tid FROM trans WHERE `partition` in (%s)"
+            "SELECT tid FROM trans WHERE `partition` in (%s)%s"
             " ORDER BY tid DESC LIMIT %d,%d"
-            % (','.join(map(str, partition_list)), offset, length)))
+            % (','.join(map(str, set(map(self._getPartition, partition_list)))),
+               self._splitCondition('tid', *partition_list), offset, length)))
 
     def getReplicationTIDList(self, min_tid, max_tid, length, partition):
         u64 = util.u64
@@ -723,12 +767,13 @@ class MySQLDatabaseManager(DatabaseManager):
         max_tid = u64(max_tid)
         r = self.query("""SELECT tid FROM trans
                     WHERE `partition` = %(partition)d
-                    AND tid >= %(min_tid)d AND tid <= %(max_tid)d
+                    AND tid >= %(min_tid)d AND tid <= %(max_tid)d%(split)s
                     ORDER BY tid ASC LIMIT %(length)d""" % {
-            'partition': partition,
+            'partition': self._getPartition(partition),
             'min_tid': min_tid,
             'max_tid': max_tid,
             'length': length,
+            'split': self._splitCondition('tid', partition),
         })
         return [p64(t[0]) for t in r]
 
@@ -794,15 +839,35 @@ class MySQLDatabaseManager(DatabaseManager):
             self._pruneData(data_id_set)
         self.commit()
 
+    def _getPartitionSize(self, partition, length, min_tid, min_oid):
+        u64 = util.u64
+        p64 = util.p64
+        min_tid = u64(min_tid)
+        r = self.query(
+            "SELECT tid, oid, IF(compression < 128, LENGTH(value),"
+            "  CAST(CONV(HEX(SUBSTR(value, 5, 4)), 16, 10) AS INT))"
+            " FROM obj FORCE INDEX(PRIMARY)"
+            " LEFT JOIN data ON (obj.data_id = data.id)"
+            " WHERE `partition` = %d AND (tid = %d AND %d <= oid OR %d < tid)%s"
+            " ORDER BY tid ASC, oid ASC LIMIT %d" % (
+            self._getPartition(partition), min_tid, u64(min_oid), min_tid,
+            self._splitCondition('oid', partition), length))
+        if r:
+            tid, oid, _ = r[-1]
+            return len(r), int(sum(x for _, _, x in r if x)), \
+                (p64(tid), p64(oid))
+        return 0, 0, None
+
     def checkTIDRange(self, partition, length, min_tid, max_tid):
         count, tid_checksum, max_tid = self.query(
             """SELECT COUNT(*), SHA1(GROUP_CONCAT(tid SEPARATOR ",")), MAX(tid)
                FROM (SELECT tid FROM trans
                      WHERE `partition` = %(partition)s
                        AND tid >= %(min_tid)d
-                       AND tid <= %(max_tid)d
+                       AND tid <= %(max_tid)d%(split)s
                      ORDER BY tid ASC %(limit)s) AS t""" % {
-            'partition': partition,
+            'partition': self._getPartition(partition),
+            'split': self._splitCondition('tid', partition),
             'min_tid': util.u64(min_tid),
             'max_tid': util.u64(max_tid),
             'limit': '' if length is None else 'LIMIT %u' % length,
@@ -823,13 +888,14 @@ class MySQLDatabaseManager(DatabaseManager):
                WHERE `partition` = %(partition)s
                  AND tid <= %(max_tid)d
                  AND (tid > %(min_tid)d OR
-                      tid = %(min_tid)d AND oid >= %(min_oid)d)
+                      tid = %(min_tid)d AND oid >= %(min_oid)d)%(split)s
                ORDER BY tid, oid %(limit)s""" % {
             'min_oid': u64(min_oid),
             'min_tid': u64(min_tid),
             'max_tid': u64(max_tid),
             'limit': '' if length is None else 'LIMIT %u' % length,
-            'partition': partition,
+            'partition': self._getPartition(partition),
+            'split': self._splitCondition('oid', partition),
         })
         if r:
             p64 = util.p64
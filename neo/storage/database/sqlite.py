@@ -14,15 +14,21 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import errno
 import os
+import re
 import sqlite3
+from collections import defaultdict
 from hashlib import sha1
+from heapq import merge
+from itertools import islice
 import string
 import traceback
 
 from . import LOG_QUERIES
 from .manager import DatabaseManager, splitOIDField
 from neo.lib import logging, util
+from neo.lib.exception import DatabaseFailure
 from neo.lib.interfaces import implements
 from neo.lib.protocol import CellStates, ZERO_OID, ZERO_TID, ZERO_HASH
 
@@ -65,27 +71,136 @@ class SQLiteDatabaseManager(DatabaseManager):
              http://www.sqlite.org/tempfiles.html for more information.
              In other words, temporary files (by default in /var/tmp !) must
              never be used for small requests.
+
+    The database path can be followed by options: path?option[&option...]
+    - partitioned: 'trans' & 'obj' tables of each partition are stored in
+      a separate file (named <path>.p<partition>). Other tables remain in the
+      main file. An existing database is automatically converted.
+    - wal: use WAL journal mode
+    - mmap_size=<bytes>: maximum size of the memory-mapped I/O
     """
 
     VERSION = 1
 
     def _parse(self, database):
+        database, _, options = database.partition('?')
         self.db = os.path.expanduser(database)
+        self._partitioned = self._wal = False
+        self._mmap_size = None
+        for option in options.split('&') if options else ():
+            name, _, value = option.partition('=')
+            try:
+                if name == 'mmap_size':
+                    self._mmap_size = int(value)
+                    continue
+                if not value and name in ('partitioned', 'wal'):
+                    setattr(self, '_' + name, True)
+                    continue
+            except ValueError:
+                pass
+            raise DatabaseFailure('invalid SQLite option: %r' % option)
+        if self._partitioned and self.db in ('', ':memory:'):
+            raise DatabaseFailure(
+                "'partitioned' option requires an on-disk database")
 
     def _close(self):
+        for conn in self._shard_dict.itervalues():
+            conn.close()
+        if self._partitioned:
+            self._empty_shard.close()
         self.conn.close()
 
     def _connect(self):
         logging.info('connecting to SQLite database %r', self.db)
-        self.conn = sqlite3.connect(self.db, check_same_thread=False)
+        self.conn = self._open(self.db)
         self.lock(self.db)
+        self._config = {}
+        self._shard_dict = {}
+        shard_list = self._getShardList()
+        if self._partitioned:
+            # Queries that only read partitions without data run on empty
+            # tables instead of creating files for them.
+            self._empty_shard = sqlite3.connect(':memory:',
+                                                check_same_thread=False)
+            self._createTables(self._empty_shard.execute)
+            for partition in shard_list:
+                self._shard(partition, True)
+        elif shard_list:
+            raise DatabaseFailure("%r uses 1 file per partition:"
+                " the 'partitioned' option is required" % self.db)
+
+    def _open(self, path):
+        conn = sqlite3.connect(path, check_same_thread=False)
+        q = conn.execute
         if self.UNSAFE:
-            q = self.query
             q("PRAGMA synchronous = OFF")
+        if self._wal:
+            q("PRAGMA journal_mode = WAL")
+        elif self.UNSAFE:
             q("PRAGMA journal_mode = MEMORY")
-        self._config = {}
+        if self._mmap_size is not None:
+            q("PRAGMA mmap_size = %u" % self._mmap_size)
+        return conn
+
+    def _getShardPath(self, partition):
+        return '%s.p%u' % (self.db, partition)
+
+    def _getShardList(self):
+        if self.db in ('', ':memory:'):
+            return ()
+        dirname, basename = os.path.split(os.path.abspath(self.db))
+        match = re.compile(re.escape(basename) + r'\.p(\d+)$').match
+        return [int(m.group(1)) for m in map(match, os.listdir(dirname)) if m]
+
+    def _shard(self, partition, create=False):
+        """Return query function for 'trans' & 'obj' tables of a partition
+
+        The file of a partition is only created by writers (create=True).
+        """
+        if not self._partitioned:
+            return self.query
+        try:
+            return self._shard_dict[partition].execute
+        except KeyError:
+            if not create:
+                return self._empty_shard.execute
+            conn = self._shard_dict[partition] = self._open(
+                self._getShardPath(partition))
+            self._createTables(conn.execute)
+            return conn.execute
+
+    def _shards(self):
+        """Return query functions for all 'trans' & 'obj' tables"""
+        if self._partitioned:
+            return [conn.execute for conn in self._shard_dict.itervalues()]
+        return self.query,
+
+    def _dropShard(self, partition):
+        conn = self._shard_dict.pop(partition, None)
+        if conn is not None:
+            conn.close()
+        path = self._getShardPath(partition)
+        for suffix in '', '-journal', '-wal', '-shm':
+            try:
+                os.remove(path + suffix)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def _getAssignedShardDict(self):
+        """Return assigned partitions, grouped by the shard containing them"""
+        np = self._getDataPartitions()
+        shard_dict = defaultdict(list)
+        for partition, _ in self.getPartitionTable(self.getUUID()):
+            shard = partition % np
+            if shard in self._shard_dict:
+                shard_dict[shard].append(partition)
+        return shard_dict
 
     def _commit(self):
+        # Partition files first: see unlockTransaction.
+        for conn in self._shard_dict.itervalues():
+            retry_if_locked(conn.commit)
         retry_if_locked(self.conn.commit)
 
     if LOG_QUERIES:
@@ -103,11 +218,17 @@ class SQLiteDatabaseManager(DatabaseManager):
     def erase(self):
         for t in 'config', 'pt', 'trans', 'obj', 'data', 'ttrans', 'tobj':
             self.query('DROP TABLE IF EXISTS ' + t)
+        for partition in self._getShardList():
+            self._dropShard(partition)
 
     def nonempty(self, table):
+        if self._partitioned and table in ('trans', 'obj'):
+            return any(self._nonempty(q, table) for q in self._shards())
+        return self._nonempty(self.query, table)
+
+    def _nonempty(self, q, table):
         try:
-            return bool(self.query(
-                "SELECT 1 FROM %s LIMIT 1" % table).fetchone())
+            return bool(q("SELECT 1 FROM %s LIMIT 1" % table).fetchone())
         except sqlite3.OperationalError as e:
             if not e.args[0].startswith("no such table:"):
                 raise
@@ -135,6 +256,14 @@ class SQLiteDatabaseManager(DatabaseManager):
 
         self._setConfiguration("version", self.VERSION)
 
+        if not self._partitioned:
+            self._createTables(q)
+        else:
+            table_list = [t for t in ('trans', 'obj')
+                            if self._nonempty(q, t) is not None]
+            if table_list:
+                self._splitTables(table_list)
+
         # The table "pt" stores a partition table.
         q("""CREATE TABLE IF NOT EXISTS pt (
                  rid INTEGER NOT NULL,
@@ -143,35 +272,6 @@ class SQLiteDatabaseManager(DatabaseManager):
                  PRIMARY KEY (rid, nid))
           """)
 
-        # The table "trans" stores information on committed transactions.
-        q("""CREATE TABLE IF NOT EXISTS trans (
-                 partition INTEGER NOT NULL,
-                 tid INTEGER NOT NULL,
-                 packed BOOLEAN NOT NULL,
-                 oids BLOB NOT NULL,
-                 user BLOB NOT NULL,
-                 description BLOB NOT NULL,
-                 ext BLOB NOT NULL,
-                 ttid INTEGER NOT NULL,
-                 PRIMARY KEY (partition, tid))
-          """)
-
-        # The table "obj" stores committed object metadata.
-        q("""CREATE TABLE IF NOT EXISTS obj (
-                 partition INTEGER NOT NULL,
-                 oid INTEGER NOT NULL,
-                 tid INTEGER NOT NULL,
-                 data_id INTEGER,
-                 value_tid INTEGER,
-                 PRIMARY KEY (partition, tid, oid))
-          """)
-        q("""CREATE INDEX IF NOT EXISTS _obj_i1 ON
-                 obj(partition, oid, tid)
-          """)
-        q("""CREATE INDEX IF NOT EXISTS _obj_i2 ON
-                 obj(data_id)
-          """)
-
         # The table "data" stores object data.
         q("""CREATE TABLE IF NOT EXISTS data (
                  id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -208,6 +308,63 @@ class SQLiteDatabaseManager(DatabaseManager):
         self._uncommitted_data.update(q("SELECT data_id, count(*)"
             " FROM tobj WHERE data_id IS NOT NULL GROUP BY data_id"))
 
+    def _createTables(self, q):
+        # The table "trans" stores information on committed transactions.
+        q("""CREATE TABLE IF NOT EXISTS trans (
+                 partition INTEGER NOT NULL,
+                 tid INTEGER NOT NULL,
+                 packed BOOLEAN NOT NULL,
+                 oids BLOB NOT NULL,
+                 user BLOB NOT NULL,
+                 description BLOB NOT NULL,
+                 ext BLOB NOT NULL,
+                 ttid INTEGER NOT NULL,
+                 PRIMARY KEY (partition, tid))
+          """)
+
+        # The table "obj" stores committed object metadata.
+        q("""CREATE TABLE IF NOT EXISTS obj (
+                 partition INTEGER NOT NULL,
+                 oid INTEGER NOT NULL,
+                 tid INTEGER NOT NULL,
+                 data_id INTEGER,
+                 value_tid INTEGER,
+                 PRIMARY KEY (partition, tid, oid))
+          """)
+        q("""CREATE INDEX IF NOT EXISTS _obj_i1 ON
+                 obj(partition, oid, tid)
+          """)
+        q("""CREATE INDEX IF NOT EXISTS _obj_i2 ON
+                 obj(data_id)
+          """)
+
+    def _splitTables(self, table_list):
+        """Move given tables of the main file to partition files
+
+        Partition files are committed before the tables are dropped from the
+        main file so that an interrupted conversion can be resumed.
+        """
+        logging.info("converting %r to 1 file per partition", self.db)
+        q = self.query
+        for table in table_list:
+            sql = "INSERT OR REPLACE INTO %s VALUES (%s)" % (table,
+                ','.join('?' * (8 if table == 'trans' else 5)))
+            for partition, in q("SELECT DISTINCT partition FROM "
+                                + table).fetchall():
+                self._shard(partition, True)
+                insert = self._shard_dict[partition].executemany
+                r = q("SELECT * FROM %s WHERE partition=?" % table,
+                      (partition,))
+                while 1:
+                    x = r.fetchmany(10000)
+                    if not x:
+                        break
+                    insert(sql, x)
+        self.commit()
+        for table in table_list:
+            q("DROP TABLE " + table)
+        self.commit()
+
     def getConfiguration(self, key):
         try:
             return self._config[key]
@@ -233,6 +390,14 @@ class SQLiteDatabaseManager(DatabaseManager):
             return self.query("SELECT rid, state FROM pt WHERE nid=?", nid)
         return self.query("SELECT * FROM pt")
 
+    def _rid(self, column):
+        """Return the SQL expression matching the 'rid' column of 'pt'
+        for rows of 'trans' (column='tid') or 'obj' (column='oid')"""
+        np = self.getNumPartitions()
+        if np == self._getDataPartitions():
+            return "partition"
+        return "%s %% %u" % (column, np)
+
     # A test with a table of 20 million lines and SQLite 3.8.7.1 shows that
     # it's not worth changing getLastTID:
     # - It already returns the result in less than 2 seconds, without reading
@@ -244,25 +409,51 @@ class SQLiteDatabaseManager(DatabaseManager):
     #   each partition (and finish in Python with max() for getLastTID).
 
     def getLastTID(self, max_tid):
+        if self._partitioned:
+            return max([self._shard(shard)(
+                    "SELECT MAX(tid) FROM trans WHERE tid<=?"
+                    + self._splitCondition('tid', *partition_list),
+                    (max_tid,)).next()[0]
+                for shard, partition_list
+                in self._getAssignedShardDict().iteritems()] or (None,))
         return self.query(
             "SELECT MAX(tid) FROM pt, trans"
-            " WHERE nid=? AND rid=partition AND tid<=?",
+            " WHERE nid=? AND rid=%s AND tid<=?" % self._rid('tid'),
             (self.getUUID(), max_tid,)).next()[0]
 
     def _getLastIDs(self):
         p64 = util.p64
+        if self._partitioned:
+            trans = {}
+            obj = {}
+            oid = None
+            for shard, partition_list in \
+                    self._getAssignedShardDict().iteritems():
+                q = self._shard(shard)
+                tid, = q("SELECT MAX(tid) FROM trans WHERE 1"
+                    + self._splitCondition('tid', *partition_list)).next()
+                if tid is not None:
+                    trans[shard] = p64(tid)
+                tid, x = q("SELECT MAX(tid), MAX(oid) FROM obj WHERE 1"
+                    + self._splitCondition('oid', *partition_list)).next()
+                if tid is not None:
+                    obj[shard] = p64(tid)
+                    oid = max(oid, x)
+            return trans, obj, None if oid is None else p64(oid)
         q = self.query
         args = self.getUUID(),
         trans = {partition: p64(tid)
             for partition, tid in q(
                 "SELECT partition, MAX(tid) FROM pt, trans"
-                " WHERE nid=? AND rid=partition GROUP BY partition", args)}
+                " WHERE nid=? AND rid=%s GROUP BY partition"
+                % self._rid('tid'), args)}
+        rid = self._rid('oid')
         obj = {partition: p64(tid)
             for partition, tid in q(
                 "SELECT partition, MAX(tid) FROM pt, obj"
-                " WHERE nid=? AND rid=partition GROUP BY partition", args)}
+                " WHERE nid=? AND rid=%s GROUP BY partition" % rid, args)}
         oid = q("SELECT MAX(oid) oid FROM pt, obj"
-                " WHERE nid=? AND rid=partition", args).next()[0]
+                " WHERE nid=? AND rid=%s" % rid, args).next()[0]
         return trans, obj, None if oid is None else p64(oid)
 
     def _getUnfinishedTIDDict(self):
@@ -274,31 +465,37 @@ class SQLiteDatabaseManager(DatabaseManager):
         ttid = util.u64(ttid)
         # As of SQLite 3.8.7.1, 'tid>=ttid' would ignore the index on tid,
         # even though ttid is a constant.
-        for tid, in self.query("SELECT tid FROM trans"
+        partition = self._getReadablePartition(ttid)
+        for tid, in self._shard(partition)("SELECT tid FROM trans"
                 " WHERE partition=? AND tid>=? AND ttid=? LIMIT 1",
-                (self._getReadablePartition(ttid), ttid, ttid)):
+                (partition, ttid, ttid)):
             return util.p64(tid)
 
     def getLastObjectTID(self, oid):
         oid = util.u64(oid)
-        r = self.query("SELECT tid FROM obj"
+        partition = self._getReadablePartition(oid)
+        r = self._shard(partition)("SELECT tid FROM obj"
                        " WHERE partition=? AND oid=?"
                        " ORDER BY tid DESC LIMIT 1",
-                       (self._getReadablePartition(oid), oid)).fetchone()
+                       (partition, oid)).fetchone()
         return r and util.p64(r[0])
 
     def _getNextTID(self, *args): # partition, oid, tid
-        r = self.query("""SELECT tid FROM obj
+        r = self._shard(args[0])("""SELECT tid FROM obj
                           WHERE partition=? AND oid=? AND tid>?
                           ORDER BY tid LIMIT 1""", args).fetchone()
         return r and r[0]
 
     def _getObject(self, oid, tid=None, before_tid=None):
-        q = self.query
         partition = self._getReadablePartition(oid)
-        sql = ('SELECT tid, compression, data.hash, value, value_tid'
-               ' FROM obj LEFT JOIN data ON obj.data_id = data.id'
-               ' WHERE partition=? AND oid=?')
+        q = self._shard(partition)
+        if self._partitioned:
+            # Data are in the main file.
+            sql = 'SELECT tid, data_id, value_tid FROM obj'
+        else:
+            sql = ('SELECT tid, compression, data.hash, value, value_tid'
+                   ' FROM obj LEFT JOIN data ON obj.data_id = data.id')
+        sql += ' WHERE partition=? AND oid=?'
         if tid is not None:
             r = q(sql + ' AND tid=?', (partition, oid, tid))
         elif before_tid is not None:
@@ -306,10 +503,15 @@ class SQLiteDatabaseManager(DatabaseManager):
                   (partition, oid, before_tid))
         else:
             r = q(sql + ' ORDER BY tid DESC LIMIT 1', (partition, oid))
-        try:
-            serial, compression, checksum, data, value_serial = r.fetchone()
-        except TypeError:
+        r = r.fetchone()
+        if not r:
             return None
+        if self._partitioned:
+            serial, data_id, value_serial = r
+            compression, checksum, data = (None, None, None) \
+                if data_id is None else self.loadData(data_id)
+        else:
+            serial, compression, checksum, data, value_serial = r
         if checksum:
             checksum = str(checksum)
             data = str(data)
@@ -333,35 +535,58 @@ class SQLiteDatabaseManager(DatabaseManager):
                   (offset, nid, int(state)))
 
     def dropPartitions(self, offset_list):
+        split = self._split
+        if self._partitioned and not split:
+            for partition in offset_list:
+                if partition in self._shard_dict:
+                    data_id_list = [x for x, in self._shard(partition)(
+                        "SELECT DISTINCT data_id FROM obj") if x]
+                    self._dropShard(partition)
+                    self._pruneData(data_id_list)
+            return
         where = " WHERE partition=?"
-        q = self.query
-        for partition in offset_list:
+        for offset in offset_list:
+            partition = self._getPartition(offset)
+            if self._partitioned and partition not in self._shard_dict:
+                continue
+            q = self._shard(partition)
             args = partition,
+            sql = where + self._splitCondition('oid', offset)
             data_id_list = [x for x, in
-                q("SELECT DISTINCT data_id FROM obj" + where, args) if x]
-            q("DELETE FROM obj" + where, args)
-            q("DELETE FROM trans" + where, args)
+                q("SELECT DISTINCT data_id FROM obj" + sql, args) if x]
+            q("DELETE FROM obj" + sql, args)
+            q("DELETE FROM trans" + where + self._splitCondition('tid', offset),
+              args)
             self._pruneData(data_id_list)
 
     def _getUnfinishedDataIdList(self):
         return [x for x, in self.query("SELECT data_id FROM tobj") if x]
 
     def dropPartitionsTemporary(self, offset_list=None):
-        where = "" if offset_list is None else \
-            " WHERE `partition` IN (%s)" % ','.join(map(str, offset_list))
         q = self.query
-        q("DELETE FROM tobj" + where)
-        q("DELETE FROM ttrans" + where)
+        if offset_list is None:
+            q("DELETE FROM tobj")
+            q("DELETE FROM ttrans")
+        elif self._split:
+            q("DELETE FROM tobj WHERE 1" + self._splitCondition(
+                'oid', *offset_list))
+            q("DELETE FROM ttrans WHERE 1" + self._splitCondition(
+                'ttid', *offset_list))
+        else:
+            where = " WHERE `partition` IN (%s)" % ','.join(
+                map(str, offset_list))
+            q("DELETE FROM tobj" + where)
+            q("DELETE FROM ttrans" + where)
 
     def storeTransaction(self, tid, object_list, transaction, temporary=True):
         u64 = util.u64
         tid = u64(tid)
         T = 't' if temporary else ''
         obj_sql = "INSERT OR FAIL INTO %sobj VALUES (?,?,?,?,?)" % T
-        q = self.query
         for oid, data_id, value_serial in object_list:
             oid = u64(oid)
             partition = self._getPartition(oid)
+            q = self._shard(partition, not temporary)
             if value_serial:
                 value_serial = u64(value_serial)
                 (data_id,), = q("SELECT data_id FROM obj"
@@ -369,6 +594,8 @@ class SQLiteDatabaseManager(DatabaseManager):
                     (partition, oid, value_serial))
                 if temporary:
                     self.holdData(data_id)
+            if temporary:
+                q = self.query
             try:
                 q(obj_sql, (partition, oid, tid, data_id, value_serial))
             except sqlite3.IntegrityError:
@@ -385,12 +612,19 @@ class SQLiteDatabaseManager(DatabaseManager):
             oid_list, user, desc, ext, packed, ttid = transaction
             partition = self._getPartition(tid)
             assert packed in (0, 1)
+            q = self.query if temporary else self._shard(partition, True)
             q("INSERT OR FAIL INTO %strans VALUES (?,?,?,?,?,?,?,?)" % T,
                 (partition, None if temporary else tid,
                  packed, buffer(''.join(oid_list)),
                  buffer(user), buffer(desc), buffer(ext), u64(ttid)))
 
     def getOrphanList(self):
+        if self._partitioned:
+            data_id_set = {x for x, in self.query("SELECT id FROM data")}
+            for q in self._shards():
+                data_id_set.difference_update(x for x, in q(
+                    "SELECT DISTINCT data_id FROM obj"))
+            return list(data_id_set)
         return [x for x, in self.query(
             "SELECT id FROM data LEFT JOIN obj ON (id=data_id)"
             " WHERE data_id IS NULL")]
@@ -398,10 +632,13 @@ class SQLiteDatabaseManager(DatabaseManager):
     def _pruneData(self, data_id_list):
         data_id_list = set(data_id_list).difference(self._uncommitted_data)
         if data_id_list:
+            for q in self._shards():
+                data_id_list.difference_update(x for x, in q(
+                    "SELECT DISTINCT data_id FROM obj WHERE data_id IN (%s)"
+                    % ",".join(map(str, data_id_list))))
+                if not data_id_list:
+                    return 0
             q = self.query
-            data_id_list.difference_update(x for x, in q(
-                "SELECT DISTINCT data_id FROM obj WHERE data_id IN (%s)"
-                % ",".join(map(str, data_id_list))))
             q("DELETE FROM data WHERE id IN (%s)"
               % ",".join(map(str, data_id_list)))
             return len(data_id_list)
@@ -428,19 +665,42 @@ class SQLiteDatabaseManager(DatabaseManager):
 
     def _getDataTID(self, oid, tid=None, before_tid=None):
         partition = self._getReadablePartition(oid)
+        q = self._shard(partition)
         sql = 'SELECT tid, value_tid FROM obj' \
               ' WHERE partition=? AND oid=?'
         if tid is not None:
-            r = self.query(sql + ' AND tid=?', (partition, oid, tid))
+            r = q(sql + ' AND tid=?', (partition, oid, tid))
         elif before_tid is not None:
-            r = self.query(sql + ' AND tid<? ORDER BY tid DESC LIMIT 1',
-                           (partition, oid, before_tid))
+            r = q(sql + ' AND tid<? ORDER BY tid DESC LIMIT 1',
+                  (partition, oid, before_tid))
         else:
-            r = self.query(sql + ' ORDER BY tid DESC LIMIT 1',
-                           (partition, oid))
+            r = q(sql + ' ORDER BY tid DESC LIMIT 1', (partition, oid))
         r = r.fetchone()
         return r or (None, None)
 
+    def _getDataTIDList(self, request_list):
+        # One compound query per partition, and at most 500 subqueries per
+        # query (default value of SQLITE_MAX_COMPOUND_SELECT).
+        result = [(None, None)] * len(request_list)
+        sql_dict = defaultdict(list)
+        for i, (oid, tid, before_tid) in enumerate(request_list):
+            partition = self._getReadablePartition(oid)
+            sql = 'partition=%d AND oid=%d' % (partition, oid)
+            if tid is not None:
+                sql += ' AND tid=%d' % tid
+            elif before_tid is not None:
+                sql += ' AND tid<%d' % before_tid
+            sql_dict[partition].append('SELECT * FROM (SELECT %d, tid,'
+                ' value_tid FROM obj WHERE %s ORDER BY tid DESC LIMIT 1)'
+                % (i, sql))
+        for partition, sql_list in sql_dict.iteritems():
+            q = self._shard(partition)
+            for j in xrange(0, len(sql_list), 500):
+                for i, tid, value_tid in q(
+                        ' UNION ALL '.join(sql_list[j:j+500])):
+                    result[i] = tid, value_tid
+        return result
+
     def lockTransaction(self, tid, ttid):
         u64 = util.u64
         self.query("UPDATE ttrans SET tid=? WHERE ttid=?",
@@ -454,10 +714,22 @@ class SQLiteDatabaseManager(DatabaseManager):
         ttid = u64(ttid)
         sql = " FROM tobj WHERE tid=?"
         data_id_list = [x for x, in q("SELECT data_id" + sql, (ttid,)) if x]
-        q("INSERT INTO obj SELECT partition, oid, ?, data_id, value_tid" + sql,
-          (tid, ttid))
+        if self._partitioned:
+            # Partition files are committed first. If interrupted, the
+            # transaction is unlocked again, hence the REPLACE.
+            shard = self._shard
+            for r in q("SELECT partition, oid, ?, data_id, value_tid" + sql,
+                       (tid, ttid)).fetchall():
+                shard(r[0], True)(
+                    "INSERT OR REPLACE INTO obj VALUES (?,?,?,?,?)", r)
+            for r in q("SELECT * FROM ttrans WHERE tid=?", (tid,)).fetchall():
+                shard(r[0], True)("INSERT OR REPLACE INTO trans"
+                            " VALUES (?,?,?,?,?,?,?,?)", r)
+        else:
+            q("INSERT INTO obj SELECT partition, oid, ?, data_id, value_tid"
+              + sql, (tid, ttid))
+            q("INSERT INTO trans SELECT * FROM ttrans WHERE tid=?", (tid,))
         q("DELETE" + sql, (ttid,))
-        q("INSERT INTO trans SELECT * FROM ttrans WHERE tid=?", (tid,))
         q("DELETE FROM ttrans WHERE tid=?", (tid,))
         self.releaseData(data_id_list)
 
@@ -469,8 +741,9 @@ class SQLiteDatabaseManager(DatabaseManager):
 
     def deleteTransaction(self, tid):
         tid = util.u64(tid)
-        self.query("DELETE FROM trans WHERE partition=? AND tid=?",
-            (self._getPartition(tid), tid))
+        partition = self._getPartition(tid)
+        self._shard(partition)("DELETE FROM trans WHERE partition=? AND tid=?",
+            (partition, tid))
 
     def deleteObject(self, oid, serial=None):
         oid = util.u64(oid)
@@ -479,7 +752,7 @@ class SQLiteDatabaseManager(DatabaseManager):
         if serial:
             sql += " AND tid=?"
             args.append(util.u64(serial))
-        q = self.query
+        q = self._shard(args[0])
         data_id_list = [x for x, in q("SELECT DISTINCT data_id" + sql, args)
                           if x]
         q("DELETE" + sql, args)
@@ -487,16 +760,17 @@ class SQLiteDatabaseManager(DatabaseManager):
 
     def _deleteRange(self, partition, min_tid=None, max_tid=None):
         sql = " WHERE partition=?"
-        args = [partition]
+        args = [self._getPartition(partition)]
         if min_tid:
             sql += " AND ? < tid"
             args.append(util.u64(min_tid))
         if max_tid:
             sql += " AND tid <= ?"
             args.append(util.u64(max_tid))
-        q = self.query
-        q("DELETE FROM trans" + sql, args)
-        sql = " FROM obj" + sql
+        q = self._shard(args[0])
+        q("DELETE FROM trans" + sql + self._splitCondition('tid', partition),
+          args)
+        sql = " FROM obj" + sql + self._splitCondition('oid', partition)
         data_id_list = [x for x, in q("SELECT DISTINCT data_id" + sql, args)
                           if x]
         q("DELETE" + sql, args)
@@ -504,12 +778,12 @@ class SQLiteDatabaseManager(DatabaseManager):
 
     def getTransaction(self, tid, all=False):
         tid = util.u64(tid)
-        q = self.query
-        r = q("SELECT oids, user, description, ext, packed, ttid"
-              " FROM trans WHERE partition=? AND tid=?",
-              (self._getReadablePartition(tid), tid)).fetchone()
+        partition = self._getReadablePartition(tid)
+        r = self._shard(partition)("SELECT oids, user, description, ext,"
+            " packed, ttid FROM trans WHERE partition=? AND tid=?",
+            (partition, tid)).fetchone()
         if not r and all:
-            r = q("SELECT oids, user, description, ext, packed, ttid"
+            r = self.query("SELECT oids, user, description, ext, packed, ttid"
                   " FROM ttrans WHERE tid=?", (tid,)).fetchone()
         if r:
             oids, user, description, ext, packed, ttid = r
@@ -522,43 +796,68 @@ class SQLiteDatabaseManager(DatabaseManager):
         # client's transaction.
         p64 = util.p64
         oid = util.u64(oid)
-        return [(p64(tid), length or 0) for tid, length in self.query("""\
-            SELECT tid, LENGTH(value)
-                FROM obj LEFT JOIN data ON obj.data_id = data.id
-                WHERE partition=? AND oid=? AND tid>=?
-                ORDER BY tid DESC LIMIT ?,?""",
-            (self._getReadablePartition(oid), oid,
-             self._getPackTID(), offset, length))
-            ] or None
+        partition = self._getReadablePartition(oid)
+        args = partition, oid, self._getPackTID(), offset, length
+        if self._partitioned:
+            r = self._shard(partition)("""\
+                SELECT tid, data_id FROM obj
+                    WHERE partition=? AND oid=? AND tid>=?
+                    ORDER BY tid DESC LIMIT ?,?""", args).fetchall()
+            data_id_list = [x for _, x in r if x]
+            if data_id_list:
+                length_dict = dict(self.query(
+                    "SELECT id, LENGTH(value) FROM data WHERE id IN (%s)"
+                    % ",".join(map(str, data_id_list))))
+                r = [(tid, length_dict.get(x)) for tid, x in r]
+        else:
+            r = self.query("""\
+                SELECT tid, LENGTH(value)
+                    FROM obj LEFT JOIN data ON obj.data_id = data.id
+                    WHERE partition=? AND oid=? AND tid>=?
+                    ORDER BY tid DESC LIMIT ?,?""", args)
+        return [(p64(tid), length or 0) for tid, length in r] or None
 
     def getReplicationObjectList(self, min_tid, max_tid, length, partition,
             min_oid):
         u64 = util.u64
         p64 = util.p64
         min_tid = u64(min_tid)
-        return [(p64(serial), p64(oid)) for serial, oid in self.query("""\
+        tag = self._getPartition(partition)
+        return [(p64(serial), p64(oid))
+            for serial, oid in self._shard(tag)("""\
             SELECT tid, oid FROM obj
             WHERE partition=? AND tid<=?
-            AND (tid=? AND ?<=oid OR ?<tid)
-            ORDER BY tid ASC, oid ASC LIMIT ?""",
-            (partition, u64(max_tid), min_tid, u64(min_oid), min_tid, length))]
+            AND (tid=? AND ?<=oid OR ?<tid)%s
+            ORDER BY tid ASC, oid ASC LIMIT ?"""
+            % self._splitCondition('oid', partition),
+            (tag, u64(max_tid), min_tid, u64(min_oid), min_tid, length))]
 
     def _getTIDList(self, offset, length, partition_list):
+        tag_list = set(map(self._getPartition, partition_list))
+        split = self._splitCondition('tid', *partition_list)
+        if self._partitioned:
+            return (-tid for tid in islice(merge(*(
+                (-tid for tid, in self._shard(partition)(
+                    "SELECT tid FROM trans WHERE partition=?%s"
+                    " ORDER BY tid DESC LIMIT %d" % (split, offset + length),
+                    (partition,)))
+                for partition in tag_list)), offset, offset + length))
         return (t[0] for t in self.query(
-            "SELECT tid FROM trans WHERE `partition` in (%s)"
+            "SELECT tid FROM trans WHERE `partition` in (%s)%s"
             " ORDER BY tid DESC LIMIT %d,%d"
-            % (','.join(map(str, partition_list)), offset, length)))
+            % (','.join(map(str, tag_list)), split, offset, length)))
 
     def getReplicationTIDList(self, min_tid, max_tid, length, partition):
         u64 = util.u64
         p64 = util.p64
         min_tid = u64(min_tid)
         max_tid = u64(max_tid)
-        return [p64(t[0]) for t in self.query("""\
+        tag = self._getPartition(partition)
+        return [p64(t[0]) for t in self._shard(tag)("""\
             SELECT tid FROM trans
-            WHERE partition=? AND ?<=tid AND tid<=?
-            ORDER BY tid ASC LIMIT ?""",
-            (partition, min_tid, max_tid, length))]
+            WHERE partition=? AND ?<=tid AND tid<=?%s
+            ORDER BY tid ASC LIMIT ?""" % self._splitCondition('tid', partition),
+            (tag, min_tid, max_tid, length))]
 
     def _updatePackFuture(self, oid, orig_serial, max_serial):
         # Before deleting this objects revision, see if there is any
@@ -567,8 +866,7 @@ class SQLiteDatabaseManager(DatabaseManager):
         # reference is just updated to point to the new data location.
         partition = self._getReadablePartition(oid)
         value_serial = None
-        q = self.query
-        for T in '', 't':
+        for T, q in ('', self._shard(partition)), ('t', self.query):
             update = """UPDATE OR FAIL %sobj SET value_tid=?
                          WHERE partition=? AND oid=? AND tid=?""" % T
             for serial, in q("""SELECT tid FROM %sobj
@@ -587,42 +885,80 @@ class SQLiteDatabaseManager(DatabaseManager):
         tid = util.u64(tid)
         updatePackFuture = self._updatePackFuture
         getPartition = self._getReadablePartition
-        q = self.query
         self._setPackTID(tid)
-        for count, oid, max_serial in q("SELECT COUNT(*) - 1, oid, MAX(tid)"
-                                        " FROM obj WHERE tid<=? GROUP BY oid",
-                                        (tid,)):
-            partition = getPartition(oid)
-            if q("SELECT 1 FROM obj WHERE partition=?"
-                 " AND oid=? AND tid=? AND data_id IS NULL",
-                 (partition, oid, max_serial)).fetchone():
-                max_serial += 1
-            elif not count:
-                continue
-            # There are things to delete for this object
-            data_id_set = set()
-            sql = " FROM obj WHERE partition=? AND oid=? AND tid<?"
-            args = partition, oid, max_serial
-            for serial, data_id in q("SELECT tid, data_id" + sql, args):
-                data_id_set.add(data_id)
-                new_serial = updatePackFuture(oid, serial, max_serial)
-                if new_serial:
-                    new_serial = p64(new_serial)
-                updateObjectDataForPack(p64(oid), p64(serial),
-                                        new_serial, data_id)
-            q("DELETE" + sql, args)
-            data_id_set.discard(None)
-            self._pruneData(data_id_set)
+        for q in self._shards():
+            for count, oid, max_serial in q(
+                    "SELECT COUNT(*) - 1, oid, MAX(tid)"
+                    " FROM obj WHERE tid<=? GROUP BY oid", (tid,)):
+                partition = getPartition(oid)
+                if q("SELECT 1 FROM obj WHERE partition=?"
+                     " AND oid=? AND tid=? AND data_id IS NULL",
+                     (partition, oid, max_serial)).fetchone():
+                    max_serial += 1
+                elif not count:
+                    continue
+                # There are things to delete for this object
+                data_id_set = set()
+                sql = " FROM obj WHERE partition=? AND oid=? AND tid<?"
+                args = partition, oid, max_serial
+                for serial, data_id in q("SELECT tid, data_id" + sql, args):
+                    data_id_set.add(data_id)
+                    new_serial = updatePackFuture(oid, serial, max_serial)
+                    if new_serial:
+                        new_serial = p64(new_serial)
+                    updateObjectDataForPack(p64(oid), p64(serial),
+                                            new_serial, data_id)
+                q("DELETE" + sql, args)
+                data_id_set.discard(None)
+                self._pruneData(data_id_set)
         self.commit()
 
+    def _getPartitionSize(self, partition, length, min_tid, min_oid):
+        u64 = util.u64
+        p64 = util.p64
+        min_tid = u64(min_tid)
+        tag = self._getPartition(partition)
+        sql = """ FROM obj%s
+            WHERE partition=? AND (tid=? AND ?<=oid OR ?<tid)%s
+            ORDER BY tid ASC, oid ASC LIMIT ?"""
+        args = tag, min_tid, u64(min_oid), min_tid, length
+        split = self._splitCondition('oid', partition)
+        if self._partitioned:
+            # 'data' is not in the same file, so no join is possible.
+            r = self._shard(tag)(
+                "SELECT tid, oid, data_id" + sql % ("", split),
+                args).fetchall()
+            count_dict = defaultdict(int)
+            for _, _, x in r:
+                if x:
+                    count_dict[x] += 1
+            data_id_list = list(count_dict)
+            size = 0
+            for i in xrange(0, len(data_id_list), 1000):
+                for data_id, n in self.query(
+                        "SELECT id, LENGTH(value) FROM data WHERE id IN (%s)"
+                        % ",".join(map(str, data_id_list[i:i+1000]))):
+                    size += n * count_dict[data_id]
+        else:
+            r = self.query("SELECT tid, oid, LENGTH(value)" + sql % (
+                " LEFT JOIN data ON obj.data_id = data.id", split),
+                args).fetchall()
+            size = sum(x for _, _, x in r if x)
+        if r:
+            tid, oid, _ = r[-1]
+            return len(r), size, (p64(tid), p64(oid))
+        return 0, 0, None
+
     def checkTIDRange(self, partition, length, min_tid, max_tid):
         # XXX: SQLite's GROUP_CONCAT is slow (looks like quadratic)
-        count, tids, max_tid = self.query("""\
+        tag = self._getPartition(partition)
+        count, tids, max_tid = self._shard(tag)("""\
             SELECT COUNT(*), GROUP_CONCAT(tid), MAX(tid)
             FROM (SELECT tid FROM trans
-                  WHERE partition=? AND ?<=tid AND tid<=?
-                  ORDER BY tid ASC LIMIT ?) AS t""",
-            (partition, util.u64(min_tid), util.u64(max_tid),
+                  WHERE partition=? AND ?<=tid AND tid<=?%s
+                  ORDER BY tid ASC LIMIT ?) AS t"""
+            % self._splitCondition('tid', partition),
+            (tag, util.u64(min_tid), util.u64(max_tid),
              -1 if length is None else length)).fetchone()
         if count:
             return count, sha1(tids).digest(), util.p64(max_tid)
@@ -635,12 +971,13 @@ class SQLiteDatabaseManager(DatabaseManager):
         # We would need a function (that could be named 'LAST') that returns the
         # last grouped value, instead of the greatest one.
         min_tid = u64(min_tid)
-        r = self.query("""\
+        tag = self._getPartition(partition)
+        r = self._shard(tag)("""\
             SELECT tid, oid
             FROM obj
-            WHERE partition=? AND tid<=? AND (tid>? OR tid=? AND oid>=?)
-            ORDER BY tid, oid LIMIT ?""",
-            (partition, u64(max_tid), min_tid, min_tid, u64(min_oid),
+            WHERE partition=? AND tid<=? AND (tid>? OR tid=? AND oid>=?)%s
+            ORDER BY tid, oid LIMIT ?""" % self._splitCondition('oid', partition),
+            (tag, u64(max_tid), min_tid, min_tid, u64(min_oid),
              -1 if length is None else length)).fetchall()
         if r:
             p64 = util.p64
@@ -64,6 +64,9 @@ class BaseMasterHandler(BaseHandler):
                         uuid_str(uuid))
                 self.app.tm.abortFor(uuid)
 
+    def notifyCompression(self, conn, codec_list):
+        self.app.compression_set = frozenset(codec_list)
+
     def notifyPartitionChanges(self, conn, ptid, cell_list):
         """This is very similar to Send Partition Table, except that
        the information is only about changes from the previous."""
@@ -76,6 +79,24 @@ class BaseMasterHandler(BaseHandler):
             app.replicator.notifyPartitionChanges(cell_list)
         app.dm.commit()
 
+    def notifyPartitionSplit(self, conn, ptid, num_partitions):
+        app = self.app
+        pt = app.pt
+        if ptid != 1 + pt.getID():
+            raise ProtocolError('wrong partition table id')
+        np = pt.getPartitions()
+        pt.split(ptid, num_partitions)
+        app.dm.splitPartitions(ptid, num_partitions)
+        app.tm.split(num_partitions)
+        if app.operational:
+            app.replicator.split(np, num_partitions)
+            app.newTask(app.reportPartitionSizes())
+
+    def askStats(self, conn):
+        app = self.app
+        conn.answer(Packets.AnswerStats(
+            [(app.uuid, app.em.stats.getSampleList())]))
+
     def askFinalTID(self, conn, ttid):
         conn.answer(Packets.AnswerFinalTID(self.app.dm.getFinalTID(ttid)))
 
@@ -18,7 +18,7 @@ from neo.lib import logging
 from neo.lib.handler import DelayEvent
 from neo.lib.util import dump, makeChecksum, add64
 from neo.lib.protocol import Packets, Errors, NonReadableCell, ProtocolError, \
-    ZERO_HASH, INVALID_PARTITION
+    ZERO_HASH, ZERO_OID, INVALID_PARTITION
 from ..transactions import ConflictError, NotRegisteredError
 from . import BaseHandler
 import time
@@ -27,6 +27,10 @@ import time
 # Set to None to disable.
 SLOW_STORE = 2
 
+# Maximum size of data returned at once by AskTransactionRecords
+# (at least 1 record is always returned).
+RECORDS_MAX_SIZE = 1 << 22
+
 class ClientOperationHandler(BaseHandler):
 
     def askTransactionInformation(self, conn, tid):
@@ -95,14 +99,13 @@ class ClientOperationHandler(BaseHandler):
 
     def askStoreObject(self, conn, oid, serial,
             compression, checksum, data, data_serial, ttid):
-        if 1 < compression:
+        if compression not in self.app.compression_set:
             raise ProtocolError('invalid compression value')
         # register the transaction
         self.app.tm.register(conn, ttid)
         if data or checksum != ZERO_HASH:
             # TODO: return an appropriate error packet
             assert makeChecksum(data) == checksum
-            assert data_serial is None
         else:
             checksum = data = None
         try:
@@ -114,6 +117,39 @@ class ClientOperationHandler(BaseHandler):
                 compression, checksum, data, data_serial, ttid, time.time()),
             *e.args)
 
+    def _askRestoreObject(self, conn, oid, compression, checksum, data,
+            data_serial, ttid):
+        try:
+            self.app.tm.restoreObject(ttid, oid, compression,
+                    checksum, data, data_serial)
+        except NonReadableCell:
+            logging.info('Ignore restore of %s by %s: unassigned partition',
+                dump(oid), dump(ttid))
+        except NotRegisteredError:
+            # transaction was aborted, cancel this event
+            logging.info('Forget restore of %s by %s delayed by %s',
+                    dump(oid), dump(ttid),
+                    dump(self.app.tm.getLockingTID(oid)))
+        conn.answer(Packets.AnswerRestoreObject())
+
+    def askRestoreObject(self, conn, oid,
+            compression, checksum, data, data_serial, ttid):
+        if compression not in self.app.compression_set:
+            raise ProtocolError('invalid compression value')
+        self.app.tm.register(conn, ttid)
+        if data or checksum != ZERO_HASH:
+            # TODO: return an appropriate error packet
+            assert makeChecksum(data) == checksum
+        else:
+            checksum = data = None
+        args = oid, compression, checksum, data, data_serial, ttid
+        try:
+            self._askRestoreObject(conn, *args)
+        except DelayEvent, e:
+            # locked by a previous transaction, retry later
+            self.app.tm.queueEvent(self._askRestoreObject, conn, args,
+                                   *e.args)
+
     def askRebaseTransaction(self, conn, *args):
         conn.answer(Packets.AnswerRebaseTransaction(
             self.app.tm.rebase(conn, *args)))
@@ -134,10 +170,64 @@ class ClientOperationHandler(BaseHandler):
                 logging.info('RebaseObject delay: %.02fs', duration)
         conn.answer(Packets.AnswerRebaseObject(conflict))
 
-    def askTIDsFrom(self, conn, min_tid, max_tid, length, partition):
+    def _checkNumPartitions(self, num_partitions):
+        # Requests for a partition are built by the client for a given number
+        # of partitions. Answering them after a split, whether the client or
+        # this node is not notified yet, would silently miss data: the client
+        # retries instead, with the new number of partitions.
+        if num_partitions != self.app.pt.getPartitions():
+            raise NonReadableCell
+
+    def askTIDsFrom(self, conn, min_tid, max_tid, length, partition,
+                    num_partitions):
+        self._checkNumPartitions(num_partitions)
         conn.answer(Packets.AnswerTIDsFrom(self.app.dm.getReplicationTIDList(
             min_tid, max_tid, length, partition)))
 
+    def askTransactionRecords(self, conn, partition, num_partitions, length,
+                              min_tid, max_tid, min_oid):
+        self._checkNumPartitions(num_partitions)
+        app = self.app
+        if app.tm.isLockedTid(max_tid):
+            # Transactions are still in ttrans/tobj.
+            raise DelayEvent
+        dm = app.dm
+        tid_list = dm.getReplicationTIDList(min_tid, max_tid, length + 1,
+            partition)
+        if length < len(tid_list):
+            next_tid = tid_list.pop()
+            next_oid = ZERO_OID
+            max_tid = add64(next_tid, -1)
+        else:
+            next_tid = next_oid = None
+        object_list = []
+        size = 0
+        for serial, oid in dm.getReplicationObjectList(
+                min_tid, max_tid, length + 1, partition, min_oid):
+            if length <= len(object_list) or RECORDS_MAX_SIZE <= size:
+                next_tid = serial
+                next_oid = oid
+                break
+            o = dm.getObject(oid, serial)
+            if o:
+                _, _, compression, checksum, data, data_serial = o
+                if checksum is None:
+                    checksum = ZERO_HASH
+                    data = ''
+                size += len(data)
+                object_list.append((oid, serial, compression, checksum,
+                                    data, data_serial))
+        txn_list = []
+        for tid in tid_list:
+            if None is not next_tid <= tid:
+                break
+            t = dm.getTransaction(tid)
+            if t:
+                oid_list, user, desc, ext, packed, _ = t
+                txn_list.append((tid, user, desc, ext, packed, oid_list))
+        conn.answer(Packets.AnswerTransactionRecords(
+            txn_list, object_list, next_tid, next_oid))
+
     def _askTIDs(self, first, last, partition):
         # This method is complicated, because I must return TIDs only
         # about usable partitions assigned to me.
@@ -160,16 +250,13 @@ class ClientOperationHandler(BaseHandler):
 
     def askObjectUndoSerial(self, conn, ttid, ltid, undone_tid, oid_list):
         app = self.app
-        findUndoTID = app.dm.findUndoTID
         getObjectFromTransaction = app.tm.getObjectFromTransaction
-        object_tid_dict = {}
+        object_tid_dict = app.dm.findUndoTIDDict(ttid, ltid, undone_tid,
+            {oid: getObjectFromTransaction(ttid, oid) for oid in oid_list})
         for oid in oid_list:
-            current_serial, undo_serial, is_current = findUndoTID(oid, ttid,
-                ltid, undone_tid, getObjectFromTransaction(ttid, oid))
-            if current_serial is None:
+            if object_tid_dict[oid][0] is None:
                 p = Errors.OidNotFound(dump(oid))
                 break
-            object_tid_dict[oid] = (current_serial, undo_serial, is_current)
         else:
             p = Packets.AnswerObjectUndoSerial(object_tid_dict)
         conn.answer(p)
@@ -229,6 +316,7 @@ class ClientReadOnlyOperationHandler(ClientOperationHandler):
     askStoreTransaction     = _readOnly
     askVoteTransaction      = _readOnly
     askStoreObject          = _readOnly
+    askRestoreObject        = _readOnly
     askFinalTID             = _readOnly
     askRebaseObject         = _readOnly
     askRebaseTransaction    = _readOnly
@@ -263,13 +351,21 @@ class ClientReadOnlyOperationHandler(ClientOperationHandler):
         super(ClientReadOnlyOperationHandler, self).askObject(
             conn, oid, serial, tid)
 
-    def askTIDsFrom(self, conn, min_tid, max_tid, length, partition):
+    def askTIDsFrom(self, conn, min_tid, max_tid, length, partition,
+                    num_partitions):
         backup_tid = self.app.dm.getBackupTID()
         max_tid = min(max_tid, backup_tid)
         # NOTE we don't need to adjust min_tid: if min_tid > max_tid
         #      db.getReplicationTIDList will return empty [], which is correct
         super(ClientReadOnlyOperationHandler, self).askTIDsFrom(
-                conn, min_tid, max_tid, length, partition)
+                conn, min_tid, max_tid, length, partition, num_partitions)
+
+    def askTransactionRecords(self, conn, partition, num_partitions, length,
+                              min_tid, max_tid, min_oid):
+        max_tid = min(max_tid, self.app.dm.getBackupTID())
+        super(ClientReadOnlyOperationHandler, self).askTransactionRecords(
+            conn, partition, num_partitions, length, min_tid, max_tid,
+            min_oid)
 
     def askTIDs(self, conn, first, last, partition):
         backup_tid = self.app.dm.getBackupTID()
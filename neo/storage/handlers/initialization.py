@@ -35,16 +35,15 @@ class InitializationHandler(BaseMasterHandler):
                 cell_list.append((offset, cell.getUUID(), cell.getState()))
                 if cell.getUUID() == app.uuid:
                     unassigned_set.remove(offset)
-        # delete objects database
         dm = app.dm
+        dm.changePartitionTable(ptid, cell_list, reset=True)
+        # delete objects database
         if unassigned_set:
           if app.disable_drop_partitions:
             logging.info("don't drop data for partitions %r", unassigned_set)
           else:
             logging.debug('drop data for partitions %r', unassigned_set)
             dm.dropPartitions(unassigned_set)
-
-        dm.changePartitionTable(ptid, cell_list, reset=True)
         dm.commit()
 
     def truncate(self, conn, tid):
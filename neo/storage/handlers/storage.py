@@ -52,16 +52,15 @@ class StorageOperationHandler(EventHandler):
             else:
                 node = app.nm.getByAddress(conn.getAddress())
                 node.setUnknown()
-            replicator = app.replicator
-            if replicator.current_node is node:
-                replicator.abort()
+            app.replicator.nodeLost(node)
             app.checker.connectionLost(conn)
 
     # Client
 
     def connectionFailed(self, conn):
-        if self.app.operational:
-            self.app.replicator.abort()
+        app = self.app
+        if app.operational:
+            app.replicator.nodeLost(app.nm.getByAddress(conn.getAddress()))
 
     def _acceptIdentification(self, node, *args):
         self.app.replicator.connected(node)
@@ -86,7 +85,9 @@ class StorageOperationHandler(EventHandler):
     def addTransaction(self, conn, tid, user, desc, ext, packed, ttid,
                                    oid_list):
         # Directly store the transaction.
-        self.app.dm.storeTransaction(tid, (),
+        app = self.app
+        app.em.stats.inc('neo_replicated_transactions_total')
+        app.dm.storeTransaction(tid, (),
             (oid_list, user, desc, ext, packed, ttid), False)
 
     @checkConnectionIsReplicatorConnection
@@ -111,7 +112,11 @@ class StorageOperationHandler(EventHandler):
     @checkConnectionIsReplicatorConnection
     def addObject(self, conn, oid, serial, compression,
                               checksum, data, data_serial):
-        dm = self.app.dm
+        app = self.app
+        inc = app.em.stats.inc
+        inc('neo_replicated_objects_total')
+        inc('neo_replicated_bytes_total', len(data))
+        dm = app.dm
         if data or checksum != ZERO_HASH:
             data_id = dm.storeData(checksum, data, compression)
         else:
@@ -25,7 +25,10 @@ bringing it up-to-date. This happens in the following cases:
   (note that in this case, the cell is always marked as UP_TO_DATE).
 
 Replication happens per partition. Reference node can change between
-partitions.
+partitions. Internal replication is done one partition at a time, whereas
+several partitions can be replicated at the same time from an upstream
+cluster (see --backup-replications option of storage nodes), so that a
+constantly modified partition does not prevent other ones to be backed up.
 
 2 parts, done sequentially:
 - Transaction (metadata) replication
@@ -109,28 +112,52 @@ class Partition(object):
                                                       if hasattr(self, x)),
             id(self))
 
-class Replicator(object):
+class Replication(object):
+    """Replication of a partition from a node, that is in progress"""
 
     # When the replication of a partition is aborted, the connection to the
     # feeding node may still be open, e.g. on PT update from the master. In
     # such case, replication is also aborted on the other side but there may
-    # be a few incoming packets that must be discarded.
-    _conn_msg_id = None
+    # be a few incoming packets that must be discarded: 'msg_id' is the id of
+    # the last request, and it is None until the node is identified.
+    __slots__ = 'offset', 'node', 'upstream', 'msg_id', 'tid'
+
+    __repr__ = Partition.__repr__.im_func
+
+    def __init__(self, offset, node, upstream):
+        self.offset = offset
+        self.node = node
+        self.upstream = upstream
+        self.msg_id = self.tid = None
+
+    def getConnection(self):
+        node = self.node
+        if node.isConnected(True):
+            return node.getConnection()
+
+class Replicator(object):
 
-    current_node = None
-    current_partition = None
+    # Replication for which a packet is being processed,
+    # as selected by isReplicatingConnection.
+    current = None
 
     def __init__(self, app):
         self.app = app
+        self.replication_dict = {}
 
-    def getCurrentConnection(self):
-        node = self.current_node
-        if node is not None and node.isConnected(True):
-            return node.getConnection()
+    def isUsingConnection(self, conn):
+        for r in self.replication_dict.itervalues():
+            if r.getConnection() is conn:
+                return True
+        return False
 
     def isReplicatingConnection(self, conn):
-        return conn is self.getCurrentConnection() and \
-            conn.getPeerId() == self._conn_msg_id
+        msg_id = conn.getPeerId()
+        for r in self.replication_dict.itervalues():
+            if r.msg_id == msg_id and r.getConnection() is conn:
+                self.current = r
+                return True
+        return False
 
     def setUnfinishedTIDList(self, max_tid, ttid_list, offset_list):
         """This is a callback from MasterOperationHandler."""
@@ -165,7 +192,7 @@ class Replicator(object):
                     self.replicate_dict[offset] = max_tid
                 if p.max_ttid < min_ttid:
                     # no more unfinished transaction for this partition
-                    if not (offset == self.current_partition
+                    if not (offset in self.replication_dict
                             or offset in self.replicate_dict):
                         logging.debug(
                             "All unfinished transactions have been aborted."
@@ -229,9 +256,24 @@ class Replicator(object):
         if outdated_list:
             self.app.tm.replicating(outdated_list)
 
+    def split(self, np, num_partitions):
+        """This is a callback from MasterOperationHandler.
+
+        All cells are readable when the partition table is split, so that new
+        partitions simply continue where the ones they come from are.
+        """
+        partition_dict = self.partition_dict
+        for offset, p in partition_dict.items():
+            assert p.max_ttid is None and offset not in self.replicate_dict, p
+            for i in xrange(offset + np, num_partitions, np):
+                partition_dict[i] = x = Partition()
+                x.next_trans = p.next_trans
+                x.next_obj = p.next_obj
+                x.max_ttid = None
+
     def notifyPartitionChanges(self, cell_list):
         """This is a callback from MasterOperationHandler."""
-        abort = False
+        abort_list = []
         added_list = []
         discarded_list = []
         readable_list = []
@@ -246,7 +288,8 @@ class Replicator(object):
                         continue
                     self.replicate_dict.pop(offset, None)
                     self.source_dict.pop(offset, None)
-                    abort = abort or self.current_partition == offset
+                    if offset in self.replication_dict:
+                        abort_list.append(offset)
                     discarded_list.append(offset)
                 elif state == CellStates.OUT_OF_DATE:
                     assert offset not in self.partition_dict
@@ -269,8 +312,11 @@ class Replicator(object):
             tm.discarded(discarded_list)
         if readable_list:
             tm.readable(readable_list)
-        if abort:
-            self.abort()
+            app.newTask(app.reportPartitionSizes(readable_list))
+        for offset in abort_list:
+            r = self.replication_dict.get(offset)
+            if r is not None:
+                self._abort(r)
 
     def backup(self, tid, source_dict):
         next_tid = None
@@ -278,7 +324,7 @@ class Replicator(object):
             if source:
                 self.source_dict[offset] = source
                 self.replicate_dict[offset] = tid
-            elif offset != self.current_partition and \
+            elif offset not in self.replication_dict and \
                  offset not in self.replicate_dict:
                 # The master did its best to avoid useless replication orders
                 # but there may still be a few, and we may receive redundant
@@ -306,58 +352,73 @@ class Replicator(object):
         #        time/bandwidth and replication is actually never finished.
         #      - When all storages of a non-backup cluster are up-to-date,
         #        there's no reason to keep any connection open.
-        if self.current_partition is not None or not self.replicate_dict:
-            return
         app = self.app
-        assert app.master_conn and app.operational, (
-            app.master_conn, app.operational)
-        # Start replicating the partition which is furthest behind,
-        # to increase the overall backup_tid as soon as possible.
-        # Then prefer a partition with no unfinished transaction.
-        # XXX: When leaving backup mode, we should only consider UP_TO_DATE
-        #      cells.
-        offset = min(self.replicate_dict, key=self._nextPartitionSortKey)
-        try:
-            addr, name = self.source_dict[offset]
-        except KeyError:
-            assert app.pt.getCell(offset, app.uuid).isOutOfDate(), (
-                offset, app.pt.getCell(offset, app.uuid).getState())
-            node = random.choice([cell.getNode()
-                for cell in app.pt.getCellList(offset, readable=True)
-                if cell.getNodeState() == NodeStates.RUNNING])
-            name = None
-        else:
-            node = app.nm.getByAddress(addr)
-            if node is None:
-                assert name, addr
-                node = app.nm.createStorage(address=addr)
-        self.current_partition = offset
-        previous_node = self.current_node
-        self.current_node = node
-        if node.isConnected(connecting=True):
-            if node.isIdentified():
-                node.getConnection().asClient()
-                self.fetchTransactions()
-        else:
-            assert name or node.getUUID() != app.uuid, "loopback connection"
-            conn = ClientConnection(app, StorageOperationHandler(app), node)
+        replication_dict = self.replication_dict
+        while self.replicate_dict:
+            upstream = sum(r.upstream for r in replication_dict.itervalues())
+            internal = len(replication_dict) - upstream
+            offset_list = []
+            for offset in self.replicate_dict:
+                if offset not in replication_dict and (
+                        upstream < app.backup_replications
+                        if self.source_dict.get(offset, (None, None))[1] else
+                        not internal):
+                    offset_list.append(offset)
+            if not offset_list:
+                break
+            assert app.master_conn and app.operational, (
+                app.master_conn, app.operational)
+            # Start replicating the partition which is furthest behind
+            # (i.e. with the largest gap to the tid to replicate),
+            # to increase the overall backup_tid as soon as possible.
+            # Then prefer a partition with no unfinished transaction.
+            # XXX: When leaving backup mode, we should only consider UP_TO_DATE
+            #      cells.
+            offset = min(offset_list, key=self._nextPartitionSortKey)
             try:
-                conn.ask(Packets.RequestIdentification(NodeTypes.STORAGE,
-                    None if name else app.uuid, app.server, name or app.name,
-                    app.id_timestamp))
-            except ConnectionClosed:
-                if previous_node is self.current_node:
-                    return
-        if previous_node is not None and previous_node.isConnected():
-            app.closeClient(previous_node.getConnection())
+                addr, name = self.source_dict[offset]
+            except KeyError:
+                assert app.pt.getCell(offset, app.uuid).isOutOfDate(), (
+                    offset, app.pt.getCell(offset, app.uuid).getState())
+                node = random.choice([cell.getNode()
+                    for cell in app.pt.getCellList(offset, readable=True)
+                    if cell.getNodeState() == NodeStates.RUNNING])
+                name = None
+            else:
+                node = app.nm.getByAddress(addr)
+                if node is None:
+                    assert name, addr
+                    node = app.nm.createStorage(address=addr)
+            replication_dict[offset] = r = Replication(offset, node, bool(name))
+            if node.isConnected(connecting=True):
+                if node.isIdentified():
+                    node.getConnection().asClient()
+                    self.current = r
+                    self.fetchTransactions()
+            else:
+                assert name or node.getUUID() != app.uuid, "loopback connection"
+                conn = ClientConnection(app, StorageOperationHandler(app), node)
+                try:
+                    conn.ask(Packets.RequestIdentification(NodeTypes.STORAGE,
+                        None if name else app.uuid, app.server, name or app.name,
+                        app.id_timestamp))
+                except ConnectionClosed:
+                    # The replication was aborted and
+                    # other partitions were considered.
+                    break
 
     def connected(self, node):
-        if self.current_node is node and self.current_partition is not None:
-            self.fetchTransactions()
+        for r in self.replication_dict.values():
+            if r.node is node and r.msg_id is None and \
+               self.replication_dict.get(r.offset) is r:
+                self.current = r
+                self.fetchTransactions()
 
     def fetchTransactions(self, min_tid=None):
-        assert self.current_node.getConnection().isClient(), self.current_node
-        offset = self.current_partition
+        r = self.current
+        node = r.node
+        assert node.getConnection().isClient(), node
+        offset = r.offset
         p = self.partition_dict[offset]
         if min_tid:
             p.next_trans = min_tid
@@ -367,23 +428,24 @@ class Replicator(object):
             except KeyError:
                 pass
             else:
-                if addr != self.current_node.getAddress():
+                if addr != node.getAddress():
                     return self.abort()
             min_tid = p.next_trans
-            self.replicate_tid = self.replicate_dict.pop(offset)
+            r.tid = self.replicate_dict.pop(offset)
             logging.debug("starting replication of <partition=%u"
                 " min_tid=%s max_tid=%s> from %r", offset, dump(min_tid),
-                dump(self.replicate_tid), self.current_node)
-        max_tid = self.replicate_tid
+                dump(r.tid), node)
+        max_tid = r.tid
         tid_list = self.app.dm.getReplicationTIDList(min_tid, max_tid,
             FETCH_COUNT, offset)
-        self._conn_msg_id = self.current_node.ask(Packets.AskFetchTransactions(
+        r.msg_id = node.ask(Packets.AskFetchTransactions(
             offset, FETCH_COUNT, min_tid, max_tid, tid_list))
 
     def fetchObjects(self, min_tid=None, min_oid=ZERO_OID):
-        offset = self.current_partition
+        r = self.current
+        offset = r.offset
         p = self.partition_dict[offset]
-        max_tid = self.replicate_tid
+        max_tid = r.tid
         if min_tid:
             p.next_obj = min_tid
         else:
@@ -396,13 +458,14 @@ class Replicator(object):
                 object_dict[serial].append(oid)
             except KeyError:
                 object_dict[serial] = [oid]
-        self._conn_msg_id = self.current_node.ask(Packets.AskFetchObjects(
+        r.msg_id = r.node.ask(Packets.AskFetchObjects(
             offset, FETCH_COUNT, min_tid, max_tid, min_oid, object_dict))
 
     def finish(self):
-        offset = self.current_partition
-        tid = self.replicate_tid
-        del self.current_partition, self._conn_msg_id, self.replicate_tid
+        r = self.current
+        del self.current, self.replication_dict[r.offset]
+        offset = r.offset
+        tid = r.tid
         p = self.partition_dict[offset]
         p.next_obj = add64(tid, 1)
         self.updateBackupTID()
@@ -412,45 +475,55 @@ class Replicator(object):
         else:
             self.app.tm.replicated(offset, tid)
         logging.debug("partition %u replicated up to %s from %r",
-                      offset, dump(tid), self.current_node)
-        self.getCurrentConnection().setReconnectionNoDelay()
+                      offset, dump(tid), r.node)
+        conn = r.getConnection()
+        conn.setReconnectionNoDelay()
         self._nextPartition()
+        if not self.isUsingConnection(conn):
+            self.app.closeClient(conn)
 
     def abort(self, message=''):
-        offset = self.current_partition
-        if offset is None:
-            return
-        del self.current_partition
-        self._conn_msg_id = None
+        r = self.current
+        if r is not None:
+            self._abort(r, message)
+
+    def nodeLost(self, node):
+        for r in self.replication_dict.values():
+            if r.node is node and self.replication_dict.get(r.offset) is r:
+                self._abort(r)
+
+    def _abort(self, r, message=''):
+        offset = r.offset
+        conn = r.getConnection()
+        del self.replication_dict[offset]
+        if self.current is r:
+            del self.current
         logging.warning('replication aborted for partition %u%s',
                         offset, message and ' (%s)' % message)
         if offset in self.partition_dict:
             # XXX: Try another partition if possible, to increase probability to
             #      connect to another node. It would be better to explicitly
             #      search for another node instead.
-            tid = self.replicate_dict.pop(offset, None) or self.replicate_tid
-            if self.replicate_dict:
-                self._nextPartition()
-                self.replicate_dict[offset] = tid
-            else:
-                self.replicate_dict[offset] = tid
-                self._nextPartition()
-        else: # partition removed
+            tid = self.replicate_dict.pop(offset, None) or r.tid
             self._nextPartition()
+            self.replicate_dict[offset] = tid
+        self._nextPartition()
+        if conn is not None and not self.isUsingConnection(conn):
+            self.app.closeClient(conn)
 
     def stop(self):
         # Close any open connection to an upstream storage,
-        # possibly aborting current replication.
-        node = self.current_node
-        if node is not None is node.getUUID():
-            offset = self.current_partition
-            if offset is not None:
+        # possibly aborting current replications.
+        for offset, r in self.replication_dict.items():
+            if r.upstream:
                 logging.info('cancel replication of partition %u', offset)
-                del self.current_partition
-                if self._conn_msg_id is not None:
-                    self.replicate_dict.setdefault(offset, self.replicate_tid)
-                    del self._conn_msg_id, self.replicate_tid
-                self.getCurrentConnection().close()
+                del self.replication_dict[offset]
+                if r.msg_id is not None:
+                    self.replicate_dict.setdefault(offset, r.tid)
+        self.current = None
+        for node in self.app.nm.getStorageList():
+            if node.getUUID() is None and node.isConnected(True):
+                node.getConnection().close()
         # Cancel all replication orders from upstream cluster.
         for offset in self.replicate_dict.keys():
             addr, name = self.source_dict.get(offset, (None, None))
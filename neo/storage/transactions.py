@@ -17,7 +17,7 @@
 from time import time
 from neo.lib import logging
 from neo.lib.handler import DelayEvent, EventQueue
-from neo.lib.util import dump
+from neo.lib.util import dump, u64
 from neo.lib.protocol import Packets, ProtocolError, NonReadableCell, \
     uuid_str, MAX_TID
 
@@ -96,8 +96,11 @@ class TransactionManager(EventQueue):
         self._load_lock_dict = {}
         self._replicated = {}
         self._replicating = set()
+        self.split(app.pt.getPartitions())
+
+    def split(self, np):
+        """Called when the partition table is split"""
         from neo.lib.util import u64
-        np = app.pt.getPartitions()
         self.getPartition = lambda oid: u64(oid) % np
 
     def discarded(self, offset_list):
@@ -314,13 +317,16 @@ class TransactionManager(EventQueue):
             Unlock transaction
         """
         try:
-            tid = self._transaction_dict[ttid].tid
+            transaction = self._transaction_dict[ttid]
         except KeyError:
             raise ProtocolError("unknown ttid %s" % dump(ttid))
+        tid = transaction.tid
         logging.debug('Unlock TXN %s (ttid=%s)', dump(tid), dump(ttid))
-        dm = self._app.dm
+        app = self._app
+        dm = app.dm
         dm.unlockTransaction(tid, ttid)
-        self._app.em.setTimeout(time() + 1, dm.deferCommit())
+        app.em.setTimeout(time() + 1, dm.deferCommit())
+        app.countObjects(transaction.store_dict)
         self.abort(ttid, even_if_locked=True)
 
     def getFinalTID(self, ttid):
@@ -473,6 +479,50 @@ class TransactionManager(EventQueue):
             data_id = self._app.dm.holdData(checksum, data, compression)
         transaction.store(oid, data_id, value_serial)
 
+    def restoreObject(self, ttid, oid, compression, checksum, data,
+            value_serial):
+        """
+            Store an object that is restored with its original tid
+
+            There's no conflict detection: the client restores transactions
+            in tid order and the store lock is only taken to serialize
+            transactions modifying the same object.
+            Raises:
+                DelayEvent
+                NonReadableCell
+        """
+        try:
+            transaction = self._transaction_dict[ttid]
+        except KeyError:
+            raise NotRegisteredError
+        if self.getPartition(oid) in self._replicating:
+            # See lockObject.
+            transaction.lockless.add(oid)
+        else:
+            app = self._app
+            if not app.pt.isAssigned(oid, app.uuid):
+                raise NonReadableCell
+            locked = self._store_lock_dict.get(oid)
+            if locked != ttid:
+                if locked:
+                    transaction.logDelay(ttid, locked, (oid, None))
+                    raise DelayEvent(transaction)
+                self._store_lock_dict[oid] = ttid
+        transaction.serial_dict[oid] = None
+        if data is None:
+            data_id = None
+        else:
+            dm = self._app.dm
+            if value_serial and dm._getDataTID(
+                    u64(oid), u64(value_serial))[0] is not None:
+                data_id = None
+            else:
+                # The back-pointer is only a hint and the revision it points
+                # to is not here, so keep the data sent by the client.
+                value_serial = None
+                data_id = dm.holdData(checksum, data, compression)
+        transaction.store(oid, data_id, value_serial)
+
     def rebaseObject(self, ttid, oid):
         try:
             transaction = self._transaction_dict[ttid]
@@ -20,6 +20,7 @@ import functools
 import gc
 import os
 import random
+import shutil
 import socket
 import sys
 import tempfile
@@ -227,6 +228,13 @@ class NeoUnitTestBase(NeoTestBase):
                 except OSError, e:
                     if e.errno != errno.ENOENT:
                         raise
+        elif adapter == 'Log':
+            temp_dir = getTempDirectory()
+            for i in xrange(number):
+                shutil.rmtree(os.path.join(temp_dir,
+                    '%s%s.neolog' % (prefix, i)), True)
+        elif adapter == 'Memory':
+            pass
         else:
             assert False, adapter
 
@@ -255,6 +263,10 @@ class NeoUnitTestBase(NeoTestBase):
             db = '%s@%s%s%s' % (DB_USER, prefix, index, DB_SOCKET)
         elif adapter == 'SQLite':
             db = os.path.join(getTempDirectory(), 'test_neo%s.sqlite' % index)
+        elif adapter == 'Log':
+            db = os.path.join(getTempDirectory(), 'test_neo%s.neolog' % index)
+        elif adapter == 'Memory':
+            db = ''
         else:
             assert False, adapter
         return Mock({
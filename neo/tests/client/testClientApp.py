@@ -14,13 +14,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import unittest
+import os, unittest
 from ..mock import Mock
 from ZODB.POSException import StorageTransactionError
-from .. import NeoUnitTestBase, buildUrlFromString
+from .. import NeoUnitTestBase, buildUrlFromString, getTempDirectory
 from neo.client.app import Application
-from neo.client.cache import test as testCache
+from neo.client.cache import ClientCache, POLICY_DICT, replay, \
+    test as testCache
 from neo.client.exception import NEOStorageError
+from neo.client.hostcache import HostCache
 
 class ClientApplicationTests(NeoUnitTestBase):
 
@@ -69,6 +71,95 @@ class ClientApplicationTests(NeoUnitTestBase):
 
     testCache = testCache
 
+    def testCacheTrace(self):
+        cache_trace = os.path.join(getTempDirectory(), 'cache.trace')
+        oid1, oid2 = map(self.makeOID, (1, 2))
+        tid1, tid2, tid3 = map(self.makeTID, (1, 2, 3))
+        cache = ClientCache(max_size=100, trace=cache_trace)
+        cache.load(oid1)
+        cache.store(oid1, 'a' * 40, tid1, None)
+        cache.load(oid1)
+        cache.load(oid2)
+        cache.store(oid2, 'b' * 40, tid1, None)
+        cache.invalidate(oid1, tid2)
+        cache.load(oid1, tid2)
+        cache.load(oid1, tid1 + '*')
+        cache.clear_current()
+        cache.store(oid1, 'c' * 80, tid2, tid3)
+        # The 80-byte item does not fit with the other one.
+        self.assertIsNone(cache.load(oid1, tid3))
+        cache.load(oid2)
+        path = cache._trace.path
+        self.assertEqual(path, '%s.%u' % (cache_trace, os.getpid()))
+        cache.close()
+        for policy in POLICY_DICT:
+            with open(path, 'rb') as f:
+                self.assertEqual(replay(f, ClientCache(
+                    max_size=100, policy=policy)), (3, 4))
+        # With a bigger cache, the 80-byte item is kept.
+        with open(path, 'rb') as f:
+            self.assertEqual(replay(f, ClientCache(max_size=200)), (4, 3))
+        self.assertRaises(ValueError, ClientCache, policy='lru')
+
+    def testHostCache(self):
+        path = os.path.join(getTempDirectory(), 'host.cache')
+        oid1, oid2 = map(self.makeOID, (1, 2))
+        tid1, tid2, tid3 = map(self.makeTID, (1, 2, 3))
+        # 2 processes
+        cache1 = HostCache(path, 1 << 16, stripes=2)
+        cache2 = HostCache(path)
+        try:
+            self.assertEqual(cache2._data_size, 1 << 15)
+            cache1.connected(tid1)
+            cache1.store(oid1, 0, 'a', tid1, None, tid1)
+            self.assertEqual(cache2.load(oid1), (tid1, None, 0, 'a'))
+            self.assertEqual(cache2.load(oid1, tid2), (tid1, None, 0, 'a'))
+            self.assertEqual(cache2.load(oid1, tid1 + '*'),
+                             (tid1, None, 0, 'a'))
+            self.assertIsNone(cache2.load(oid1, tid1))
+            cache2.invalidateObjects(tid2, (oid1,))
+            self.assertIsNone(cache1.load(oid1))
+            self.assertEqual(cache1.load(oid1, tid2), (tid1, tid2, 0, 'a'))
+            # Loaded by a process that had not received the invalidation yet.
+            cache1.store(oid1, 0, 'b', tid2, None, tid1)
+            self.assertIsNone(cache2.load(oid1, tid3))
+            cache1.store(oid1, 0, 'b', tid2, None, tid2)
+            self.assertEqual(cache2.load(oid1, tid3), (tid2, None, 0, 'b'))
+            # Invalidations were lost.
+            cache2.connected(tid3)
+            self.assertIsNone(cache1.load(oid1))
+            self.assertEqual(cache1.load(oid1, tid2), (tid1, tid2, 0, 'a'))
+            cache1.store(oid1, 0, 'c', tid3, None, tid3)
+            self.assertEqual(cache1.load(oid1), (tid3, None, 0, 'c'))
+            # Old data is overwritten.
+            data = 'x' * (cache1._max_object_size - 1)
+            for i in xrange(5):
+                cache1.store(oid2, 0, data, tid1, tid2, tid3)
+                cache1.store(oid1, 0, data, tid1, tid2, tid3)
+            self.assertIsNone(cache2.load(oid1))
+            self.assertEqual(cache2.load(oid1, tid2), (tid1, tid2, 0, data))
+            self.assertEqual(cache2.load(oid2, tid2), (tid1, tid2, 0, data))
+            # Corrupted data is ignored.
+            stripe, offset = cache1._getStripe(oid2)
+            i = offset + cache1._stripe_size - 1
+            cache1._map[i] = chr(ord(cache1._map[i]) ^ 1)
+            self.assertIsNone(cache2.load(oid2, tid2))
+            # A process dies while holding a lock.
+            pid = os.fork()
+            if not pid:
+                cache1._lock(stripe)
+                os._exit(0)
+            os.waitpid(pid, 0)
+            cache2.store(oid2, 0, 'd', tid3, None, tid3)
+            self.assertEqual(cache2.load(oid2), (tid3, None, 0, 'd'))
+            # Truncation.
+            cache1.connected(tid2)
+            self.assertIsNone(cache2.load(oid2))
+            self.assertIsNone(cache2.load(oid1, tid2))
+        finally:
+            cache1.close()
+            cache2.close()
+
     def test_store1(self):
         app = self.getApp()
         oid = self.makeOID(11)
@@ -22,6 +22,7 @@ import ZODB
 import socket
 import signal
 import random
+import shutil
 import MySQLdb
 import sqlite3
 import unittest
@@ -297,6 +298,13 @@ class NEOCluster(object):
             self.db_template = (lambda t: lambda db:
                 ':memory:' if db is None else db if os.sep in db else t % db
                 )(os.path.join(temp_dir, '%s.sqlite'))
+        elif adapter == 'Log':
+            self.db_template = (lambda t: lambda db:
+                db if os.sep in db else t % db
+                )(os.path.join(temp_dir, '%s.neolog'))
+        elif adapter == 'Memory':
+            # Databases only live in storage processes.
+            self.db_template = lambda db: db or ''
         else:
             assert False, adapter
         self.address_type = address_type
@@ -372,6 +380,10 @@ class NEOCluster(object):
                             raise
                     else:
                         logging.debug('%r deleted', db)
+        elif self.adapter == 'Log':
+            if clear_databases:
+                for db in self.db_list:
+                    shutil.rmtree(self.db_template(db), True)
 
     def run(self, except_storages=()):
         """ Start cluster processes except some storage nodes """
@@ -176,10 +176,10 @@ class MasterPartitionTableTests(NeoUnitTestBase):
                     pt.setUpToDate(node_dict[uuid], offset)
         pt.log()
 
-    def tweak(self, pt, drop_list=()):
-        change_list = pt.tweak(drop_list)
+    def tweak(self, pt, drop_list=(), *args):
+        change_list = pt.tweak(drop_list, *args)
         pt.log()
-        self.assertFalse(pt.tweak(drop_list))
+        self.assertFalse(pt.tweak(drop_list, *args))
         return change_list
 
     def test_17_tweak(self):
@@ -311,6 +311,39 @@ class MasterPartitionTableTests(NeoUnitTestBase):
         self.tweak(pt)
         self.update(pt)
 
+    def test_19_tweak(self):
+        sn = [self.createStorage(None, i + 1, NodeStates.RUNNING)
+              for i in xrange(3)]
+        # Move the smallest partitions, and check the dry run.
+        size_list = [10, 1, 10, 1]
+        pt = PartitionTable(4, 0)
+        pt.make(sn[:1])
+        pt.addNodeList(sn[1:2])
+        change_list = pt.tweak((), size_list, None, True)
+        self.assertPartitionTable(pt, 'U.|U.|U.|U.')
+        self.assertEqual(change_list, self.tweak(pt, (), size_list))
+        self.assertPartitionTable(pt, 'U.|FO|U.|FO')
+        self.update(pt)
+        self.assertPartitionTable(pt, 'U.|.U|U.|.U')
+        # Capacity: the first node can't keep the biggest partitions.
+        pt = PartitionTable(4, 0)
+        pt.make(sn[:1])
+        pt.addNodeList(sn[1:2])
+        self.tweak(pt, (), size_list, {sn[0]: ('', 15)})
+        self.assertPartitionTable(pt, 'FO|U.|FO|U.')
+        # Devid: nodes on the same device must not replicate each other.
+        device_dict = {sn[0]: ('a', 0), sn[1]: ('a', 0), sn[2]: ('b', 0)}
+        pt = PartitionTable(2, 1)
+        pt.make(sn[:2])
+        pt.addNodeList(sn[2:])
+        self.update(pt, self.tweak(pt, (), None, device_dict))
+        self.assertPartitionTable(pt, 'U.U|.UU')
+        # Constraints are ignored if they can't be satisfied.
+        pt = PartitionTable(1, 1)
+        pt.make(sn[:2])
+        self.assertFalse(self.tweak(pt, (), None, device_dict))
+        self.assertPartitionTable(pt, 'UU')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -19,7 +19,7 @@ from ..mock import Mock
 from struct import pack
 from .. import NeoUnitTestBase
 from neo.lib.protocol import NodeTypes
-from neo.lib.util import packTID, unpackTID, addTID
+from neo.lib.util import packTID, unpackTID, addTID, u64
 from neo.master.transactions import TransactionManager
 
 class testTransactionManager(NeoUnitTestBase):
@@ -64,5 +64,40 @@ class testTransactionManager(NeoUnitTestBase):
         tm.clientLost(node1)
         self.assertTrue(tid1 not in tm)
 
+    def testCommitQueue(self):
+        client_uuid, client = self.makeNode(NodeTypes.CLIENT)
+        s1_uuid, s1 = self.makeNode(NodeTypes.STORAGE)
+        s2_uuid, s2 = self.makeNode(NodeTypes.STORAGE)
+        for node in s1, s2:
+            node.mockAddReturnValues(isIdentified=True)
+        cell_list = [Mock({'getNode': node}) for node in (s1, s2)]
+        pt = Mock({'getPartitions': 2, 'getCellList': cell_list[:1]})
+        pt.getPartition = lambda x: u64(x) % 2
+        app = Mock({'getStorageReadySet': {s1_uuid, s2_uuid}})
+        app.pt = pt
+        committed = []
+        tm = TransactionManager(lambda txn: committed.append(txn.getTTID()))
+        def prepare(*cell_list):
+            pt.mockAddReturnValues(getCellList=cell_list)
+            ttid = tm.begin(client, 0)
+            tm.prepare(app, ttid, (), (), None)
+            return ttid
+        t1 = prepare(*cell_list)
+        t2 = prepare(cell_list[0])
+        # queued immediately and aborted before it is prepared
+        t3 = self.getNextTID()
+        tm.begin(client, 0, t3)
+        t4 = prepare(cell_list[0])
+        tm.abort(t3, client_uuid)
+        tm.lock(t2, s1_uuid)
+        tm.lock(t1, s1_uuid)
+        self.assertEqual(committed, [])
+        tm.storageLost(s2_uuid)
+        self.assertEqual(committed, [t1, t2])
+        tm.lock(t4, s1_uuid)
+        self.assertEqual(committed, [t1, t2, t4])
+        self.assertFalse(tm.hasPending())
+        self.assertFalse(tm._storage_dict)
+
 if __name__ == '__main__':
     unittest.main()
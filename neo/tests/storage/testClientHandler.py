@@ -15,7 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
-from ..mock import Mock, ReturnValues
+from ..mock import Mock
 from .. import NeoUnitTestBase
 from neo.storage.app import Application
 from neo.storage.handlers.client import ClientOperationHandler
@@ -89,13 +89,14 @@ class StorageClientHandlerTests(NeoUnitTestBase):
         tid = self.getNextTID()
         ltid = self.getNextTID()
         undone_tid = self.getNextTID()
-        # Keep 2 entries here, so we check findUndoTID is called only once.
+        # Only the second object is not found.
         oid_list = map(p64, (1, 2))
         self.app.tm = Mock({
             'getObjectFromTransaction': None,
         })
         self.app.dm = Mock({
-            'findUndoTID': ReturnValues((None, None, False), )
+            'findUndoTIDDict': {oid_list[0]: (tid, None, True),
+                                oid_list[1]: (None, None, False)},
         })
         self.operation.askObjectUndoSerial(conn, tid, ltid, undone_tid, oid_list)
         self.checkErrorPacket(conn)
@@ -17,7 +17,7 @@
 from binascii import a2b_hex
 from contextlib import contextmanager
 import unittest
-from neo.lib.util import add64, p64, u64
+from neo.lib.util import add64, makeChecksum, p64, u64
 from neo.lib.protocol import CellStates, ZERO_HASH, ZERO_OID, ZERO_TID, MAX_TID
 from .. import NeoUnitTestBase
 
@@ -443,6 +443,98 @@ class StorageDBTests(NeoUnitTestBase):
         y = 1, a2b_hex('356a192b7913b04c54574d18c28d46e6395428ab'), tid2
         check(y, x + y[1:], 1, 1, ZERO_TID, MAX_TID)
 
+    def test_getPartitionSize(self):
+        self.setNumPartitions(2, True)
+        db = self.db
+        self.assertEqual(db.getPartitionSize(0), (0, 0))
+        oid1, oid2, oid3 = map(p64, (2, 4, 5))
+        tid1, tid2 = self.getTIDs(2)
+        data_id = db.holdData(makeChecksum('foo'), 'foo', 0)
+        db.storeTransaction(tid1, (
+            (oid1, data_id, None),
+            (oid2, None, None),
+            (oid3, db.holdData(makeChecksum('barbaz'), 'barbaz', 0), None),
+            ), ((oid1, oid2, oid3), 'user', 'desc', 'ext', False, tid1), False)
+        db.storeTransaction(tid2, ((oid1, data_id, None),),
+            ((oid1,), 'user', 'desc', 'ext', False, tid2), False)
+        db.commit()
+        self.assertEqual(db.getPartitionSize(0), (3, 6))
+        self.assertEqual(db.getPartitionSize(1), (1, 6))
+        # by steps of object records
+        self.assertEqual(list(db.iterPartitionSize(0, 1)),
+                         [(1, 3), (2, 3), (3, 6), (3, 6)])
+        self.assertEqual(list(db.iterPartitionSize(0, 2)), [(2, 3), (3, 6)])
+        self.assertEqual(list(db.iterPartitionSize(1, 2)), [(1, 6)])
+
+    def test_splitPartitions(self):
+        self.setNumPartitions(2, True)
+        db = self.db
+        uuid = db.getUUID()
+        def store(*tids):
+            for tid in map(p64, tids):
+                txn, objs = self.getTransaction([tid])
+                db.storeTransaction(tid, objs, txn, False)
+            db.commit()
+        def check(partition, *tids):
+            tid_list = map(p64, tids)
+            self.assertEqual(db.getReplicationTIDList(
+                ZERO_TID, MAX_TID, 10, partition), tid_list)
+            self.assertEqual(db.getReplicationObjectList(
+                ZERO_TID, MAX_TID, 10, partition, ZERO_OID),
+                zip(tid_list, tid_list))
+            self.assertEqual(db.getTIDList(0, 10, [partition]),
+                             tid_list[::-1])
+            self.assertEqual(db.getPartitionSize(partition), (len(tids), 0))
+            self.assertEqual(db.checkTIDRange(partition, None,
+                ZERO_TID, MAX_TID)[0], len(tids))
+            self.assertEqual(db.checkSerialRange(partition, None,
+                ZERO_TID, MAX_TID, ZERO_OID)[0], len(tids))
+        store(*xrange(1, 9))
+        db.splitPartitions(2, 4)
+        self.assertEqual(db.getNumPartitions(), 4)
+        self.checkSet(db.getPartitionTable(uuid),
+            [(i, CellStates.UP_TO_DATE) for i in xrange(4)])
+        store(9, 10)
+        check(0, 4, 8)
+        check(1, 1, 5, 9)
+        check(2, 2, 6, 10)
+        check(3, 3, 7)
+        self.assertEqual(db.getReplicationTIDList(
+            ZERO_TID, MAX_TID, 1, 1), [p64(1)])
+        self.assertEqual(db.getTIDList(0, 10, [1, 3]),
+                         map(p64, (9, 7, 5, 3, 1)))
+        for tid in xrange(1, 11):
+            oid = tid = p64(tid)
+            self.assertEqual(db.getObject(oid)[0], tid)
+            self.assertTrue(db.getTransaction(tid))
+        self.assertEqual(db.getLastIDs()[::3], (p64(10), p64(10)))
+        db._deleteRange(1, p64(1), p64(5))
+        check(1, 1, 9)
+        check(3, 3, 7)
+        db.dropPartitions((3,))
+        db.changePartitionTable(3, [(3, uuid, CellStates.DISCARDED)])
+        db.commit()
+        check(1, 1, 9)
+        self.assertFalse(db.getReplicationTIDList(ZERO_TID, MAX_TID, 10, 3))
+        self.assertEqual(db.getPartitionSize(3), (0, 0))
+        # Rows remain tagged with the initial number of partitions.
+        db.splitPartitions(4, 8)
+        check(0, 8)
+        check(1, 1, 9)
+        check(2, 2, 10)
+        check(4, 4)
+        check(6, 6)
+        check(5)
+        self.checkSet(db.getPartitionTable(uuid),
+            [(i, CellStates.UP_TO_DATE) for i in xrange(8) if i % 4 != 3])
+        self.assertEqual(db.getLastTID(10), 10)
+        # Data of a partition that is not assigned anymore (without being
+        # dropped) must be ignored, even if it shares its tag with others.
+        db.changePartitionTable(5, [(2, uuid, CellStates.DISCARDED)])
+        db.commit()
+        self.assertEqual(db.getLastTID(10), 9)
+        self.assertEqual(db.getLastIDs()[::3], (p64(9), p64(9)))
+
     def test_findUndoTID(self):
         self.setNumPartitions(4, True)
         db = self.db
@@ -509,5 +601,56 @@ class StorageDBTests(NeoUnitTestBase):
             db.findUndoTID(oid1, tid5, tid4, tid1, None),
             (tid3, None, True))
 
+    def test_findUndoTIDDict(self):
+        self.setNumPartitions(4, True)
+        db = self.db
+        tid1, tid2, tid3, tid4, tid5, tid6 = [self.getNextTID()
+                                              for i in xrange(6)]
+        oid1, oid2, oid3, oid4 = map(p64, xrange(1, 5))
+        foo = db.holdData("3" * 20, 'foo', 0)
+        bar = db.holdData("4" * 20, 'bar', 0)
+        db.releaseData((foo, bar))
+        db.storeTransaction(tid1, (
+            (oid1, foo, None),
+            (oid2, foo, None),
+            (oid3, foo, None),
+            ), None, temporary=False)
+        db.storeTransaction(tid2, (
+            (oid1, bar, None),
+            (oid2, bar, None),
+            (oid3, bar, None),
+            ), None, temporary=False)
+        # Chains of data tids: oid1 -> tid1, oid2 -> tid4 -> tid1
+        db.storeTransaction(tid3, (
+            (oid1, None, tid1),
+            (oid2, None, tid1),
+            (oid3, foo, None),
+            ), None, temporary=False)
+        db.storeTransaction(tid4, (
+            (oid2, None, tid3),
+            ), None, temporary=False)
+        request = {oid1: None, oid2: None, oid3: None}
+        self.assertEqual(db.findUndoTIDDict(tid6, tid5, tid1, request), {
+            oid1: (tid3, None, True),
+            oid2: (tid4, None, True),
+            oid3: (tid3, None, False),
+            })
+        self.assertEqual(db.findUndoTIDDict(tid6, tid5, tid2, request), {
+            oid1: (tid3, tid1, False),
+            oid2: (tid4, tid1, False),
+            oid3: (tid3, tid1, False),
+            })
+        # oid4 does not exist
+        request[oid4] = None
+        self.assertEqual(db.findUndoTIDDict(tid6, tid5, tid3, request)[oid4],
+                         (None, None, False))
+        # Same results as findUndoTID.
+        request = {oid1: None, oid2: (u64(oid2), None, tid1), oid3: None}
+        for undone_tid in tid1, tid2, tid3:
+            self.assertEqual(
+                db.findUndoTIDDict(tid6, tid5, undone_tid, request),
+                {oid: db.findUndoTID(oid, tid6, tid5, undone_tid, x)
+                 for oid, x in request.iteritems()})
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,128 @@
+#
+# Copyright (C) 2017  Nexedi SA
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, shutil, tempfile, unittest
+from .. import getTempDirectory, DB_PREFIX
+from .testStorageDBTests import StorageDBTests
+from neo.lib.util import makeChecksum
+from neo.storage.database.log import LogDatabaseManager
+
+class StorageLogTests(StorageDBTests):
+
+    def _tearDown(self, success):
+        super(StorageLogTests, self)._tearDown(success)
+        for path in self.__dict__.pop('_path_list', ()):
+            shutil.rmtree(path, True)
+
+    def _test_lockDatabase_open(self):
+        db = os.path.join(getTempDirectory(), DB_PREFIX + '0.neolog')
+        return LogDatabaseManager(db)
+
+    def getDB(self, reset=0, path=None):
+        if path is None:
+            path = tempfile.mkdtemp(dir=getTempDirectory())
+            self.__dict__.setdefault('_path_list', []).append(path)
+        db = LogDatabaseManager(path)
+        db.setup(reset)
+        return db
+
+    def reopen(self, checkpoint=True):
+        db = self._db
+        db.commit()
+        if not checkpoint:
+            db._appended = 0
+        db.close()
+        self._db = db = self.getDB(path=db.db)
+        db.changePartitionTable(db.getPTID(), db.getPartitionTable(), True)
+        return db
+
+    def _populate(self, count):
+        tid_list = self.getTIDs(count)
+        oid1, oid2 = self.getOIDs(2)
+        for tid in tid_list:
+            txn, objs = self.getTransaction([oid1, oid2])
+            objs = [(oid, self.db.holdData(makeChecksum(tid), tid, 0), None)
+                    for oid, _, _ in objs]
+            with self.commitTransaction(tid, objs, txn):
+                pass
+        return oid1, oid2, tid_list
+
+    def _dump(self):
+        db = self.db
+        oid1, oid2 = self.getOIDs(2)
+        tid_list = db.getTIDList(0, 100, [0])
+        return (db.getLastIDs(), tid_list,
+                [db.getObjectHistory(oid, 0, 100) for oid in (oid1, oid2)],
+                [db.getObject(oid1, tid) for tid in tid_list],
+                sorted(db.getPartitionTable()))
+
+    def test_reopen(self):
+        self._populate(5)
+        expected = self._dump()
+        self.reopen(False)
+        self.assertEqual(self._dump(), expected)
+        self.reopen()
+        self.assertEqual(self._dump(), expected)
+        self.assertTrue(os.path.exists(os.path.join(self.db.db, 'checkpoint')))
+        # Logs are replayed from the checkpoint.
+        self._populate(2)
+        expected = self._dump()
+        self.reopen(False)
+        self.assertEqual(self._dump(), expected)
+
+    def test_truncatedLog(self):
+        self._populate(2)
+        expected = self._dump()
+        db = self.reopen(False)
+        path = db.db
+        size = db._data_log.size, db._partitions[0].log.size
+        db.close()
+        del self._db
+        for name in 'data', 'p0':
+            with open(os.path.join(path, name), 'ab') as f:
+                f.write('\0\0\1')
+        self._db = db = self.getDB(path=path)
+        db.changePartitionTable(db.getPTID(), db.getPartitionTable(), True)
+        self.assertEqual(self._dump(), expected)
+        self.assertEqual(size,
+            (db._data_log.size, db._partitions[0].log.size))
+
+    def test_compaction(self):
+        db = self.db
+        db.COMPACT_DATA = db.COMPACT_RECORDS = 0, .5
+        oid1, oid2, tid_list = self._populate(10)
+        db.pack(tid_list[-1], lambda *args: None)
+        self.assertTrue(db._needCompaction())
+        # Previous revisions were dropped.
+        self.assertEqual(db.getObjectHistory(oid1, 0, 100),
+                         [(tid_list[-1], len(tid_list[-1]))])
+        expected = self._dump()
+        size = db._data_log.size, db._partitions[0].log.size
+        for _ in db._compact():
+            pass
+        self.assertFalse(db._needCompaction())
+        self.assertTrue(db._data_log.size < size[0])
+        self.assertTrue(db._partitions[0].log.size < size[1])
+        self.assertEqual(self._dump(), expected)
+        self.reopen(False)
+        self.assertEqual(self._dump(), expected)
+        self.reopen()
+        self.assertEqual(self._dump(), expected)
+
+del StorageDBTests
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+#
+# Copyright (C) 2017  Nexedi SA
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from .. import DB_PREFIX
+from .testStorageDBTests import StorageDBTests
+from neo.lib.util import makeChecksum
+from neo.storage.database import memory
+from neo.storage.database.memory import MemoryDatabaseManager
+
+class StorageMemoryTests(StorageDBTests):
+
+    def _tearDown(self, success):
+        super(StorageMemoryTests, self)._tearDown(success)
+        memory._database_dict.pop(DB_PREFIX + '0', None)
+
+    def _test_lockDatabase_open(self):
+        return MemoryDatabaseManager(DB_PREFIX + '0')
+
+    def getDB(self, reset=0, name=''):
+        db = MemoryDatabaseManager(name)
+        db.setup(reset)
+        return db
+
+    def test_lockDatabase(self):
+        super(StorageMemoryTests, self).test_lockDatabase()
+        # No lock on private databases.
+        db = self.getDB()
+        self.getDB().close()
+        db.close()
+
+    def test_reopen(self):
+        self._db = db = self.getDB(name=DB_PREFIX + '0')
+        self.setNumPartitions(1)
+        oid, = self.getOIDs(1)
+        tid1, tid2 = self.getTIDs(2)
+        for tid in tid1, tid2:
+            txn, objs = self.getTransaction([oid])
+            objs = [(oid, db.holdData(makeChecksum(tid), tid, 0), None)]
+            with self.commitTransaction(tid, objs, txn):
+                pass
+        db.close()
+        self._db = db = self.getDB(name=DB_PREFIX + '0')
+        db.changePartitionTable(db.getPTID(), db.getPartitionTable(), True)
+        self.assertEqual(db.getObjectHistory(oid, 0, 10),
+                         [(tid2, len(tid2)), (tid1, len(tid1))])
+        self.assertEqual(db.getObject(oid)[4], tid2)
+        # Data are deduplicated.
+        count = len(db._data)
+        data_id = db.holdData(makeChecksum(tid1), tid1, 0)
+        self.assertEqual(db.loadData(data_id)[2], tid1)
+        self.assertEqual(len(db._data), count)
+
+del StorageDBTests
+
+if __name__ == "__main__":
+    unittest.main()
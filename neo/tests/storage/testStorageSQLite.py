@@ -14,9 +14,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import os, unittest
+import glob, os, tempfile, unittest
 from .. import getTempDirectory, DB_PREFIX
 from .testStorageDBTests import StorageDBTests
+from neo.lib.exception import DatabaseFailure
+from neo.lib.protocol import MAX_TID, ZERO_HASH, ZERO_TID
 from neo.storage.database.sqlite import SQLiteDatabaseManager
 
 class StorageSQLiteTests(StorageDBTests):
@@ -37,6 +39,81 @@ class StorageSQLiteTests(StorageDBTests):
         self.getDB().close()
         db.close()
 
+
+class StoragePartitionedSQLiteTests(StorageSQLiteTests):
+
+    def _tearDown(self, success):
+        super(StoragePartitionedSQLiteTests, self)._tearDown(success)
+        for path in self.__dict__.pop('_path_list', ()):
+            for path in glob.glob(path + '*'):
+                os.remove(path)
+
+    def getDB(self, reset=0, path=None, options='?partitioned&wal'):
+        if path is None:
+            fd, path = tempfile.mkstemp(dir=getTempDirectory())
+            os.close(fd)
+            self.__dict__.setdefault('_path_list', []).append(path)
+        db = SQLiteDatabaseManager(path + options)
+        db.setup(reset)
+        return db
+
+    test_lockDatabase = StorageDBTests.test_lockDatabase.im_func
+
+    def test_options(self):
+        for x in ':memory:?partitioned', 'x?foo', 'x?mmap_size=a', 'x?wal=1':
+            self.assertRaises(DatabaseFailure, SQLiteDatabaseManager, x)
+        db = self.getDB(options='?wal&mmap_size=65536')
+        self.assertEqual(db.query("PRAGMA journal_mode").fetchone()[0], 'wal')
+        self.assertEqual(db.query("PRAGMA mmap_size").fetchone()[0], 65536)
+        db.close()
+
+    def test_partitionFiles(self):
+        np = 4
+        self.setNumPartitions(np)
+        db = self.db
+        path = db.db
+        oid_list = self.getOIDs(np)
+        txn, objs = self.getTransaction(oid_list)
+        tid = self.getNextTID()
+        with self.commitTransaction(tid, objs, txn):
+            pass
+        self.assertEqual(sorted(db._getShardList()), range(np))
+        db.dropPartitions((1, 2))
+        db.commit()
+        self.assertEqual(sorted(db._getShardList()), [0, 3])
+        self.assertEqual(db.getObject(oid_list[3])[0], tid)
+        # Reading partitions without data does not create their files.
+        self.assertEqual(db.getPartitionSize(1), (0, 0))
+        self.assertEqual(db.checkTIDRange(2, None, ZERO_TID, MAX_TID),
+                         (0, ZERO_HASH, ZERO_TID))
+        self.assertEqual(db.getReplicationTIDList(ZERO_TID, MAX_TID, 9, 2), [])
+        self.assertEqual(sorted(db._getShardList()), [0, 3])
+        db.close()
+        del self._db
+        # Partition files are not silently ignored.
+        self.assertRaises(DatabaseFailure, SQLiteDatabaseManager, path)
+
+    def test_migration(self):
+        np = 4
+        fd, path = tempfile.mkstemp(dir=getTempDirectory())
+        os.close(fd)
+        self.__dict__.setdefault('_path_list', []).append(path)
+        self._db = self.getDB(path=path, options='')
+        self.setNumPartitions(np)
+        oid_list = self.getOIDs(np)
+        txn, objs = self.getTransaction(oid_list)
+        tid = txn[-1]
+        with self.commitTransaction(tid, objs, txn):
+            pass
+        expected = [self.db.getObject(oid) for oid in oid_list]
+        self.db.close()
+        self._db = db = self.getDB(path=path)
+        db.changePartitionTable(db.getPTID(), db.getPartitionTable(), True)
+        self.assertEqual(sorted(db._getShardList()), range(np))
+        self.assertEqual(db._nonempty(db.query, 'obj'), None)
+        self.assertEqual([db.getObject(oid) for oid in oid_list], expected)
+        self.assertEqual(db.getTransaction(tid)[0], oid_list)
+
 del StorageDBTests
 
 if __name__ == "__main__":
@@ -0,0 +1,64 @@
+#
+# Copyright (C) 2017  Nexedi SA
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from itertools import cycle
+from . import NeoUnitTestBase
+from neo.lib.connector import BIG_CHUNK, SocketConnectorIPv4
+
+class ShortWriteSocket(object):
+    """Socket accepting at most a given number of bytes per send"""
+
+    def __init__(self, size_list):
+        self.size_iter = cycle(size_list)
+        self.sent = []
+
+    def send(self, msg):
+        msg = str(msg)[:next(self.size_iter)]
+        self.sent.append(msg)
+        return len(msg)
+
+
+class ConnectorTests(NeoUnitTestBase):
+
+    def _send(self, chunk_list, size_list):
+        connector = object.__new__(SocketConnectorIPv4)
+        connector.socket = s = ShortWriteSocket(size_list)
+        connector.queued = []
+        connector.queue(chunk_list)
+        n = 0
+        while not connector.send():
+            n += 1
+            self.assertLess(n, 1000)
+        self.assertEqual(connector.queued, [])
+        self.assertEqual(''.join(s.sent), ''.join(chunk_list))
+        return s.sent
+
+    def testSendShortWrites(self):
+        big = ''.join(chr(i % 251) for i in xrange(BIG_CHUNK + 1000))
+        chunk_list = ['head1', 'body1', '', 'head2', big, 'head3',
+                      'body3' * 1000, big[::-1], 'tail']
+        for size_list in (1 << 20,), (1, 4096), (7, 1000), (BIG_CHUNK - 1, 3):
+            self._send(chunk_list, size_list)
+
+    def testSendBigChunk(self):
+        big = 'x' * BIG_CHUNK
+        sent = self._send(['a', 'b', big, 'c', 'd'], (1 << 20,))
+        # Small chunks are concatenated, whereas big ones are sent alone.
+        self.assertEqual(sent, ['ab', big, 'cd'])
+
+if __name__ == '__main__':
+    unittest.main()
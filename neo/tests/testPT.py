@@ -17,6 +17,7 @@
 import unittest
 from neo.lib.protocol import NodeStates, CellStates
 from neo.lib.pt import Cell, PartitionTable, PartitionTableException
+from neo.lib.util import p64
 from . import NeoUnitTestBase
 
 class PartitionTableTests(NeoUnitTestBase):
@@ -344,6 +345,39 @@ class PartitionTableTests(NeoUnitTestBase):
         # it's not up to date and running, so not operational
         self.assertFalse(pt.operational())
 
+    def test_11_readable(self):
+        pt = PartitionTable(3, 1)
+        sn1, sn2 = [self.createStorage(("127.0.0.1", 19001 + i),
+                                       self.getStorageUUID())
+                    for i in xrange(2)]
+        for sn in sn1, sn2:
+            sn.setState(NodeStates.RUNNING)
+            for x in xrange(3):
+                pt._setCell(x, sn, CellStates.UP_TO_DATE)
+        self.assertTrue(pt.operational())
+        self.assertEqual(pt.getNodeSet(True), {sn1, sn2})
+        # Cells of a node that is not running are ignored.
+        self.assertTrue(pt.operational((sn1.getUUID(),)))
+        sn2.setState(NodeStates.DOWN)
+        self.assertFalse(pt.operational((sn1.getUUID(),)))
+        sn2.setState(NodeStates.RUNNING)
+        # Returned lists can be modified by the caller.
+        pt.getCellList(0, True).pop()
+        self.assertEqual(len(pt.getCellList(0, True)), 2)
+        pt._setCell(0, sn1, CellStates.OUT_OF_DATE)
+        pt._setCell(1, sn1, CellStates.FEEDING)
+        pt.removeCell(2, sn1)
+        for x in xrange(3):
+            self.assertEqual(pt.getCellList(x, True), filter(Cell.isReadable,
+                pt.getCellList(x)))
+        self.assertEqual(pt.getAssignedPartitionList(sn1.getUUID()), [1])
+        self.assertFalse(pt.operational((sn2.getUUID(),)))
+        pt._setCell(0, sn2, CellStates.OUT_OF_DATE)
+        self.assertEqual(pt.getNodeSet(True), {sn1, sn2})
+        self.assertFalse(pt.operational())
+        pt.removeCell(1, sn1)
+        self.assertEqual(pt.getNodeSet(True), {sn2})
+
     def test_12_getRow(self):
         num_partitions = 5
         num_replicas = 2
@@ -387,6 +421,40 @@ class PartitionTableTests(NeoUnitTestBase):
         # unknown row
         self.assertRaises(IndexError,  pt.getRow, 5)
 
+    def test_13_split(self):
+        pt = PartitionTable(2, 1)
+        sn1, sn2 = [self.createStorage(("127.0.0.1", 19001 + i),
+                                       self.getStorageUUID())
+                    for i in xrange(2)]
+        for sn in sn1, sn2:
+            sn.setState(NodeStates.RUNNING)
+        pt._setCell(0, sn1, CellStates.UP_TO_DATE)
+        pt._setCell(0, sn2, CellStates.FEEDING)
+        pt._setCell(1, sn2, CellStates.UP_TO_DATE)
+        pt._id = 1
+        row_list = pt.getRowList()
+        pt.split(2, 6)
+        self.assertEqual(pt.getID(), 2)
+        self.assertEqual(pt.getPartitions(), 6)
+        self.assertTrue(pt.filled())
+        self.assertTrue(pt.operational())
+        for offset, row in pt.getRowList():
+            self.assertEqual(row, row_list[offset % 2][1])
+            self.assertEqual(pt.getCellList(offset, True),
+                filter(Cell.isReadable, pt.getCellList(offset)))
+        self.assertEqual(pt.count_dict, {sn1: 3, sn2: 3})
+        self.assertEqual(pt.getAssignedPartitionList(sn1.getUUID()),
+                         [0, 2, 4])
+        self.assertEqual(pt.getNodeSet(True), {sn1, sn2})
+        self.assertEqual(pt.getPartition(p64(9)), 3)
+        # Cells are not shared between partitions.
+        pt._setCell(2, sn2, CellStates.UP_TO_DATE)
+        self.assertEqual(pt.getCell(0, sn2.getUUID()).getState(),
+                         CellStates.FEEDING)
+        pt.removeCell(3, sn2)
+        self.assertFalse(pt.operational())
+        self.assertEqual(pt.getNodeSet(True), {sn1, sn2})
+
 if __name__ == '__main__':
     unittest.main()
 
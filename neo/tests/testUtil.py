@@ -16,8 +16,12 @@
 
 import unittest
 import socket
+from cPickle import Pickler
+from cStringIO import StringIO
 from . import NeoUnitTestBase
-from neo.lib.util import ReadBuffer, parseNodeAddress
+from neo.lib.compress import (Compressor, decompress,
+    parseCodec, parseCodecList)
+from neo.lib.util import ReadBuffer, getPersistentReferences, parseNodeAddress
 
 class UtilTests(NeoUnitTestBase):
 
@@ -56,6 +60,50 @@ class UtilTests(NeoUnitTestBase):
         self.assertEqual(buf.read(3), None)
         self.assertEqual(buf.read(2), 'ef')
 
+    def testGetPersistentReferences(self):
+        class Ref(object):
+            def __init__(self, pid):
+                self.pid = pid
+        for protocol in 1, 2:
+            f = StringIO()
+            p = Pickler(f, protocol)
+            p.inst_persistent_id = lambda obj: getattr(obj, 'pid', None)
+            a = Ref('a')
+            # 2 pickles sharing the same memo, like ZODB object records
+            p.dump((UtilTests, None)).dump(
+                [a, {1: (Ref(('b', UtilTests)), 1.5)}, Ref(('c', None)), a])
+            # The class of a reference is only known by unpickling.
+            self.assertEqual(getPersistentReferences(f.getvalue()),
+                             ['a', ('b', None), ('c', None), 'a'])
+
+    def testCompressor(self):
+        self.assertEqual(parseCodec(True), (1, 6))
+        self.assertEqual(parseCodec('on'), (1, 6))
+        self.assertEqual(parseCodec('false'), (0, None))
+        self.assertEqual(parseCodec(None), (0, None))
+        self.assertEqual(parseCodec('zlib=9'), (1, 9))
+        self.assertEqual(parseCodec('BZ2'), (2, 9))
+        for spec in 'foo', 'zlib=', 'zlib=10', 'bz2=0':
+            self.assertRaises(ValueError, parseCodec, spec)
+        self.assertEqual(parseCodecList(''), {0})
+        self.assertEqual(parseCodecList('bz2, zlib'), {0, 1, 2})
+        self.assertRaises(ValueError, parseCodecList, 'zlib,foo')
+        self.assertRaises(ValueError, Compressor, True, 0, 1)
+        compressible = 'x' * 100
+        for spec in 'zlib', 'zlib=1', 'bz2':
+            compression, data = Compressor(spec)(compressible)
+            self.assertTrue(compression)
+            self.assertEqual(decompress(compression, data), compressible)
+        # Compressed size is 12 bytes.
+        self.assertEqual(Compressor(min_size=101)(compressible),
+                         (0, compressible))
+        self.assertEqual(Compressor(min_gain=.9)(compressible),
+                         (0, compressible))
+        self.assertEqual(Compressor(min_gain=.8)(compressible)[0], 1)
+        self.assertEqual(Compressor(False)(compressible), (0, compressible))
+        self.assertEqual(decompress(0, compressible), compressible)
+        self.assertRaises(ValueError, decompress, 255, compressible)
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -16,20 +16,20 @@
 
 # XXX: Consider using ClusterStates.STOPPING to stop clusters
 
-import os, random, select, socket, sys, tempfile
+import os, random, select, shutil, socket, sys, tempfile
 import thread, threading, time, traceback, weakref
 from collections import deque
 from ConfigParser import SafeConfigParser
 from contextlib import contextmanager
 from itertools import count
 from functools import partial, wraps
-from zlib import decompress
 from ..mock import Mock
 import transaction, ZODB
 import neo.admin.app, neo.master.app, neo.storage.app
 import neo.client.app, neo.neoctl.app
 from neo.client import Storage
 from neo.lib import logging
+from neo.lib.compress import decompress, parseCodecList
 from neo.lib.connection import BaseConnection, \
     ClientConnection, Connection, ConnectionClosed, ListeningConnection
 from neo.lib.connector import SocketConnector, ConnectorException
@@ -405,13 +405,33 @@ class StorageApplication(ServerNode, neo.storage.app.Application):
 
     def getDataLockInfo(self):
         dm = self.dm
-        index = tuple(dm.query("SELECT id, hash, compression FROM data"))
+        adapter = self.getAdapter()
+        if adapter == 'Log':
+            index = [(i,) + dm.loadData(i)[1::-1] for i in dm._data_pos]
+        elif adapter == 'Memory':
+            index = [(i, h, c) for i, (c, h, _) in dm._data.iteritems()]
+        else:
+            index = tuple(dm.query("SELECT id, hash, compression FROM data"))
         assert set(dm._uncommitted_data).issubset(x[0] for x in index)
         get = dm._uncommitted_data.get
         return {(str(h), c & 0x7f): get(i, 0) for i, h, c in index}
 
     def sqlCount(self, table):
-        (r,), = self.dm.query("SELECT COUNT(*) FROM " + table)
+        dm = self.dm
+        adapter = self.getAdapter()
+        if adapter in ('Log', 'Memory'):
+            if table == 'data':
+                return len(dm._data_pos if adapter == 'Log' else dm._data)
+            p = dm._partitions.itervalues()
+            if table == 'obj':
+                return sum(x.count for x in p)
+            if table == 'trans':
+                return sum(len(x.trans) for x in p)
+            return 0
+        if getattr(dm, '_partitioned', False) and table in ('trans', 'obj'):
+            return sum(q("SELECT COUNT(*) FROM " + table).next()[0]
+                       for q in dm._shards())
+        (r,), = dm.query("SELECT COUNT(*) FROM " + table)
         return r
 
 class ClientApplication(Node, neo.client.app.Application):
@@ -652,7 +672,8 @@ class NEOCluster(object):
                        adapter=os.getenv('NEO_TESTS_ADAPTER', 'SQLite'),
                        storage_count=None, db_list=None, clear_databases=True,
                        db_user=DB_USER, db_password='', compress=True,
-                       importer=None, autostart=None):
+                       importer=None, autostart=None, compression=None,
+                       invalidation_delay=None, backup_replications=None):
         self.name = 'neo_%s' % self._allocate('name',
             lambda: random.randint(0, 100))
         self.compress = compress
@@ -668,7 +689,12 @@ class NEOCluster(object):
             self.upstream = weakref.proxy(upstream)
             kw.update(getUpstreamCluster=upstream.name,
                 getUpstreamMasters=parseMasterList(upstream.master_nodes))
+        if compression is not None:
+            compression = parseCodecList(compression)
         self.master_list = [MasterApplication(getAutostart=autostart,
+                                              getCompression=compression,
+                                              getInvalidationDelay=
+                                                  invalidation_delay,
                                               address=x, **kw)
                             for x in master_list]
         if db_list is None:
@@ -682,6 +708,13 @@ class NEOCluster(object):
             db = '%s:%s@%%s%s' % (db_user, db_password, DB_SOCKET)
         elif adapter == 'SQLite':
             db = os.path.join(getTempDirectory(), '%s.sqlite')
+        elif adapter == 'Log':
+            db = os.path.join(getTempDirectory(), '%s.neolog')
+            if clear_databases:
+                for x in db_list:
+                    shutil.rmtree(db % x, True)
+        elif adapter == 'Memory':
+            db = '%s'
         else:
             assert False, adapter
         if importer:
@@ -697,7 +730,10 @@ class NEOCluster(object):
             with open(db % tuple(db_list), "w") as f:
                 cfg.write(f)
             kw["getAdapter"] = "Importer"
-        self.storage_list = [StorageApplication(getDatabase=db % x, **kw)
+        self.storage_list = [StorageApplication(getDatabase=db % x,
+                                                getBackupReplications=
+                                                    backup_replications,
+                                                **kw)
                              for x in db_list]
         self.admin_list = [AdminApplication(**kw)]
 
@@ -984,9 +1020,8 @@ class NEOThreadedTest(NeoTestBase):
 
     def getUnpickler(self, conn):
         reader = conn._reader
-        def unpickler(data, compression=False):
-            if compression:
-                data = decompress(data)
+        def unpickler(data, compression=0):
+            data = decompress(compression, data)
             obj = reader.getGhost(data)
             reader.setGhostState(obj, data)
             return obj
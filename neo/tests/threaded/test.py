@@ -36,11 +36,14 @@ from neo.lib.handler import DelayEvent
 from neo.lib import logging
 from neo.lib.protocol import (CellStates, ClusterStates, NodeStates, NodeTypes,
     Packets, Packet, uuid_str, ZERO_OID, ZERO_TID, MAX_TID)
-from .. import expectedFailure, unpickle_state, Patch, TransactionalResource
+from .. import expectedFailure, getTempDirectory, unpickle_state, Patch, \
+    TransactionalResource
 from . import ClientApplication, ConnectionFilter, LockLock, NEOThreadedTest, \
     RandomConflictDict, ThreadId, with_cluster
+from neo.lib.stats import formatNodeStats
 from neo.lib.util import add64, makeChecksum, p64, u64
 from neo.client.exception import NEOPrimaryMasterLost, NEOStorageError
+from neo.client.handlers.master import PrimaryNotificationsHandler
 from neo.client.transactions import Transaction
 from neo.master.handlers.client import ClientServiceHandler
 from neo.storage.handlers.client import ClientOperationHandler
@@ -70,7 +73,8 @@ class Test(NEOThreadedTest):
             compressible = 'x' * 20
             compressed = compress(compressible)
             oid_list = []
-            if cluster.storage.getAdapter() == 'SQLite':
+            adapter = cluster.storage.getAdapter()
+            if adapter == 'SQLite':
                 big = None
                 data = 'foo', '', 'foo', compressed, compressible
             else:
@@ -78,7 +82,8 @@ class Test(NEOThreadedTest):
                 assert len(big) < len(compress(big))
                 data = ('foo', big, '', 'foo', big[:2**24-1], big,
                         compressed, compressible, big[:2**24])
-                self.assertFalse(cluster.storage.sqlCount('bigdata'))
+                if adapter == 'MySQL':
+                    self.assertFalse(cluster.storage.sqlCount('bigdata'))
             self.assertFalse(cluster.storage.sqlCount('data'))
             for data in data:
                 if data is compressible:
@@ -101,7 +106,7 @@ class Test(NEOThreadedTest):
                 self.assertEqual((data, serial), storage.load(oid, ''))
                 self.assertEqual((data, serial), storage.load(oid, ''))
                 oid_list.append((oid, data, serial))
-            if big:
+            if big and adapter == 'MySQL':
                 self.assertTrue(cluster.storage.sqlCount('bigdata'))
             self.assertTrue(cluster.storage.sqlCount('data'))
             for i, (oid, data, serial) in enumerate(oid_list, 1):
@@ -111,10 +116,185 @@ class Test(NEOThreadedTest):
                     storage.load, oid, '')
                 for oid, data, serial in oid_list[i:]:
                     self.assertEqual((data, serial), storage.load(oid, ''))
-            if big:
+            if big and adapter == 'MySQL':
                 self.assertFalse(cluster.storage.sqlCount('bigdata'))
             self.assertFalse(cluster.storage.sqlCount('data'))
 
+    @with_cluster()
+    def testCompressWorkers(self, cluster):
+        client = ClientApplication(name=cluster.name,
+            master_nodes=cluster.master_nodes, compress_workers=2)
+        db = DB(storage=cluster.getZODBStorage(client=client))
+        try:
+            t, c = cluster.getTransaction(db)
+            r = c.root()
+            # Enough data for the client to wait for storage nodes
+            # in the middle of the transaction.
+            self.assertLess(client._cache._max_size, 100 * 1000)
+            for i in xrange(100):
+                r[i] = x = PCounter()
+                x.value = str(i) * 1000 if i % 2 else os.urandom(1000)
+            t.commit()
+            r[0].value = r[1].value = 'x'
+            t.commit()
+            t, c = cluster.getTransaction()
+            r2 = c.root()
+            self.assertEqual([r2[i].value for i in xrange(100)],
+                             [r[i].value for i in xrange(100)])
+        finally:
+            db.close()
+
+    @with_cluster()
+    def testCompressWorkersConflict(self, cluster):
+        client = ClientApplication(name=cluster.name,
+            master_nodes=cluster.master_nodes, compress_workers=2)
+        db = DB(storage=cluster.getZODBStorage(client=client))
+        try:
+            t1, c1 = cluster.getTransaction(db)
+            c1.root()['x'] = x = PCounterWithResolution()
+            t1.commit()
+            x.value += 1
+            t2, c2 = cluster.getTransaction()
+            c2.root()['x'].value += 2
+            t2.commit()
+            def _compress(orig, data):
+                # The resolved object is not compressed yet when
+                # all answers to stores are received.
+                time.sleep(.1)
+                return orig(data)
+            with Patch(client, _compress=_compress):
+                t1.commit()
+            self.assertEqual(x.value, 3)
+            t2.begin()
+            self.assertEqual(c2.root()['x'].value, 3)
+        finally:
+            db.close()
+
+    @with_cluster()
+    def testCacheCompress(self, cluster):
+        client = ClientApplication(name=cluster.name,
+            master_nodes=cluster.master_nodes, cache_compress=True)
+        db = DB(storage=cluster.getZODBStorage(client=client))
+        try:
+            t, c = cluster.getTransaction(db)
+            c.root()[0] = x = PCounter()
+            x.value = 'x' * 10000
+            t.commit()
+            cache = client._cache
+            cache.clear()
+            c.cacheMinimize()
+            self.assertEqual(c.root()[0].value, x.value)
+            self.assertLess(cache._size, 1000)
+        finally:
+            db.close()
+
+    @with_cluster()
+    def testHostCache(self, cluster):
+        path = os.path.join(getTempDirectory(), 'host.cache')
+        client_list = [ClientApplication(name=cluster.name, host_cache=path,
+            master_nodes=cluster.master_nodes) for x in 0, 1]
+        db_list = [DB(storage=cluster.getZODBStorage(client=client))
+                   for client in client_list]
+        try:
+            t1, c1 = cluster.getTransaction(db_list[0])
+            c1.root()[0] = x1 = PCounter()
+            x1.value = 1
+            t1.commit()
+            t2, c2 = cluster.getTransaction(db_list[1])
+            c2.root()
+            client_list[0]._cache.clear()
+            c1.cacheMinimize()
+            self.assertEqual(x1.value, 1)
+            # The second client gets the object from the shared cache.
+            with Patch(client_list[1], _loadFromStorage=None):
+                x2 = c2.root()[0]
+                self.assertEqual(x2.value, 1)
+            x1.value = 2
+            t1.commit()
+            t2.begin()
+            client_list[1]._cache.clear()
+            c2.cacheMinimize()
+            self.assertEqual(x2.value, 2)
+        finally:
+            for db in db_list:
+                db.close()
+
+    @with_cluster()
+    def testHostCacheSnapshot(self, cluster):
+        path = os.path.join(getTempDirectory(), 'host-snapshot.cache')
+        client_list = [ClientApplication(name=cluster.name, host_cache=path,
+            master_nodes=cluster.master_nodes) for x in 0, 1]
+        db_list = [DB(storage=cluster.getZODBStorage(client=client))
+                   for client in client_list]
+        try:
+            t1, c1 = cluster.getTransaction(db_list[0])
+            c1.root()[0] = x1 = PCounter()
+            x1.value = 1
+            t1.commit()
+            t2, c2 = cluster.getTransaction(db_list[1])
+            x2 = c2.root()[0]
+            self.assertEqual(x2.value, 1)
+            with cluster.master.filterConnection(client_list[1]) as m2c:
+                m2c.delayInvalidateObjects()
+                x1.value = 2
+                t1.commit()
+                # The first client puts the new revision in the shared cache.
+                client_list[0]._cache.clear()
+                c1.cacheMinimize()
+                self.assertEqual(x1.value, 2)
+                # The second client has not processed the invalidation yet
+                # so it must not see a revision after its snapshot.
+                client_list[1]._cache.clear()
+                c2.cacheMinimize()
+                self.assertEqual(x2.value, 1)
+            t2.begin()
+            self.assertEqual(x2.value, 2)
+        finally:
+            for db in db_list:
+                db.close()
+
+    @with_cluster(compression='zlib')
+    def testCompressionCodecs(self, cluster):
+        data = 'x' * 100
+        for compress, min_size, compression in (
+                (True, 0, 1),
+                ('zlib=9', 101, 0),
+                ('bz2', 0, 0), # not allowed by the cluster
+                ):
+            client = ClientApplication(name=cluster.name,
+                master_nodes=cluster.master_nodes, compress=compress,
+                compress_min_size=min_size)
+            storage = cluster.getZODBStorage(client=client)
+            try:
+                oid = storage.new_oid()
+                txn = transaction.Transaction()
+                storage.tpc_begin(txn)
+                storage.store(oid, None, data, '', txn)
+                storage.tpc_vote(txn)
+                storage.tpc_finish(txn)
+                self.tic()
+                self.assertEqual(cluster.storage.dm.getObject(oid)[2],
+                                 compression)
+                client._cache.clear()
+                self.assertEqual(storage.load(oid)[0], data)
+            finally:
+                storage.close()
+        # Storage nodes reject codecs that are not allowed.
+        client = ClientApplication(name=cluster.name,
+            master_nodes=cluster.master_nodes, compress='bz2')
+        storage = cluster.getZODBStorage(client=client)
+        try:
+            storage.sync()
+            client.compression_set = frozenset((0, 2))
+            txn = transaction.Transaction()
+            storage.tpc_begin(txn)
+            storage.store(storage.new_oid(), None, data, '', txn)
+            self.assertRaises(POSException.StorageError,
+                              storage.tpc_vote, txn)
+            storage.tpc_abort(txn)
+        finally:
+            storage.close()
+
     @with_cluster()
     def testDeleteObject(self, cluster):
         if 1:
@@ -778,6 +958,30 @@ class Test(NEOThreadedTest):
             cluster.client.cp.closeAll()
             t1, = cluster.client.undoLog(0, 10)
 
+    @with_cluster(storage_count=2, partitions=2)
+    def testStorageDisconnectedDuringTransactionLog(self, cluster):
+        t, c = cluster.getTransaction()
+        r = c.root()
+        for i in xrange(4):
+            r[i] = i
+            t.commit()
+        transactionLog = lambda: cluster.client.transactionLog(
+            ZERO_TID, c.db().lastTransaction(), 10)
+        expected = transactionLog()
+        self.assertEqual(len(expected[1]), 5)
+        closed = []
+        def askTransactionInformation(orig, self, conn, tid):
+            if closed:
+                orig(self, conn, tid)
+            else:
+                # Requests to other nodes are being processed.
+                closed.append(tid)
+                conn.close()
+        with Patch(ClientOperationHandler,
+                   askTransactionInformation=askTransactionInformation):
+            self.assertEqual(expected, transactionLog())
+        self.assertTrue(closed)
+
     @with_cluster(storage_count=2, replicas=1)
     def testDropNodeThenRestartCluster(self, cluster):
         """ Start a cluster with more than one storage, down one, shutdown the
@@ -1092,6 +1296,75 @@ class Test(NEOThreadedTest):
             self.assertFalse(cluster.client.new_oid_list)
             self.assertEqual(2, u64(cluster.client.new_oid()))
 
+    @with_cluster()
+    def testNewOIDs(self, cluster):
+        client = cluster.client
+        storage = cluster.getZODBStorage()
+        oid_list = [u64(storage.new_oid()) for i in xrange(2000)]
+        self.assertEqual(oid_list, range(oid_list[0], oid_list[0] + 2000))
+        # More OIDs are requested at once when they're consumed quickly.
+        self.assertGreater(client._new_oid_count, 100)
+        self.assertLess(client.new_oid_stall_count, 2000 // 100)
+        # The stall counter is only incremented if we wait for the master.
+        stall_count = client.new_oid_stall_count
+        self.tic()
+        storage.new_oid()
+        self.assertEqual(stall_count, client.new_oid_stall_count)
+
+    @with_cluster()
+    def testNewOIDsMasterFailure(self, cluster):
+        client = cluster.client
+        storage = cluster.getZODBStorage()
+        for reconnect in 0, 1:
+            client.new_oid_list = ()
+            with cluster.master.filterConnection(client) as m2c:
+                m2c.delayAnswerNewOIDs()
+                client._askNewOIDs()
+                self.tic()
+                m2c, = cluster.master.getConnectionList(client)
+                m2c.close()
+                self.tic()
+            if reconnect:
+                client.sync()
+                self.assertIs(client._new_oid_request, None)
+            # The request of new OIDs was lost with the connection to the
+            # primary master, and it's sent again to the new one.
+            storage.new_oid()
+
+    @with_cluster(invalidation_delay=3600)
+    def testInvalidationDelay(self, cluster):
+        client = cluster.client
+        t1, c1 = cluster.getTransaction()
+        c1.root()['x'] = x1 = PCounter()
+        t1.commit()
+        invalidation_list = []
+        def invalidateObjectsList(orig, self, conn, *args):
+            invalidation_list.append(len(args[0]))
+            orig(self, conn, *args)
+        with cluster.newClient(1) as db, Patch(PrimaryNotificationsHandler,
+                invalidateObjectsList=invalidateObjectsList):
+            t2, c2 = cluster.getTransaction(db)
+            x2 = c2.root()['x']
+            for i in xrange(3):
+                x2.value += 1
+                t2.commit()
+            self.tic()
+            self.assertFalse(invalidation_list)
+            self.assertLess(client.last_tid, x2._p_serial)
+            # Buffered invalidations are sent before answering.
+            client.sync()
+            self.assertEqual(invalidation_list, [3])
+            self.assertEqual(client.last_tid, x2._p_serial)
+            t1.begin()
+            self.assertEqual(x1.value, 3)
+            # When the master is idle, invalidations are sent on timeout.
+            with Patch(cluster.master, invalidation_delay=.01):
+                x2.value += 1
+                t2.commit()
+                self.tic(check_timeout=(cluster.master,))
+            self.assertEqual(invalidation_list, [3, 1])
+            self.assertEqual(client.last_tid, x2._p_serial)
+
     @with_cluster()
     def testClientFailureDuringTpcFinish(self, cluster):
         """
@@ -1461,6 +1734,90 @@ class Test(NEOThreadedTest):
             check(0, ok)
             check(1, ok)
 
+    @with_cluster(storage_count=2, partitions=2)
+    def testRestore(self, cluster):
+        from ZODB.FileStorage import FileStorage
+        path = os.path.join(getTempDirectory(), self.id() + '.fs')
+        db = DB(FileStorage(path))
+        try:
+            t, c = cluster.getTransaction(db)
+            c.root()['x'] = x = PCounter()
+            t.commit()
+            for i in xrange(3):
+                x.value += 1
+                t.commit()
+            c.root()['y'] = PCounter()
+            t.commit()
+            ob = db.undoLog(0, 2)
+            db.undo(ob[1]['id']) # back-pointer to a previous revision
+            t.commit()
+            db.undo(ob[0]['id']) # undo of creation
+            t.commit()
+            def records(storage):
+                return [(txn.tid, sorted((r.oid, r.data, r.data_txn)
+                                         for r in txn))
+                        for txn in storage.iterator()]
+            expected = records(db.storage)
+            # Also exercise flow control when importing.
+            cluster.client._cache._max_size = 1
+            cluster.getZODBStorage().copyTransactionsFrom(db.storage)
+            self.assertEqual(expected, records(cluster.getZODBStorage()))
+        finally:
+            db.close()
+
+    @with_cluster()
+    def testRestoreMissingBackPointer(self, cluster):
+        storage = cluster.getZODBStorage()
+        oid = storage.new_oid()
+        data = 'foo'
+        def restore(tid, data_serial):
+            txn = transaction.Transaction()
+            storage.tpc_begin(txn, tid)
+            storage.restore(oid, tid, data, '', data_serial, txn)
+            storage.tpc_vote(txn)
+            storage.tpc_finish(txn)
+        # Back-pointer to a revision that is not in this storage,
+        # as with a partial copy: the data must be stored instead.
+        tid1 = p64(u64(storage.lastTransaction()) + 10)
+        restore(tid1, p64(1))
+        # Back-pointer to an existing revision.
+        tid2 = add64(tid1, 1)
+        restore(tid2, tid1)
+        for tid, data_tid in (tid1, None), (tid2, tid1):
+            self.assertEqual(storage.loadSerial(oid, tid), data)
+            r, = storage.iterator(tid, tid)
+            r, = r
+            self.assertEqual(r.data_txn, data_tid)
+
+    @with_cluster(storage_count=2, partitions=3)
+    def testIteratorChunks(self, cluster):
+        from neo.client import iterator
+        from neo.storage.handlers import client
+        t, c = cluster.getTransaction()
+        r = c.root()
+        for i in xrange(4):
+            r[i] = PCounter()
+            t.commit()
+        for i in xrange(4):
+            r[i].value = i
+        t.commit()
+        del r[0]
+        t.commit()
+        storage = cluster.getZODBStorage()
+        def records(*args):
+            return [(txn.tid, txn.user, txn.description, txn.extension,
+                     [(r.oid, r.data, r.data_txn) for r in txn])
+                    for txn in storage.iterator(*args)]
+        expected = records()
+        self.assertEqual(len(expected), 7)
+        self.assertEqual(len(expected[5][4]), 4)
+        # Split chunks in the middle of transactions.
+        with Patch(iterator, CHUNK_LENGTH=1), Patch(iterator, READAHEAD=1), \
+             Patch(client, RECORDS_MAX_SIZE=1):
+            self.assertEqual(expected, records())
+            self.assertEqual(expected[2:5],
+                             records(expected[2][0], expected[4][0]))
+
     @with_cluster(replicas=1)
     def testLateConflictOnReplica(self, cluster):
         """
@@ -2321,6 +2678,45 @@ class Test(NEOThreadedTest):
         self.assertFalse(m1.primary)
         self.assertTrue(m1.is_alive())
 
+    @with_cluster(master_count=2, replicas=1, storage_count=2)
+    def testSecondaryMirror(self, cluster):
+        m0 = cluster.primary_master
+        m1, = set(cluster.master_list).difference((m0,))
+        s0, s1 = cluster.storage_list
+        def check():
+            self.assertEqual(m0.pt.getID(), m1.pt.getID())
+            self.assertEqual(m0.pt.getRowList(), m1.pt.getRowList())
+            self.assertEqual((m0.tm.getLastOID(), m0.tm.getLastTID()),
+                             m1.mirrored_ids)
+        t, c = cluster.getTransaction()
+        c.root()[''] = PCounter()
+        t.commit()
+        check()
+        # OIDs that are allocated but not committed yet.
+        oid = cluster.client.new_oid()
+        self.tic()
+        check()
+        self.assertLessEqual(oid, m1.mirrored_ids[0])
+        s1.stop()
+        cluster.join((s1,))
+        s1.resetNode()
+        self.tic()
+        check()
+        # The new primary does not need any partition table from storage nodes.
+        with ConnectionFilter() as f:
+            f.delayAskPartitionTable(lambda conn: conn.getUUID() == s0.uuid)
+            m0.stop()
+            cluster.join((m0,))
+            m0.resetNode()
+            self.tic()
+            self.assertTrue(m1.primary)
+            self.assertEqual(cluster.neoctl.getClusterState(),
+                             ClusterStates.RUNNING)
+        self.assertFalse(f.filtered_count)
+        self.assertLess(oid, m1.tm.getNextOIDList(1)[0])
+        c.root()[''].value += 1
+        t.commit()
+
     @with_cluster(partitions=2, storage_count=2)
     def testStorageBackendLastIDs(self, cluster):
         """
@@ -2349,6 +2745,68 @@ class Test(NEOThreadedTest):
                 self.assertEqual(expected,
                     (dm.getLastTID(u64(MAX_TID)), dm.getLastIDs()))
 
+    @with_cluster()
+    def testStats(self, cluster):
+        m, = cluster.master_list
+        s, = cluster.storage_list
+        t, c = cluster.getTransaction()
+        r = c.root()
+        def getStats():
+            node_dict = {uuid: dict(sample_list)
+                for uuid, sample_list in cluster.neoctl.getStats()}
+            self.assertEqual(sorted(node_dict),
+                sorted((m.uuid, s.uuid, cluster.client.uuid)))
+            return node_dict
+        commits = 'neo_commit_phase_seconds_count{phase="lock"}'
+        hits = 'neo_cache_hits_total{cache="local"}'
+        count = getStats()[m.uuid].get(commits, 0)
+        r[''] = PCounter()
+        t.commit()
+        node_dict = getStats()
+        self.assertEqual(node_dict[m.uuid][commits], count + 1)
+        hit_count = node_dict[cluster.client.uuid].get(hits, 0)
+        c.cacheMinimize()
+        r[''].value
+        node_dict = getStats()
+        self.assertTrue(
+            node_dict[s.uuid]['neo_packets_received_total{type="StoreObject"}'])
+        self.assertTrue(node_dict[s.uuid][
+            'neo_event_loop_lag_seconds_count'])
+        client = node_dict[cluster.client.uuid]
+        self.assertEqual(client[hits], hit_count + 2)
+        self.assertTrue(client[
+            'neo_request_latency_seconds_count{type="FinishTransaction"}'])
+        text = formatNodeStats(cluster.neoctl.getStats())
+        self.assertIn('neo_commit_phase_seconds_bucket{node="%s",phase="lock",'
+            'le="+Inf"} %s\n' % (uuid_str(m.uuid), float(count + 1)), text)
+
+    @with_cluster(storage_count=2, partitions=2)
+    def testStatsClusterStateChange(self, cluster):
+        m = cluster.master
+        s0, s1 = cluster.storage_list
+        answer_list = []
+        class conn(object): # admin connection
+            getPeerId = lambda self: 1
+            isClosed = lambda self: False
+            def send(self, packet, msg_id):
+                answer_list.append(packet)
+        with m.filterConnection(s0, s1) as f:
+            f.delayAskStats()
+            m.askStats(conn())
+            self.tic()
+            self.assertFalse(answer_list)
+            # The cluster is not operational anymore.
+            s0.stop()
+            cluster.join((s0,))
+            self.tic()
+            self.assertEqual(m.cluster_state, ClusterStates.RECOVERING)
+            s1.stop()
+            cluster.join((s1,))
+            self.tic()
+        self.assertFalse(m.stats_request_list)
+        packet, = answer_list
+        self.assertEqual([uuid for uuid, _ in packet.decode()[0]], [m.uuid])
+
 
 if __name__ == "__main__":
     unittest.main()
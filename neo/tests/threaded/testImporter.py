@@ -20,11 +20,14 @@ from itertools import islice, izip_longest
 import os, shutil, unittest
 import neo, transaction, ZODB
 from neo.lib import logging
-from neo.lib.util import u64
-from neo.storage.database.importer import Repickler
+from neo.lib.util import getPersistentReferences, p64, u64
+from neo.storage.database.importer import \
+    getRepickler, ImporterDatabaseManager, ImportProgress, Repickler
 from ..fs2zodb import Inode
 from .. import getTempDirectory
+from .. import Patch
 from . import NEOCluster, NEOThreadedTest
+from persistent.mapping import PersistentMapping
 from ZODB.FileStorage import FileStorage
 
 
@@ -127,6 +130,26 @@ class ImporterTests(NEOThreadedTest):
         self.assertIs(Obj, load())
         self.assertDictEqual(state, load())
 
+    def testRepickleFastPath(self):
+        class Ref(object):
+            def __init__(self, pid):
+                self.pid = pid
+        def dump(*state):
+            p = StringIO()
+            pickler = Pickler(p, 1)
+            pickler.inst_persistent_id = lambda obj: getattr(obj, 'pid', None)
+            pickler.dump(Obj).dump(state)
+            return p.getvalue()
+        data = dump(Ref(p64(1)), Ref((p64(2), Obj)))
+        self.assertIs(data, getRepickler(0, {3: 4})(data))
+        repickled = getRepickler(0, {2: 4})(data)
+        self.assertEqual(getPersistentReferences(repickled), [p64(1), p64(4)])
+        repickled = getRepickler(1, {})(data)
+        self.assertEqual(getPersistentReferences(repickled),
+                         [p64(2), (p64(3), None)])
+        data = dump("foo")
+        self.assertIs(data, getRepickler(1, {})(data))
+
     def test(self):
         # XXX: Using NEO source files as test data was a bad idea because
         #      the test breaks easily in case of massive changes in the code,
@@ -232,6 +255,52 @@ class ImporterTests(NEOThreadedTest):
                 for x, y, z in os.walk(src_root)))
             t.commit()
 
+    def testWorkers(self):
+        importer = []
+        fs_dir = os.path.join(getTempDirectory(), self.id())
+        shutil.rmtree(fs_dir, 1) # for --loop
+        os.mkdir(fs_dir)
+        conn_list = []
+        for name in "root", "sub":
+            fs_path = os.path.join(fs_dir, name + ".fs")
+            c = ZODB.DB(FileStorage(fs_path)).open()
+            c.root()["neo"] = PersistentMapping()
+            transaction.commit()
+            conn_list.append(c)
+            importer.append((name, {
+                "storage": "<filestorage>\npath %s\n</filestorage>" % fs_path
+                }))
+        r = conn_list[0].root()["neo"]["sub"] = PersistentMapping()
+        transaction.commit()
+        # Interleave commits so that batches mix both databases.
+        for i in xrange(10):
+            for c in conn_list:
+                c.root()["neo"][i] = PersistentMapping(x=i)
+                transaction.commit()
+        (_, root_cfg), (_, sub_cfg) = importer
+        root_cfg["sub"] = str(u64(r._p_oid))
+        sub_cfg["oid"] = str(u64(conn_list[1].root()["neo"]._p_oid))
+        for c in conn_list:
+            c.db().close()
+        with NEOCluster(compress=False, importer=importer) as cluster, \
+             Patch(ImporterDatabaseManager, BATCH_RECORDS=3), \
+             Patch(ImportProgress, INTERVAL=0):
+            cluster.storage.dm.workers = 2
+            cluster.start()
+            while cluster.storage.dm._import:
+                self.tic()
+            (uuid, tid, max_tid, txn_rate, byte_rate, eta), = \
+                cluster.neoctl.getImportProgress()
+            self.assertEqual(uuid, cluster.storage.uuid)
+            self.assertEqual(tid, max_tid)
+            self.assertEqual(eta, 0)
+            t, c = cluster.getTransaction()
+            r = c.root()["neo"]
+            self.assertEqual(sorted(r), range(10) + ["sub"])
+            for i in xrange(10):
+                self.assertEqual(r[i]["x"], i)
+                self.assertEqual(r["sub"][i]["x"], i)
+
 
 if __name__ == "__main__":
     unittest.main()
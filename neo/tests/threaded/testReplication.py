@@ -21,6 +21,7 @@ import unittest
 from collections import defaultdict
 from functools import wraps
 from neo.lib import logging
+from neo.client import app as client_app
 from neo.client.exception import NEOStorageError
 from neo.master.handlers.backup import BackupHandler
 from neo.storage.checker import CHECK_COUNT
@@ -39,9 +40,9 @@ from .test import PCounter, PCounterWithResolution # XXX
 def backup_test(partitions=1, upstream_kw={}, backup_kw={}):
     def decorator(wrapped):
         def wrapper(self):
-            with NEOCluster(partitions, **upstream_kw) as upstream:
+            with NEOCluster(partitions=partitions, **upstream_kw) as upstream:
                 upstream.start()
-                with NEOCluster(partitions, upstream=upstream,
+                with NEOCluster(partitions=partitions, upstream=upstream,
                                 **backup_kw) as backup:
                     backup.start()
                     backup.neoctl.setClusterState(ClusterStates.STARTING_BACKUP)
@@ -217,7 +218,9 @@ class ReplicationTests(NEOThreadedTest):
                         # a second replication partially and aborts.
                         p = Patch(backup.storage_list[storage].replicator,
                                   fetchObjects=fetchObjects)
-                    with p:
+                    # Do not pipeline imports, so that 'counts' stops them
+                    # as soon as possible.
+                    with p, Patch(client_app, IMPORT_WINDOW=1):
                         importZODB(lambda x: counts[0] > 1)
                     if event > 5:
                         backup.neoctl.checkReplicas(check_dict, ZERO_TID, None)
@@ -301,6 +304,88 @@ class ReplicationTests(NEOThreadedTest):
         self.tic()
         self.assertEqual(1, self.checkBackup(backup))
 
+    @backup_test(4, backup_kw=dict(backup_replications=3))
+    def testBackupParallelReplication(self, backup):
+        """
+        Check that a backup storage node replicates several partitions at the
+        same time from upstream, and the reporting of the backup lag.
+        """
+        upstream = backup.upstream
+        t, c = upstream.getTransaction()
+        r = c.root()
+        self.tic()
+        for i in xrange(8):
+            r[i] = PCounter()
+        replicator = backup.storage.replicator
+        with ConnectionFilter() as f:
+            f.delayAskFetchTransactions()
+            t.commit()
+            self.tic()
+            self.assertEqual(3, len(replicator.replication_dict))
+            self.assertEqual(1, len(replicator.replicate_dict))
+            backup_tid, upstream_tid, partition_list = \
+                backup.neoctl.getBackupLag()
+            self.assertEqual(upstream_tid, upstream.last_tid)
+            self.assertLess(backup_tid, upstream_tid)
+            self.assertEqual(range(4), [x[0] for x in partition_list])
+            for offset, tid, pending in partition_list:
+                self.assertEqual(tid, backup_tid)
+                self.assertEqual(pending, 1)
+        self.tic()
+        self.assertFalse(replicator.replication_dict)
+        self.assertEqual(4, self.checkBackup(backup))
+        backup_tid, upstream_tid, partition_list = backup.neoctl.getBackupLag()
+        self.assertEqual(backup_tid, upstream_tid)
+        for offset, tid, pending in partition_list:
+            self.assertEqual(tid, upstream_tid)
+            self.assertEqual(pending, 0)
+
+    @backup_test(2)
+    def testBackupInvalidation(self, backup):
+        """
+        Check that clients of a backup cluster are notified of new data,
+        only once it is fully replicated.
+        """
+        upstream = backup.upstream
+        t, c = upstream.getTransaction()
+        r = c.root()
+        r[0] = ob = PCounter()
+        t.commit()
+        self.tic()
+        tb, cb = backup.getTransaction()
+        obb = cb.root()[0]
+        self.assertEqual(obb.value, 0)
+        ob.value = 1
+        with ConnectionFilter() as f:
+            f.delayAskFetchObjects()
+            t.commit()
+            self.tic()
+            tb.begin()
+            self.assertEqual(obb.value, 0)
+        self.tic()
+        tb.begin()
+        self.assertEqual(obb.value, 1)
+        self.assertEqual(cb.db().storage.lastTransaction(), upstream.last_tid)
+        # Past a limit, pending invalidations are dropped
+        # and clients must reconnect to clear their caches.
+        client = cb.db().storage.app
+        master_conn = client.master_conn
+        backup_app = backup.master.backup_app
+        with Patch(backup_app, max_invalidations=1), \
+             ConnectionFilter() as f:
+            f.delayAskFetchObjects()
+            for ob.value in 2, 3:
+                t.commit()
+                self.tic()
+            self.assertEqual(backup_app.invalidation_list,
+                             [(upstream.last_tid, None)])
+        self.tic()
+        self.assertFalse(backup_app.invalidation_list)
+        self.assertEqual(backup_app.invalidation_size, 0)
+        self.assertIsNot(client.master_conn, master_conn)
+        tb.begin()
+        self.assertEqual(obb.value, 3)
+
     @with_cluster(start_cluster=0, partitions=3, replicas=1, storage_count=3)
     def testSafeTweak(self, cluster):
         """
@@ -561,6 +646,167 @@ class ReplicationTests(NEOThreadedTest):
         self.assertEqual(2, s0.sqlCount('obj'))
         expectedFailure(self.assertEqual)(2, count)
 
+    @with_cluster(start_cluster=0, storage_count=2, partitions=2)
+    def testTweakPlan(self, cluster):
+        s0, s1 = cluster.storage_list
+        cluster.start(storage_list=(s0,))
+        t, c = cluster.getTransaction()
+        r = c.root()
+        r[''] = 'x' * 1000
+        t.commit()
+        # Storage nodes report sizes at startup, and then when partitions
+        # grow enough: here, each partition gets at least 100 new objects.
+        for i in xrange(200):
+            r[i] = PCounter()
+        t.commit()
+        self.tic()
+        size_list = map(s0.dm.getPartitionSize, xrange(2))
+        self.assertEqual(cluster.master.partition_size_dict[s0.uuid][2],
+                         dict(enumerate(size_list)))
+        s1.start()
+        self.tic()
+        cluster.enableStorageList((s1,))
+        # The smallest partition moves, and nothing is done on a dry run.
+        byte_count, cell_list = cluster.neoctl.getTweakPlan()
+        self.assertEqual(byte_count, size_list[1][1])
+        self.assertEqual(sorted(cell_list), [
+            (1, s0.uuid, CellStates.FEEDING),
+            (1, s1.uuid, CellStates.OUT_OF_DATE)])
+        self.assertEqual(cluster.getOutdatedCells(), [])
+        cluster.neoctl.tweakPartitionTable()
+        self.tic()
+        self.assertEqual(cluster.master.partition_size_dict[s1.uuid][2],
+                         {1: size_list[1]})
+        self.assertEqual(cluster.neoctl.getTweakPlan(), (0, []))
+
+    @with_cluster(start_cluster=0, storage_count=2, partitions=2)
+    def testSplitPartitions(self, cluster):
+        s0, s1 = cluster.storage_list
+        cluster.start(storage_list=(s0,))
+        t, c = cluster.getTransaction()
+        r = c.root()
+        for i in xrange(8):
+            r[i] = PCounter()
+        t.commit()
+        self.assertRaises(RuntimeError, cluster.neoctl.splitPartitions, 3)
+        self.tic()
+        cluster.neoctl.splitPartitions(4)
+        self.tic()
+        for pt in (cluster.master.pt, cluster.admin.pt, s0.pt,
+                   cluster.client.pt):
+            self.assertEqual(pt.getPartitions(), 4)
+        self.assertEqual(s0.dm.getNumPartitions(), 4)
+        self.assertEqual(sorted(cluster.master.partition_size_dict[s0.uuid][2]),
+                         range(4))
+        # Commit before and after moving half of the new partitions.
+        for i in xrange(8):
+            r[i].value += 1
+        r[8] = PCounter()
+        t.commit()
+        s1.start()
+        self.tic()
+        cluster.enableStorageList((s1,))
+        cluster.neoctl.tweakPartitionTable()
+        self.tic()
+        self.assertEqual(cluster.getOutdatedCells(), [])
+        self.assertEqual(len(s0.pt.getAssignedPartitionList(s1.uuid)), 2)
+        for i in xrange(9):
+            r[i].value += 1
+        t.commit()
+        self.tic()
+        with cluster.newClient(1) as db:
+            t2, c2 = cluster.getTransaction(db)
+            r = c2.root()
+            self.assertEqual([r[i].value for i in xrange(9)], [2] * 8 + [1])
+        # Discarded partitions are dropped at restart, without touching the
+        # rows that are still assigned and share the same storage partition.
+        s0.stop()
+        cluster.join((s0,))
+        s0.resetNode()
+        s0.start()
+        self.tic()
+        for s in s0, s1:
+            self.assertEqual(set(s.pt.getAssignedPartitionList(s.uuid)),
+                {offset for offset in xrange(4)
+                        if s.dm.getPartitionSize(offset)[0]})
+        with cluster.newClient(1) as db:
+            t2, c2 = cluster.getTransaction(db)
+            r = c2.root()
+            self.assertEqual([r[i].value for i in xrange(9)], [2] * 8 + [1])
+
+    @with_cluster(partitions=2)
+    def testSplitPartitionsDuringReads(self, cluster):
+        from neo.client import iterator
+        from neo.client.handlers.master import PrimaryNotificationsHandler
+        t, c = cluster.getTransaction()
+        r = c.root()
+        for i in xrange(6):
+            r[i] = PCounter()
+            t.commit()
+        storage = cluster.getZODBStorage()
+        def records(txn_list):
+            return [(txn.tid, [(r.oid, r.data, r.data_txn) for r in txn])
+                    for txn in txn_list]
+        expected = records(storage.iterator())
+        self.assertEqual(len(expected), 7)
+        # Storage nodes must not answer requests for former partitions.
+        with Patch(iterator, CHUNK_LENGTH=1), Patch(iterator, READAHEAD=1):
+            txn_iter = storage.iterator()
+            txn_list = [next(txn_iter), next(txn_iter)]
+            cluster.neoctl.splitPartitions(4)
+            self.tic()
+            txn_list += txn_iter
+        self.assertEqual(expected, records(txn_list))
+        transactionLog = lambda: cluster.client.transactionLog(
+            ZERO_TID, c.db().lastTransaction(), 10)
+        expected = transactionLog()
+        self.assertEqual(len(expected[1]), 7)
+        # Same if the client is notified after the storage node.
+        split = []
+        def notifyPartitionSplit(orig, *args):
+            split.append(lambda: orig(*args))
+        def sync(orig):
+            while split:
+                split.pop()()
+            orig()
+        with Patch(PrimaryNotificationsHandler,
+                   notifyPartitionSplit=notifyPartitionSplit):
+            cluster.neoctl.splitPartitions(8)
+            self.tic()
+            self.assertEqual(cluster.client.pt.getPartitions(), 4)
+            with Patch(cluster.client, sync=sync):
+                self.assertEqual(expected, transactionLog())
+        self.assertEqual(cluster.client.pt.getPartitions(), 8)
+
+    @with_cluster(master_count=2, storage_count=2, partitions=2, replicas=1)
+    def testSplitPartitionsRestart(self, cluster):
+        t, c = cluster.getTransaction()
+        r = c.root()
+        for i in xrange(8):
+            r[i] = PCounter()
+        t.commit()
+        cluster.neoctl.splitPartitions(4)
+        self.tic()
+        # Masters are restarted with the former number of partitions: the
+        # primary gets the new one from storage nodes during the recovery,
+        # and the secondary from the primary.
+        cluster.stop()
+        cluster.start()
+        self.assertEqual(cluster.neoctl.getClusterState(),
+                         ClusterStates.RUNNING)
+        self.tic()
+        for node in cluster.master_list + cluster.storage_list + [
+                cluster.admin]:
+            self.assertEqual(node.pt.getPartitions(), 4)
+        self.assertEqual(cluster.getOutdatedCells(), [])
+        with cluster.newClient(1) as db:
+            t2, c2 = cluster.getTransaction(db)
+            r = c2.root()
+            self.assertEqual([r[i].value for i in xrange(8)], [0] * 8)
+            for i in xrange(8):
+                r[i].value += 1
+            t2.commit()
+
     @with_cluster(start_cluster=0, replicas=1)
     def testResumingReplication(self, cluster):
         if 1:
@@ -684,7 +930,7 @@ class ReplicationTests(NEOThreadedTest):
         B = backup
         U = B.upstream
         Z = U.getZODBStorage()
-        #Zb = B.getZODBStorage()    # XXX see below about invalidations
+        Zb = B.getZODBStorage()
 
         oid_list = []
         tid_list = []
@@ -726,9 +972,9 @@ class ReplicationTests(NEOThreadedTest):
                 self.assertEqual(1, self.checkBackup(B, max_tid=B.backup_tid))
 
                 # read data from B and verify it is what it should be
-                # XXX we open new ZODB storage every time because invalidations
-                # are not yet implemented in read-only mode.
-                Zb = B.getZODBStorage()
+                # (the client is notified of new data via invalidations)
+                self.assertEqual(Zb.lastTransaction(), tid_list[
+                    cutoff - 1 if cutoff <= i < recover else i])
                 for j, oid in enumerate(oid_list):
                     if cutoff <= i < recover and j >= cutoff:
                         self.assertRaises(POSKeyError, Zb.load, oid, '')
@@ -741,7 +987,6 @@ class ReplicationTests(NEOThreadedTest):
                 # not-yet-fully fetched backup state (transactions committed at
                 # [cutoff, recover) should not be there; otherwise transactions
                 # should be fully there)
-                Zb = B.getZODBStorage()
                 Btxn_list = list(Zb.iterator())
                 self.assertEqual(len(Btxn_list), cutoff if cutoff <= i < recover
                                                  else i+1)
@@ -766,11 +1011,6 @@ class ReplicationTests(NEOThreadedTest):
                 # thus not ReadOnlyError
                 self.assertRaises(NEOStorageError, Zb.tpc_vote, txn)
 
-                # close storage because client app is otherwise shared in
-                # threaded tests and we need to refresh last_tid on next run
-                # (XXX see above about invalidations not working)
-                Zb.close()
-
 
 if __name__ == "__main__":
     unittest.main()